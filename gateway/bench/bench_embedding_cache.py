@@ -0,0 +1,94 @@
+"""
+基准测试：向量缓存（services/embedding_cache.py）
+模拟一天的检索查询：--distinct 条不同的查询文本按 Zipf 分布重复出现（少数常用问法占大头），
+共 --lookups 次，未命中的当作调 API 后写回缓存。报告：
+- 命中率（内存 / 磁盘分开）以及省下的 API 调用次数
+- 内存命中、磁盘命中（内存层清空后，含 asyncio.to_thread 的切换开销）的单次延迟
+- 重新打开后（模拟重启）磁盘层的命中情况
+不调用硅基流动，向量用随机数代替。
+
+用法（在 gateway 目录下）：
+    python bench/bench_embedding_cache.py
+    python bench/bench_embedding_cache.py --distinct 5000 --lookups 50000 --size 512
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from services.embedding_cache import EmbeddingCache, make_embedding_key, normalize_text
+
+MODEL = "BAAI/bge-large-zh-v1.5"
+DIM = 1024
+
+
+async def timed(func, keys) -> tuple:
+    latencies = []
+    for key in keys:
+        started = time.perf_counter()
+        await func(key)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return statistics.median(latencies) * 1e6, latencies[int(len(latencies) * 0.95) - 1] * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--distinct", type=int, default=2000, help="不同查询文本的条数")
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=2048, help="内存 LRU 条数")
+    parser.add_argument("--zipf", type=float, default=1.2)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="embedding_cache_")
+    rng = np.random.default_rng(0)
+    path = os.path.join(directory, "embedding_cache.db")
+    try:
+        # 同一个问题常带不同的空白（换行、多空格），规范化后是同一个键
+        texts = [f"上次说的第 {i} 件事 后来怎么样了" for i in range(args.distinct)]
+        picks = np.minimum(rng.zipf(args.zipf, args.lookups), args.distinct) - 1
+        vector = rng.standard_normal(DIM).astype(np.float32).tolist()
+
+        cache = EmbeddingCache(path, args.size)
+        api_calls = 0
+        started = time.perf_counter()
+        for i in picks:
+            text = texts[i] if rng.random() < 0.5 else texts[i].replace(" ", "  ") + "\n"
+            key = make_embedding_key(MODEL, normalize_text(text))
+            if await cache.get(key) is None:
+                api_calls += 1
+                await cache.put(key, vector)
+        elapsed = time.perf_counter() - started
+        stats = cache.get_stats()
+        print(f"{args.lookups} lookups over {args.distinct} distinct queries in {elapsed:.2f}s: "
+              f"hit_rate {stats['hit_rate']:.3f} (memory {stats['memory_hits']}, disk {stats['disk_hits']}), "
+              f"API calls {api_calls} instead of {args.lookups}")
+
+        keys = [make_embedding_key(MODEL, normalize_text(texts[i])) for i in np.unique(picks)[:min(1000, args.size)]]
+        p50, p95 = await timed(cache.get, keys)
+        print(f"memory hit: p50 {p50:7.1f}us  p95 {p95:7.1f}us")
+        cache.close()
+
+        # 内存层为空（重启 / 另一个 worker）：第一次读走磁盘
+        cache = EmbeddingCache(path, args.size)
+        p50, p95 = await timed(cache.get, keys)
+        stats = cache.get_stats()
+        print(f"disk hit:   p50 {p50:7.1f}us  p95 {p95:7.1f}us  "
+              f"(after reopen: {stats['disk_hits']}/{len(keys)} from disk, {stats['disk_entries']} on disk, "
+              f"{os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+        cache.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
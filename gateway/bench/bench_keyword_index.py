@@ -0,0 +1,112 @@
+"""
+基准测试：进程内关键词倒排索引（services/keyword_index.py）
+生成 --rows 条随机中文对话（外加 rows / 10 条摘要）直接灌进索引，报告建索引耗时、内存占用明细
+（varint 差值编码的倒排表 vs 未压缩的 uint32 对），以及检索延迟（p50/p95/max，单位微秒）。
+检索词从正文里截 2~3 字，每次 4~5 个，和 hybrid_search 扩展后的关键词差不多。不连数据库，随时可跑。
+
+用法（在 gateway 目录下）：
+    python bench/bench_keyword_index.py --rows 50000
+    python bench/bench_keyword_index.py --rows 200000 --iterations 2000
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.keyword_index import KeywordIndex
+
+CHANNELS = ("deepseek", "claude")
+SCENES = ("daily", "plot", "meta")
+# 常用字，随机拼成正文
+CHARS = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所"
+    "民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那"
+    "社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通"
+    "咖啡雨电影猫旅剧晚饭音乐散步考试朋友周末医院书店，。！？ "
+)
+
+
+def random_text(rng: random.Random, low: int, high: int) -> str:
+    return "".join(rng.choice(CHARS) for _ in range(rng.randint(low, high)))
+
+
+def sample_terms(rng: random.Random, texts: list) -> list:
+    terms = []
+    while len(terms) < rng.randint(4, 5):
+        text = rng.choice(texts)
+        size = rng.choice((2, 2, 3))
+        start = rng.randrange(0, len(text) - size)
+        term = text[start:start + size]
+        if term.strip() and all(ch not in "，。！？ " for ch in term):
+            terms.append(term)
+    return terms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    base = datetime.now(timezone.utc) - timedelta(days=365)
+    conversations = [{
+        "id": str(uuid.uuid4()), "user_msg": random_text(rng, 10, 60), "assistant_msg": random_text(rng, 40, 300),
+        "created_at": (base + timedelta(minutes=5 * i)).isoformat(), "scene_type": rng.choice(SCENES),
+        "model_channel": CHANNELS[i % 2], "round_number": i // 2 + 1,
+    } for i in range(args.rows)]
+    summaries = [{
+        "id": str(uuid.uuid4()), "summary": random_text(rng, 80, 300),
+        "created_at": (base + timedelta(hours=8 * i)).isoformat(), "scene_type": rng.choice(SCENES),
+        "model_channel": CHANNELS[i % 2], "start_round": i * 10, "end_round": i * 10 + 9,
+    } for i in range(args.rows // 10)]
+    chars = sum(len(r["user_msg"]) + len(r["assistant_msg"]) for r in conversations)
+    chars += sum(len(r["summary"]) for r in summaries)
+
+    index = KeywordIndex()
+    version = index.reset()
+    started = time.perf_counter()
+    for offset in range(0, len(conversations), 1000):
+        index.add("conversations", conversations[offset:offset + 1000])
+    index.add("summaries", summaries)
+    index.mark_ready(version)
+    elapsed = time.perf_counter() - started
+    print(f"indexed {len(conversations)} conversations + {len(summaries)} summaries ({chars / 1e6:.1f}M chars) "
+          f"in {elapsed:.1f}s ({(len(conversations) + len(summaries)) / elapsed:.0f} docs/s)")
+    for key, value in index.memory_report().items():
+        print(f"  {key:26s} {value}")
+
+    texts = [r["user_msg"] for r in conversations[:5000]]
+    term_sets = [sample_terms(rng, texts) for _ in range(200)]
+    for label, scene in (("scene=daily", "daily"), ("no scene filter", None)):
+        for terms in term_sets[:10]:
+            index.search(terms, scene, 15, "deepseek")
+        latencies, rows = [], 0
+        for i in range(args.iterations):
+            terms = term_sets[i % len(term_sets)]
+            t0 = time.perf_counter()
+            rows += len(index.search(terms, scene, 15, "deepseek"))
+            latencies.append(time.perf_counter() - t0)
+        latencies.sort()
+        print(f"search ({label:15s}) p50 {statistics.median(latencies) * 1e6:8.0f}us  "
+              f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1e6:8.0f}us  max {latencies[-1] * 1e6:8.0f}us  "
+              f"rows {rows / args.iterations:.1f}")
+
+    started = time.perf_counter()
+    for i in range(200):
+        index.add("conversations", [{
+            "id": str(uuid.uuid4()), "user_msg": random_text(rng, 10, 60), "assistant_msg": random_text(rng, 40, 300),
+            "created_at": datetime.now(timezone.utc).isoformat(), "scene_type": "daily", "model_channel": "deepseek",
+        }])
+    print(f"incremental add: {(time.perf_counter() - started) / 200 * 1e6:.0f}us per conversation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+基准测试：关键词检索 逐词 ilike 循环（以前的写法）vs keyword_search_multi 单次调用（migrations/007）
+在独立 schema keyword_bench 里建 conversations / summaries（和线上一样的二元组 GIN 索引；有 pg_trgm 时
+也建 v2_schema 里的三元组索引），生成 --rows 条随机中文对话，然后对同一组检索词分别跑：
+- loop：每个词各查一次 conversations、一次 summaries，串行（最多 10 次往返）
+- multi：一次调用查完全部词，去重、按命中词数排序
+统计 p50/p95/max。本机直连时往返几乎不花时间，加 --rtt 20 可以模拟每次往返 20ms 的网络延迟（PostgREST 更高）。
+需要 SUPABASE_DB_URL（或 --dsn）、已安装 asyncpg，并且目标库已执行 migrations/007（用到 text_bigrams / keyword_search_multi）。
+
+用法（在 gateway 目录下）：
+    python bench/bench_keyword_search.py --rows 100000
+    python bench/bench_keyword_search.py --rows 100000 --rtt 20 --keep
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncpg
+
+from config import get_settings
+
+SCHEMA = "keyword_bench"
+CHANNEL = "deepseek"
+SCENES = ("daily", "plot", "meta")
+# 常用字，随机拼成正文；检索词从生成的正文里截取，保证有命中
+CHARS = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所"
+    "民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那"
+    "社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通"
+    "并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区"
+    "强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清"
+    "咖啡雨电影猫旅剧晚饭音乐散步考试朋友周末医院书店"
+)
+TERM_SETS = 50
+
+
+def random_text(rng: random.Random, low: int, high: int) -> str:
+    return "".join(rng.choice(CHARS) for _ in range(rng.randint(low, high)))
+
+
+def sample_terms(rng: random.Random, texts: list) -> list:
+    """从正文里截 4~5 个 2~3 字的词（和 jieba 扩展后的检索词长度差不多）"""
+    terms = []
+    for _ in range(rng.randint(4, 5)):
+        text = rng.choice(texts)
+        size = rng.choice((2, 2, 3))
+        start = rng.randrange(0, len(text) - size)
+        terms.append(text[start:start + size])
+    return terms
+
+
+async def setup(conn, rows: int, summaries: int, rng: random.Random) -> list:
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.execute(f"""
+        CREATE TABLE {SCHEMA}.conversations (
+            id uuid PRIMARY KEY, user_msg text, assistant_msg text, created_at timestamptz,
+            scene_type text, topic text, emotion text, round_number int, model_channel text
+        )
+    """)
+    await conn.execute(f"""
+        CREATE TABLE {SCHEMA}.summaries (
+            id uuid PRIMARY KEY, summary text, created_at timestamptz, scene_type text,
+            topic text, start_round int, end_round int, model_channel text
+        )
+    """)
+    started = time.perf_counter()
+    base = datetime.now(timezone.utc) - timedelta(days=365)
+    texts = []
+    conv_records = []
+    for i in range(rows):
+        user_msg, assistant_msg = random_text(rng, 10, 60), random_text(rng, 40, 300)
+        if i < 5000:
+            texts.append(user_msg)
+        conv_records.append((
+            uuid.uuid4(), user_msg, assistant_msg, base + timedelta(seconds=i * 300),
+            rng.choice(SCENES), None, None, i + 1, CHANNEL,
+        ))
+    await conn.copy_records_to_table("conversations", schema_name=SCHEMA, records=conv_records)
+    sum_records = [(
+        uuid.uuid4(), random_text(rng, 80, 300), base + timedelta(hours=i * 8), rng.choice(SCENES),
+        None, i * 10, i * 10 + 9, CHANNEL,
+    ) for i in range(summaries)]
+    await conn.copy_records_to_table("summaries", schema_name=SCHEMA, records=sum_records)
+    print(f"seeded {rows} conversations / {summaries} summaries in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    await conn.execute(f"""
+        CREATE INDEX ON {SCHEMA}.conversations
+            USING GIN (public.text_bigrams(COALESCE(user_msg, '') || E'\\n' || COALESCE(assistant_msg, '')))
+    """)
+    await conn.execute(f"CREATE INDEX ON {SCHEMA}.summaries USING GIN (public.text_bigrams(COALESCE(summary, '')))")
+    await conn.execute(f"CREATE INDEX ON {SCHEMA}.conversations (model_channel, created_at DESC)")
+    try:
+        await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        await conn.execute(f"CREATE INDEX ON {SCHEMA}.conversations USING GIN (user_msg gin_trgm_ops)")
+        await conn.execute(f"CREATE INDEX ON {SCHEMA}.conversations USING GIN (assistant_msg gin_trgm_ops)")
+    except asyncpg.PostgresError as e:
+        print(f"pg_trgm unavailable, baseline runs without trigram indexes: {e}")
+    await conn.execute(f"ANALYZE {SCHEMA}.conversations")
+    await conn.execute(f"ANALYZE {SCHEMA}.summaries")
+    print(f"indexes built in {time.perf_counter() - started:.1f}s")
+    return texts
+
+
+async def loop_search(conn, terms: list, scenes: list, rtt: float) -> int:
+    """以前的写法：每个词两次 ilike，串行"""
+    count = 0
+    for term in terms[:5]:
+        if len(term) < 2:
+            continue
+        for sql in (
+            """
+            SELECT id, user_msg, assistant_msg, created_at, scene_type, topic, emotion, round_number
+            FROM conversations
+            WHERE model_channel = $1
+              AND (user_msg ILIKE '%' || $2 || '%' OR assistant_msg ILIKE '%' || $2 || '%')
+              AND scene_type = ANY($3)
+            ORDER BY created_at DESC
+            LIMIT 15
+            """,
+            """
+            SELECT id, summary, created_at, scene_type, topic, start_round, end_round
+            FROM summaries
+            WHERE model_channel = $1 AND summary ILIKE '%' || $2 || '%' AND scene_type = ANY($3)
+            ORDER BY created_at DESC
+            LIMIT 5
+            """,
+        ):
+            if rtt:
+                await asyncio.sleep(rtt)
+            count += len(await conn.fetch(sql, CHANNEL, term, scenes))
+    return count
+
+
+async def multi_search(conn, terms: list, scenes: list, rtt: float) -> int:
+    if rtt:
+        await asyncio.sleep(rtt)
+    return len(await conn.fetch("SELECT * FROM keyword_search_multi($1, $2, $3, 15, 5)", terms, CHANNEL, scenes))
+
+
+async def measure(fn, conn, term_sets: list, iterations: int, rtt: float) -> dict:
+    scenes = ["daily", "plot"]
+    for terms in term_sets[:3]:
+        await fn(conn, terms, scenes, rtt)
+    latencies, rows = [], 0
+    for i in range(iterations):
+        terms = term_sets[i % len(term_sets)]
+        started = time.perf_counter()
+        rows += await fn(conn, terms, scenes, rtt)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "max": latencies[-1] * 1000,
+        "rows": rows / iterations,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", help="默认用 SUPABASE_DB_URL")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--summaries", type=int, help="默认 rows / 10")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--rtt", type=float, default=0.0, help="模拟每次往返的网络延迟（毫秒）")
+    parser.add_argument("--keep", action="store_true", help="保留 keyword_bench schema，重复运行时不再生成数据")
+    args = parser.parse_args()
+
+    dsn = args.dsn or get_settings().supabase_db_url
+    if not dsn:
+        raise SystemExit("SUPABASE_DB_URL (or --dsn) is required")
+    rng = random.Random(0)
+    conn = await asyncpg.connect(dsn, statement_cache_size=0)
+    try:
+        exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", f"{SCHEMA}.conversations")
+        if exists and args.keep:
+            texts = [r["user_msg"] for r in await conn.fetch(f"SELECT user_msg FROM {SCHEMA}.conversations LIMIT 5000")]
+            print(f"reusing {SCHEMA} ({await conn.fetchval(f'SELECT count(*) FROM {SCHEMA}.conversations')} rows)")
+        else:
+            texts = await setup(conn, args.rows, args.summaries or args.rows // 10, rng)
+        # keyword_search_multi 里的表名按 search_path 解析，指向 bench 表
+        await conn.execute(f"SET search_path = {SCHEMA}, public")
+        term_sets = [sample_terms(rng, texts) for _ in range(TERM_SETS)]
+
+        rtt = args.rtt / 1000
+        print(f"iterations={args.iterations} rtt={args.rtt}ms terms/query={statistics.mean(map(len, term_sets)):.1f}")
+        for name, fn, trips in (
+            ("loop (2 queries per term)", loop_search, "~10 round trips"),
+            ("keyword_search_multi", multi_search, "1 round trip"),
+        ):
+            stats = await measure(fn, conn, term_sets, args.iterations, rtt)
+            print(f"{name:28s} p50 {stats['p50']:8.2f}ms  p95 {stats['p95']:8.2f}ms  max {stats['max']:8.2f}ms"
+                  f"  rows {stats['rows']:5.1f}  ({trips})")
+    finally:
+        if not args.keep:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""
+基准测试：本地存储驱动（STORAGE_DRIVER=local，SQLite + FTS5 + NumPy 向量索引）
+在临时数据库里生成 --rows 条对话（随机中文片段 + 1024 维随机向量，多个 channel / 场景），
+然后测热点调用的延迟（p50/p95/max）：最近对话、当前轮数、带轮数插入、关键词检索（>=3 字走 FTS5，
+2 字走 LIKE 扫描）、向量检索。不连网络，随时可跑。
+
+用法（在 gateway 目录下）：
+    python bench/bench_local_storage.py --rows 20000
+    python bench/bench_local_storage.py --rows 100000 --iterations 100 --keep /tmp/memory_bench.db
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from services.local_repository import LocalRepository
+
+CHANNELS = ("deepseek", "claude")
+SCENES = ("daily", "plot", "meta")
+WORDS = ("咖啡", "下雨", "电影", "工作", "猫", "旅行", "剧本", "晚饭", "音乐", "散步", "考试", "朋友", "周末", "医院", "书店")
+EMBEDDING_DIM = 1024
+
+
+def random_text(rng: random.Random) -> str:
+    return "，".join(rng.choice(WORDS) + rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+
+
+async def seed(repo: LocalRepository, rows: int, batch: int = 2000):
+    rng = random.Random(0)
+    vectors = np.random.default_rng(0).standard_normal((min(rows, batch), EMBEDDING_DIM), dtype=np.float32)
+    started = time.perf_counter()
+    for offset in range(0, rows, batch):
+        size = min(batch, rows - offset)
+        channel = CHANNELS[(offset // batch) % len(CHANNELS)]
+        turns = [{
+            "user_msg": random_text(rng), "assistant_msg": random_text(rng), "scene_type": rng.choice(SCENES),
+        } for _ in range(size)]
+        ids = await repo.copy_conversations_with_rounds("dream", channel, turns)
+        await repo.store_embeddings(ids, [vectors[i] for i in range(size)])
+    elapsed = time.perf_counter() - started
+    print(f"seeded {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s incl. embeddings)")
+
+
+async def measure(factory, iterations: int) -> dict:
+    for _ in range(3):
+        await factory()
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await factory()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "max": latencies[-1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--keep", help="数据库文件路径（保留，重复运行时不再生成数据）")
+    args = parser.parse_args()
+
+    path = args.keep or os.path.join(tempfile.mkdtemp(), "memory_bench.db")
+    repo = LocalRepository(path)
+    await repo.connect()
+    if not await repo.get_current_round("dream", CHANNELS[0]):
+        await seed(repo, args.rows)
+
+    query = np.random.default_rng(1).standard_normal(EMBEDDING_DIM).tolist()
+    cases = {
+        "get_recent": lambda: repo.get_recent("dream", 4, "claude"),
+        "get_current_round": lambda: repo.get_current_round("dream", "claude"),
+        "insert_conversation_with_round": lambda: repo.insert_conversation_with_round(
+            "dream", "bench", "bench", "daily", "bench_local"),
+        "keyword_search (3+ chars, FTS5)": lambda: repo.keyword_search(["咖啡下雨", "电影猫"], "daily", 15, "claude"),
+        "keyword_search (2 chars, LIKE)": lambda: repo.keyword_search(["咖啡", "电影"], "daily", 15, "claude"),
+        "vector_search conversations": lambda: repo.vector_search(query, "conversations", "daily", 15, "claude"),
+    }
+    print(f"path={path} iterations={args.iterations}")
+    try:
+        for name, factory in cases.items():
+            stats = await measure(factory, args.iterations)
+            print(f"{name:34s} p50 {stats['p50']:7.2f}ms  p95 {stats['p95']:7.2f}ms  max {stats['max']:7.2f}ms")
+    finally:
+        await repo._execute("DELETE FROM conversations WHERE model_channel = ?", "bench_local")
+        await repo._execute("DELETE FROM conversation_rounds WHERE model_channel = ?", "bench_local")
+        await repo.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+"""
+基准测试：supabase-py + asyncio.to_thread（PostgREST）vs asyncpg 直连（连接池 + prepared statement）
+对同一个 Supabase 项目跑热点查询，统计每次调用的延迟（p50/p95/max）和并发下的吞吐。
+需要 .env 里配好 SUPABASE_URL / SUPABASE_KEY / SUPABASE_DB_URL，且已安装 asyncpg。
+
+默认只读；加 --write 时额外测插入（写到 bench 专用 channel，结束后删除）。
+
+用法（在 gateway 目录下）：
+    python bench/bench_storage_paths.py --iterations 200 --concurrency 8
+    python bench/bench_storage_paths.py --iterations 100 --write
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import get_settings
+from services import storage
+from services.pg_repository import PgRepository
+
+BENCH_CHANNEL = "bench_storage"
+EMBEDDING_DIM = 1024
+
+
+def random_embedding() -> list:
+    return [random.uniform(-1, 1) for _ in range(EMBEDDING_DIM)]
+
+
+def supabase_rpc(table: str, embedding: list, limit: int, channel: str):
+    """和 pgvector_service.vector_search_rpc 一样的 PostgREST 调用（同步）"""
+    func_name = "search_conversations_v2" if table == "conversations" else "search_summaries_v2"
+    params = {
+        "query_embedding": f"[{','.join(str(x) for x in embedding)}]",
+        "match_count": limit,
+        "filter_scene": "daily",
+        "filter_channel": channel,
+    }
+    result = storage.supabase.rpc(func_name, params).execute()
+    return result.data or []
+
+
+def build_cases(repo: PgRepository, channel: str, write: bool) -> dict:
+    """用例名 -> (supabase 路径, asyncpg 路径)，两边都是无参协程工厂"""
+    embedding = random_embedding()
+    cases = {
+        "get_recent": (
+            lambda: asyncio.to_thread(storage._db_get_recent, "dream", 4, channel),
+            lambda: repo.get_recent("dream", 4, channel),
+        ),
+        "get_current_round": (
+            lambda: asyncio.to_thread(storage._db_get_current_round, "dream", channel),
+            lambda: repo.get_current_round("dream", channel),
+        ),
+        "get_recent_summaries": (
+            lambda: asyncio.to_thread(storage._db_get_recent_summaries, "dream", 3, channel),
+            lambda: repo.get_recent_summaries("dream", 3, channel),
+        ),
+        "rpc_search_conversations": (
+            lambda: asyncio.to_thread(supabase_rpc, "conversations", embedding, 15, channel),
+            lambda: repo.vector_search(embedding, "conversations", "daily", 15, channel),
+        ),
+        "rpc_search_summaries": (
+            lambda: asyncio.to_thread(supabase_rpc, "summaries", embedding, 15, channel),
+            lambda: repo.vector_search(embedding, "summaries", "daily", 15, channel),
+        ),
+    }
+    if write:
+        cases["insert_conversation"] = (
+            lambda: asyncio.to_thread(storage._db_insert_conversation, "dream", "bench", "bench", 0, "daily", BENCH_CHANNEL),
+            lambda: repo.insert_conversation("dream", "bench", "bench", 0, "daily", BENCH_CHANNEL),
+        )
+    return cases
+
+
+async def measure(factory, iterations: int, concurrency: int) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await factory()
+            latencies.append(time.perf_counter() - started)
+
+    # 预热：建连 / TLS 握手 / prepare 不计入
+    for _ in range(3):
+        await factory()
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(iterations)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "max": latencies[-1] * 1000,
+        "qps": iterations / elapsed,
+    }
+
+
+def fmt(stats: dict) -> str:
+    return f"p50 {stats['p50']:7.1f}ms  p95 {stats['p95']:7.1f}ms  max {stats['max']:7.1f}ms  {stats['qps']:7.1f} q/s"
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--channel", default="deepseek", help="读测试用的 channel")
+    parser.add_argument("--write", action="store_true", help="同时测插入（写入后清理）")
+    args = parser.parse_args()
+
+    settings = get_settings()
+    if not settings.supabase_db_url:
+        sys.exit("SUPABASE_DB_URL is not configured")
+    repo = PgRepository(settings.supabase_db_url, min_size=args.concurrency, max_size=args.concurrency)
+    await repo.connect()
+
+    print(f"iterations={args.iterations} concurrency={args.concurrency} prepared={repo.prepared}")
+    try:
+        for name, (supabase_path, asyncpg_path) in build_cases(repo, args.channel, args.write).items():
+            before = await measure(supabase_path, args.iterations, args.concurrency)
+            after = await measure(asyncpg_path, args.iterations, args.concurrency)
+            print(f"\n{name}")
+            print(f"  supabase+to_thread  {fmt(before)}")
+            print(f"  asyncpg             {fmt(after)}")
+            print(f"  p50 speedup         x{before['p50'] / after['p50']:.1f}")
+    finally:
+        if args.write:
+            await repo._execute("DELETE FROM conversations WHERE model_channel = $1", BENCH_CHANNEL)
+        await repo.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+"""
+基准测试：stream_chunks 逐行解析模式 vs 透传模式
+本地起一个 mock SSE 上游（uvicorn，同进程），每个 delta 里带上发送时刻，
+统计网关吐出该 delta 的延迟（p50/p95/max）和整体吞吐。
+
+用法（在 gateway 目录下）：
+    python bench/bench_stream_passthrough.py --chunks 2000 --rounds 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+# main.py 导入时会初始化 Supabase 客户端，基准测试不连库，给个占位配置即可
+os.environ.setdefault("SUPABASE_URL", "https://bench.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+import main
+
+MOCK_PORT = 18761
+
+
+def build_mock_upstream(chunks: int, interval: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def completions():
+        async def gen():
+            for i in range(chunks):
+                data = {
+                    "id": "bench",
+                    "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {"content": f"字{i}"}, "finish_reason": None}],
+                    "t": time.perf_counter(),
+                }
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+                if interval:
+                    await asyncio.sleep(interval)
+                elif i % 50 == 0:
+                    await asyncio.sleep(0)
+            yield b"data: [DONE]\n\n"
+        return StreamingResponse(gen(), media_type="text/event-stream")
+
+    return app
+
+
+async def run_once(passthrough: bool) -> dict:
+    url = f"http://127.0.0.1:{MOCK_PORT}/v1/chat/completions"
+    body = {"model": "bench", "stream": True, "messages": []}
+    collector = {"assistant_chunks": [], "reasoning_chunks": []}
+
+    received = []  # (到达时刻, 字节块)
+    start = time.perf_counter()
+    async for block in main.stream_chunks(url, {}, body, collector, passthrough=passthrough):
+        received.append((time.perf_counter(), block))
+    elapsed = time.perf_counter() - start
+    scanner = collector.get("scanner")
+    if scanner is not None:
+        await scanner
+
+    # 计时结束后再解析，统计每个 delta 的延迟
+    latencies = []
+    for arrived, block in received:
+        for line in block.split(b"\n"):
+            if line.startswith(b"data: {"):
+                latencies.append((arrived - json.loads(line[6:])["t"]) * 1000)
+    return {
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "collected": len(collector["assistant_chunks"]),
+    }
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def bench(chunks: int, rounds: int, interval: float):
+    server = uvicorn.Server(uvicorn.Config(
+        build_mock_upstream(chunks, interval), host="127.0.0.1", port=MOCK_PORT, log_level="warning"
+    ))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        # 预热连接池
+        await run_once(True)
+        for passthrough in (False, True):
+            mode = "passthrough" if passthrough else "line-parse"
+            all_lat, total = [], 0.0
+            for _ in range(rounds):
+                r = await run_once(passthrough)
+                assert r["collected"] == chunks, f"{mode}: collected {r['collected']}/{chunks}"
+                all_lat.extend(r["latencies"])
+                total += r["elapsed"]
+            print(
+                f"{mode:12s} chunks/s={chunks * rounds / total:10.0f}  "
+                f"p50={statistics.median(all_lat):7.3f}ms  p95={_pct(all_lat, 0.95):7.3f}ms  "
+                f"max={max(all_lat):7.3f}ms"
+            )
+    finally:
+        await main.upstream_pool.close()
+        server.should_exit = True
+        await server_task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000, help="每次流的 delta 数")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=0.0, help="上游每个 delta 间隔（秒），0 为突发")
+    args = parser.parse_args()
+    asyncio.run(bench(args.chunks, args.rounds, args.interval))
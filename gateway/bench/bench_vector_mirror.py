@@ -0,0 +1,96 @@
+"""
+基准测试：本机向量镜像（services/vector_mirror.py）
+在临时目录里写入 --rows 条 1024 维随机向量（两个 channel、三种场景，rows / 10 条摘要），报告：
+- 写入耗时（按 200 条一批，和 sync_vector_mirror 补齐时一样）
+- 重新打开耗时（模拟重启 / 另一个 worker：只读 SQLite 元数据，矩阵文件按需映射）
+- 检索延迟 p50/p95/max（channel + 场景过滤，top 15），以及和 NumPy 精确计算结果的一致性
+不连数据库，随时可跑。
+
+用法（在 gateway 目录下）：
+    python bench/bench_vector_mirror.py --rows 20000
+    python bench/bench_vector_mirror.py --rows 100000 --iterations 200
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from services.vector_mirror import VectorMirror
+
+CHANNELS = ("deepseek", "claude")
+SCENES = ("daily", "plot", "meta")
+DIM = 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="vector_mirror_")
+    rng = np.random.default_rng(0)
+    try:
+        mirror = VectorMirror(directory, DIM)
+        mirror.open()
+        vectors = rng.standard_normal((args.rows, DIM), dtype=np.float32)
+        channels = [CHANNELS[i % 2] for i in range(args.rows)]
+        scenes = [SCENES[i % 3] for i in range(args.rows)]
+        started = time.perf_counter()
+        for offset in range(0, args.rows, 200):
+            mirror.upsert("conversations", [
+                (f"c{i}", vectors[i], channels[i], scenes[i]) for i in range(offset, min(offset + 200, args.rows))
+            ])
+        summaries = args.rows // 10
+        for offset in range(0, summaries, 200):
+            mirror.upsert("summaries", [
+                (f"s{i}", vectors[i], channels[i], scenes[i]) for i in range(offset, min(offset + 200, summaries))
+            ])
+        mirror.mark_synced()
+        elapsed = time.perf_counter() - started
+        print(f"wrote {args.rows} conversation + {summaries} summary vectors in {elapsed:.1f}s "
+              f"({(args.rows + summaries) / elapsed:.0f} vectors/s)")
+        mirror.close()
+
+        started = time.perf_counter()
+        mirror = VectorMirror(directory, DIM)
+        mirror.open()
+        print(f"reopen: {(time.perf_counter() - started) * 1000:.1f}ms, ready={mirror.ready}, {mirror.get_stats()}")
+
+        # 精确结果：float64 全量计算后按同样的过滤取 top 15
+        normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        channel_arr, scene_arr = np.array(channels), np.array(scenes)
+        queries = rng.standard_normal((50, DIM), dtype=np.float32)
+        for label, scene in (("scene=daily", "daily"), ("scene=meta", "meta"), ("no scene filter", None)):
+            allowed = np.isin(scene_arr, ["daily", "plot"] if scene == "daily" else [scene]) if scene else True
+            mask = (channel_arr == "deepseek") & allowed
+            agree = 0
+            for q in queries[:10]:
+                hits = [record_id for record_id, _ in mirror.search("conversations", q, 15, "deepseek", scene)]
+                scores = np.where(mask, normalized.astype(np.float64) @ q.astype(np.float64), -np.inf)
+                exact = [f"c{i}" for i in np.argsort(-scores)[:15]]
+                agree += hits == exact
+            latencies = []
+            for i in range(args.iterations):
+                t0 = time.perf_counter()
+                mirror.search("conversations", queries[i % len(queries)], 15, "deepseek", scene)
+                latencies.append(time.perf_counter() - t0)
+            latencies.sort()
+            print(f"search ({label:15s}) p50 {statistics.median(latencies) * 1000:7.2f}ms  "
+                  f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.2f}ms  max {latencies[-1] * 1000:7.2f}ms  "
+                  f"exact top-15 match {agree}/10")
+        mirror.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
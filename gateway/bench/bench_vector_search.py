@@ -0,0 +1,234 @@
+"""
+基准测试：向量检索 精确扫描（migrations/001 的写法）vs HNSW + ef_search（migrations/008）
+在独立 schema vector_bench 里建 conversations（和线上一样按通道建部分 HNSW 索引），生成 --rows 条
+1024 维向量（围绕若干中心点聚簇，接近真实 embedding 的分布；70% deepseek / 30% claude，
+场景 daily 60% / plot 25% / meta 15%），然后对同一组查询分别跑：
+- exact：001 里的 ORDER BY embedding <=> q LIMIT n（全量算距离）
+- hnsw ef=N：008 的 search_conversations_v2(..., ef_search => N)
+统计 p50/p95 延迟和 recall@15（以 exact 结果为准），场景过滤分 daily / meta / 不过滤三种。
+需要 SUPABASE_DB_URL（或 --dsn）、已安装 asyncpg，目标库已执行 migrations/008（用到新的 search_conversations_v2）。
+
+--check-plan：不生成数据，直接对线上表做 EXPLAIN，确认每个通道的 ANN 子查询走 HNSW 部分索引
+（计划退化时退出码 1，可以放进部署后的检查）。
+
+用法（在 gateway 目录下）：
+    python bench/bench_vector_search.py --rows 10000
+    python bench/bench_vector_search.py --rows 100000 --ef 40,100,200,400 --keep
+    python bench/bench_vector_search.py --check-plan
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import struct
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncpg
+import numpy as np
+
+from config import get_settings
+
+SCHEMA = "vector_bench"
+DIM = 1024
+CHANNELS = (("deepseek", 0.7), ("claude", 0.3))
+SCENES = (("daily", 0.6), ("plot", 0.25), ("meta", 0.15))
+CLUSTERS = 256
+QUERIES = 50
+K = 15
+
+# 008 精确兜底分支的写法（也就是 001 里的查询）
+SQL_EXACT = """
+    SELECT id FROM conversations c
+    WHERE c.embedding IS NOT NULL AND c.model_channel = $2
+      AND ($3::text IS NULL OR c.scene_type = $3 OR ($3 = 'daily' AND c.scene_type IN ('daily', 'plot')))
+    ORDER BY (c.embedding <=> $1) + 0
+    LIMIT $4
+"""
+SQL_RPC = "SELECT id FROM search_conversations_v2($1, $4, $3, $2, $5)"
+
+# 008 里 ANN 子查询的形状（channel 是字面量，才能匹配部分索引）
+SQL_PLAN = """
+    EXPLAIN (FORMAT JSON)
+    SELECT id FROM {table}
+    WHERE embedding IS NOT NULL AND model_channel = {channel}
+    ORDER BY embedding <=> $1
+    LIMIT 100
+"""
+
+
+def encode_vector(value) -> bytes:
+    """pgvector 二进制格式：维度(int16) + 保留(int16) + float4 数组（大端）"""
+    vec = np.asarray(value, dtype=">f4")
+    return struct.pack(">HH", vec.shape[0], 0) + vec.tobytes()
+
+
+def decode_vector(data: bytes):
+    dim, _ = struct.unpack_from(">HH", data)
+    return np.frombuffer(data, dtype=">f4", count=dim, offset=4).astype(np.float32)
+
+
+async def register_vector(conn):
+    await conn.set_type_codec("vector", schema="public", encoder=encode_vector, decoder=decode_vector, format="binary")
+
+
+def clustered(rng, centers, count: int, noise: float = 0.9):
+    picks = rng.integers(0, len(centers), count)
+    return centers[picks] + noise * rng.standard_normal((count, DIM), dtype=np.float32) / np.sqrt(DIM) * 8
+
+
+def weighted(rng, choices, count: int) -> list:
+    names = [name for name, _ in choices]
+    return [names[i] for i in rng.choice(len(names), count, p=[w for _, w in choices])]
+
+
+async def setup(conn, rows: int, rng) -> None:
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.execute(f"""
+        CREATE TABLE {SCHEMA}.conversations (
+            id uuid PRIMARY KEY, user_msg text, assistant_msg text, created_at timestamptz,
+            scene_type text, topic text, emotion text, round_number int, model_channel text,
+            embedding public.vector(1024)
+        )
+    """)
+    # 中心点带一个公共分量：真实 embedding 的不同话题之间也有 0.3~0.5 的相似度，
+    # 完全正交的簇在 HNSW 图里是互不连通的孤岛，召回会失真
+    shared = rng.standard_normal(DIM, dtype=np.float32)
+    centers = 0.8 * shared + rng.standard_normal((CLUSTERS, DIM), dtype=np.float32)
+    started = time.perf_counter()
+    base = datetime.now(timezone.utc) - timedelta(days=365)
+    for offset in range(0, rows, 10000):
+        size = min(10000, rows - offset)
+        vectors = clustered(rng, centers, size)
+        channels, scenes = weighted(rng, CHANNELS, size), weighted(rng, SCENES, size)
+        await conn.copy_records_to_table("conversations", schema_name=SCHEMA, records=[(
+            uuid.uuid4(), "u", "a", base + timedelta(seconds=(offset + i) * 60), scenes[i], None, None,
+            offset + i + 1, channels[i], vectors[i],
+        ) for i in range(size)])
+    print(f"seeded {rows} rows in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    await conn.execute("SET maintenance_work_mem = '1GB'")
+    for channel, _ in CHANNELS:
+        await conn.execute(f"""
+            CREATE INDEX idx_bench_embedding_hnsw_{channel} ON {SCHEMA}.conversations
+                USING hnsw (embedding public.vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+                WHERE model_channel = '{channel}'
+        """)
+    await conn.execute("RESET maintenance_work_mem")
+    await conn.execute(f"ANALYZE {SCHEMA}.conversations")
+    print(f"HNSW indexes built in {time.perf_counter() - started:.1f}s")
+
+
+def plan_index_names(plan: dict) -> list:
+    names = [plan["Index Name"]] if "Index Name" in plan else []
+    for child in plan.get("Plans", []):
+        names.extend(plan_index_names(child))
+    return names
+
+
+async def check_plan(conn, channels: list) -> bool:
+    """每张表每个通道：ANN 子查询能否用上 HNSW 部分索引，以及规划器默认是否选它"""
+    ok = True
+    for table in ("conversations", "summaries"):
+        for channel in channels:
+            sample = await conn.fetchval(
+                f"SELECT embedding FROM {table} WHERE embedding IS NOT NULL AND model_channel = $1 LIMIT 1", channel)
+            if sample is None:
+                print(f"{table:14s} {channel:10s} no embeddings, skipped")
+                continue
+            sql = SQL_PLAN.format(table=table, channel=f"'{channel}'")
+            natural = plan_index_names(json.loads(await conn.fetchval(sql, sample))[0]["Plan"])
+            async with conn.transaction():
+                # 小表上规划器可能更愿意顺序扫描，这里确认索引至少“能用”（谓词、操作符类都匹配）
+                await conn.execute("SET LOCAL enable_seqscan = off")
+                forced = plan_index_names(json.loads(await conn.fetchval(sql, sample))[0]["Plan"])
+            usable = any("hnsw" in name for name in forced)
+            chosen = any("hnsw" in name for name in natural)
+            ok &= usable
+            print(f"{table:14s} {channel:10s} {'OK  ' if usable else 'FAIL'} "
+                  f"usable={forced or '-'} chosen_by_default={chosen}")
+    return ok
+
+
+async def check_plan_bench(conn) -> bool:
+    """bench 表上 ANN 子查询默认就应该选 HNSW（数据量够大时）"""
+    sample = await conn.fetchval("SELECT embedding FROM conversations WHERE model_channel = 'deepseek' LIMIT 1")
+    names = plan_index_names(json.loads(await conn.fetchval(
+        SQL_PLAN.format(table="conversations", channel="'deepseek'"), sample))[0]["Plan"])
+    return any("hnsw" in name for name in names)
+
+
+async def measure(conn, sql: str, queries, channel: str, scene, ef: int, iterations: int):
+    latencies, results = [], []
+    for i in range(iterations):
+        q = queries[i % len(queries)]
+        started = time.perf_counter()
+        rows = await conn.fetch(sql, q, channel, scene, K, *([ef] if ef else []))
+        latencies.append(time.perf_counter() - started)
+        if i < len(queries):
+            results.append([row["id"] for row in rows])
+    latencies.sort()
+    return results, statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.95) - 1] * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", help="默认用 SUPABASE_DB_URL")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--ef", default="40,100,200,400", help="要测的 ef_search，逗号分隔")
+    parser.add_argument("--keep", action="store_true", help="保留 vector_bench schema，重复运行时不再生成数据")
+    parser.add_argument("--check-plan", action="store_true", help="只对线上表做 EXPLAIN 回归检查")
+    parser.add_argument("--channels", default="deepseek,claude")
+    args = parser.parse_args()
+
+    dsn = args.dsn or get_settings().supabase_db_url
+    if not dsn:
+        raise SystemExit("SUPABASE_DB_URL (or --dsn) is required")
+    conn = await asyncpg.connect(dsn, statement_cache_size=0)
+    try:
+        await register_vector(conn)
+        if args.check_plan:
+            ok = await check_plan(conn, [c.strip() for c in args.channels.split(",") if c.strip()])
+            raise SystemExit(0 if ok else 1)
+
+        rng = np.random.default_rng(0)
+        exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", f"{SCHEMA}.conversations")
+        if exists and args.keep:
+            print(f"reusing {SCHEMA} ({await conn.fetchval(f'SELECT count(*) FROM {SCHEMA}.conversations')} rows)")
+        else:
+            await setup(conn, args.rows, rng)
+        # search_conversations_v2 里的表名按 search_path 解析，指向 bench 表
+        await conn.execute(f"SET search_path = {SCHEMA}, public")
+        # 查询向量：随机取本通道的向量再加扰动（和表里同分布，但不是原样命中）
+        samples = await conn.fetch(
+            f"SELECT embedding FROM conversations WHERE model_channel = 'deepseek' ORDER BY random() LIMIT {QUERIES}")
+        queries = [row["embedding"] + 0.5 * rng.standard_normal(DIM, dtype=np.float32) / np.sqrt(DIM) * 8
+                   for row in samples]
+
+        ok = await check_plan_bench(conn)
+        print(f"plan check: {'OK' if ok else 'FAIL (ANN subquery does not use the HNSW index)'}")
+        print(f"iterations={args.iterations} k={K} channel=deepseek")
+        for label, scene in (("scene=daily", "daily"), ("scene=meta", "meta"), ("no scene filter", None)):
+            exact, p50, p95 = await measure(conn, SQL_EXACT, queries, "deepseek", scene, 0, args.iterations)
+            print(f"{label:16s} {'exact (001)':14s} p50 {p50:8.2f}ms  p95 {p95:8.2f}ms  recall@{K} 1.000")
+            for ef in (int(v) for v in args.ef.split(",")):
+                ann, p50, p95 = await measure(conn, SQL_RPC, queries, "deepseek", scene, ef, args.iterations)
+                recall = statistics.mean(len(set(a) & set(e)) / max(len(e), 1) for a, e in zip(ann, exact))
+                print(f"{label:16s} {f'hnsw ef={ef}':14s} p50 {p50:8.2f}ms  p95 {p95:8.2f}ms  recall@{K} {recall:.3f}")
+    finally:
+        if not args.keep and not args.check_plan:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
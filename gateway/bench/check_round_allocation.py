@@ -0,0 +1,155 @@
+"""
+并发检查：同一 channel 并发写入时轮数唯一且连续
+--target db：对真实库（需已执行 migrations/002）用多个进程同时调用 save_conversation_with_round /
+             save_conversations_batch，写到一个临时 channel，读回 round_number 校验是否正好是 1..N，结束后清理
+--target local：进程内热计数器（ROUND_ALLOCATION=local）+ 内存里的假表，随机延迟并随机让写入失败，
+             校验失败的写入不留空号（不连库，随时可跑）
+
+用法（在 gateway 目录下）：
+    python bench/check_round_allocation.py --target db --processes 4 --turns 50
+    python bench/check_round_allocation.py --target local --turns 2000
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.round_counter import LocalRoundCounter
+
+
+def verify(rounds: list, expected: int) -> bool:
+    duplicates = len(rounds) - len(set(rounds))
+    missing = sorted(set(range(1, expected + 1)) - set(rounds))
+    print(f"rows={len(rounds)} expected={expected} duplicates={duplicates} "
+          f"missing={missing[:10]}{'...' if len(missing) > 10 else ''}")
+    ok = duplicates == 0 and not missing and len(rounds) == expected
+    print("OK: round numbers are unique and gap-free" if ok else "FAILED")
+    return ok
+
+
+# ============ local：进程内计数器 ============
+
+async def check_local(turns: int, failure_rate: float) -> bool:
+    counter = LocalRoundCounter()
+    table = []
+
+    async def load_current():
+        await asyncio.sleep(0.01)
+        return max(table, default=0)
+
+    def writer(count: int):
+        async def write(first_round: int):
+            await asyncio.sleep(random.uniform(0, 0.002))
+            if random.random() < failure_rate:
+                raise RuntimeError("simulated write failure")
+            table.extend(range(first_round, first_round + count))
+            return first_round
+        return write
+
+    async def one(i: int):
+        # 单条和批量混合
+        count = 1 if i % 5 else random.randint(2, 6)
+        while True:
+            try:
+                await counter.allocate("dream", "check", count, load_current, writer(count))
+                return count
+            except RuntimeError:
+                continue
+
+    started = time.perf_counter()
+    written = sum(await asyncio.gather(*(one(i) for i in range(turns))))
+    print(f"local: {turns} writers, {written} rows in {time.perf_counter() - started:.2f}s, stats={counter.get_stats()}")
+    return verify(table, written)
+
+
+# ============ db：多进程打真实库 ============
+
+async def _db_worker(channel: str, turns: int, batch_every: int) -> int:
+    from services.storage import save_conversation_with_round, save_conversations_batch
+
+    async def one(i: int) -> int:
+        if batch_every and i % batch_every == 0:
+            batch = [
+                {"user_msg": f"check batch {i}-{j}", "assistant_msg": "ok", "scene_type": "daily", "channel": channel}
+                for j in range(3)
+            ]
+            ids = await save_conversations_batch(batch)
+            return sum(1 for conv_id in ids if conv_id)
+        conv_id = await save_conversation_with_round(f"check {i}", "ok", channel=channel)
+        return 1 if conv_id else 0
+
+    return sum(await asyncio.gather(*(one(i) for i in range(turns))))
+
+
+def _db_process(channel: str, turns: int, batch_every: int, queue):
+    queue.put(asyncio.run(_db_worker(channel, turns, batch_every)))
+
+
+async def _db_rounds(channel: str) -> list:
+    from services.storage import _run
+    rows = await _run("get_conversations_for_summary", "dream", 0, 10 ** 9, channel)
+    return [row["round_number"] for row in rows]
+
+
+async def _db_cleanup(channel: str):
+    from services.repository import get_repository
+    from services.storage import supabase
+    repo = await get_repository()
+    if repo is not None:
+        await repo._execute("DELETE FROM conversations WHERE model_channel = $1", channel)
+        await repo._execute("DELETE FROM conversation_rounds WHERE model_channel = $1", channel)
+        return
+    supabase.table("conversations").delete().eq("model_channel", channel).execute()
+    supabase.table("conversation_rounds").delete().eq("model_channel", channel).execute()
+
+
+def check_db(processes: int, turns: int, batch_every: int, keep: bool) -> bool:
+    channel = f"round_check_{uuid.uuid4().hex[:8]}"
+    queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_db_process, args=(channel, turns, batch_every, queue))
+        for _ in range(processes)
+    ]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    written = sum(queue.get() for _ in workers)
+    for w in workers:
+        w.join()
+    print(f"db: {processes} processes x {turns} turns -> {written} rows in {time.perf_counter() - started:.2f}s (channel={channel})")
+
+    async def finish():
+        rounds = await _db_rounds(channel)
+        if not keep:
+            await _db_cleanup(channel)
+        return rounds
+
+    return verify(asyncio.run(finish()), written)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", choices=("db", "local"), default="local")
+    parser.add_argument("--processes", type=int, default=4, help="db：并发进程数")
+    parser.add_argument("--turns", type=int, default=50, help="每个进程（local：总共）的并发写入数")
+    parser.add_argument("--batch-every", type=int, default=7, help="db：每隔几次写入混一次 3 条的批量写（0 关闭）")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="local：模拟写入失败的比例")
+    parser.add_argument("--keep", action="store_true", help="db：保留测试数据")
+    args = parser.parse_args()
+
+    if args.target == "local":
+        ok = asyncio.run(check_local(args.turns, args.failure_rate))
+    else:
+        ok = check_db(args.processes, args.turns, args.batch_every, args.keep)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
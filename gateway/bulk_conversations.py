@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+对话批量导入 / 导出 / 向量回填（命令行入口，逻辑在 services/bulk_import.py）
+
+用法（在 gateway 目录下）：
+    python bulk_conversations.py import kelivo_export.jsonl --channel claude
+    python bulk_conversations.py import backups/2026-10-01.json --no-embed
+    python bulk_conversations.py export deepseek.ndjson --channel deepseek
+    python bulk_conversations.py embed --channel deepseek
+    python bulk_conversations.py move --from deepseek --to claude
+
+导入中途中断后重跑同一条命令会从检查点继续；加 --restart 从头开始（已导入的行按 id 跳过，不会重复）。
+move 原地改库里的 channel（需要 migrations/009）；gateway 的关键词索引和最近对话缓存在它自己的进程里，迁移后重启 gateway。
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, '/home/dream/memory-system/gateway')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from services.bulk_import import backfill_embeddings, export_file, import_file, move_channel
+from services.repository import close_repository
+
+
+async def main(args):
+    try:
+        if args.command == "import":
+            await import_file(
+                args.file,
+                user_id=args.user,
+                channel=args.channel,
+                default_channel=args.default_channel,
+                scene_type=args.scene,
+                batch_size=args.batch_size,
+                embed=not args.no_embed,
+                embed_batch_size=args.embed_batch,
+                embed_concurrency=args.embed_concurrency,
+                checkpoint_path=args.checkpoint,
+                resume=not args.restart,
+            )
+        elif args.command == "export":
+            await export_file(args.out, user_id=args.user, channel=args.channel, page_size=args.page_size)
+        elif args.command == "embed":
+            await backfill_embeddings(channel=args.channel, batch_size=args.embed_batch,
+                                      concurrency=args.embed_concurrency)
+        elif args.command == "move":
+            await move_channel(args.from_channel, args.to_channel, user_id=args.user)
+    finally:
+        await close_repository()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对话批量导入 / 导出 / 向量回填")
+    parser.add_argument("--user", default="dream")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="从 JSONL/NDJSON、daily_backup 或 JSON 数组导入")
+    p_import.add_argument("file")
+    p_import.add_argument("--channel", help="强制写入的 channel（库里已有的对话换 channel 用 move）")
+    p_import.add_argument("--default-channel", default="deepseek", help="记录里没有 channel 时用")
+    p_import.add_argument("--scene", help="强制的 scene_type")
+    p_import.add_argument("--batch-size", type=int, default=500)
+    p_import.add_argument("--no-embed", action="store_true", help="只写库，向量之后用 embed 子命令补")
+    p_import.add_argument("--embed-batch", type=int, default=32)
+    p_import.add_argument("--embed-concurrency", type=int, default=4)
+    p_import.add_argument("--checkpoint", help="检查点文件，默认 <源文件>.checkpoint.json")
+    p_import.add_argument("--restart", action="store_true", help="忽略检查点从头导入")
+
+    p_export = sub.add_parser("export", help="按时间顺序导出为 NDJSON")
+    p_export.add_argument("out")
+    p_export.add_argument("--channel")
+    p_export.add_argument("--page-size", type=int, default=1000)
+
+    p_embed = sub.add_parser("embed", help="给没有向量的对话补向量")
+    p_embed.add_argument("--channel")
+    p_embed.add_argument("--embed-batch", type=int, default=32)
+    p_embed.add_argument("--embed-concurrency", type=int, default=4)
+
+    p_move = sub.add_parser("move", help="把一个 channel 的对话和摘要整体改到另一个 channel")
+    p_move.add_argument("--from", dest="from_channel", required=True)
+    p_move.add_argument("--to", dest="to_channel", required=True)
+
+    asyncio.run(main(parser.parse_args()))
@@ -43,6 +43,101 @@ class Settings(BaseSettings):
     memu_port: int = 8000
     memu_url: str = "http://localhost:8000"
 
+    # 上游连接池（每个后端一个长连接客户端）
+    upstream_max_connections: int = 100
+    upstream_max_keepalive: int = 20
+    upstream_keepalive_expiry: float = 60.0
+    upstream_http2: bool = True
+    # 连接预热（HEAD）对同一上游的最小间隔（秒），避免没有空闲连接时每个请求都多发一个 HEAD
+    upstream_warm_interval: float = 10.0
+
+    # 流式透传：原样转发上游字节块，delta 提取放到旁路 task
+    # 和可续传流一起开时缓冲区也原样存取字节（续传按字节偏移，没有事件 id / Last-Event-ID）；
+    # 关闭则逐行解析再转发，续传按事件序号
+    stream_passthrough: bool = True
+
+    # 假流式回放节奏：cps（固定字符速率）/ duration（总时长封顶）/ instant（立即吐完）
+    fake_stream_pacing: str = "duration"
+    fake_stream_cps: float = 200.0
+    fake_stream_max_duration: float = 8.0
+    fake_stream_keepalive_interval: float = 10.0
+
+    # 转发前记忆检索的默认延迟预算（秒），按后端的覆盖见 main.PREFLIGHT_BUDGETS
+    preflight_budget: float = 1.5
+
+    # 对话写后日志（本地 SQLite WAL），为空则用 gateway/data/journal.db
+    journal_path: str = ""
+    journal_batch_size: int = 50
+
+    # 等价组路由：按健康度选通道 + 首字节前失败切换；对冲请求只用于非流式
+    backend_routing: bool = True
+    hedge_requests: bool = False
+    hedge_min_delay: float = 2.0
+
+    # 响应缓存（默认关闭）：只缓存 temperature=0 或客户端系统请求（标题/总结等）
+    response_cache: bool = False
+    response_cache_max_entries: int = 512
+    response_cache_ttl: float = 600.0
+
+    # 记忆注入方式：system（追加到 system prompt）/ trailing（独立尾部消息，保持前缀可被上游 prompt cache 命中）
+    memory_injection_mode: str = "system"
+    # 对支持的后端（Claude）在稳定前缀末尾加 cache_control 断点；只在 trailing 注入时生效
+    # （system 注入每轮改写 system prompt，断点只会产生缓存写入费用）
+    prompt_cache_breakpoints: bool = True
+
+    # 可续传流：上游写入环形缓冲区，客户端断线后 GET /v1/streams/{id}?from=N 续读
+    # 透传开着时 N 是已收到的字节数（字节不改写）；透传关闭时 N 是事件序号，每个事件多一行 id: N、行尾统一成 LF
+    resumable_streams: bool = True
+    stream_buffer_max_streams: int = 32
+    stream_buffer_max_frames: int = 10000
+    stream_buffer_ttl: float = 300.0
+
+    # 单飞合并：相同请求体在途时后来者订阅领头请求的结果；领头结束后保留 window 秒
+    coalesce_requests: bool = True
+    coalesce_window: float = 5.0
+
+    # 共享状态后端：memory（进程内）/ sqlite（WAL 文件，多 worker 共享、重启保留）
+    state_backend: str = "memory"
+    state_path: str = ""
+    # uvicorn worker 数（>1 时请用 sqlite 状态后端）
+    workers: int = 1
+
+    # 存储驱动：supabase（supabase-py + 线程池）/ asyncpg（直连 SUPABASE_DB_URL，连接池 + prepared statement）
+    # / local（本机 SQLite + FTS5 + NumPy 向量索引，不需要 Supabase）
+    storage_driver: str = "supabase"
+    # local 驱动的数据库文件，为空则用 gateway/data/memory.db
+    local_db_path: str = ""
+    pg_pool_min_size: int = 2
+    pg_pool_max_size: int = 10
+    # 对话轮数分配：db（数据库函数原子分配，需 migrations/002）/ local（进程内计数，仅单 worker）/ legacy（先查后插）
+    round_allocation: str = "db"
+    # 计数累加器（引用权重 / 记忆 hits）：每隔多少秒、或待写 ID 数达到多少时批量落库
+    counter_flush_interval: float = 5.0
+    counter_flush_threshold: int = 200
+    # 最近对话 / 摘要尾部缓存：每个 (user, channel) 在内存里保留最新 N 条（0 关闭，WORKERS>1 时自动关闭）
+    recent_cache_size: int = 20
+    # 启动时预热哪些记忆通道（逗号分隔）
+    recent_cache_channels: str = "deepseek,claude"
+    # 进程内关键词倒排索引（BM25）：启动时从库里建好，关键词召回不再走数据库（WORKERS>1 时自动关闭）
+    keyword_index_enabled: bool = True
+    # 本机向量镜像（内存映射文件 + NumPy）：向量检索不再走数据库；local 驱动不需要，自动关闭
+    vector_mirror_enabled: bool = True
+    # 镜像目录，为空则用 gateway/data/vector_mirror（多 worker 共享同一目录）
+    vector_mirror_dir: str = ""
+    # 数据库向量检索的 HNSW 候选数 ef_search（需 migrations/008），越大召回越高、越慢；0 表示用函数默认值（200）
+    vector_ef_search: int = 200
+    # 向量缓存：按 (模型, 规范化文本) 复用 embedding，内存 LRU 条数（0 关闭）+ 磁盘层条数上限（0 只用内存）
+    embedding_cache_enabled: bool = True
+    embedding_cache_size: int = 2048
+    embedding_cache_disk_entries: int = 100000
+    # 磁盘层 SQLite 文件，为空则用 gateway/data/embedding_cache.db（多 worker 共享）
+    embedding_cache_path: str = ""
+    # 会话消息数由数据库触发器增量维护（需 migrations/006，没执行时自动探测到并退回），关闭则退回每条消息后 count 重算
+    session_count_trigger: bool = True
+    # 会话列表按生成列 sort_at = COALESCE(updated_at, created_at) 分页（需 migrations/010，没执行时第一次查询报错后自动退回），
+    # 关闭则按 updated_at 分页（updated_at 为空的会话排在最前）
+    session_sort_at: bool = True
+
     # JWT鉴权
     auth_password: str = ""
     jwt_secret: str = ""
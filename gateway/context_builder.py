@@ -11,6 +11,9 @@ import asyncio
 from datetime import datetime, timezone, timedelta
 
 from config import get_settings
+from services.counter_accumulator import CounterAccumulator
+from services.repository import get_repository
+from services.storage import get_global_recent, is_missing_function, is_uuid
 
 from supabase import create_client
 
@@ -113,26 +116,69 @@ def memory_relevance_score(memory: dict, rerank_score: float = 0.5) -> float:
     return rerank_score * 0.7 + importance * 0.3
 
 
+def _db_touch_memories(memory_ids: list, hits: list) -> int:
+    """【同步】批量 hits + delta 并刷新访问时间（数据库函数，见 migrations/003）"""
+    result = get_supabase().rpc("touch_memories", {"p_ids": memory_ids, "p_hits": hits}).execute()
+    return result.data or 0
+
+
+def _db_touch_memory(memory_id: str, delta: int):
+    """【同步】单条先读后写（没有 migrations/003 时的兜底）"""
+    sb = get_supabase()
+    current = sb.table("memories").select("hits").eq("id", memory_id).execute()
+    if current.data:
+        sb.table("memories").update({
+            "hits": (current.data[0].get("hits") or 0) + delta,
+            "last_accessed_at": datetime.now(timezone.utc).isoformat(),
+        }).eq("id", memory_id).execute()
+
+
+_touch_rpc_missing = False
+
+
+async def _flush_memory_hits(deltas: dict):
+    """hits 累加器的落库函数：一条批量原子 UPDATE"""
+    global _touch_rpc_missing
+    ids, hits = list(deltas), list(deltas.values())
+    repo = await get_repository()
+    if repo is not None:
+        await repo.touch_memories(ids, hits)
+        return
+    if not _touch_rpc_missing:
+        try:
+            await asyncio.to_thread(_db_touch_memories, ids, hits)
+            return
+        except Exception as e:
+            if not is_missing_function(e):
+                raise
+            _touch_rpc_missing = True
+            print(f"[context_builder] touch_memories missing (run migrations/003), updating one by one: {e}")
+    for memory_id, delta in deltas.items():
+        await asyncio.to_thread(_db_touch_memory, memory_id, delta)
+
+
+_settings = get_settings()
+memory_hits = CounterAccumulator(
+    "memory_hits", _flush_memory_hits,
+    interval=_settings.counter_flush_interval, max_pending=_settings.counter_flush_threshold,
+)
+
+
 async def on_memory_injected(memory_id: str):
-    """每次注入记忆时更新访问记录"""
-    try:
-        sb = get_supabase()
-        # 先拿当前 hits
-        current = sb.table("memories").select("hits").eq("id", memory_id).execute()
-        if current.data:
-            new_hits = (current.data[0].get("hits") or 0) + 1
-            sb.table("memories").update({
-                "hits": new_hits,
-                "last_accessed_at": datetime.now(timezone.utc).isoformat(),
-            }).eq("id", memory_id).execute()
-    except Exception as e:
-        print(f"[context_builder] on_memory_injected error: {e}")
+    """每次注入记忆时更新访问记录（进累加器，按批落库；last_accessed_at 取落库时刻）"""
+    if not is_uuid(memory_id):
+        print(f"[context_builder] Ignoring hit for invalid memory id {memory_id!r}")
+        return
+    memory_hits.add(memory_id)
 
 
 # ---- 数据获取函数 ----
 
 async def fetch_core_memories() -> tuple:
     """获取核心记忆（base + living）"""
+    repo = await get_repository()
+    if repo is not None:
+        return await repo.get_core_memories()
     sb = get_supabase()
 
     core_base = sb.table("memories") \
@@ -152,14 +198,8 @@ async def fetch_core_memories() -> tuple:
 
 
 async def fetch_global_recent(limit: int = 3) -> list:
-    """跨 session 全局时间线最新 N 轮对话"""
-    sb = get_supabase()
-    result = sb.table("conversations") \
-        .select("user_msg, assistant_msg, scene_type, created_at") \
-        .order("created_at", desc=True) \
-        .limit(limit * 2) \
-        .execute()
-    return result.data or []
+    """跨 session 全局时间线最新 N 轮对话（读 storage 的尾部缓存）"""
+    return await get_global_recent(limit * 2)
 
 
 async def fetch_merged_summaries(scene_type: str = None, days: int = 30) -> list:
@@ -232,11 +272,14 @@ async def build_context(session_id: str, user_input: str) -> list:
 
     返回: [{"role": "system", "content": "..."}]
     """
-    sb = get_supabase()
-
     # 获取 session 信息
-    session_result = sb.table("sessions").select("scene_type").eq("id", session_id).execute()
-    scene_type = session_result.data[0]["scene_type"] if session_result.data else "daily"
+    repo = await get_repository()
+    if repo is not None:
+        scene_type = await repo.get_session_scene(session_id) or "daily"
+    else:
+        sb = get_supabase()
+        session_result = sb.table("sessions").select("scene_type").eq("id", session_id).execute()
+        scene_type = session_result.data[0]["scene_type"] if session_result.data else "daily"
 
     context_parts = []
     used_tokens = 0
@@ -4,34 +4,69 @@ Memory Gateway - 多后端代理网关
 v2.2 - 场景检测 + 混合检索 + pgvector + 自动注入
 """
 
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import Depends, FastAPI, Request, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse, JSONResponse, PlainTextResponse
 from starlette.background import BackgroundTask
 from contextlib import asynccontextmanager
 import httpx
 import json
 import asyncio
-from typing import AsyncGenerator, Optional
+import os
+import time
+from typing import AsyncGenerator, Optional, Tuple
 from datetime import datetime
 
 import sys
 sys.path.insert(0, '/home/dream/memory-system/gateway')
+from auth import auth_required
 from config import get_settings
-from services.storage import save_conversation_with_round, update_weight
+from services.storage import (
+    build_keyword_index, keyword_index, recent_cache, save_conversations_batch, update_weight, warm_recent_cache,
+)
+from services.counter_accumulator import get_accumulator_stats, stop_accumulators
+from services.repository import close_repository, get_repository, get_repository_stats
 from services.summary_service import check_and_generate_summary
-from services.pgvector_service import store_conversation_embedding
+from services.pgvector_service import embedding_cache, store_conversation_embedding, sync_vector_mirror, vector_mirror
 from services.scene_detector import SceneDetector
+from services.state_backend import get_state_backend
 from services.synonym_service import SynonymService
 from services.auto_inject import AutoInject
+from services.http_pool import UpstreamClientPool
+from services.sse_scanner import scan_sse_queue
+from services.fake_stream import Pacer, SSETemplate, render_message, stream_pending
+from services.preflight import PreflightPipeline
+from services.journal import ConversationJournal
+from services.backend_router import BackendRouter
+from services.response_cache import ResponseCache, make_cache_key
+from services.metrics import (
+    registry as metrics_registry, SCENE_DETECT_SECONDS, RETRIEVAL_SECONDS, UPSTREAM_TTFB_SECONDS,
+    UPSTREAM_RESPONSE_SECONDS, STREAM_DURATION_SECONDS, STORAGE_SECONDS, STORAGE_FLUSH_SECONDS, UPSTREAM_ERRORS,
+    PROMPT_TOKENS, PROMPT_CACHED_TOKENS,
+)
+from services.prompt_cache import PromptCacheStats, add_cache_breakpoints
+from services.stream_buffer import StreamRegistry, pump_stream
+from services.single_flight import Flight, SingleFlight
 import re
 from routers.mcp_tools import router as mcp_router, set_synonym_service
 
 settings = get_settings()
 
 # ============ v2 全局服务实例 ============
-scene_detector = SceneDetector()
-synonym_service = SynonymService()
-auto_inject = AutoInject(synonym_service=synonym_service)
+state_backend = get_state_backend()
+scene_detector = SceneDetector(state=state_backend)
+synonym_service = SynonymService(state=state_backend)
+auto_inject = AutoInject(synonym_service=synonym_service, injection_mode=settings.memory_injection_mode, state=state_backend)
+# system 注入时记忆每轮改写 system prompt，前缀永远对不上：打断点只会每次按 1.25 倍付缓存写入费、没有命中
+PROMPT_CACHE_ACTIVE = settings.prompt_cache_breakpoints and auto_inject.injection_mode == "trailing"
+if settings.prompt_cache_breakpoints and not PROMPT_CACHE_ACTIVE:
+    print("[PromptCache] Breakpoints disabled: MEMORY_INJECTION_MODE=system rewrites the prefix every turn (use trailing)")
+upstream_pool = UpstreamClientPool(
+    max_connections=settings.upstream_max_connections,
+    max_keepalive_connections=settings.upstream_max_keepalive,
+    keepalive_expiry=settings.upstream_keepalive_expiry,
+    http2=settings.upstream_http2,
+    warm_interval=settings.upstream_warm_interval,
+)
 
 # ============ 多后端配置 ============
 
@@ -158,19 +193,22 @@ BACKENDS = {
         "base_url": "https://openrouter.ai/api/v1",
         "api_key": settings.openrouter_api_key,
         "model_name": "anthropic/claude-sonnet-4.5",
-        "extra_headers": {"HTTP-Referer": "https://memory-system.local", "X-Title": "Memory Gateway"}
+        "extra_headers": {"HTTP-Referer": "https://memory-system.local", "X-Title": "Memory Gateway"},
+        "prompt_cache": True
     },
     "claude-opus-4.5": {
         "base_url": "https://openrouter.ai/api/v1",
         "api_key": settings.openrouter_api_key,
         "model_name": "anthropic/claude-opus-4.5",
-        "extra_headers": {"HTTP-Referer": "https://memory-system.local", "X-Title": "Memory Gateway"}
+        "extra_headers": {"HTTP-Referer": "https://memory-system.local", "X-Title": "Memory Gateway"},
+        "prompt_cache": True
     },
     "claude-opus-4.6": {
         "base_url": "https://openrouter.ai/api/v1",
         "api_key": settings.openrouter_api_key,
         "model_name": "anthropic/claude-opus-4.6",
-        "extra_headers": {"HTTP-Referer": "https://memory-system.local", "X-Title": "Memory Gateway"}
+        "extra_headers": {"HTTP-Referer": "https://memory-system.local", "X-Title": "Memory Gateway"},
+        "prompt_cache": True
     },
     
         # ===== DZZI 中转通道（Claude API）=====
@@ -178,13 +216,15 @@ BACKENDS = {
     "claude-opus-4.6-dzzi": {
         "base_url": "https://api.dzzi.ai/v1",
         "api_key": settings.dzzi_api_key,
-        "model_name": "[0.1]claude-opus-4-6-thinking"
+        "model_name": "[0.1]claude-opus-4-6-thinking",
+        "prompt_cache": True
     },
     # 按次计费
     "claude-opus-4.6-dzzi-peruse": {
         "base_url": "https://api.dzzi.ai/v1",
         "api_key": settings.dzzi_per_use_api_key,
-        "model_name": "[按次]claude-opus-4-6-thinking"
+        "model_name": "[按次]claude-opus-4-6-thinking",
+        "prompt_cache": True
     },
 }
 
@@ -212,10 +252,44 @@ MODEL_ALIASES = {
     "deepseek-chat": "deepseek-chat",
     "deepseek-reasoner": "deepseek-reasoner",
         # DZZI 中转
-    "claude-dzzi": "claude-opus-4-6-dzzi",
-    "claude-dzzi-peruse": "claude-opus-4-6-dzzi-peruse",
+    "claude-dzzi": "claude-opus-4.6-dzzi",
+    "claude-dzzi-peruse": "claude-opus-4.6-dzzi-peruse",
+}
+
+# ============ 等价组（同一模型的多条通道） ============
+# 组内按 TTFB/错误率 选最健康的成员，首字节前失败自动切换；按次计费的通道不参与自动路由
+
+BACKEND_GROUPS = {
+    "claude-opus-4.5": ["claude-opus-4.5", "claude-opus-ag"],
+    "claude-opus-4.6": ["claude-opus-4.6", "claude-opus-4.6-dzzi"],
+    "claude-sonnet-4.5": ["claude-sonnet-4.5", "claude-sonnet-ag"],
+    "gemini-3-pro": ["gemini-3-pro", "gemini-3-pro-ag"],
 }
 
+backend_router = BackendRouter(BACKEND_GROUPS)
+
+# 这些上游状态码视为后端故障：记入错误率并切换到组内下一个成员（400 等请求本身的问题不切换）
+FAILOVER_STATUS = {401, 403, 404, 408, 429}
+
+# ============ 预检延迟预算（秒） ============
+# 记忆检索超过预算就不等，直接转发；按 请求别名 > 后端名 > 默认值 查找
+# 快模型给短预算（首字快，等检索不划算），慢的思考模型首字本来就慢，可以多等一会儿
+
+PREFLIGHT_BUDGETS = {
+    "gemini-3-flash": 0.8,
+    "gemini-2.5-flash-ag": 0.8,
+    "deepseek-chat": 1.2,
+    "gpt-4o": 1.2,
+    "deepseek-reasoner": 2.5,
+    "claude-opus-ag": 2.5,
+    "claude-opus-4.5": 2.5,
+    "claude-opus-4.6": 2.5,
+    "claude-opus-4.6-dzzi": 2.5,
+    "claude-opus-4.6-dzzi-peruse": 2.5,
+}
+
+preflight = PreflightPipeline(auto_inject, default_budget=settings.preflight_budget, budgets=PREFLIGHT_BUDGETS)
+
 # ============ 过滤关键词 ============
 
 SYSTEM_KEYWORDS = [
@@ -225,21 +299,88 @@ SYSTEM_KEYWORDS = [
     "Generate a concise", "Based on the conversation"
 ]
 
+def is_system_request(user_msg: str) -> bool:
+    lowered = user_msg.lower()
+    return any(kw.lower() in lowered for kw in SYSTEM_KEYWORDS)
+
 def should_skip_storage(user_msg: str) -> bool:
     if not user_msg or len(user_msg.strip()) < 2:
         return True
-    for kw in SYSTEM_KEYWORDS:
-        if kw.lower() in user_msg.lower():
-            return True
-    return False
+    return is_system_request(user_msg)
+
+# ============ 上游 prompt cache 统计 ============
+
+prompt_cache_stats = PromptCacheStats()
+
+def record_prompt_usage(labels: tuple, usage: Optional[dict]):
+    """记录上游 usage 里的 prompt token / 缓存命中 token"""
+    parsed = prompt_cache_stats.record(labels[1], usage)
+    if parsed is None:
+        return
+    PROMPT_TOKENS.inc(*labels, amount=parsed["prompt_tokens"])
+    if parsed["cached_tokens"]:
+        PROMPT_CACHED_TOKENS.inc(*labels, amount=parsed["cached_tokens"])
+        print(f"[PromptCache] {labels[1]}: {parsed['cached_tokens']}/{parsed['prompt_tokens']} prompt tokens from cache")
+
+# ============ 响应缓存 ============
+
+response_cache = ResponseCache(
+    max_entries=settings.response_cache_max_entries,
+    ttl=settings.response_cache_ttl,
+)
+
+# 命中缓存时一次性吐出，不再模拟打字节奏
+cache_replay_pacer = Pacer(strategy="instant")
+
+def is_cacheable_request(body: dict, user_msg: str) -> bool:
+    """只缓存确定性请求：temperature=0，或客户端系统请求（标题/总结等）"""
+    if body.get("n", 1) != 1:
+        return False
+    return body.get("temperature") == 0 or (bool(user_msg) and is_system_request(user_msg))
+
+def replay_cached_response(message: dict, model: str, as_sse: bool):
+    """按请求模式重放缓存的 assistant 消息"""
+    msg_id = f"chatcmpl-cache-{int(datetime.now().timestamp())}"
+    created = int(datetime.now().timestamp())
+    if as_sse:
+        template = SSETemplate(msg_id=msg_id, created=created, model=model)
+        response = StreamingResponse(
+            render_message(template, message, cache_replay_pacer),
+            media_type="text/event-stream",
+        )
+    else:
+        reply = {"role": "assistant", "content": message.get("content") or ""}
+        if message.get("reasoning_content"):
+            reply["reasoning_content"] = message["reasoning_content"]
+        if message.get("tool_calls"):
+            reply["tool_calls"] = message["tool_calls"]
+        result = {
+            "id": msg_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": reply, "finish_reason": message.get("finish_reason") or "stop"}],
+        }
+        if message.get("usage"):
+            result["usage"] = message["usage"]
+        response = JSONResponse(content=result)
+    response.headers["X-Gateway-Cache"] = "HIT"
+    return response
+
+CITATION_ID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
 
 async def process_citations(assistant_msg: str) -> str:
     pattern = r"\[\[used:([a-f0-9-]+)\]\]"
     matches = re.findall(pattern, assistant_msg)
     for conv_id in matches:
+        # 只认完整的 UUID（截断的 [[used:abc]] 也会被清掉，但不计权重）
+        if not CITATION_ID.fullmatch(conv_id):
+            print(f"[Citation] Ignoring malformed id {conv_id!r}")
+            continue
         try:
             await update_weight(conv_id)
-            print(f"[Citation] Weight updated for {conv_id[:8]}...")
+            print(f"[Citation] Weight +1 queued for {conv_id[:8]}...")
         except Exception as e:
             print(f"[Citation] Error updating weight: {e}")
     clean_msg = re.sub(pattern, "", assistant_msg)
@@ -262,11 +403,69 @@ def get_backend_config(model: str) -> dict:
             "base_url": "https://openrouter.ai/api/v1",
             "api_key": settings.openrouter_api_key,
             "model_name": model,
-            "extra_headers": {"HTTP-Referer": "https://memory-system.local", "X-Title": "Memory Gateway"}
+            "extra_headers": {"HTTP-Referer": "https://memory-system.local", "X-Title": "Memory Gateway"},
+            "prompt_cache": model.startswith("anthropic/")
         }
     print(f"Unknown model '{model}', falling back to deepseek-chat")
     return BACKENDS["deepseek-chat"]
 
+def resolve_backend_name(model: str) -> str:
+    """别名解析为 BACKENDS 的键；OpenRouter 动态模型（带/）原样返回"""
+    resolved_model = MODEL_ALIASES.get(model.lower(), model)
+    if resolved_model in BACKENDS:
+        return resolved_model
+    if "/" in model:
+        return model
+    print(f"Unknown model '{model}', falling back to deepseek-chat")
+    return "deepseek-chat"
+
+
+def build_upstream_plan(requested_model: str, channel: str = "") -> list:
+    """生成上游尝试计划：按健康度排序的候选后端列表，第一个是首选"""
+    primary = resolve_backend_name(requested_model)
+    names = [primary]
+    if settings.backend_routing:
+        names = backend_router.candidates(
+            primary, available=lambda name: bool(BACKENDS.get(name, {}).get("api_key"))
+        )
+
+    plan = []
+    for name in names:
+        backend = BACKENDS.get(name) or get_backend_config(name)
+        if not backend.get("api_key"):
+            continue
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {backend['api_key']}"}
+        if "extra_headers" in backend:
+            headers.update(backend["extra_headers"])
+        plan.append({
+            "name": name,
+            "base_url": backend["base_url"],
+            "url": f"{backend['base_url']}/chat/completions",
+            "headers": headers,
+            "model_name": backend["model_name"],
+            # 支持 cache_control 断点的后端（Claude），发送前给稳定前缀打断点（只在 trailing 注入时，见 PROMPT_CACHE_ACTIVE）
+            "prompt_cache": backend.get("prompt_cache", False) and PROMPT_CACHE_ACTIVE,
+            # 指标标签：(请求模型, 实际后端, 记忆通道)
+            "labels": (requested_model, name, channel),
+        })
+    return plan
+
+
+def attempt_body(attempt: dict, body: dict) -> dict:
+    """某个候选后端实际发送的请求体（模型名 + 可选的 prompt cache 断点）"""
+    payload = dict(body, model=attempt["model_name"])
+    if attempt.get("prompt_cache"):
+        if body.get("messages"):
+            payload["messages"] = add_cache_breakpoints(body["messages"])
+        # 流式默认不带 usage，要求上游在最后一个分片里附上，才能统计缓存命中
+        if body.get("stream") and "stream_options" not in body:
+            payload["stream_options"] = {"include_usage": True}
+    return payload
+
+
+def is_failover_status(status_code: int) -> bool:
+    return status_code >= 500 or status_code in FAILOVER_STATUS
+
 def is_local_url(url: str) -> bool:
     """判断是否为本地地址（本地不需要代理）"""
     return "localhost" in url or "127.0.0.1" in url
@@ -285,12 +484,122 @@ def get_timeout(model_name: str) -> float:
             return 300.0
     return 180.0
 
+# ============ 对话持久化（写后日志） ============
+
+_background_tasks = set()
+
+def spawn(coro) -> asyncio.Task:
+    """创建后台任务并持有引用，避免任务被GC回收"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+def on_journal_flushed(turns: list, conv_ids: list):
+    """一批对话落库后：每个通道检查一次摘要，每条对话向量化"""
+    channels = {turn["channel"] for turn, conv_id in zip(turns, conv_ids) if conv_id}
+    for channel in channels:
+        spawn(check_and_generate_summary(channel=channel))
+    for turn, conv_id in zip(turns, conv_ids):
+        if conv_id:
+            spawn(store_conversation_embedding(
+                conv_id, turn["user_msg"], turn["assistant_msg"],
+                channel=turn["channel"], scene_type=turn.get("scene_type", "daily"),
+            ))
+
+async def write_journal_batch(turns: list, user_id: str = "dream") -> list:
+    with STORAGE_FLUSH_SECONDS.time():
+        return await save_conversations_batch(turns, user_id)
+
+stream_registry = StreamRegistry(
+    max_streams=settings.stream_buffer_max_streams,
+    max_frames=settings.stream_buffer_max_frames,
+    ttl=settings.stream_buffer_ttl,
+)
+
+single_flight = SingleFlight(window=settings.coalesce_window)
+
+def sse_response(source: AsyncGenerator[bytes, None], background: Optional[BackgroundTask] = None,
+                 collector: Optional[dict] = None, flight: Optional[Flight] = None,
+                 raw: bool = False) -> StreamingResponse:
+    """包装 SSE 响应；开启可续传（或需要给合并的重复请求扇出）时上游由后台 task 写入环形缓冲区，客户端从缓冲区读
+
+    raw=True（透传的上游字节）时缓冲区原样存取，不改写字节，续传按字节偏移
+    """
+    if not settings.resumable_streams and flight is None:
+        return StreamingResponse(source, media_type="text/event-stream", background=background)
+    buffer = stream_registry.create(raw)
+    producer = spawn(pump_stream(buffer, source))
+    if collector is not None:
+        collector["producer"] = producer
+    if flight is not None:
+        single_flight.attach_stream(
+            flight, buffer, producer, (lambda: bool(collector.get("error"))) if collector is not None else None)
+    response = StreamingResponse(buffer.follow(0), media_type="text/event-stream", background=background)
+    response.headers["X-Stream-Id"] = buffer.stream_id
+    response.headers["X-Stream-Resume"] = "bytes" if buffer.raw else "events"
+    return response
+
+async def subscribe_flight(flight: Flight) -> Optional[Response]:
+    """订阅领头请求的结果；领头请求失败或缓冲区开头已被挤出时返回 None，由调用方自己发起"""
+    await flight.wait()
+    if flight.abandoned:
+        return None
+    if flight.stream_buffer is not None:
+        buffer = flight.stream_buffer
+        if buffer.first_index > 0:
+            return None
+        response = StreamingResponse(buffer.follow(0), media_type="text/event-stream")
+        response.headers["X-Stream-Id"] = buffer.stream_id
+    else:
+        status_code, content = flight.result
+        response = Response(content=content, status_code=status_code, media_type="application/json")
+    response.headers["X-Coalesced"] = "1"
+    return response
+
+journal = ConversationJournal(
+    path=settings.journal_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "journal.db"),
+    writer=write_journal_batch,
+    on_flushed=on_journal_flushed,
+    batch_size=settings.journal_batch_size,
+)
+
+def get_upstream_client(url: str) -> httpx.AsyncClient:
+    """按目标地址取连接池里的长连接客户端（本地地址不走代理）"""
+    base_url = url.rsplit("/chat/completions", 1)[0]
+    return upstream_pool.get_client(base_url, get_proxy(url))
+
 # ============ 生命周期 ============
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Starting Memory Gateway v2.2 (hybrid search + scene detection)...")
     print(f"Supported models: {list(BACKENDS.keys())}")
+    upstream_pool.build(BACKENDS, get_proxy)
+    # asyncpg / local 驱动：先建好连接池（打开本地库），journal 回放和同义词加载直接用上
+    try:
+        if await get_repository() is not None:
+            print(f"[Storage] Using {settings.storage_driver} driver")
+    except Exception as e:
+        print(f"[Storage] Warning: {settings.storage_driver} repository failed to start: {e}")
+    if settings.storage_driver == "local" and settings.workers > 1:
+        print("[Storage] Warning: STORAGE_DRIVER=local keeps vectors per process, use a single worker")
+    if settings.round_allocation == "local" and settings.workers > 1:
+        print("[Storage] Warning: ROUND_ALLOCATION=local is only safe with a single worker, use db")
+    if settings.recent_cache_size and settings.workers > 1:
+        print("[RecentCache] Disabled with WORKERS>1 (writes from other workers would be missed)")
+    # 预热最近对话缓存，冷启动注入 / init_context 第一次就不用查库
+    try:
+        await warm_recent_cache("dream", [c.strip() for c in settings.recent_cache_channels.split(",") if c.strip()])
+    except Exception as e:
+        print(f"[RecentCache] Warning: warm-up failed: {e}")
+    if settings.keyword_index_enabled and settings.workers > 1:
+        print("[KeywordIndex] Disabled with WORKERS>1 (writes from other workers would be missed)")
+    # 关键词倒排索引在后台建，建好之前关键词检索照常走数据库
+    spawn(build_keyword_index("dream"))
+    # 向量镜像：打开已有文件即可检索（上次同步过的话），后台补齐缺的行
+    spawn(sync_vector_mirror())
+    await journal.start()
     # 初始化v2服务
     try:
         await synonym_service.load()
@@ -301,6 +610,12 @@ async def lifespan(app: FastAPI):
     print("[v2] Scene detector ready")
     print("[v2] Auto-inject ready")
     yield
+    await journal.stop()
+    await stop_accumulators()
+    vector_mirror.close()
+    embedding_cache.close()
+    await close_repository()
+    await upstream_pool.close()
     print("Gateway shutdown complete")
 
 app = FastAPI(title="Memory Gateway", lifespan=lifespan)
@@ -318,12 +633,111 @@ async def health_check():
             "hybrid_search": True,
             "auto_inject": True,
             "current_scene": scene_detector.get_current_scene()
-        }
+        },
+        "state": state_backend.get_stats(),
+        "storage": get_repository_stats(),
+        "preflight": preflight.get_stats(),
+        "journal": journal.get_stats(),
+        "counters": get_accumulator_stats(),
+        "recent_cache": recent_cache.get_stats(),
+        "keyword_index": keyword_index.get_stats(),
+        "vector_mirror": vector_mirror.get_stats(),
+        "embedding_cache": embedding_cache.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "streams": stream_registry.get_stats(),
+        "single_flight": single_flight.get_stats(),
+        "prompt_cache": {
+            "injection_mode": auto_inject.injection_mode,
+            "backends": prompt_cache_stats.get_stats(),
+        },
+        "routing": backend_router.get_stats(),
+        "upstream_pool": upstream_pool.get_stats()
     }
 
+# ============ Prometheus 指标 ============
+
+def _cache_hits() -> int:
+    return response_cache.get_stats()["hits"]
+
+def _cache_misses() -> int:
+    return response_cache.get_stats()["misses"]
+
+def _embedding_cache_hits() -> int:
+    return embedding_cache.memory_hits + embedding_cache.disk_hits
+
+def _active_upstream_connections() -> int:
+    return sum(pool["active"] for pool in upstream_pool.get_stats()["pools"])
+
+metrics_registry.gauge_callback("gateway_response_cache_hits_total", "Response cache hits", _cache_hits, kind="counter")
+metrics_registry.gauge_callback("gateway_response_cache_misses_total", "Response cache misses", _cache_misses, kind="counter")
+metrics_registry.gauge_callback(
+    "gateway_embedding_cache_hits_total", "Embedding cache hits (memory + disk)", _embedding_cache_hits, kind="counter",
+)
+metrics_registry.gauge_callback(
+    "gateway_embedding_cache_misses_total", "Embedding cache misses (sent to the embedding API)",
+    lambda: embedding_cache.misses, kind="counter",
+)
+metrics_registry.gauge_callback("gateway_background_tasks", "In-flight background tasks", lambda: len(_background_tasks))
+metrics_registry.gauge_callback("gateway_journal_queue_depth", "Turns waiting in the write-behind journal", lambda: journal.get_stats()["queue_depth"])
+metrics_registry.gauge_callback("gateway_journal_dead_letters", "Turns moved to the journal dead-letter state", lambda: journal.get_stats()["dead_letters"])
+metrics_registry.gauge_callback(
+    "gateway_counter_pending_increments", "Weight/hit increments waiting for the next batched flush",
+    lambda: sum(stats["pending_increments"] for stats in get_accumulator_stats().values()),
+)
+metrics_registry.gauge_callback(
+    "gateway_counter_flushed_increments_total", "Weight/hit increments written by batched flushes",
+    lambda: sum(stats["flushed_increments"] for stats in get_accumulator_stats().values()), kind="counter",
+)
+metrics_registry.gauge_callback("gateway_upstream_active_connections", "Active pooled upstream connections", _active_upstream_connections)
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.post("/admin/journal/replay")
+async def replay_journal_dead_letters(ids: Optional[str] = Query(None), _=Depends(auth_required)):
+    """把写后日志的死信放回队列重试（ids 逗号分隔，不传则全部）"""
+    try:
+        wanted = [int(v) for v in ids.split(",") if v.strip()] if ids else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+    replayed = journal.replay_dead_letters(wanted)
+    return {"replayed": replayed, "journal": journal.get_stats()}
+
+@app.get("/v1/streams/{stream_id}")
+async def resume_stream(stream_id: str, request: Request, from_: Optional[int] = Query(None, alias="from")):
+    """断线续传：从第 from 个事件（或 Last-Event-ID 的下一个）继续读，上游没结束就一直跟到结束
+
+    透传的流（X-Stream-Resume: bytes）没有事件 id，from 是客户端已收到的字节数
+    """
+    buffer = stream_registry.get(stream_id)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    start = from_
+    if start is None:
+        last_event_id = request.headers.get("last-event-id", "")
+        start = int(last_event_id) + 1 if last_event_id.isdigit() and not buffer.raw else 0
+    unit = "bytes" if buffer.raw else "events"
+    if start < buffer.first_position:
+        raise HTTPException(status_code=410, detail=f"{unit.capitalize()} before {buffer.first_position} are no longer buffered")
+    stream_registry.mark_resumed()
+    print(f"[StreamBuffer] Resuming {stream_id} from {unit} {start} (produced={buffer.next_position}, done={buffer.done})")
+    response = StreamingResponse(buffer.follow(start), media_type="text/event-stream")
+    response.headers["X-Stream-Id"] = stream_id
+    response.headers["X-Stream-Resume"] = unit
+    return response
+
 @app.get("/models")
 async def list_models():
-    return {"models": list(BACKENDS.keys()), "aliases": MODEL_ALIASES}
+    return {
+        "models": list(BACKENDS.keys()),
+        "aliases": MODEL_ALIASES,
+        "routing": {
+            "enabled": settings.backend_routing,
+            "hedging": settings.hedge_requests,
+            "groups": backend_router.get_stats()["groups"],
+        },
+    }
 
 @app.post("/v1/chat/completions")
 async def proxy_chat_completions(request: Request):
@@ -333,16 +747,14 @@ async def proxy_chat_completions(request: Request):
         raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
 
     requested_model = body.get("model", "deepseek-chat")
-    backend = get_backend_config(requested_model)
-
-    if not backend.get("api_key"):
-        raise HTTPException(status_code=400, detail=f"API key not configured for model: {requested_model}")
 
-    body["model"] = backend["model_name"]
+    # ===== v3: 推断记忆通道 =====
+    channel = get_channel_from_model(requested_model)
 
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {backend['api_key']}"}
-    if "extra_headers" in backend:
-        headers.update(backend["extra_headers"])
+    plan = build_upstream_plan(requested_model, channel)
+    if not plan:
+        raise HTTPException(status_code=400, detail=f"API key not configured for model: {requested_model}")
+    primary = plan[0]
 
     messages = body.get("messages", [])
     user_msg = ""
@@ -355,84 +767,161 @@ async def proxy_chat_completions(request: Request):
                 user_msg = " ".join(part.get("text", "") for part in content if part.get("type") == "text")
             break
 
-    # ===== v3: 推断记忆通道 =====
-    channel = get_channel_from_model(requested_model)
+    is_stream = body.get("stream", False)
+    is_fake_stream = "假流式" in requested_model
+
+    # ===== 响应缓存：按客户端原始 messages 计算键（记忆注入之前），命中直接重放 =====
+    cache_key = None
+    if settings.response_cache and is_cacheable_request(body, user_msg):
+        cache_key = make_cache_key(
+            resolve_backend_name(requested_model), messages, body.get("temperature"), body.get("tools")
+        )
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] {requested_model} | stream={is_stream} | channel={channel} | cache=hit")
+            model_name = primary["model_name"].replace("假流式/", "", 1).replace("流式抗截断/", "", 1)
+            return replay_cached_response(cached, model_name, as_sse=is_stream or is_fake_stream)
+
+    # ===== 单飞合并：同一请求体正在处理（或刚处理完）时订阅它的结果，不再检索/请求上游/存储 =====
+    flight = None
+    if settings.coalesce_requests:
+        flight_key = single_flight.fingerprint(body)
+        leader = single_flight.join(flight_key)
+        if leader is not None:
+            response = await subscribe_flight(leader)
+            if response is not None:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] {requested_model} | stream={is_stream} | channel={channel} | coalesced={flight_key[:8]}")
+                return response
+        flight = single_flight.lead(flight_key)
+
+    try:
+        response = await forward_chat(
+            body, requested_model, channel, plan, messages, user_msg,
+            is_stream, is_fake_stream, cache_key, flight
+        )
+    except BaseException:
+        if flight is not None:
+            single_flight.abandon(flight)
+        raise
+    if flight is not None and not flight.settled:
+        # 失败的响应不发布给订阅者 / 之后的重试，让它们自己重新请求
+        if isinstance(response, StreamingResponse) or not 200 <= response.status_code < 300:
+            single_flight.abandon(flight)
+        else:
+            single_flight.resolve(flight, response.status_code, response.body)
+    return response
+
+
+async def forward_chat(body: dict, requested_model: str, channel: str, plan: list, messages: list, user_msg: str,
+                       is_stream: bool, is_fake_stream: bool, cache_key: Optional[str] = None,
+                       flight: Optional[Flight] = None) -> Response:
+    """场景检测 → 限时记忆注入 → 按模式转发上游"""
+    primary = plan[0]
 
     # ===== v2: 场景检测 =====
     current_scene = "daily"
     try:
-        current_scene = scene_detector.detect(user_msg, channel=channel)
+        with SCENE_DETECT_SECONDS.time(*primary["labels"]):
+            current_scene = scene_detector.detect(user_msg, channel=channel)
         if scene_detector.has_scene_changed():
             print(f"[v2] Scene changed to: {current_scene} (channel={channel})")
     except Exception as e:
         print(f"[v2] Scene detection error: {e}")
 
-    # ===== v2: 自动注入记忆 =====
+    # ===== v2: 自动注入记忆（限时预检，与上游连接预热并行） =====
+    spawn(upstream_pool.warm(primary["base_url"], get_proxy(primary["base_url"])))
+    budget = preflight.get_budget(requested_model, primary["name"])
+    preflight_path = "error"
     try:
-        messages = await auto_inject.process(
-            user_msg=user_msg,
-            scene_type=current_scene,
-            messages=messages,
-            channel=channel
-        )
+        with RETRIEVAL_SECONDS.time(*primary["labels"]):
+            messages, preflight_path = await preflight.run(
+                user_msg=user_msg,
+                scene_type=current_scene,
+                messages=messages,
+                budget=budget,
+                channel=channel
+            )
         body["messages"] = messages
     except Exception as e:
         print(f"[v2] Auto-inject error: {e}")
 
-    is_stream = body.get("stream", False)
-    target_url = f"{backend['base_url']}/chat/completions"
-
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] {requested_model} -> {backend['model_name']} | stream={is_stream} | scene={current_scene} | channel={channel}")
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {requested_model} -> {primary['name']} ({primary['model_name']}) | stream={is_stream} | scene={current_scene} | channel={channel} | preflight={preflight_path}")
 
     # 假流式模型走非流式请求再包装成SSE
-    if "假流式" in requested_model:
-        return await fake_stream_to_normal(target_url, headers, body, user_msg, current_scene, channel)
+    if is_fake_stream:
+        response = await fake_stream_to_normal(plan, body, user_msg, current_scene, channel, cache_key, flight)
     elif is_stream:
         collector = {"assistant_chunks": [], "reasoning_chunks": []}
-        return StreamingResponse(
-            stream_chunks(target_url, headers, body, collector),
-            media_type="text/event-stream",
-            background=BackgroundTask(store_stream_result, collector, user_msg, current_scene, channel)
+        response = sse_response(
+            stream_with_failover(plan, body, collector),
+            background=BackgroundTask(store_stream_result, collector, user_msg, current_scene, channel, cache_key),
+            collector=collector,
+            flight=flight,
+            raw=settings.stream_passthrough,
         )
     else:
-        return await non_stream_request(target_url, headers, body, user_msg, current_scene, channel)
+        response = await non_stream_request(plan, body, user_msg, current_scene, channel, cache_key)
+    response.headers["X-Memory-Preflight"] = preflight_path
+    if cache_key:
+        response.headers["X-Gateway-Cache"] = "MISS"
+    return response
 
 # ============ 假流式处理 ============
 
-async def fake_stream_to_normal(url: str, headers: dict, body: dict, user_msg: str, scene_type: str = "daily", channel: str = "deepseek"):
+fake_stream_pacer = Pacer(
+    strategy=settings.fake_stream_pacing,
+    cps=settings.fake_stream_cps,
+    max_duration=settings.fake_stream_max_duration,
+)
+
+async def fake_stream_to_normal(plan: list, body: dict, user_msg: str, scene_type: str = "daily", channel: str = "deepseek",
+                                cache_key: Optional[str] = None, flight: Optional[Flight] = None):
     """
     假流式：
-    1. 去掉模型名前缀，以非流式方式请求
-    2. 解析 content + reasoning_content + tool_calls
-    3. 包装成标准SSE流返回给Kelivo（先发思考再发回答）
-    4. 存储到数据库（带scene_type）
+    1. 去掉模型名前缀，以非流式方式请求（后台 task，不阻塞开流）
+    2. 立即返回SSE：先发 role chunk，上游未返回期间发 keep-alive 注释
+    3. 上游返回后解析 content + reasoning_content + tool_calls，按节奏策略回放（先思考再回答）
+    4. 存储由 BackgroundTask 等上游结果后执行（带scene_type），不受客户端断连影响
     """
     body["stream"] = False
-    if isinstance(body.get("model"), str):
-        body["model"] = body["model"].replace("假流式/", "", 1).replace("流式抗截断/", "", 1)
-
-    print(f"[FakeStream] Requesting non-stream: {body['model']}")
-
-    proxy = get_proxy(url)
-    timeout = get_timeout(body.get("model", ""))
+    plan = [
+        dict(attempt, model_name=attempt["model_name"].replace("假流式/", "", 1).replace("流式抗截断/", "", 1))
+        for attempt in plan
+    ]
+
+    print(f"[FakeStream] Requesting non-stream: {plan[0]['model_name']}")
+
+    upstream = asyncio.create_task(fetch_fake_stream_message(plan, body))
+    template = SSETemplate(
+        msg_id=f"chatcmpl-fake-{int(datetime.now().timestamp())}",
+        created=int(datetime.now().timestamp()),
+        model=plan[0]["model_name"],
+    )
+    return sse_response(
+        stream_pending(template, upstream, fake_stream_pacer, settings.fake_stream_keepalive_interval),
+        background=BackgroundTask(store_fake_stream_result, upstream, user_msg, scene_type, channel, cache_key),
+        flight=flight,
+    )
+
+
+async def fetch_fake_stream_message(plan: list, body: dict) -> dict:
+    """非流式请求上游（失败按路由计划切换），返回 {"error": {...}} 或解析好的 assistant 消息"""
+    timeout = get_timeout(plan[0]["model_name"])
 
     try:
-        async with httpx.AsyncClient(timeout=timeout, proxy=proxy) as client:
-            response = await client.post(url, headers=headers, json=body)
-            if response.status_code != 200:
-                error_text = response.text
-                print(f"[FakeStream] Backend error {response.status_code}: {error_text[:300]}")
-                return JSONResponse(
-                    status_code=response.status_code,
-                    content={"error": {"message": error_text, "code": response.status_code}}
-                )
-            result = response.json()
+        attempt, response = await post_with_routing(plan, body)
+        if response.status_code != 200:
+            error_text = response.text
+            print(f"[FakeStream] Backend error {response.status_code}: {error_text[:300]}")
+            return {"error": {"message": error_text, "code": response.status_code}}
+        result = response.json()
+        record_prompt_usage(attempt["labels"], result.get("usage"))
     except httpx.TimeoutException:
         print(f"[FakeStream] Request timeout ({timeout}s)")
-        return JSONResponse(status_code=504, content={"error": {"message": "Gateway timeout", "code": 504}})
+        return {"error": {"message": "Gateway timeout", "code": 504}}
     except Exception as e:
         print(f"[FakeStream] Connection error: {e}")
-        return JSONResponse(status_code=502, content={"error": {"message": str(e), "code": 502}})
+        return {"error": {"message": str(e), "code": 502}}
 
     # 解析响应
     choice = result.get("choices", [{}])[0] if result.get("choices") else {}
@@ -440,9 +929,6 @@ async def fake_stream_to_normal(url: str, headers: dict, body: dict, user_msg: s
     assistant_content = message.get("content", "") or ""
     reasoning_content = message.get("reasoning_content", "") or ""
     tool_calls = message.get("tool_calls")
-    model_name = result.get("model", "")
-    msg_id = result.get("id", f"chatcmpl-fake-{int(datetime.now().timestamp())}")
-    finish_reason = choice.get("finish_reason", "stop")
 
     if tool_calls:
         print(f"[FakeStream] Got {len(tool_calls)} tool_calls: {[tc.get('function', {}).get('name', '?') for tc in tool_calls]}")
@@ -453,179 +939,165 @@ async def fake_stream_to_normal(url: str, headers: dict, body: dict, user_msg: s
     if not assistant_content and not reasoning_content and not tool_calls:
         print(f"[FakeStream] WARNING: Empty response! Full result: {json.dumps(result, ensure_ascii=False)[:500]}")
 
-    # 存储到数据库（v3: 带scene_type + channel，使用pgvector）
-    storage_text = assistant_content or reasoning_content
+    return {
+        "content": assistant_content,
+        "reasoning_content": reasoning_content,
+        "tool_calls": tool_calls,
+        "finish_reason": choice.get("finish_reason", "stop"),
+        "labels": attempt["labels"],
+    }
+
+
+async def store_fake_stream_result(upstream: asyncio.Task, user_msg: str, scene_type: str, channel: str,
+                                   cache_key: Optional[str] = None):
+    """BackgroundTask：等上游结果后存储（v3: 带scene_type + channel，使用pgvector）"""
+    try:
+        message = await upstream
+    except Exception as e:
+        print(f"[FakeStream] Upstream task error: {e}")
+        return
+    if "error" in message:
+        return
+    if cache_key:
+        response_cache.put(cache_key, message)
+
+    storage_text = message["content"] or message["reasoning_content"]
     if user_msg and storage_text and not should_skip_storage(user_msg):
         try:
-            conv_id = await save_conversation_with_round(user_msg, storage_text, scene_type=scene_type, channel=channel)
-            asyncio.create_task(check_and_generate_summary(channel=channel))
-            if conv_id:
-                asyncio.create_task(store_conversation_embedding(conv_id, user_msg, storage_text))
-            print(f"[FakeStream] Saved to DB (scene={scene_type}, channel={channel})")
+            with STORAGE_SECONDS.time(*message["labels"]):
+                journal.append(user_msg, storage_text, scene_type=scene_type, channel=channel)
+            print(f"[FakeStream] Queued for storage (scene={scene_type}, channel={channel})")
         except Exception as e:
             print(f"[FakeStream] Storage error: {e}")
 
-    # 包装成标准SSE流返回给Kelivo
-    async def generate_sse():
-        created = int(datetime.now().timestamp())
-
-        if tool_calls:
-            # ===== 工具调用模式 =====
-            # 先发送思考过程（如果有）
-            if reasoning_content:
-                chunk_size = 4
-                for i in range(0, len(reasoning_content), chunk_size):
-                    text_chunk = reasoning_content[i:i + chunk_size]
-                    chunk_data = {
-                        "id": msg_id,
-                        "object": "chat.completion.chunk",
-                        "created": created,
-                        "model": model_name,
-                        "choices": [{
-                            "index": 0,
-                            "delta": {"reasoning_content": text_chunk},
-                            "finish_reason": None
-                        }]
-                    }
-                    yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n".encode()
-                    await asyncio.sleep(0.02)
-
-            for tc_idx, tc in enumerate(tool_calls):
-                func = tc.get("function", {})
-                tc_id = tc.get("id", f"call_{tc_idx}")
-                arguments = func.get("arguments", "")
-
-                first_delta = {
-                    "tool_calls": [{
-                        "index": tc_idx,
-                        "id": tc_id,
-                        "type": "function",
-                        "function": {
-                            "name": func.get("name", ""),
-                            "arguments": ""
-                        }
-                    }]
-                }
-                if tc_idx == 0:
-                    first_delta["role"] = "assistant"
-                    first_delta["content"] = None
-
-                yield f"data: {json.dumps({'id': msg_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model_name, 'choices': [{'index': 0, 'delta': first_delta, 'finish_reason': None}]}, ensure_ascii=False)}\n\n".encode()
-
-                if arguments:
-                    arg_delta = {
-                        "tool_calls": [{
-                            "index": tc_idx,
-                            "function": {"arguments": arguments}
-                        }]
-                    }
-                    yield f"data: {json.dumps({'id': msg_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model_name, 'choices': [{'index': 0, 'delta': arg_delta, 'finish_reason': None}]}, ensure_ascii=False)}\n\n".encode()
-
-            yield f"data: {json.dumps({'id': msg_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model_name, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'tool_calls'}]}, ensure_ascii=False)}\n\n".encode()
-            yield b"data: [DONE]\n\n"
-
-        else:
-            # ===== 文本模式（含思考过程） =====
-            # 第一个chunk带role
-            first_chunk = {
-                "id": msg_id,
-                "object": "chat.completion.chunk",
-                "created": created,
-                "model": model_name,
-                "choices": [{
-                    "index": 0,
-                    "delta": {"role": "assistant", "content": ""},
-                    "finish_reason": None
-                }]
-            }
-            yield f"data: {json.dumps(first_chunk, ensure_ascii=False)}\n\n".encode()
-
-            # 先发送 reasoning_content（思考过程）
-            if reasoning_content:
-                chunk_size = 4
-                for i in range(0, len(reasoning_content), chunk_size):
-                    text_chunk = reasoning_content[i:i + chunk_size]
-                    chunk_data = {
-                        "id": msg_id,
-                        "object": "chat.completion.chunk",
-                        "created": created,
-                        "model": model_name,
-                        "choices": [{
-                            "index": 0,
-                            "delta": {"reasoning_content": text_chunk},
-                            "finish_reason": None
-                        }]
-                    }
-                    yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n".encode()
-                    await asyncio.sleep(0.02)
-
-            # 再发送 content（最终回答）
-            if assistant_content:
-                chunk_size = 4
-                for i in range(0, len(assistant_content), chunk_size):
-                    text_chunk = assistant_content[i:i + chunk_size]
-                    chunk_data = {
-                        "id": msg_id,
-                        "object": "chat.completion.chunk",
-                        "created": created,
-                        "model": model_name,
-                        "choices": [{
-                            "index": 0,
-                            "delta": {"content": text_chunk},
-                            "finish_reason": None
-                        }]
-                    }
-                    yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n".encode()
-                    await asyncio.sleep(0.02)
-
-            # 结束标记
-            yield f"data: {json.dumps({'id': msg_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model_name, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}, ensure_ascii=False)}\n\n".encode()
-            yield b"data: [DONE]\n\n"
-
-    return StreamingResponse(generate_sse(), media_type="text/event-stream")
-
 # ============ 正常流式处理 ============
 
-async def stream_chunks(url: str, headers: dict, body: dict, collector: dict) -> AsyncGenerator[bytes, None]:
+async def stream_with_failover(plan: list, body: dict, collector: dict) -> AsyncGenerator[bytes, None]:
+    """按路由计划流式请求：首字节前失败就切到下一个候选后端"""
+    for i, attempt in enumerate(plan):
+        is_last = i == len(plan) - 1
+        collector["backend"] = attempt["name"]
+        collector["labels"] = attempt["labels"]
+        async for chunk in stream_chunks(
+            attempt["url"], attempt["headers"], attempt_body(attempt, body), collector,
+            backend_name=attempt["name"], allow_failover=not is_last, labels=attempt["labels"]
+        ):
+            yield chunk
+        if not collector.pop("failover", False):
+            return
+        print(f"[Router] {attempt['name']} failed before first byte, failing over to {plan[i + 1]['name']}")
+
+
+async def stream_chunks(url: str, headers: dict, body: dict, collector: dict, passthrough: Optional[bool] = None,
+                        backend_name: str = "", allow_failover: bool = False,
+                        labels: Optional[tuple] = None) -> AsyncGenerator[bytes, None]:
     """流式转发响应给客户端，同时收集 chunks 到 collector 字典。
     存储逻辑由 BackgroundTask(store_stream_result) 在响应结束后独立执行，
-    避免客户端断连导致 async generator 被取消而丢失存储。"""
-    proxy = get_proxy(url)
+    避免客户端断连导致 async generator 被取消而丢失存储。
+
+    passthrough=True（默认取 settings.stream_passthrough）时原样转发上游字节块，
+    content/reasoning 的提取交给旁路扫描 task，不占用转发路径。
+    allow_failover=True 时首字节前的失败不向客户端输出，只置 collector["failover"] 由调用方切换后端。
+    labels=(请求模型, 后端, 通道) 时记录 TTFB / 流时长 / 错误指标。"""
+    if passthrough is None:
+        passthrough = settings.stream_passthrough
+    client = get_upstream_client(url)
     timeout = get_timeout(body.get("model", ""))
+    queue: Optional[asyncio.Queue] = None
+    started = time.perf_counter()
+    first_byte = False
+
+    def mark_first_byte():
+        nonlocal first_byte
+        if not first_byte:
+            first_byte = True
+            ttfb = time.perf_counter() - started
+            if backend_name:
+                backend_router.record_success(backend_name, ttfb)
+            if labels:
+                UPSTREAM_TTFB_SECONDS.observe(ttfb, *labels)
 
     try:
-        async with httpx.AsyncClient(timeout=timeout, proxy=proxy) as client:
-            async with client.stream("POST", url, headers=headers, json=body) as response:
-                if response.status_code != 200:
-                    error_body = await response.aread()
-                    print(f"[Stream] Backend error {response.status_code}: {error_body.decode()[:300]}")
-                    yield f"data: {json.dumps({'error': error_body.decode()})}\n\n".encode()
-                    collector["error"] = True
-                    return
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        yield f"{line}\n\n".encode()
-                        if line == "data: [DONE]":
-                            continue
-                        try:
-                            data = json.loads(line[6:])
-                            delta = data.get("choices", [{}])[0].get("delta", {})
-                            content = delta.get("content", "")
-                            reasoning = delta.get("reasoning_content", "")
-                            if content:
-                                collector["assistant_chunks"].append(content)
-                            if reasoning:
-                                collector["reasoning_chunks"].append(reasoning)
-                        except:
-                            pass
+        async with client.stream("POST", url, headers=headers, json=body, timeout=timeout) as response:
+            if response.status_code != 200:
+                error_body = await response.aread()
+                print(f"[Stream] Backend error {response.status_code}: {error_body.decode()[:300]}")
+                if labels:
+                    UPSTREAM_ERRORS.inc(*labels, "status")
+                if is_failover_status(response.status_code):
+                    if backend_name:
+                        backend_router.record_failure(backend_name)
+                    if allow_failover:
+                        collector["failover"] = True
+                        return
+                yield f"data: {json.dumps({'error': error_body.decode()})}\n\n".encode()
+                collector["error"] = True
+                return
+            if passthrough:
+                queue = asyncio.Queue()
+                collector["scanner"] = asyncio.create_task(scan_sse_queue(queue, collector))
+                async for block in response.aiter_bytes():
+                    mark_first_byte()
+                    yield block
+                    queue.put_nowait(block)
+                if labels:
+                    STREAM_DURATION_SECONDS.observe(time.perf_counter() - started, *labels)
+                return
+            async for line in response.aiter_lines():
+                if line.startswith("data: "):
+                    mark_first_byte()
+                    yield f"{line}\n\n".encode()
+                    if line == "data: [DONE]":
+                        continue
+                    try:
+                        data = json.loads(line[6:])
+                        if data.get("usage"):
+                            collector["usage"] = data["usage"]
+                        choice = (data.get("choices") or [{}])[0]
+                        delta = choice.get("delta", {})
+                        content = delta.get("content", "")
+                        reasoning = delta.get("reasoning_content", "")
+                        if content:
+                            collector["assistant_chunks"].append(content)
+                        if reasoning:
+                            collector["reasoning_chunks"].append(reasoning)
+                        if delta.get("tool_calls"):
+                            collector["has_tool_calls"] = True
+                        if choice.get("finish_reason"):
+                            collector["finish_reason"] = choice["finish_reason"]
+                    except:
+                        pass
+            if labels:
+                STREAM_DURATION_SECONDS.observe(time.perf_counter() - started, *labels)
     except Exception as e:
         print(f"[Stream] Connection error: {e}")
+        if labels:
+            UPSTREAM_ERRORS.inc(*labels, "timeout" if isinstance(e, httpx.TimeoutException) else "error")
+        if not first_byte:
+            if backend_name:
+                backend_router.record_failure(backend_name)
+            if allow_failover:
+                collector["failover"] = True
+                return
         collector["error"] = True
+    finally:
+        # 通知旁路扫描器上游已结束（客户端断连被取消时也要通知）
+        if queue is not None:
+            queue.put_nowait(None)
 
 
-async def store_stream_result(collector: dict, user_msg: str, scene_type: str, channel: str):
+async def store_stream_result(collector: dict, user_msg: str, scene_type: str, channel: str,
+                              cache_key: Optional[str] = None):
     """BackgroundTask：在流式响应完全结束后执行，将收集到的内容存入数据库。
     此函数独立于 StreamingResponse 运行，不受客户端断连影响。"""
+    # 可续传模式下客户端读完/断开时上游可能还在生成，等后台 producer 写完
+    producer = collector.get("producer")
+    if producer is not None:
+        await producer
+    scanner = collector.get("scanner")
+    if scanner is not None:
+        await scanner
+
     if collector.get("error"):
         print(f"[Stream] Storage skipped due to stream error")
         return
@@ -635,16 +1107,26 @@ async def store_stream_result(collector: dict, user_msg: str, scene_type: str, c
     assistant_msg = "".join(assistant_chunks)
     reasoning_msg = "".join(reasoning_chunks)
 
+    if collector.get("labels"):
+        record_prompt_usage(collector["labels"], collector.get("usage"))
+
+    # 工具调用分片没有收集，这类流不进缓存；客户端中途断开（没收到 finish_reason）也不缓存
+    if cache_key and collector.get("finish_reason") and not collector.get("has_tool_calls"):
+        response_cache.put(cache_key, {
+            "content": assistant_msg,
+            "reasoning_content": reasoning_msg,
+            "tool_calls": None,
+            "finish_reason": collector["finish_reason"],
+        })
+
     print(f"[Stream] Chunks collected: content={len(assistant_chunks)}, reasoning={len(reasoning_chunks)}, user_msg_len={len(user_msg)}, skip={should_skip_storage(user_msg) if user_msg else 'no_user_msg'}")
 
     storage_text = assistant_msg or reasoning_msg
     if user_msg and storage_text and not should_skip_storage(user_msg):
         try:
-            conv_id = await save_conversation_with_round(user_msg, storage_text, scene_type=scene_type, channel=channel)
-            asyncio.create_task(check_and_generate_summary(channel=channel))
-            if conv_id:
-                asyncio.create_task(store_conversation_embedding(conv_id, user_msg, storage_text))
-            print(f"[Stream] Saved to DB (scene={scene_type}, channel={channel})")
+            with STORAGE_SECONDS.time(*collector.get("labels", ("", "", channel))):
+                journal.append(user_msg, storage_text, scene_type=scene_type, channel=channel)
+            print(f"[Stream] Queued for storage (scene={scene_type}, channel={channel})")
         except Exception as e:
             print(f"[Stream] Storage error: {e}")
     else:
@@ -652,13 +1134,90 @@ async def store_stream_result(collector: dict, user_msg: str, scene_type: str, c
 
 # ============ 非流式处理 ============
 
-async def non_stream_request(url: str, headers: dict, body: dict, user_msg: str, scene_type: str = "daily", channel: str = "deepseek") -> JSONResponse:
-    proxy = get_proxy(url)
-    timeout = get_timeout(body.get("model", ""))
+async def post_upstream(attempt: dict, body: dict) -> httpx.Response:
+    """向单个候选后端发非流式请求，并记录其健康度"""
+    client = get_upstream_client(attempt["url"])
+    timeout = get_timeout(attempt["model_name"])
+    started = time.perf_counter()
+    try:
+        response = await client.post(
+            attempt["url"], headers=attempt["headers"],
+            json=attempt_body(attempt, body), timeout=timeout
+        )
+    except Exception as e:
+        backend_router.record_failure(attempt["name"])
+        UPSTREAM_ERRORS.inc(*attempt["labels"], "timeout" if isinstance(e, httpx.TimeoutException) else "error")
+        raise
+    # 非流式拿到的是整个响应的耗时，单独记，不混进流式的 TTFB（路由打分只看 TTFB）
+    elapsed = time.perf_counter() - started
+    if response.status_code == 200:
+        backend_router.record_response(attempt["name"], elapsed)
+        UPSTREAM_RESPONSE_SECONDS.observe(elapsed, *attempt["labels"])
+    else:
+        UPSTREAM_ERRORS.inc(*attempt["labels"], "status")
+        if is_failover_status(response.status_code):
+            backend_router.record_failure(attempt["name"])
+    return response
+
+
+async def post_with_routing(plan: list, body: dict, hedge: bool = False) -> Tuple[dict, httpx.Response]:
+    """按路由计划发非流式请求，返回 (实际命中的候选, 响应)：
+    - 候选后端失败（连接错误或故障状态码）立即切到下一个
+    - hedge=True 且首选有足够样本时，超过其 p95 TTFB 仍未返回就并发请求下一个，先成功者胜出
+    全部失败时返回最后一个上游响应，或抛出最后一个异常"""
+    pending = {}
+    next_idx = 0
+    hedged = False
+    last_response = None
+    last_error: Optional[Exception] = None
+
+    def launch():
+        nonlocal next_idx
+        attempt = plan[next_idx]
+        next_idx += 1
+        pending[asyncio.create_task(post_upstream(attempt, body))] = attempt
+
+    launch()
+    try:
+        while pending:
+            delay = None
+            if hedge and not hedged and next_idx < len(plan):
+                delay = backend_router.hedge_delay(plan[0]["name"], settings.hedge_min_delay)
+            done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                print(f"[Router] {plan[0]['name']} slower than p95 ({delay:.1f}s), hedging with {plan[next_idx]['name']}")
+                launch()
+                continue
+            for task in done:
+                attempt = pending.pop(task)
+                try:
+                    response = task.result()
+                except Exception as e:
+                    print(f"[Router] {attempt['name']} error: {e}")
+                    last_error = e
+                    continue
+                if response.status_code == 200 or not is_failover_status(response.status_code):
+                    return attempt, response
+                last_response = (attempt, response)
+            if not pending and next_idx < len(plan):
+                print(f"[Router] Failing over to {plan[next_idx]['name']}")
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if last_response is not None:
+        return last_response
+    raise last_error
+
+
+async def non_stream_request(plan: list, body: dict, user_msg: str, scene_type: str = "daily", channel: str = "deepseek",
+                             cache_key: Optional[str] = None) -> JSONResponse:
+    timeout = get_timeout(plan[0]["model_name"])
 
     try:
-        async with httpx.AsyncClient(timeout=timeout, proxy=proxy) as client:
-            response = await client.post(url, headers=headers, json=body)
+        attempt, response = await post_with_routing(plan, body, hedge=settings.hedge_requests)
     except httpx.TimeoutException:
         print(f"[NonStream] Request timeout ({timeout}s)")
         return JSONResponse(status_code=504, content={"error": "Gateway timeout"})
@@ -671,14 +1230,24 @@ async def non_stream_request(url: str, headers: dict, body: dict, user_msg: str,
         return JSONResponse(status_code=response.status_code, content={"error": response.text})
 
     result = response.json()
+    record_prompt_usage(attempt["labels"], result.get("usage"))
 
     # 提取content和reasoning_content
     assistant_msg = ""
     reasoning_msg = ""
     try:
-        message = result["choices"][0]["message"]
+        choice = result["choices"][0]
+        message = choice["message"]
         assistant_msg = message.get("content", "") or ""
         reasoning_msg = message.get("reasoning_content", "") or ""
+        if cache_key:
+            response_cache.put(cache_key, {
+                "content": assistant_msg,
+                "reasoning_content": reasoning_msg,
+                "tool_calls": message.get("tool_calls"),
+                "finish_reason": choice.get("finish_reason", "stop"),
+                "usage": result.get("usage"),
+            })
     except:
         pass
 
@@ -689,10 +1258,8 @@ async def non_stream_request(url: str, headers: dict, body: dict, user_msg: str,
     storage_text = assistant_msg or reasoning_msg
     if user_msg and storage_text and not should_skip_storage(user_msg):
         try:
-            conv_id = await save_conversation_with_round(user_msg, storage_text, scene_type=scene_type, channel=channel)
-            asyncio.create_task(check_and_generate_summary(channel=channel))
-            if conv_id:
-                asyncio.create_task(store_conversation_embedding(conv_id, user_msg, storage_text))
+            with STORAGE_SECONDS.time(*attempt["labels"]):
+                journal.append(user_msg, storage_text, scene_type=scene_type, channel=channel)
         except Exception as e:
             print(f"[NonStream] Storage error: {e}")
 
@@ -700,4 +1267,10 @@ async def non_stream_request(url: str, headers: dict, body: dict, user_msg: str,
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    if settings.workers > 1:
+        # 多 worker 需要共享状态（STATE_BACKEND=sqlite），否则场景/轮数各 worker 各算各的
+        if settings.state_backend == "memory":
+            print("[State] WARNING: multiple workers with the in-process state backend")
+        uvicorn.run("main:app", host="0.0.0.0", port=8001, workers=settings.workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8001)
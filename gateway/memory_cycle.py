@@ -11,6 +11,8 @@ import httpx
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from config import get_settings
+from services.pgvector_service import sync_vector_mirror
+from sessions import reconcile_session_counts
 from supabase import create_client
 
 logger = logging.getLogger(__name__)
@@ -293,5 +295,20 @@ def setup_scheduler():
         id='monthly_archive',
         replace_existing=True,
     )
+    scheduler.add_job(
+        reconcile_session_counts,
+        'cron',
+        hour=5,
+        id='session_count_reconcile',
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        sync_vector_mirror,
+        'cron',
+        hour=5,
+        minute=30,
+        id='vector_mirror_sync',
+        replace_existing=True,
+    )
     scheduler.start()
     logger.info("[memory_cycle] 定时任务已启动")
\ No newline at end of file
@@ -5,12 +5,12 @@
 
 import httpx
 import re
-import time
 from typing import Optional, Dict, List, Tuple
 
 import sys
 sys.path.insert(0, '/home/dream/memory-system/gateway')
 from config import get_settings
+from services.state_backend import get_state_backend
 
 settings = get_settings()
 
@@ -18,11 +18,19 @@ AMAP_BASE_URL = "https://restapi.amap.com/v3"
 AMAP_TIMEOUT = 10.0  # 高德是国内服务，10秒足够
 
 # ============ 地理编码缓存 ============
-# key: "地名|城市" -> value: (坐标字符串, 时间戳)
-_geocode_cache: Dict[str, Tuple[str, float]] = {}
+# 存状态后端 geocode namespace：key "地名|城市" -> 坐标字符串（多 worker 共享）
+_GEOCODE_NAMESPACE = "geocode"
 _CACHE_TTL = 600  # 缓存10分钟
 
 
+def _geocode_cache_get(cache_key: str) -> Optional[str]:
+    return get_state_backend().get(_GEOCODE_NAMESPACE, cache_key)
+
+
+def _geocode_cache_set(cache_key: str, location: str):
+    get_state_backend().set(_GEOCODE_NAMESPACE, cache_key, location, ttl=_CACHE_TTL)
+
+
 # ============ 内部工具函数 ============
 
 async def _amap_get(endpoint: str, params: dict) -> dict:
@@ -60,12 +68,10 @@ async def _resolve_location(input_str: str, city: str = "") -> str:
 
     # 查缓存
     cache_key = f"{input_str}|{city}"
-    cached = _geocode_cache.get(cache_key)
+    cached = _geocode_cache_get(cache_key)
     if cached:
-        coord, ts = cached
-        if time.time() - ts < _CACHE_TTL:
-            print(f"[Amap] Geocode cache hit: {input_str} -> {coord}")
-            return coord
+        print(f"[Amap] Geocode cache hit: {input_str} -> {cached}")
+        return cached
 
     # 调 geocode API
     params = {"address": input_str}
@@ -82,7 +88,7 @@ async def _resolve_location(input_str: str, city: str = "") -> str:
         raise Exception(f"'{input_str}' 的坐标数据异常")
 
     # 存缓存
-    _geocode_cache[cache_key] = (location, time.time())
+    _geocode_cache_set(cache_key, location)
     print(f"[Amap] Geocoded: {input_str} -> {location}")
     return location
 
@@ -185,7 +191,7 @@ async def maps_geo(address: str, city: str = "") -> dict:
 
         # 存入缓存
         cache_key = f"{address}|{city}"
-        _geocode_cache[cache_key] = (location, time.time())
+        _geocode_cache_set(cache_key, location)
 
         text = f"📍 {formatted}\n坐标: {location}\n省份: {province}\n城市: {city_name}\n区县: {district}"
         return _ok(text)
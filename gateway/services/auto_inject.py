@@ -11,6 +11,8 @@ import sys
 
 sys.path.insert(0, '/home/dream/memory-system/gateway')
 from services.hybrid_search import hybrid_search, search_recent_by_emotion
+from services.prompt_cache import MEMORY_MARKER
+from services.state_backend import MemoryStateBackend, StateBackend
 
 # 触发规则关键词
 RECALL_KEYWORDS = [
@@ -32,14 +34,26 @@ EMOTION_KEYWORDS = [
 # 注入内容最大字数限制
 MAX_INJECT_CHARS = 500
 
+# 状态后端里的 namespace："{user_id}_{channel}" -> 轮数
+ROUNDS_NAMESPACE = "session_rounds"
+
+# 注入方式：
+# system   - 追加到第一条 system 消息末尾（每轮都改 system prompt，上游 prompt cache 无法命中）
+# trailing - 作为独立消息插在最后一条 user 消息前，system prompt 和历史保持逐字节不变
+INJECTION_MODES = ("system", "trailing")
+
 
 class AutoInject:
     """网关自动记忆注入服务"""
 
-    def __init__(self, synonym_service=None):
+    def __init__(self, synonym_service=None, injection_mode: str = "system", state: Optional[StateBackend] = None):
         self._synonym_service = synonym_service
-        # 会话轮数计数器（按 user_id + channel 隔离，Gateway重启后重置）
-        self._session_rounds: Dict[str, int] = {}
+        if injection_mode not in INJECTION_MODES:
+            print(f"[AutoInject] Unknown injection mode '{injection_mode}', falling back to system")
+            injection_mode = "system"
+        self.injection_mode = injection_mode
+        # 会话轮数计数器（按 user_id + channel 隔离，存状态后端：sqlite 后端下多 worker 共享、重启不清零）
+        self._state = state or MemoryStateBackend()
 
     def _round_key(self, user_id: str, channel: str) -> str:
         """生成轮数计数器的键"""
@@ -47,14 +61,11 @@ class AutoInject:
 
     def increment_round(self, user_id: str = "dream", channel: str = "deepseek") -> int:
         """增加会话轮数并返回当前值"""
-        key = self._round_key(user_id, channel)
-        self._session_rounds[key] = self._session_rounds.get(key, 0) + 1
-        return self._session_rounds[key]
+        return self._state.incr(ROUNDS_NAMESPACE, self._round_key(user_id, channel))
 
     def get_round(self, user_id: str = "dream", channel: str = "deepseek") -> int:
         """获取当前会话轮数"""
-        key = self._round_key(user_id, channel)
-        return self._session_rounds.get(key, 0)
+        return int(self._state.get(ROUNDS_NAMESPACE, self._round_key(user_id, channel), 0))
 
     async def process(
         self,
@@ -68,17 +79,35 @@ class AutoInject:
         处理消息列表，根据规则决定是否注入记忆
         返回修改后的 messages 列表（可能在system prompt末尾追加记忆）
         """
+        _, memory_text = await self.retrieve(user_msg, scene_type, user_id, channel)
+        if not memory_text:
+            return messages
+
+        # 注入到system prompt
+        return self._inject_memory(messages, memory_text)
+
+    async def retrieve(
+        self,
+        user_msg: str,
+        scene_type: str,
+        user_id: str = "dream",
+        channel: str = "deepseek"
+    ) -> Tuple[str, Optional[str]]:
+        """
+        只做检索：计轮数 + 判断规则 + 执行检索
+        返回 (rule_name, 待注入的记忆文本或None)，供预检流水线在截止时间内单独调度
+        """
         current_round = self.increment_round(user_id, channel)
 
         # meta场景不注入
         if scene_type == "meta":
-            return messages
+            return ("meta", None)
 
         # 判断触发规则
         rule, search_query = self._detect_rule(user_msg, scene_type, current_round)
 
         if rule == "default":
-            return messages
+            return (rule, None)
 
         print(f"[AutoInject] Rule triggered: {rule} (round={current_round})")
 
@@ -89,12 +118,13 @@ class AutoInject:
             )
         except Exception as e:
             print(f"[AutoInject] Execution error: {e}")
-            return messages
-
-        if not memory_text:
-            return messages
+            return (rule, None)
+        return (rule, memory_text)
 
-        # 注入到system prompt
+    def inject(self, messages: List[Dict], memory_text: str) -> List[Dict]:
+        """把检索到的记忆注入消息列表（按 injection_mode）"""
+        if self.injection_mode == "trailing":
+            return self._inject_trailing(messages, memory_text)
         return self._inject_memory(messages, memory_text)
 
     def _detect_rule(
@@ -240,14 +270,7 @@ class AutoInject:
         self, messages: List[Dict], memory_text: str
     ) -> List[Dict]:
         """将记忆文本注入system prompt末尾"""
-        inject_block = (
-            "\n\n---\n"
-            "[记忆参考 - 仅供自然融入对话，不要机械引用]\n\n"
-            f"{memory_text}\n\n"
-            "注意：以上记忆仅供参考。标记为[剧本]的内容是角色扮演剧情，不是真实事件。\n"
-            "带时间戳的内容请注意时效性，过去的安排不代表当前状态。\n"
-            "---"
-        )
+        inject_block = f"\n\n---\n{_format_memory_block(memory_text)}---"
 
         # 复制消息列表避免修改原始数据
         new_messages = []
@@ -275,6 +298,37 @@ class AutoInject:
         print(f"[AutoInject] Injected {len(memory_text)} chars into system prompt")
         return new_messages
 
+    def _inject_trailing(
+        self, messages: List[Dict], memory_text: str
+    ) -> List[Dict]:
+        """将记忆作为独立消息插在最后一条 user 消息之前，前面的稳定前缀不变
+
+        用 user 角色而不是 system：Claude 没有对话中途的 system，中转会把它并进顶部 system，
+        反而又破坏了前缀缓存。
+        """
+        memory_msg = {"role": "user", "content": _format_memory_block(memory_text)}
+
+        insert_at = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].get("role") == "user":
+                insert_at = i
+                break
+
+        new_messages = list(messages)
+        new_messages.insert(insert_at, memory_msg)
+        print(f"[AutoInject] Injected {len(memory_text)} chars as trailing message")
+        return new_messages
+
+
+def _format_memory_block(memory_text: str) -> str:
+    """记忆块正文（以 MEMORY_MARKER 开头，prompt_cache 靠它识别易变尾部）"""
+    return (
+        f"{MEMORY_MARKER} - 仅供自然融入对话，不要机械引用]\n\n"
+        f"{memory_text}\n\n"
+        "注意：以上记忆仅供参考。标记为[剧本]的内容是角色扮演剧情，不是真实事件。\n"
+        "带时间戳的内容请注意时效性，过去的安排不代表当前状态。\n"
+    )
+
 
 def _format_time(time_str: str) -> str:
     """格式化时间字符串为北京时间"""
@@ -0,0 +1,169 @@
+"""
+后端路由 - 等价组内按健康度选路
+同一个模型常有多条通道（Antigravity / OpenRouter / DZZI），把它们配成等价组：
+每个后端跟踪首字节耗时（TTFB）的 EWMA 和错误率 EWMA，请求优先发往当前最健康的成员；
+首字节前失败自动切到下一个成员，非流式请求可在 p95 延迟后发一个对冲请求。
+非流式请求拿到的是整个响应的耗时（和输出长度有关），单独记一份，只用来算对冲等待时间，不混进 TTFB。
+"""
+
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+# EWMA 平滑系数（越大越看重最近的样本）
+EWMA_ALPHA = 0.2
+# 错误率惩罚：score = ewma_ttfb * (1 + ERROR_PENALTY * error_rate)
+ERROR_PENALTY = 4.0
+# 连续失败多少次后熔断，熔断期间排到最后
+CIRCUIT_FAILURES = 3
+CIRCUIT_COOLDOWN = 30.0
+# p95 计算用的滑动窗口大小，样本不足时不对冲
+P95_WINDOW = 100
+P95_MIN_SAMPLES = 10
+
+
+class BackendHealth:
+    """单个后端的健康统计"""
+
+    def __init__(self):
+        self.ewma_ttfb: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.last_failure_at = 0.0
+        self.samples: Deque[float] = deque(maxlen=P95_WINDOW)
+        # 非流式请求的完整响应耗时
+        self.ewma_response: Optional[float] = None
+        self.response_samples: Deque[float] = deque(maxlen=P95_WINDOW)
+
+    def _succeeded(self):
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate
+
+    def record_success(self, ttfb: float):
+        self._succeeded()
+        self.ewma_ttfb = ttfb if self.ewma_ttfb is None else (
+            EWMA_ALPHA * ttfb + (1 - EWMA_ALPHA) * self.ewma_ttfb
+        )
+        self.samples.append(ttfb)
+
+    def record_response(self, seconds: float):
+        self._succeeded()
+        self.ewma_response = seconds if self.ewma_response is None else (
+            EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.ewma_response
+        )
+        self.response_samples.append(seconds)
+
+    def record_failure(self):
+        self.requests += 1
+        self.errors += 1
+        self.consecutive_failures += 1
+        self.last_failure_at = time.time()
+        self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+
+    def circuit_open(self) -> bool:
+        return (
+            self.consecutive_failures >= CIRCUIT_FAILURES
+            and time.time() - self.last_failure_at < CIRCUIT_COOLDOWN
+        )
+
+    @staticmethod
+    def _p95(samples: Deque[float]) -> Optional[float]:
+        if len(samples) < P95_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def p95(self) -> Optional[float]:
+        return self._p95(self.samples)
+
+    def response_p95(self) -> Optional[float]:
+        return self._p95(self.response_samples)
+
+
+class BackendRouter:
+    """等价组路由表 + 健康度统计"""
+
+    def __init__(self, groups: Dict[str, List[str]]):
+        self.groups = groups
+        self._group_of: Dict[str, str] = {}
+        for group, members in groups.items():
+            for name in members:
+                self._group_of[name] = group
+        self._health: Dict[str, BackendHealth] = {}
+
+    def health(self, name: str) -> BackendHealth:
+        if name not in self._health:
+            self._health[name] = BackendHealth()
+        return self._health[name]
+
+    def group_of(self, name: str) -> Optional[str]:
+        return self._group_of.get(name)
+
+    def candidates(self, name: str, available: Callable[[str], bool] = lambda n: True) -> List[str]:
+        """返回按健康度排好序的候选后端（第一个是首选），不在等价组里的只返回自己"""
+        group = self._group_of.get(name)
+        if not group:
+            return [name]
+        members = [m for m in self.groups[group] if m == name or available(m)]
+
+        # 没有 TTFB 样本的成员按组内已知分数的中位数估计（错误率照样惩罚，只走非流式的成员也会被降级），
+        # 平分时优先请求指定的后端
+        known = sorted(s for s in (self._score(m) for m in members) if s is not None)
+        prior = known[len(known) // 2] if known else 0.0
+
+        def sort_key(member: str):
+            h = self.health(member)
+            score = self._score(member)
+            if score is None:
+                score = prior * (1 + ERROR_PENALTY * h.error_rate)
+            return (h.circuit_open(), score, member != name)
+
+        return sorted(members, key=sort_key)
+
+    def _score(self, name: str) -> Optional[float]:
+        h = self.health(name)
+        if h.ewma_ttfb is None:
+            return None
+        return h.ewma_ttfb * (1 + ERROR_PENALTY * h.error_rate)
+
+    def record_success(self, name: str, ttfb: float):
+        self.health(name).record_success(ttfb)
+
+    def record_response(self, name: str, seconds: float):
+        """非流式请求成功：记完整响应耗时（不算 TTFB）"""
+        self.health(name).record_response(seconds)
+
+    def record_failure(self, name: str):
+        self.health(name).record_failure()
+
+    def hedge_delay(self, name: str, min_delay: float = 0.0) -> Optional[float]:
+        """对冲请求（只用于非流式）的等待时间：首选后端非流式响应耗时的 p95（样本不足返回 None，不对冲）"""
+        p95 = self.health(name).response_p95()
+        if p95 is None:
+            return None
+        return max(p95, min_delay)
+
+    def get_stats(self) -> dict:
+        """各后端健康度与各组当前首选"""
+        backends = {}
+        for name, h in self._health.items():
+            backends[name] = {
+                "ewma_ttfb_ms": round(h.ewma_ttfb * 1000, 1) if h.ewma_ttfb is not None else None,
+                "p95_ttfb_ms": round(h.p95() * 1000, 1) if h.p95() is not None else None,
+                "ewma_response_ms": round(h.ewma_response * 1000, 1) if h.ewma_response is not None else None,
+                "p95_response_ms": round(h.response_p95() * 1000, 1) if h.response_p95() is not None else None,
+                "error_rate": round(h.error_rate, 3),
+                "requests": h.requests,
+                "errors": h.errors,
+                "circuit_open": h.circuit_open(),
+            }
+        return {
+            "groups": {
+                group: {"members": members, "preferred_order": self.candidates(members[0])}
+                for group, members in self.groups.items()
+            },
+            "backends": backends,
+        }
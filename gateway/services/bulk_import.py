@@ -0,0 +1,544 @@
+"""
+对话批量导入 / 导出
+迁移历史数据（Kelivo 导出、ChromaDB 时期的数据、channel 重新分配）用：
+- 流式读取 JSONL/NDJSON（一行一条）、daily_backup 备份文件（{"conversations": [...]}）或 JSON 数组
+  （.json 也是边读边解析，一次只解析一条记录，整个文件不进内存）
+- 按批写入：asyncpg 驱动走 COPY，supabase 驱动走一次多行插入；每批在数据库里一次分配一段连续轮数
+- 每轮对话的 id 由源记录决定（源记录的 uuid，或按内容算的 uuid5），写入时库里已有的 id 跳过：
+  重复导入同一个文件、提交后检查点没写上就崩溃，重跑都不会插出重复的行
+- 向量化放进队列按批生成（一次 API 请求一批），和写库并行，写库后同步写进本机向量镜像；
+  没生成成功的用 backfill_embeddings 补
+- 每批提交后写检查点，进程崩溃后重跑同一条命令从断点继续
+导出按 (created_at, id) 键集分页写 NDJSON，格式可以直接再导入（备份 / 迁到另一个库）。
+channel 重新分配用 move_channel 原地更新，不走导出再导入（那样会复制出一份、旧 channel 的行还在）。
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import sys
+sys.path.insert(0, '/home/dream/memory-system/gateway')
+from services.storage import (
+    SKIP_KEYWORDS,
+    get_conversations_missing_embedding,
+    import_conversations_batch,
+    iter_conversations,
+    move_conversation_channel,
+    store_conversation_embeddings,
+)
+from services.pgvector_service import generate_embeddings, mirror_embeddings, vector_mirror
+
+USER_KEYS = ("user_msg", "user", "question", "prompt", "input")
+ASSISTANT_KEYS = ("assistant_msg", "assistant", "answer", "response", "output")
+TIME_KEYS = ("created_at", "timestamp", "time", "date")
+CHANNEL_KEYS = ("model_channel", "channel")
+
+# 源记录没有 uuid 时按内容生成 id 用的命名空间（固定值，改了之后重跑就认不出已导入的行）
+IMPORT_NAMESPACE = uuid.UUID("5f0c8f4e-3b1d-4c55-9a7e-6d2f1b8c0a91")
+
+
+# ============ 读取与规范化 ============
+
+def _first(raw: Dict, keys: Tuple[str, ...]):
+    for key in keys:
+        value = raw.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _text(value) -> str:
+    if isinstance(value, list):
+        # OpenAI 多段 content
+        return "".join(part.get("text", "") for part in value if isinstance(part, dict))
+    return str(value) if value is not None else ""
+
+
+def _timestamp(value) -> Optional[str]:
+    """ISO 字符串或 epoch 秒/毫秒 -> ISO 字符串（带时区）"""
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        seconds = value / 1000 if value > 1e11 else value
+        return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat()
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.isoformat()
+
+
+def normalize_record(raw: Dict) -> List[Dict]:
+    """一条源记录 -> 若干轮 {user_msg, assistant_msg, scene_type, channel, created_at}
+
+    支持 user_msg/assistant_msg（本库导出、daily_backup）、user/assistant 等常见别名，
+    以及 {"messages": [{"role", "content"}, ...]} 形式（按 user -> assistant 配对）。
+    """
+    scene_type = raw.get("scene_type")
+    channel = _first(raw, CHANNEL_KEYS)
+    created_at = _timestamp(_first(raw, TIME_KEYS))
+
+    if isinstance(raw.get("messages"), list):
+        turns = []
+        pending_user = None
+        for msg in raw["messages"]:
+            role = msg.get("role")
+            if role == "user":
+                pending_user = _text(msg.get("content"))
+            elif role == "assistant" and pending_user is not None:
+                turns.append({
+                    "user_msg": pending_user,
+                    "assistant_msg": _text(msg.get("content")),
+                    "scene_type": scene_type,
+                    "channel": channel,
+                    "created_at": _timestamp(_first(msg, TIME_KEYS)) or created_at,
+                })
+                pending_user = None
+        return turns
+
+    user_msg = _text(_first(raw, USER_KEYS))
+    assistant_msg = _text(_first(raw, ASSISTANT_KEYS))
+    if not user_msg and not assistant_msg:
+        return []
+    return [{
+        "user_msg": user_msg,
+        "assistant_msg": assistant_msg,
+        "scene_type": scene_type,
+        "channel": channel,
+        "created_at": created_at,
+    }]
+
+
+def turn_ids(raw: Dict, turns: List[Dict], position: int, user_id: str) -> List[str]:
+    """每轮对话的 id：同一条源记录每次算出来都一样，导入时据此去重
+
+    源记录自带 uuid 且只有一轮（本库导出、daily_backup）直接沿用；带其他 id（或一条记录拆出多轮）时
+    由 id + 轮序号算 uuid5；都没有时由时间和正文算（没有时间时再加上记录序号，避免不同位置的相同寒暄被合并）
+    """
+    source_id = raw.get("id")
+    if source_id not in (None, "") and len(turns) == 1:
+        try:
+            return [str(uuid.UUID(str(source_id)))]
+        except ValueError:
+            pass
+    ids = []
+    for index, turn in enumerate(turns):
+        if source_id not in (None, ""):
+            key = f"{user_id}\n{source_id}\n{index}"
+        else:
+            when = turn["created_at"] or f"#{position}"
+            key = f"{user_id}\n{when}\n{index}\n{turn['user_msg']}\n{turn['assistant_msg']}"
+        ids.append(str(uuid.uuid5(IMPORT_NAMESPACE, key)))
+    return ids
+
+
+class _JsonStream:
+    """从文件里按需解析 JSON：数组一次只解析一个元素，大文件不会整个读进内存"""
+
+    def __init__(self, f, chunk_size: int = 1 << 16):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """再读一块（丢掉已解析的部分），文件已读完返回 False"""
+        if self._eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """跳过空白，返回下一个字符（文件结束返回空串）"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n\ufeff":
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def take(self, expected: str):
+        found = self.peek()
+        if found != expected:
+            raise ValueError(f"Invalid JSON: expected {expected!r}, found {found or 'end of file'!r}")
+        self._pos += 1
+
+    def value(self):
+        """解析下一个完整的 JSON 值"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # 值跨块：读下一块再试
+                if self._fill():
+                    continue
+                raise
+            # 数字可能正好断在块尾（"12" 后面还有 "34"），读到下一块再确认
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def elements(self) -> Iterator:
+        """逐个产出当前位置上数组的元素"""
+        self.take("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            separator = self.peek()
+            self._pos += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError(f"Invalid JSON: expected ',' or ']', found {separator or 'end of file'!r}")
+
+
+def _iter_json_records(f) -> Iterator:
+    """JSON 数组，或 daily_backup：{"date", "conversations": [...], "memories": [...]}"""
+    stream = _JsonStream(f)
+    if stream.peek() != "{":
+        yield from stream.elements()
+        return
+    stream.take("{")
+    while stream.peek() not in ("}", ""):
+        key = stream.value()
+        stream.take(":")
+        if key == "conversations" and stream.peek() == "[":
+            yield from stream.elements()
+            return
+        # 其他字段（date / memories）解析后丢掉
+        stream.value()
+        if stream.peek() == ",":
+            stream.take(",")
+
+
+def iter_source(path: str) -> Iterator[Optional[Dict]]:
+    """按顺序产出源记录（解析失败的行产出 None，保证记录序号稳定，检查点可用）"""
+    if path.endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = None
+                yield record if isinstance(record, dict) else None
+        return
+    with open(path, encoding="utf-8") as f:
+        for record in _iter_json_records(f):
+            yield record if isinstance(record, dict) else None
+
+
+# ============ 检查点 ============
+
+class ImportCheckpoint:
+    """导入进度：已提交到第几条源记录。源文件变了（大小不同）就从头开始"""
+
+    def __init__(self, path: str, source: str):
+        self.path = path
+        self.source = source
+        self._size = os.path.getsize(source)
+
+    def load(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[Import] Ignoring unreadable checkpoint {self.path}: {e}")
+            return 0
+        if data.get("source") != os.path.abspath(self.source) or data.get("size") != self._size:
+            print(f"[Import] Checkpoint is for a different file, starting over")
+            return 0
+        return int(data.get("position", 0))
+
+    def save(self, position: int, stats: Dict):
+        # 先写临时文件再原子替换，写到一半崩溃也不会损坏检查点
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "source": os.path.abspath(self.source),
+                "size": self._size,
+                "position": position,
+                "stats": stats,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# ============ 向量化队列 ============
+
+def _embedding_text(user_msg: str, assistant_msg: str) -> str:
+    # 与 store_conversation_embedding 的格式一致
+    return f"用户: {user_msg}\n助手: {assistant_msg}"
+
+
+class EmbeddingQueue:
+    """攒批生成向量：一次 API 请求一批，一条 UPDATE 写一批，再写进本机向量镜像；多个 worker 并行"""
+
+    def __init__(self, batch_size: int = 32, concurrency: int = 4):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        # 有界队列：向量化跟不上时让写库等一等，内存不会无限涨
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=batch_size * concurrency * 4)
+        self._workers: List[asyncio.Task] = []
+        self.embedded = 0
+        self.failed = 0
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def put(self, conversation_id: str, text: str, channel: Optional[str] = None,
+                  scene_type: Optional[str] = None):
+        """channel / scene_type 是向量镜像的过滤列，不知道时 mirror_embeddings 回库查"""
+        await self._queue.put((conversation_id, text, channel, scene_type))
+
+    async def drain(self):
+        """等已入队的全部处理完"""
+        await self._queue.join()
+
+    async def close(self):
+        """等队列清空后停掉 worker"""
+        for _ in self._workers:
+            await self._queue.put(None)
+        await asyncio.gather(*self._workers)
+
+    async def _worker(self):
+        done = False
+        while not done:
+            batch = []
+            item = await self._queue.get()
+            taken = 1
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size or self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+                taken += 1
+            done = item is None
+            if batch:
+                await self._embed(batch)
+            for _ in range(taken):
+                self._queue.task_done()
+
+    async def _embed(self, batch: List[Tuple[str, str, Optional[str], Optional[str]]]):
+        try:
+            vectors = await generate_embeddings([item[1] for item in batch])
+            done = [(conv_id, vec, channel, scene_type)
+                    for (conv_id, _, channel, scene_type), vec in zip(batch, vectors) if vec]
+            if done:
+                await store_conversation_embeddings([item[0] for item in done], [item[1] for item in done])
+                # 不写镜像的话，镜像同步过之后这些行要等每天的 sync_vector_mirror 才召回得到
+                await mirror_embeddings("conversations", done)
+            self.embedded += len(done)
+            self.failed += len(batch) - len(done)
+        except Exception as e:
+            # 失败的行 embedding 仍为空，之后用 backfill_embeddings 补
+            self.failed += len(batch)
+            print(f"[Import] Embedding batch failed ({len(batch)} rows left for backfill): {e}")
+
+
+# ============ 导入 ============
+
+def _is_system_turn(turn: Dict) -> bool:
+    user_msg = turn["user_msg"]
+    if any(kw.lower() in user_msg.lower() for kw in SKIP_KEYWORDS):
+        return True
+    return not user_msg.strip() or not turn["assistant_msg"].strip()
+
+
+class _Progress:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self._last = self.started
+
+    def rate(self, rows: int) -> float:
+        elapsed = time.perf_counter() - self.started
+        return rows / elapsed if elapsed > 0 else 0.0
+
+    def maybe_report(self, label: str, rows: int, extra: str = ""):
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            print(f"[{label}] {rows} rows, {self.rate(rows):.0f} rows/s{extra}")
+
+
+async def import_file(
+    path: str,
+    user_id: str = "dream",
+    channel: Optional[str] = None,
+    default_channel: str = "deepseek",
+    scene_type: Optional[str] = None,
+    batch_size: int = 500,
+    embed: bool = True,
+    embed_batch_size: int = 32,
+    embed_concurrency: int = 4,
+    checkpoint_path: Optional[str] = None,
+    resume: bool = True,
+    report_every: float = 5.0,
+) -> Dict:
+    """把文件里的对话批量导入 conversations
+
+    同一个文件重复导入时已有的行跳过（按 turn_ids 算出的 id），计入 duplicates。
+
+    Args:
+        channel: 强制写入的 channel，不传则取记录里的，再没有用 default_channel
+            （库里已有的对话换 channel 用 move_channel，这里按 id 去重，不会再插一份）
+        scene_type: 强制的场景，不传则取记录里的，再没有用 daily
+        checkpoint_path: 检查点文件，默认 <源文件>.checkpoint.json
+        resume: 是否从检查点继续（False 时从头导入）
+    Returns:
+        统计：inserted / duplicates / skipped / invalid / embedded / rows_per_second ...
+    """
+    checkpoint = ImportCheckpoint(checkpoint_path or path + ".checkpoint.json", path)
+    start = checkpoint.load() if resume else 0
+    if start:
+        print(f"[Import] Resuming {path} after record {start}")
+
+    stats = {"inserted": 0, "duplicates": 0, "skipped": 0, "invalid": 0, "embedded": 0, "embed_failed": 0}
+    embedder = EmbeddingQueue(embed_batch_size, embed_concurrency) if embed else None
+    if embedder:
+        embedder.start()
+    progress = _Progress(report_every)
+    pending: List[Dict] = []
+
+    async def commit(position: int):
+        # 按 channel 分组（组内保持原顺序），每组一次写入
+        groups: Dict[str, List[Dict]] = {}
+        for turn in pending:
+            groups.setdefault(turn["channel"], []).append(turn)
+        for group_channel, turns in groups.items():
+            ids = await import_conversations_batch(turns, user_id, group_channel)
+            for conv_id, turn in zip(ids, turns):
+                # None：库里已有这个 id（之前导入过，或上次提交后没来得及写检查点）
+                if conv_id is None:
+                    stats["duplicates"] += 1
+                    continue
+                stats["inserted"] += 1
+                if embedder:
+                    await embedder.put(conv_id, _embedding_text(turn["user_msg"], turn["assistant_msg"]),
+                                       group_channel, turn["scene_type"])
+        pending.clear()
+        # 检查点在提交之后写；两者之间崩溃时重跑会再提交这一批，按 id 去重后不会重复插入
+        checkpoint.save(position, stats)
+        progress.maybe_report("Import", stats["inserted"])
+
+    position = 0
+    for position, raw in enumerate(iter_source(path), start=1):
+        if position <= start:
+            continue
+        turns = normalize_record(raw) if raw is not None else []
+        if not turns:
+            stats["invalid"] += 1
+            continue
+        for turn, conv_id in zip(turns, turn_ids(raw, turns, position, user_id)):
+            turn["id"] = conv_id
+            if _is_system_turn(turn):
+                stats["skipped"] += 1
+                continue
+            turn["channel"] = channel or turn["channel"] or default_channel
+            turn["scene_type"] = scene_type or turn["scene_type"] or "daily"
+            pending.append(turn)
+        if len(pending) >= batch_size:
+            await commit(position)
+    if pending or position > start:
+        await commit(position)
+
+    insert_seconds = time.perf_counter() - progress.started
+    if embedder:
+        await embedder.close()
+        stats["embedded"] = embedder.embedded
+        stats["embed_failed"] = embedder.failed
+    stats["seconds"] = round(time.perf_counter() - progress.started, 2)
+    stats["rows_per_second"] = round(stats["inserted"] / insert_seconds, 1) if insert_seconds > 0 else 0.0
+    checkpoint.clear()
+    print(f"[Import] Done: {stats}")
+    return stats
+
+
+# ============ 导出 / 向量回填 ============
+
+async def export_file(out_path: str, user_id: str = "dream", channel: Optional[str] = None,
+                      page_size: int = 1000, report_every: float = 5.0) -> Dict:
+    """按时间顺序把对话导出为 NDJSON（可直接用 import_file 导入另一个库；导回同一个库时按 id 全部跳过）"""
+    progress = _Progress(report_every)
+    rows = 0
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        async for row in iter_conversations(user_id, channel, page_size):
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            rows += 1
+            progress.maybe_report("Export", rows)
+    os.replace(tmp, out_path)
+    stats = {"exported": rows, "seconds": round(time.perf_counter() - progress.started, 2),
+             "rows_per_second": round(progress.rate(rows), 1)}
+    print(f"[Export] Done: {out_path} {stats}")
+    return stats
+
+
+async def move_channel(from_channel: str, to_channel: str, user_id: str = "dream") -> Dict:
+    """把 from_channel 的对话和摘要整体改到 to_channel：原地 UPDATE，id、向量、元数据都不动，
+    轮数平移到目标 channel 已有轮数之后（摘要的轮数范围一起平移）"""
+    started = time.perf_counter()
+    moved = await move_conversation_channel(user_id, from_channel, to_channel)
+    # 本机向量镜像里的 channel 一起改（镜像目录多进程共享，gateway 下次检索前就能读到）
+    mirrored = 0
+    if moved and vector_mirror.enabled:
+        await asyncio.to_thread(vector_mirror.open)
+        mirrored = await asyncio.to_thread(vector_mirror.rename_channel, from_channel, to_channel)
+    stats = {"moved": moved, "mirror_updated": mirrored, "seconds": round(time.perf_counter() - started, 2)}
+    print(f"[Move] Done: {from_channel} -> {to_channel} {stats}")
+    return stats
+
+
+async def backfill_embeddings(channel: Optional[str] = None, batch_size: int = 32, concurrency: int = 4,
+                              page_size: int = 500, report_every: float = 5.0) -> Dict:
+    """给还没有向量的对话补向量（导入时向量化失败、或用 --no-embed 导入后）"""
+    embedder = EmbeddingQueue(batch_size, concurrency)
+    embedder.start()
+    progress = _Progress(report_every)
+    seen = set()
+    while True:
+        page = await get_conversations_missing_embedding(channel, page_size)
+        # 每页处理完再查下一页；查到的全是见过的，说明剩下的都是生成失败的，结束
+        fresh = [row for row in page if row["id"] not in seen]
+        if not fresh:
+            break
+        for row in fresh:
+            seen.add(row["id"])
+            await embedder.put(row["id"], _embedding_text(row["user_msg"], row["assistant_msg"]),
+                               row.get("model_channel"), row.get("scene_type"))
+        await embedder.drain()
+        progress.maybe_report("Embed", embedder.embedded)
+    await embedder.close()
+    stats = {"embedded": embedder.embedded, "failed": embedder.failed,
+             "seconds": round(time.perf_counter() - progress.started, 2),
+             "rows_per_second": round(progress.rate(embedder.embedded), 1)}
+    print(f"[Embed] Done: {stats}")
+    return stats
@@ -0,0 +1,205 @@
+"""
+计数累加器 - 按 ID 聚合的增量，定时 / 到阈值时一次批量原子落库
+引用标记 [[used:...]] 的权重 +1、记忆注入的 hits +1 以前每次都是先读后写两次往返，
+并发时还会丢增量。现在请求路径上只在内存字典里累加，后台按 interval 或 pending 数超过
+max_pending 时把整批 {id: delta} 交给 flusher（一条 UPDATE ... SET x = x + delta）。
+flush 失败时逐个 key 单独重试，成功的照常落库，仍失败的合并回去等下次；同一个 key 连续失败
+max_attempts 次就丢掉（打一行日志），一个坏 key 不会把整批永远卡住。失败后至少隔一个 interval 再试。
+关闭时尽力 flush。进程崩溃会丢掉最多一个 interval 的增量。
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# 进程内所有累加器（关闭时统一 flush，/health 统一出统计）
+_accumulators: List["CounterAccumulator"] = []
+
+
+class CounterAccumulator:
+    """按 key 聚合的增量计数器"""
+
+    def __init__(
+        self,
+        name: str,
+        flusher: Callable[[Dict[str, int]], Awaitable[None]],
+        interval: float = 5.0,
+        max_pending: int = 200,
+        max_attempts: int = 3,
+    ):
+        """
+        Args:
+            name: 统计里的名字
+            flusher: 批量落库函数 ({key: delta}) -> None，失败应抛异常
+            interval: 定时 flush 间隔（秒）
+            max_pending: 待写 key 数达到多少时提前 flush
+            max_attempts: 单个 key 单独重试连续失败多少次后丢掉
+        """
+        self.name = name
+        self._flusher = flusher
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._pending: Dict[str, int] = {}
+        # 单独重试失败的次数（成功或丢掉后清除）
+        self._attempts: Dict[str, int] = {}
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.running = False
+
+        self._added = 0
+        self._flushes = 0
+        self._flushed_keys = 0
+        self._flushed_increments = 0
+        self._failures = 0
+        self._dropped_keys = 0
+        self._dropped_increments = 0
+        self._last_flush_ms = 0.0
+        self._last_flush_at = 0.0
+        self._last_error = ""
+        _accumulators.append(self)
+
+    # ---- 请求路径 ----
+
+    def add(self, key: str, amount: int = 1):
+        """累加一次增量（同步，O(1)）"""
+        self._pending[key] = self._pending.get(key, 0) + amount
+        self._added += amount
+        self._ensure_started()
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    def pending(self, key: str) -> int:
+        """还没落库的增量（读数时可以加上它得到最新值）"""
+        return self._pending.get(key, 0)
+
+    # ---- 生命周期 ----
+
+    def _ensure_started(self):
+        # 第一次 add 时在当前事件循环里起后台 task，调用方不需要显式 start
+        if self.running:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.running = True
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self, timeout: float = 10.0):
+        """停止后台循环并把剩余增量写掉"""
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout=timeout)
+        except Exception as e:
+            print(f"[Counter] {self.name} flush on shutdown incomplete: {e}")
+        if self._pending:
+            print(f"[Counter] {self.name} dropped {len(self._pending)} pending keys on shutdown")
+
+    # ---- 后台 flush ----
+
+    async def _flush_loop(self):
+        while self.running:
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                if not await self.flush():
+                    # 失败后退避一个 interval，期间 add() 触发的提前 flush 等退避结束再做
+                    await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"[Counter] {self.name} loop error: {e}")
+                await asyncio.sleep(1)
+
+    async def flush(self) -> bool:
+        """把当前累计的增量一次写掉；整批失败时逐个 key 重试，返回是否全部写掉"""
+        async with self._lock:
+            if not self._pending:
+                return True
+            batch, self._pending = self._pending, {}
+            started = time.perf_counter()
+            try:
+                await self._flusher(batch)
+            except Exception as e:
+                self._failures += 1
+                self._last_error = str(e)[:200]
+                print(f"[Counter] {self.name} flush of {len(batch)} keys failed, retrying one by one: {self._last_error}")
+                written = await self._flush_each(batch)
+            else:
+                written = batch
+            if written:
+                for key in written:
+                    self._attempts.pop(key, None)
+                self._flushes += 1
+                self._flushed_keys += len(written)
+                self._flushed_increments += sum(written.values())
+                self._last_flush_ms = (time.perf_counter() - started) * 1000
+                self._last_flush_at = time.time()
+            return len(written) == len(batch)
+
+    async def _flush_each(self, batch: Dict[str, int]) -> Dict[str, int]:
+        """逐个 key 单独落库，返回写成功的部分；失败的合并回待写队列，连续失败 max_attempts 次的丢掉"""
+        written: Dict[str, int] = {}
+        kept = 0
+        for key, delta in batch.items():
+            try:
+                await self._flusher({key: delta})
+                written[key] = delta
+                continue
+            except Exception as e:
+                error = str(e)[:200]
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts >= self.max_attempts:
+                self._attempts.pop(key, None)
+                self._dropped_keys += 1
+                self._dropped_increments += delta
+                print(f"[Counter] {self.name} dropped key {key!r} (+{delta}) after {attempts} failed attempts: {error}")
+            else:
+                self._attempts[key] = attempts
+                self._pending[key] = self._pending.get(key, 0) + delta
+                kept += 1
+        if kept:
+            print(f"[Counter] {self.name} {kept} keys kept for retry")
+        return written
+
+    def get_stats(self) -> dict:
+        """待写与已落库统计"""
+        return {
+            "running": self.running,
+            "pending_keys": len(self._pending),
+            "pending_increments": sum(self._pending.values()),
+            "added": self._added,
+            "flushes": self._flushes,
+            "flushed_keys": self._flushed_keys,
+            "flushed_increments": self._flushed_increments,
+            # 每次落库平均合并了多少次增量（越大省下的往返越多）
+            "coalesce_ratio": round(self._flushed_increments / self._flushed_keys, 2) if self._flushed_keys else 0.0,
+            "failures": self._failures,
+            "dropped_keys": self._dropped_keys,
+            "dropped_increments": self._dropped_increments,
+            "last_flush_ms": round(self._last_flush_ms, 1),
+            "last_flush_age_seconds": round(time.time() - self._last_flush_at, 1) if self._last_flush_at else None,
+            "last_error": self._last_error,
+        }
+
+
+async def stop_accumulators():
+    """关闭时 flush 进程内所有累加器"""
+    for accumulator in _accumulators:
+        await accumulator.stop()
+
+
+def get_accumulator_stats() -> Dict[str, dict]:
+    return {accumulator.name: accumulator.get_stats() for accumulator in _accumulators}
@@ -0,0 +1,267 @@
+"""
+向量缓存 - 按内容寻址的 embedding 复用
+auto_inject 的召回、MCP search_memory、日记任务每天会把相同的查询反复送去硅基流动向量化（每次 100~500ms）。
+这里按 sha256(模型名 + 规范化文本) 缓存向量，两级：
+- 内存 LRU：float32 数组（每条 4KB），只放检索查询，命中不碰磁盘
+- 磁盘：SQLite（WAL）里存 float16（每条 2KB），重启和多个 worker 共享；超过上限按最近使用时间淘汰。
+  入库文本（对话 / 摘要 / 批量导入）的向量只写这一层，回填、重跑导入时复用，不挤占查询的内存 LRU
+磁盘层的读写都在 asyncio.to_thread 里做（和 local_repository / vector_mirror 一样），不阻塞事件循环；
+最近使用时间攒一批再写，条数用内存里的计数，/health 不查库。
+规范化只做空白处理（首尾去掉、连续空白合成一个空格）：bge 的 BERT 分词本来就按空白切分并丢弃空白，
+规范化前后送进模型的 token 完全一样，所以向量可以放心复用；大小写、全半角不动（会改变 token）。
+float16 的相对误差约 1e-3，对余弦相似度的影响在小数点后第四位。
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from services.vector_index import np
+
+# 和 generate_embedding 的截断一致：截断在规范化之后做，键和实际送出去的文本一一对应
+MAX_INPUT_CHARS = 2000
+
+_WHITESPACE = re.compile(r"\s+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    vector BLOB NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_used_at ON embeddings(used_at);
+"""
+
+# 磁盘命中的最近使用时间攒够这么多条（或距上次写入超过 TOUCH_INTERVAL 秒）再批量写
+TOUCH_BATCH = 64
+TOUCH_INTERVAL = 60.0
+# 淘汰时删到上限的 90%，避免每次写入都触发
+PRUNE_TARGET = 0.9
+
+
+def normalize_text(text: str) -> str:
+    """首尾空白去掉、连续空白合成一个空格，再按 MAX_INPUT_CHARS 截断"""
+    return _WHITESPACE.sub(" ", text).strip()[:MAX_INPUT_CHARS]
+
+
+def make_embedding_key(model: str, text: str) -> str:
+    """text 需已经过 normalize_text"""
+    return hashlib.sha256(f"{model}\n{text}".encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """内存 LRU（事件循环里同步访问）+ SQLite 磁盘层（线程池里访问）"""
+
+    def __init__(self, path: str, max_entries: int = 2048, disk_max_entries: int = 100000, enabled: bool = True):
+        self.path = path
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.enabled = enabled and np is not None and max_entries > 0
+        # 磁盘连接在线程池里用，同一时间只给一个线程
+        self._disk_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_failed = False
+        self._entries: "OrderedDict[str, object]" = OrderedDict()
+        # 磁盘层条数：打开时数一次，之后按插入 / 淘汰增减（多 worker 时是估计值，淘汰前会重新数）
+        self._disk_count = 0
+        self._touched: Dict[str, float] = {}
+        self._touched_at = time.time()
+
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._disk_pruned = 0
+
+    # ---- 磁盘层（只在线程池里调用） ----
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        """第一次用到时打开；打不开（目录只读等）就只用内存层，只提示一次"""
+        if self._conn is not None or self._disk_failed or not self.disk_max_entries:
+            return self._conn
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._disk_count = conn.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+            self._conn = conn
+        except sqlite3.Error as e:
+            self._disk_failed = True
+            print(f"[EmbeddingCache] Disk tier unavailable ({self.path}), memory only: {e}")
+        return self._conn
+
+    def _disk_get(self, keys: Sequence[str]) -> Dict[str, object]:
+        rows = []
+        with self._disk_lock:
+            conn = self._disk()
+            if conn is None:
+                return {}
+            try:
+                # 分批拼 IN，避开老版本 SQLite 999 个参数的限制
+                for offset in range(0, len(keys), 500):
+                    chunk = list(keys[offset:offset + 500])
+                    rows.extend(conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk).fetchall())
+                now = time.time()
+                for key, _ in rows:
+                    self._touched[key] = now
+                if len(self._touched) >= TOUCH_BATCH or now - self._touched_at > TOUCH_INTERVAL:
+                    self._flush_touched(conn)
+            except sqlite3.Error as e:
+                print(f"[EmbeddingCache] Disk read error: {e}")
+                return {}
+        return {key: np.frombuffer(blob, dtype=np.float16).astype(np.float32) for key, blob in rows}
+
+    def _flush_touched(self, conn: sqlite3.Connection):
+        """最近使用时间一个事务批量写"""
+        if self._touched:
+            conn.execute("BEGIN")
+            try:
+                conn.executemany("UPDATE embeddings SET used_at = ? WHERE key = ?",
+                                 [(ts, key) for key, ts in self._touched.items()])
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        self._touched = {}
+        self._touched_at = time.time()
+
+    def _disk_put(self, items: Dict[str, object]):
+        with self._disk_lock:
+            conn = self._disk()
+            if conn is None:
+                return
+            now = time.time()
+            try:
+                # 同一个键的向量内容不会变，已有的不覆盖
+                added = conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, used_at) VALUES (?, ?, ?)",
+                    [(key, vector.astype(np.float16).tobytes(), now) for key, vector in items.items()],
+                ).rowcount
+                self._disk_count += max(added, 0)
+                if self._disk_count > self.disk_max_entries:
+                    self._prune(conn)
+            except sqlite3.Error as e:
+                print(f"[EmbeddingCache] Disk write error: {e}")
+
+    def _prune(self, conn: sqlite3.Connection):
+        """超过上限时删掉最久没用到的那部分（先把攒着的使用时间写进去，再以文件里的实际条数为准）"""
+        self._flush_touched(conn)
+        count = conn.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+        self._disk_count = count
+        if count <= self.disk_max_entries:
+            return
+        excess = count - int(self.disk_max_entries * PRUNE_TARGET)
+        conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used_at LIMIT ?)", (excess,))
+        self._disk_count -= excess
+        self._disk_pruned += excess
+        print(f"[EmbeddingCache] Pruned {excess} least recently used vectors from disk")
+
+    def _disk_close(self):
+        with self._disk_lock:
+            if self._conn is not None:
+                try:
+                    self._flush_touched(self._conn)
+                except sqlite3.Error as e:
+                    print(f"[EmbeddingCache] Flush on close failed: {e}")
+                self._conn.close()
+                self._conn = None
+
+    # ---- 内存层 ----
+
+    def _remember(self, key: str, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    # ---- 对外接口 ----
+
+    async def get_many(self, keys: Sequence[str], remember: bool = True) -> Dict[str, List[float]]:
+        """命中的键 -> 向量（list）；remember=True 时磁盘命中的提升到内存层"""
+        if not self.enabled:
+            return {}
+        found: Dict[str, object] = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            vector = self._entries.get(key)
+            if vector is None:
+                missing.append(key)
+            else:
+                self._entries.move_to_end(key)
+                found[key] = vector
+                self._memory_hits += 1
+        if missing and self.disk_max_entries and not self._disk_failed:
+            loaded = await asyncio.to_thread(self._disk_get, missing)
+            for key, vector in loaded.items():
+                if remember:
+                    self._remember(key, vector)
+                found[key] = vector
+                self._disk_hits += 1
+        self._misses += sum(1 for key in missing if key not in found)
+        return {key: vector.tolist() for key, vector in found.items()}
+
+    async def get(self, key: str, remember: bool = True) -> Optional[List[float]]:
+        return (await self.get_many([key], remember)).get(key)
+
+    async def put_many(self, items: Dict[str, List[float]], remember: bool = True):
+        """写入缓存；remember=False 只写磁盘层（入库文本的向量，不挤占查询的内存 LRU）"""
+        if not self.enabled or not items:
+            return
+        arrays = {key: np.asarray(vector, dtype=np.float32) for key, vector in items.items()}
+        if remember:
+            for key, vector in arrays.items():
+                self._remember(key, vector)
+        self._stores += len(arrays)
+        if self.disk_max_entries and not self._disk_failed:
+            await asyncio.to_thread(self._disk_put, arrays)
+
+    async def put(self, key: str, vector: List[float], remember: bool = True):
+        await self.put_many({key: vector}, remember)
+
+    @property
+    def memory_hits(self) -> int:
+        return self._memory_hits
+
+    @property
+    def disk_hits(self) -> int:
+        return self._disk_hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def close(self):
+        """关闭磁盘层（关闭时调用，攒着的使用时间顺手写掉）"""
+        self._disk_close()
+
+    def get_stats(self) -> dict:
+        """命中率统计（内存 / 磁盘分开算，不查库）"""
+        hits = self._memory_hits + self._disk_hits
+        lookups = hits + self._misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "disk_entries": self._disk_count if self._conn is not None else None,
+            "disk_max_entries": self.disk_max_entries,
+            "memory_hits": self._memory_hits,
+            "disk_hits": self._disk_hits,
+            "misses": self._misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "stores": self._stores,
+            "evictions": self._evictions,
+            "disk_pruned": self._disk_pruned,
+        }
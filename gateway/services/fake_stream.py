@@ -0,0 +1,159 @@
+"""
+假流式 SSE 引擎
+- 信封模板预序列化：每个分片只拼接转义后的 delta 文本，不再逐片 json.dumps 整个 dict
+- 节奏策略：固定字符速率（cps）/ 总时长封顶（duration）/ 立即全部吐出（instant）
+- 上游非流式请求还在跑时就先发 role chunk，再定时发 keep-alive 注释，客户端首字节不再等整段生成
+"""
+
+import asyncio
+import json
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+# 每个节拍的时长（秒）：cps 模式下每拍吐 cps*TICK 个字符
+TICK = 0.02
+# instant 模式下单个分片的最大字符数（避免单帧过大）
+INSTANT_CHUNK_CHARS = 256
+
+PACING_STRATEGIES = ("cps", "duration", "instant")
+
+
+class SSETemplate:
+    """chat.completion.chunk 信封模板（id/created/model 只序列化一次）"""
+
+    def __init__(self, msg_id: str, created: int, model: str):
+        head = json.dumps(
+            {"id": msg_id, "object": "chat.completion.chunk", "created": created, "model": model},
+            ensure_ascii=False,
+        )
+        # head 形如 {"id": ..., "model": "..."}，去掉末尾 } 后接 choices
+        self._prefix = b"data: " + head[:-1].encode() + b', "choices": [{"index": 0, "delta": {'
+        self._suffix = b'}, "finish_reason": null}]}\n\n'
+        self._field_keys = {
+            "content": b'"content": ',
+            "reasoning_content": b'"reasoning_content": ',
+        }
+
+    def delta(self, field: str, text: str) -> bytes:
+        """content / reasoning_content 文本分片"""
+        return b"".join((
+            self._prefix,
+            self._field_keys[field],
+            json.dumps(text, ensure_ascii=False).encode(),
+            self._suffix,
+        ))
+
+    def role(self) -> bytes:
+        return self._prefix + b'"role": "assistant", "content": ""' + self._suffix
+
+    def raw_delta(self, delta: dict) -> bytes:
+        """任意 delta（工具调用等低频分片）"""
+        return self._prefix + json.dumps(delta, ensure_ascii=False)[1:-1].encode() + self._suffix
+
+    def finish(self, finish_reason: str) -> bytes:
+        return (
+            self._prefix + b'}, "finish_reason": '
+            + json.dumps(finish_reason).encode() + b"}]}\n\n"
+        )
+
+
+class Pacer:
+    """假流式节奏控制"""
+
+    def __init__(self, strategy: str = "cps", cps: float = 200.0, max_duration: float = 8.0):
+        if strategy not in PACING_STRATEGIES:
+            print(f"[FakeStream] Unknown pacing '{strategy}', falling back to cps")
+            strategy = "cps"
+        self.strategy = strategy
+        self.cps = max(cps, 1.0)
+        self.max_duration = max_duration
+
+    def plan(self, total_chars: int) -> Tuple[int, float]:
+        """根据总字数返回 (每片字符数, 每片间隔秒)"""
+        if self.strategy == "instant" or total_chars <= 0:
+            return INSTANT_CHUNK_CHARS, 0.0
+        rate = self.cps
+        if self.strategy == "duration" and self.max_duration > 0:
+            # 按 cps 吐字，但总时长不超过 max_duration
+            rate = max(rate, total_chars / self.max_duration)
+        chunk_chars = max(1, int(rate * TICK))
+        return chunk_chars, chunk_chars / rate
+
+
+async def render_message(
+    template: SSETemplate,
+    message: Dict,
+    pacer: Pacer,
+    send_role: bool = True,
+) -> AsyncGenerator[bytes, None]:
+    """把一条完整的 assistant 消息按节奏渲染成 SSE 分片（含 [DONE]）
+
+    message: {"content", "reasoning_content", "tool_calls", "finish_reason"}
+    """
+    content = message.get("content") or ""
+    reasoning = message.get("reasoning_content") or ""
+    tool_calls: Optional[List[Dict]] = message.get("tool_calls")
+
+    if send_role:
+        yield template.role()
+
+    total_chars = len(reasoning) + (0 if tool_calls else len(content))
+    chunk_chars, delay = pacer.plan(total_chars)
+
+    # 先发思考过程，再发回答
+    fields = [("reasoning_content", reasoning)]
+    if not tool_calls:
+        fields.append(("content", content))
+    for field, text in fields:
+        for i in range(0, len(text), chunk_chars):
+            yield template.delta(field, text[i:i + chunk_chars])
+            if delay:
+                await asyncio.sleep(delay)
+
+    if tool_calls:
+        for tc_idx, tc in enumerate(tool_calls):
+            func = tc.get("function", {})
+            yield template.raw_delta({"tool_calls": [{
+                "index": tc_idx,
+                "id": tc.get("id", f"call_{tc_idx}"),
+                "type": "function",
+                "function": {"name": func.get("name", ""), "arguments": ""},
+            }]})
+            arguments = func.get("arguments", "")
+            if arguments:
+                yield template.raw_delta({"tool_calls": [{
+                    "index": tc_idx,
+                    "function": {"arguments": arguments},
+                }]})
+        yield template.finish("tool_calls")
+    else:
+        yield template.finish(message.get("finish_reason") or "stop")
+    yield b"data: [DONE]\n\n"
+
+
+async def stream_pending(
+    template: SSETemplate,
+    upstream: "asyncio.Future[Dict]",
+    pacer: Pacer,
+    keepalive_interval: float = 10.0,
+) -> AsyncGenerator[bytes, None]:
+    """上游结果未就绪时先开流：role chunk + keep-alive，结果到了再按节奏回放
+
+    upstream 结果为 {"error": {...}} 或 render_message 接受的 message dict
+    """
+    yield template.role()
+    while not upstream.done():
+        done, _ = await asyncio.wait({upstream}, timeout=keepalive_interval)
+        if not done:
+            yield b": keep-alive\n\n"
+
+    try:
+        message = upstream.result()
+    except Exception as e:
+        message = {"error": {"message": str(e), "code": 502}}
+
+    if "error" in message:
+        yield f"data: {json.dumps(message, ensure_ascii=False)}\n\n".encode()
+        return
+
+    async for chunk in render_message(template, message, pacer, send_role=False):
+        yield chunk
@@ -0,0 +1,148 @@
+"""
+上游连接池 - 每个 (base_url, proxy) 一个长连接 httpx.AsyncClient
+在 lifespan 中按 BACKENDS 预建，请求间复用 keep-alive 连接，省掉每轮的 TCP+TLS 握手
+"""
+
+import time
+
+import httpx
+from typing import Callable, Dict, Optional, Set, Tuple
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class UpstreamClientPool:
+    """上游客户端注册表"""
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60.0,
+        http2: bool = True,
+        warm_interval: float = 10.0,
+    ):
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._http2 = http2 and HTTP2_AVAILABLE
+        # (base_url, proxy) -> client
+        self._clients: Dict[Tuple[str, Optional[str]], httpx.AsyncClient] = {}
+        self._transports: Dict[Tuple[str, Optional[str]], httpx.AsyncHTTPTransport] = {}
+        self._request_counts: Dict[Tuple[str, Optional[str]], int] = {}
+        # 预热限流：每个上游同一时间只有一个 HEAD 在飞，两次之间至少隔 warm_interval 秒
+        self._warm_interval = warm_interval
+        self._warming: Set[Tuple[str, Optional[str]]] = set()
+        self._warmed_at: Dict[Tuple[str, Optional[str]], float] = {}
+        self._warms = 0
+        self._warms_skipped = 0
+
+    def build(self, backends: Dict[str, dict], get_proxy: Callable[[str], Optional[str]]):
+        """根据后端配置预建客户端（同一 base_url + proxy 共用一个）"""
+        for backend in backends.values():
+            base_url = backend["base_url"]
+            self.get_client(base_url, get_proxy(base_url))
+        print(f"[UpstreamPool] Built {len(self._clients)} clients (http2={self._http2})")
+
+    def get_client(self, base_url: str, proxy: Optional[str] = None) -> httpx.AsyncClient:
+        """获取（必要时创建）base_url 对应的长连接客户端"""
+        key = (base_url.rstrip("/"), proxy)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            # HTTP/2 只对 https 上游启用（靠 ALPN 协商，不支持的上游自动回落 HTTP/1.1）
+            use_http2 = self._http2 and base_url.startswith("https://")
+            transport = httpx.AsyncHTTPTransport(
+                http2=use_http2, limits=self._limits, proxy=proxy
+            )
+
+            async def _count_request(request: httpx.Request, _key=key):
+                self._request_counts[_key] = self._request_counts.get(_key, 0) + 1
+
+            client = httpx.AsyncClient(
+                transport=transport,
+                event_hooks={"request": [_count_request]},
+            )
+            self._clients[key] = client
+            self._transports[key] = transport
+        return client
+
+    async def warm(self, base_url: str, proxy: Optional[str] = None, timeout: float = 3.0):
+        """连接池里没有可用连接时，发一个轻量 HEAD 把连接（含 TLS）先建好
+
+        高并发时所有连接都忙，每个请求都会走到这里：同一上游正在预热、或距上次预热不到 warm_interval 秒就跳过，
+        请求自己建连接（HEAD 本身也会占一个连接，发多了反而和真正的请求抢连接数）
+        """
+        key = (base_url.rstrip("/"), proxy)
+        client = self.get_client(base_url, proxy)
+        try:
+            # HTTP/2 连接在忙也能再开流，所以看 is_available 而不是 is_idle
+            if any(conn.is_available() for conn in self._transports[key]._pool.connections):
+                return
+        except Exception:
+            pass
+        now = time.monotonic()
+        if key in self._warming or now - self._warmed_at.get(key, float("-inf")) < self._warm_interval:
+            self._warms_skipped += 1
+            return
+        self._warming.add(key)
+        self._warmed_at[key] = now
+        self._warms += 1
+        try:
+            await client.head(base_url, timeout=timeout)
+        except Exception as e:
+            print(f"[UpstreamPool] Warm {base_url} failed: {e}")
+        finally:
+            self._warming.discard(key)
+
+    async def close(self):
+        """关闭所有客户端（lifespan 结束时调用）"""
+        for client in self._clients.values():
+            try:
+                await client.aclose()
+            except Exception as e:
+                print(f"[UpstreamPool] Close error: {e}")
+        self._clients.clear()
+        self._transports.clear()
+        print("[UpstreamPool] Closed")
+
+    def get_stats(self) -> dict:
+        """连接池利用率统计"""
+        pools = []
+        for key, transport in self._transports.items():
+            base_url, proxy = key
+            total = idle = http2_conns = 0
+            try:
+                # httpcore 连接池内部状态，仅用于观测
+                for conn in transport._pool.connections:
+                    total += 1
+                    if conn.is_idle():
+                        idle += 1
+                    if "HTTP/2" in repr(conn):
+                        http2_conns += 1
+            except Exception:
+                pass
+            pools.append({
+                "base_url": base_url,
+                "proxy": bool(proxy),
+                "connections": total,
+                "active": total - idle,
+                "idle": idle,
+                "http2_connections": http2_conns,
+                "requests": self._request_counts.get(key, 0),
+            })
+        return {
+            "clients": len(self._clients),
+            "http2_enabled": self._http2,
+            "max_connections": self._limits.max_connections,
+            "max_keepalive_connections": self._limits.max_keepalive_connections,
+            "keepalive_expiry": self._limits.keepalive_expiry,
+            "warms": self._warms,
+            "warms_skipped": self._warms_skipped,
+            "pools": pools,
+        }
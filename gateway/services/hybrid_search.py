@@ -12,6 +12,7 @@ import sys
 sys.path.insert(0, '/home/dream/memory-system/gateway')
 from config import get_settings
 from services.pgvector_service import generate_embedding, vector_search_rpc
+from services.storage import get_recent_by_emotion, keyword_search
 
 settings = get_settings()
 
@@ -111,68 +112,9 @@ async def _keyword_search(
     limit: int = 15,
     channel: str = "deepseek"
 ) -> List[Dict]:
-    """关键词搜索：使用pg_trgm模糊匹配"""
+    """关键词搜索：PostgREST / asyncpg 用 ilike 模糊匹配，本地驱动用 FTS5（见 storage.keyword_search）"""
     try:
-        from supabase import create_client
-        supabase = create_client(settings.supabase_url, settings.supabase_key)
-
-        all_results = []
-
-        def _search_term(term: str):
-            """搜索单个关键词"""
-            results = []
-
-            # 搜索 conversations 表
-            try:
-                query = supabase.table("conversations") \
-                    .select("id, user_msg, assistant_msg, created_at, scene_type, topic, emotion, round_number") \
-                    .eq("model_channel", channel) \
-                    .or_(f"user_msg.ilike.%{term}%,assistant_msg.ilike.%{term}%")
-
-                if scene_type == "plot":
-                    query = query.eq("scene_type", "plot")
-                elif scene_type == "daily":
-                    query = query.in_("scene_type", ["daily", "plot"])
-
-                result = query.order("created_at", desc=True).limit(limit).execute()
-                if result.data:
-                    for row in result.data:
-                        row["_source"] = "conversations"
-                    results.extend(result.data)
-            except Exception as e:
-                print(f"[HybridSearch] Keyword conv search error: {e}")
-
-            # 搜索 summaries 表
-            try:
-                query = supabase.table("summaries") \
-                    .select("id, summary, created_at, scene_type, topic, start_round, end_round") \
-                    .eq("model_channel", channel) \
-                    .ilike("summary", f"%{term}%")
-
-                if scene_type == "plot":
-                    query = query.eq("scene_type", "plot")
-                elif scene_type == "daily":
-                    query = query.in_("scene_type", ["daily", "plot"])
-
-                result = query.order("created_at", desc=True).limit(5).execute()
-                if result.data:
-                    for row in result.data:
-                        row["_source"] = "summaries"
-                    results.extend(result.data)
-            except Exception as e:
-                print(f"[HybridSearch] Keyword sum search error: {e}")
-
-            return results
-
-        # 限制搜索的关键词数量（避免过多请求）
-        search_terms = terms[:5]
-        for term in search_terms:
-            if len(term) >= 2:  # 跳过太短的词
-                term_results = await asyncio.to_thread(_search_term, term)
-                all_results.extend(term_results)
-
-        return all_results
-
+        return await keyword_search(terms, scene_type, limit, channel)
     except Exception as e:
         print(f"[HybridSearch] Keyword search error: {e}")
         return []
@@ -321,23 +263,8 @@ async def search_recent_by_emotion(
 ) -> List[Dict]:
     """搜索近期相同情感的对话"""
     try:
-        from supabase import create_client
-        supabase = create_client(settings.supabase_url, settings.supabase_key)
-
         cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
-
-        def _search():
-            result = supabase.table("conversations") \
-                .select("id, user_msg, assistant_msg, created_at, scene_type, emotion") \
-                .eq("model_channel", channel) \
-                .eq("emotion", emotion) \
-                .gte("created_at", cutoff) \
-                .order("created_at", desc=True) \
-                .limit(limit) \
-                .execute()
-            return result.data if result.data else []
-
-        return await asyncio.to_thread(_search)
+        return await get_recent_by_emotion(emotion, cutoff, limit, channel)
     except Exception as e:
         print(f"[HybridSearch] Emotion search error: {e}")
         return []
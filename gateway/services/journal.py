@@ -0,0 +1,327 @@
+"""
+写后日志（write-behind journal）- 对话落库的本地持久队列
+请求路径上只往本地 SQLite（WAL 模式）追加一行，O(1) 返回；
+后台 flush 循环按批写入 Supabase，失败指数退避重试，启动时重放未落库的记录。
+连接 / 超时之类的暂时性错误只退避、不计失败次数（Supabase 短暂不可用不会把整个队列打进死信）；
+其他错误先拆成单条逐条写，只有单条写失败才计次，连续 MAX_ATTEMPTS 次才移进死信，
+死信可以用 replay_dead_letters 放回队列（POST /admin/journal/replay）。
+语义是至少一次：写库成功但本地删除前进程崩溃，重启后该批会再写一次。
+多个 worker 共用同一个日志文件时，每批先用租约认领（owner + lease_until），不会被两个进程同时写库。
+"""
+
+import asyncio
+import os
+import re
+import secrets
+import sqlite3
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# 单条记录单独写入连续失败多少次后移出队列（保留在文件里备查，可重放）
+MAX_ATTEMPTS = 8
+
+# 暂时性错误：按异常类型名（不依赖 httpx / asyncpg / postgrest 的导入）和上游返回的网关类状态码判断
+TRANSIENT_ERROR_TYPES = {
+    "ConnectionError", "TimeoutError", "TransportError", "TimeoutException",
+    "PostgresConnectionError", "ConnectionDoesNotExistError", "CannotConnectNowError",
+    "TooManyConnectionsError", "gaierror",
+}
+_TRANSIENT_MESSAGE = re.compile(r"\b(502|503|504|timed out|timeout|connection (refused|reset|closed))\b", re.I)
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """连接失败 / 超时 / 网关错误：等一会儿大概率就好了，不算这批数据的错"""
+    if any(cls.__name__ in TRANSIENT_ERROR_TYPES for cls in type(e).__mro__):
+        return True
+    return bool(_TRANSIENT_MESSAGE.search(str(e)))
+
+
+# 认领租约（秒）：持有者进程崩溃后，租约过期由其他 worker 接手
+LEASE_SECONDS = 120
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    user_msg TEXT NOT NULL,
+    assistant_msg TEXT NOT NULL,
+    scene_type TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    dead INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    owner TEXT,
+    lease_until REAL
+)
+"""
+
+
+class ConversationJournal:
+    """对话写后日志"""
+
+    def __init__(
+        self,
+        path: str,
+        writer: Callable[[List[Dict], str], Awaitable[List[Optional[str]]]],
+        on_flushed: Optional[Callable[[List[Dict], List[Optional[str]]], None]] = None,
+        batch_size: int = 50,
+        linger: float = 0.2,
+        max_backoff: float = 60.0,
+    ):
+        """
+        Args:
+            path: SQLite 文件路径
+            writer: 批量写库函数 (turns, user_id) -> ids，失败应抛异常
+            on_flushed: 一批写库成功后的回调（触发摘要/向量化等后续任务）
+            batch_size: 单批最大条数
+            linger: 被唤醒后再等多久攒批（秒）
+            max_backoff: 退避上限（秒）
+        """
+        self.path = path
+        self._writer = writer
+        self._on_flushed = on_flushed
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_backoff = max_backoff
+        self._conn: Optional[sqlite3.Connection] = None
+        self._owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.running = False
+
+        self._depth = 0
+        self._flushed_count = 0
+        self._failed_batches = 0
+        self._dead_count = 0
+        self._consecutive_failures = 0
+        self._last_flush_ms = 0.0
+        self._flush_ms_total = 0.0
+        self._flush_batches = 0
+        self._last_error = ""
+        # 批量写遇到非暂时性错误后，id 不超过它的记录逐条写，找出坏记录
+        self._isolate_until = 0
+
+    # ---- 生命周期 ----
+
+    def open(self):
+        """打开日志文件（WAL + synchronous=NORMAL：提交不逐条 fsync，进程崩溃不丢数据）"""
+        if self._conn is not None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        # 旧版日志文件没有租约列
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(turns)")}
+        for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE turns ADD COLUMN {column} {kind}")
+        self._depth = self._conn.execute("SELECT COUNT(*) FROM turns WHERE dead = 0").fetchone()[0]
+        self._dead_count = self._conn.execute("SELECT COUNT(*) FROM turns WHERE dead = 1").fetchone()[0]
+
+    async def start(self):
+        """启动 flush 循环，日志里遗留的记录会先被重放"""
+        if self.running:
+            return
+        self.open()
+        if self._depth:
+            print(f"[Journal] Replaying {self._depth} unflushed turns")
+            self._wakeup.set()
+        self.running = True
+        self._task = asyncio.create_task(self._flush_loop())
+        print(f"[Journal] Started ({self.path})")
+
+    async def stop(self, timeout: float = 10.0):
+        """停止：尽力把剩余记录写完，写不完的留在文件里等下次启动重放"""
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await asyncio.wait_for(self._drain(), timeout=timeout)
+        except Exception as e:
+            print(f"[Journal] Drain on shutdown incomplete: {e}")
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        print(f"[Journal] Stopped (flushed: {self._flushed_count}, pending: {self._depth})")
+
+    # ---- 请求路径 ----
+
+    def append(self, user_msg: str, assistant_msg: str, scene_type: str = "daily",
+               channel: str = "deepseek", user_id: str = "dream") -> int:
+        """追加一轮对话（同步、单行 INSERT），返回本地序号"""
+        if self._conn is None:
+            self.open()
+        cur = self._conn.execute(
+            "INSERT INTO turns (user_id, user_msg, assistant_msg, scene_type, channel, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, user_msg, assistant_msg, scene_type, channel, time.time()),
+        )
+        self._depth += 1
+        self._wakeup.set()
+        return cur.lastrowid
+
+    # ---- 后台 flush ----
+
+    async def _flush_loop(self):
+        while self.running:
+            try:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                # 攒一小会儿，突发流量时合并成一批
+                await asyncio.sleep(self.linger)
+                await self._drain()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"[Journal] Loop error: {e}")
+                await asyncio.sleep(1)
+
+    async def _drain(self):
+        """循环写批次直到队列空；失败则退避后重试"""
+        while self._depth > 0 and self._conn is not None:
+            ok = await self._flush_batch()
+            if ok:
+                self._consecutive_failures = 0
+                continue
+            self._consecutive_failures += 1
+            backoff = min(self.max_backoff, 0.5 * (2 ** self._consecutive_failures))
+            print(f"[Journal] Flush failed ({self._consecutive_failures}x), retry in {backoff:.1f}s: {self._last_error}")
+            await asyncio.sleep(backoff)
+
+    async def _flush_batch(self) -> bool:
+        # 认领一批（自己的 + 无主的 + 租约过期的），再只读自己认领的
+        now = time.time()
+        self._conn.execute(
+            "UPDATE turns SET owner = ?, lease_until = ? WHERE id IN ("
+            "SELECT id FROM turns WHERE dead = 0 AND (owner IS NULL OR owner = ? OR lease_until < ?) "
+            "ORDER BY id LIMIT ?)",
+            (self._owner, now + LEASE_SECONDS, self._owner, now, self.batch_size),
+        )
+        rows = self._conn.execute(
+            "SELECT id, user_id, user_msg, assistant_msg, scene_type, channel, attempts "
+            "FROM turns WHERE dead = 0 AND owner = ? ORDER BY id LIMIT ?",
+            (self._owner, self.batch_size),
+        ).fetchall()
+        if not rows:
+            self._depth = 0
+            return True
+
+        # 刚才整批写失败过（或队首记录已经单独失败过）：单条写，隔离出坏数据
+        if rows[0][0] <= self._isolate_until or rows[0][6] > 0:
+            rows = rows[:1]
+
+        # 按 user_id 分批（正常情况下只有 dream），这批用不上的认领先释放
+        started = time.perf_counter()
+        user_id = rows[0][1]
+        skipped = [r[0] for r in rows if r[1] != user_id]
+        if skipped:
+            self._conn.execute(
+                f"UPDATE turns SET owner = NULL WHERE id IN ({','.join('?' * len(skipped))})", skipped
+            )
+        rows = [r for r in rows if r[1] == user_id]
+        turns = [
+            {"user_msg": r[2], "assistant_msg": r[3], "scene_type": r[4], "channel": r[5]}
+            for r in rows
+        ]
+        row_ids = [r[0] for r in rows]
+        placeholders = ",".join("?" * len(row_ids))
+
+        try:
+            conv_ids = await self._writer(turns, user_id)
+        except Exception as e:
+            self._failed_batches += 1
+            self._last_error = str(e)[:200]
+            committed = getattr(e, "committed", None)
+            if committed:
+                # 写库函数报告一部分已经提交（storage.PartialBatchError）：这部分出队，只重试剩下的
+                self._complete([row_ids[i] for i in committed], [turns[i] for i in committed],
+                               [e.ids[i] for i in committed], started)
+                done = set(committed)
+                keep = [i for i in range(len(rows)) if i not in done]
+                rows, row_ids = [rows[i] for i in keep], [row_ids[i] for i in keep]
+                placeholders = ",".join("?" * len(row_ids))
+                e = e.__cause__ or e
+            if is_transient_error(e) or len(rows) > 1:
+                # 暂时性错误只退避；多条一起失败说不清是哪条的问题，之后逐条写再计次
+                if len(rows) > 1 and not is_transient_error(e):
+                    self._isolate_until = max(self._isolate_until, row_ids[-1])
+                self._conn.execute(
+                    f"UPDATE turns SET last_error = ?, owner = NULL WHERE id IN ({placeholders})",
+                    (self._last_error, *row_ids),
+                )
+                return False
+            attempts = rows[0][6] + 1
+            self._conn.execute(
+                "UPDATE turns SET attempts = ?, last_error = ?, owner = NULL, dead = ? WHERE id = ?",
+                (attempts, self._last_error, int(attempts >= MAX_ATTEMPTS), row_ids[0]),
+            )
+            if attempts >= MAX_ATTEMPTS:
+                self._depth -= 1
+                self._dead_count += 1
+                print(f"[Journal] Turn {row_ids[0]} moved to dead letter after {attempts} attempts")
+            return False
+
+        self._complete(row_ids, turns, conv_ids, started)
+        return True
+
+    def _complete(self, row_ids: List[int], turns: List[Dict], conv_ids: List[Optional[str]], started: float):
+        """已落库的记录出队，触发后续任务"""
+        self._conn.execute(f"DELETE FROM turns WHERE id IN ({','.join('?' * len(row_ids))})", row_ids)
+        self._depth = max(0, self._depth - len(row_ids))
+        self._flushed_count += len(row_ids)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._last_flush_ms = elapsed_ms
+        self._flush_ms_total += elapsed_ms
+        self._flush_batches += 1
+
+        if self._on_flushed:
+            try:
+                self._on_flushed(turns, conv_ids)
+            except Exception as e:
+                print(f"[Journal] on_flushed error: {e}")
+
+    def replay_dead_letters(self, ids: Optional[List[int]] = None) -> int:
+        """把死信（默认全部）放回队列，失败次数清零；返回放回的条数"""
+        if self._conn is None:
+            self.open()
+        sql = "UPDATE turns SET dead = 0, attempts = 0, owner = NULL, lease_until = NULL WHERE dead = 1"
+        params: tuple = ()
+        if ids:
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            params = tuple(ids)
+        count = self._conn.execute(sql, params).rowcount
+        if count:
+            self._depth += count
+            self._dead_count = max(0, self._dead_count - count)
+            self._wakeup.set()
+            print(f"[Journal] Replaying {count} dead-letter turns")
+        return count
+
+    def get_stats(self) -> dict:
+        """队列深度与 flush 延迟"""
+        oldest_age = 0.0
+        if self._conn is not None:
+            # 多 worker 共用文件时本进程的计数不含别人的记录，统计以文件为准
+            row = self._conn.execute("SELECT COUNT(*), MIN(created_at) FROM turns WHERE dead = 0").fetchone()
+            self._depth = row[0]
+            if row[1]:
+                oldest_age = time.time() - row[1]
+        avg = self._flush_ms_total / self._flush_batches if self._flush_batches else 0.0
+        return {
+            "running": self.running,
+            "queue_depth": self._depth,
+            "oldest_pending_seconds": round(oldest_age, 1),
+            "flushed_count": self._flushed_count,
+            "failed_batches": self._failed_batches,
+            "dead_letters": self._dead_count,
+            "last_flush_ms": round(self._last_flush_ms, 1),
+            "avg_flush_ms": round(avg, 1),
+            "last_error": self._last_error,
+        }
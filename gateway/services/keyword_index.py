@@ -0,0 +1,453 @@
+"""
+进程内关键词倒排索引（BM25）- 混合检索关键词一路的内存版
+一个用户的全部对话 + 摘要放得进内存，关键词召回不必每轮都走一次数据库往返。
+
+切分和 SynonymService._tokenize 一致：中文连续段、英文单词、数字。
+- 中文段按 2 字切分建索引；查询词是 2 字时直接查倒排表，3~4 字（以及更长的词）取其 2 字片段的倒排表求交集，
+  再在原文里确认整词出现（和 migrations/007 的二元组索引 + ILIKE 复核同一个思路）。
+  没有把每个 3~4 字片段都建进词典：那样词典条目数接近语料字数，内存占用比正文还大
+- 英文单词（小写）、数字整体作为一个词。数据库那一路是 ILIKE 子串匹配（'ai' 也命中 'said'），
+  这里保持同样的语义：查询里的英文 / 数字片段先在词典的英文 / 数字词里找包含它的词，取这些词倒排表的并集；
+  查询词就是一个完整片段时词频按词里出现的次数累加，否则在原文里复核
+
+倒排表按词存一个 bytearray：(文档序号差值, 词频) 交替的 varint 编码，文档按加入顺序编号，
+差值大多一个字节；查询时用 NumPy 向量化解码。启动时从库里分页建好，之后随
+save_conversation_with_round / save_conversations_batch / save_summary 增量追加，
+后台打的 topic / emotion 随 update_conversation_metadata 更新。
+切分在锁外做，写入每 ADD_CHUNK 条放一次锁；检索拿不到锁（正在大批写入）时不等，交回数据库那一路。
+只在单 worker 下使用（其他 worker 的写入这里看不到）。
+"""
+
+import math
+import re
+import sys
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 没装 numpy 时关键词检索走数据库
+    np = None
+
+# 与 SynonymService._tokenize 相同的切分规则
+TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fff]+|[a-zA-Z]+|[0-9]+')
+CJK_RUN = re.compile(r'^[\u4e00-\u9fff]+$')
+ALNUM_RUN = re.compile(r'^(?:[a-z]+|[0-9]+)$')
+
+SOURCES = ("conversations", "summaries")
+# 结果里每个来源保留的列（和 storage.keyword_search 返回的一致），外加 remove_session 用的 session_id
+FIELDS = {
+    "conversations": ("id", "user_msg", "assistant_msg", "created_at", "scene_type", "topic", "emotion",
+                      "round_number", "session_id"),
+    "summaries": ("id", "summary", "created_at", "scene_type", "topic", "start_round", "end_round"),
+}
+
+# 索引后可以更新的列（后台元数据任务补上的）
+MUTABLE_FIELDS = ("topic", "emotion")
+
+# BM25 参数
+K1 = 1.2
+B = 0.75
+
+# 建索引时每写这么多条放一次锁，事件循环上的检索 / 追加最多等这一小段
+ADD_CHUNK = 64
+# 检索等锁的上限（秒），超过就返回 None 让调用方走数据库
+SEARCH_LOCK_TIMEOUT = 0.005
+
+
+def index_units(text: str) -> List[str]:
+    """文本 -> 索引单元：中文段的 2 字片段（单字段保留单字），英文单词小写、数字"""
+    units = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if len(token) > 1 and CJK_RUN.match(token):
+            units.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            units.append(token)
+    return units
+
+
+def _document_text(source: str, row: Dict) -> str:
+    if source == "summaries":
+        return row.get("summary") or ""
+    return f"{row.get('user_msg') or ''}\n{row.get('assistant_msg') or ''}"
+
+
+def _put_varint(buf: bytearray, value: int):
+    while value >= 0x80:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _decode(buf: bytearray) -> Tuple["np.ndarray", "np.ndarray"]:
+    """倒排表 -> (文档序号, 词频)"""
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)
+    if ends.size == raw.size:
+        values = raw.astype(np.int64)
+    else:
+        starts = np.empty_like(ends)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        group = np.repeat(np.arange(ends.size), ends - starts + 1)
+        shifts = (np.arange(raw.size) - starts[group]) * 7
+        values = np.add.reduceat((raw & 0x7F).astype(np.int64) << shifts, starts)
+    return np.cumsum(values[0::2]), values[1::2]
+
+
+class KeywordIndex:
+    """单机 BM25 倒排索引（对话和摘要放在同一个索引里，按来源分别取 top-k）"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled and np is not None
+        self._lock = threading.Lock()
+        self.version = 0
+        self.ready = False
+        self._reset()
+
+        self._searches = 0
+        self._busy = 0
+        self._builds = 0
+        self._invalidations = 0
+
+    def _reset(self):
+        self._rows: List[Optional[Dict]] = []
+        self._positions: Dict[str, int] = {}
+        self._source = bytearray()
+        self._lengths = array("I")
+        self._channels = array("H")
+        self._scenes = array("H")
+        self._removed = bytearray()
+        self._codes: Dict[str, int] = {}
+        # 词 -> 倒排表 / 最后一个文档序号 / 文档频率
+        self._terms: Dict[str, int] = {}
+        # 英文 / 数字词（子串匹配时在这里面找）
+        self._words: List[Tuple[str, int]] = []
+        self._postings: List[bytearray] = []
+        self._last = array("I")
+        self._df = array("I")
+        self._alive = 0
+        self._total_length = 0
+        self._postings_bytes = 0
+
+    def _code(self, value: Optional[str]) -> int:
+        key = value or ""
+        if key not in self._codes:
+            self._codes[key] = len(self._codes)
+        return self._codes[key]
+
+    # ---- 写 ----
+
+    def reset(self) -> int:
+        """清空并进入未就绪状态（重建前调用），返回本次重建的版本号"""
+        with self._lock:
+            self._reset()
+            self.ready = False
+            self.version += 1
+            return self.version
+
+    def mark_ready(self, version: int) -> bool:
+        """重建完成；期间又被清空过则不算"""
+        with self._lock:
+            if version != self.version:
+                return False
+            self.ready = True
+            self._builds += 1
+            return True
+
+    def add(self, source: str, rows: Iterable[Dict]) -> int:
+        """追加一批对话 / 摘要（已收录的 id 跳过），返回新增条数；还没开始建索引时（如命令行导入进程）不收录"""
+        if not self.enabled or not self.version:
+            return 0
+        added = 0
+        batch = []
+        for row in rows:
+            if row and row.get("id"):
+                # 切分不碰索引，在锁外做
+                batch.append((row, Counter(index_units(_document_text(source, row)))))
+            if len(batch) >= ADD_CHUNK:
+                added += self._add_batch(source, batch)
+                batch = []
+        if batch:
+            added += self._add_batch(source, batch)
+        return added
+
+    def _add_batch(self, source: str, batch: List[Tuple[Dict, Counter]]) -> int:
+        added = 0
+        with self._lock:
+            for row, counts in batch:
+                if row["id"] not in self._positions:
+                    self._add_document(source, row, counts)
+                    added += 1
+        return added
+
+    def _add_document(self, source: str, row: Dict, counts: Counter):
+        doc = len(self._rows)
+        self._rows.append({field: row.get(field) for field in FIELDS[source]})
+        self._positions[row["id"]] = doc
+        self._source.append(SOURCES.index(source))
+        length = sum(counts.values())
+        self._lengths.append(length)
+        self._channels.append(self._code(row.get("model_channel")))
+        self._scenes.append(self._code(row.get("scene_type")))
+        self._removed.append(0)
+        self._alive += 1
+        self._total_length += length
+        terms, postings, last, df = self._terms, self._postings, self._last, self._df
+        written = 0
+        for unit, tf in counts.items():
+            term = terms.get(unit)
+            if term is None:
+                term = terms[unit] = len(postings)
+                if ALNUM_RUN.match(unit):
+                    self._words.append((unit, term))
+                postings.append(bytearray())
+                last.append(0)
+                df.append(0)
+            buf = postings[term]
+            gap = doc - last[term]
+            if gap < 0x80:
+                buf.append(gap)
+                written += 2
+            else:
+                before = len(buf)
+                _put_varint(buf, gap)
+                written += len(buf) - before + 1
+            # 词频封顶 127，始终一个字节（BM25 的词频项早已饱和）
+            buf.append(tf if tf < 0x80 else 0x7F)
+            last[term] = doc
+            df[term] += 1
+        self._postings_bytes += written
+
+    def update_fields(self, record_id: str, fields: Dict) -> bool:
+        """更新已收录行的 topic / emotion（空值不动，和 update_metadata 一致），未收录返回 False"""
+        with self._lock:
+            doc = self._positions.get(record_id)
+            if doc is None:
+                return False
+            row = self._rows[doc]
+            for field in MUTABLE_FIELDS:
+                if fields.get(field) and field in row:
+                    row[field] = fields[field]
+            return True
+
+    def remove_session(self, session_id: str) -> int:
+        """删除会话时把它的对话从结果里去掉（倒排表不动，下次重建时回收）"""
+        removed = 0
+        with self._lock:
+            for doc, row in enumerate(self._rows):
+                if row is not None and row.get("session_id") == session_id:
+                    self._remove(doc)
+                    removed += 1
+        return removed
+
+    def _remove(self, doc: int):
+        row = self._rows[doc]
+        self._rows[doc] = None
+        self._removed[doc] = 1
+        self._positions.pop(row["id"], None)
+        self._alive -= 1
+        self._total_length -= self._lengths[doc]
+
+    def invalidate(self, reason: str = "") -> int:
+        """整体失效（批量导入等），调用方负责重建"""
+        self._invalidations += 1
+        if reason:
+            print(f"[KeywordIndex] Invalidated ({reason})")
+        return self.reset()
+
+    # ---- 读 ----
+
+    def _word_postings(self, unit: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        """英文 / 数字片段按子串匹配：包含它的词的倒排表合并成 (文档序号, 出现次数)"""
+        docs, tfs = [], []
+        for word, term_id in self._words:
+            if unit in word:
+                word_docs, word_tf = _decode(self._postings[term_id])
+                docs.append(word_docs)
+                tfs.append(word_tf * word.count(unit))
+        if not docs:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        if len(docs) == 1:
+            return docs[0], tfs[0]
+        merged, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        return merged, np.bincount(inverse, weights=np.concatenate(tfs)).astype(np.int64)
+
+    def _unit_postings(self, unit: str) -> Optional[Tuple["np.ndarray", "np.ndarray"]]:
+        if ALNUM_RUN.match(unit):
+            return self._word_postings(unit)
+        term_id = self._terms.get(unit)
+        return None if term_id is None else _decode(self._postings[term_id])
+
+    def _match(self, term: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        """一个查询词命中的 (文档序号, 词频)，语义同 ILIKE '%term%'"""
+        empty = np.empty(0, dtype=np.int64)
+        units = index_units(term)
+        if not units:
+            return empty, empty
+        needle = term.lower()
+        if len(units) == 1 and units[0] == needle:
+            # 查询词本身就是一个中文 2 字片段或一个完整的英文 / 数字片段，倒排表给出的就是精确词频
+            return self._unit_postings(needle) or (empty, empty)
+        # 多个单元：按候选数从小到大求交集，再在原文里确认整词出现。
+        # 和其他单元挨着的单个汉字在原文里可能是更长中文段的一部分，没有对应的倒排表，只靠复核
+        lone = [unit for unit in units if len(unit) == 1 and CJK_RUN.match(unit)]
+        if len(lone) < len(units):
+            units = [unit for unit in units if unit not in lone]
+        candidates = []
+        for unit in dict.fromkeys(units):
+            docs = self._unit_postings(unit)
+            if docs is None or not docs[0].size:
+                return empty, empty
+            candidates.append(docs[0])
+        candidates.sort(key=len)
+        docs = candidates[0]
+        for other in candidates[1:]:
+            if not docs.size:
+                break
+            docs = np.intersect1d(docs, other, assume_unique=True)
+        hits, tfs = [], []
+        for doc in docs.tolist():
+            row = self._rows[doc]
+            if row is None:
+                continue
+            tf = _document_text(SOURCES[self._source[doc]], row).lower().count(needle)
+            if tf:
+                hits.append(doc)
+                tfs.append(tf)
+        return np.asarray(hits, dtype=np.int64), np.asarray(tfs, dtype=np.int64)
+
+    def search(self, terms: List[str], scene_type: Optional[str], limit: int = 15,
+               channel: str = "deepseek", summary_limit: int = 5) -> Optional[List[Dict]]:
+        """BM25 打分，conversations 取 limit 条、summaries 取 summary_limit 条（每行带 _source / _score）；
+        索引正忙（拿不到锁）时返回 None，调用方改走数据库"""
+        if not self._lock.acquire(timeout=SEARCH_LOCK_TIMEOUT):
+            self._busy += 1
+            return None
+        self._searches += 1
+        try:
+            return self._search(terms, scene_type, limit, channel, summary_limit)
+        finally:
+            self._lock.release()
+
+    def _search(self, terms: List[str], scene_type: Optional[str], limit: int,
+                channel: str, summary_limit: int) -> List[Dict]:
+        count = len(self._rows)
+        channel_code = self._codes.get(channel)
+        if not count or not self._alive or channel_code is None:
+            return []
+        # 下面的 frombuffer 都是零拷贝视图，只在持锁期间使用（数组扩容时不能有视图存在）
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+        avgdl = self._total_length / self._alive or 1.0
+        matched, contributions = [], []
+        for term in dict.fromkeys(t.lower() for t in terms[:5] if len(t) >= 2):
+            docs, tf = self._match(term)
+            if not docs.size:
+                continue
+            df = docs.size
+            idf = math.log(1 + (self._alive - df + 0.5) / (df + 0.5))
+            tf = tf.astype(np.float32)
+            norm = K1 * (1 - B + B * lengths[docs].astype(np.float32) / avgdl)
+            matched.append(docs)
+            contributions.append(idf * tf * (K1 + 1) / (tf + norm))
+        if not matched:
+            return []
+        # 各词命中的文档合并求和（只处理命中的文档，和总文档数无关）
+        if len(matched) == 1:
+            candidates, scores = matched[0], contributions[0]
+        else:
+            candidates, inverse = np.unique(np.concatenate(matched), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(contributions))
+
+        # 过滤只在有分数的文档上做
+        keep = np.frombuffer(self._channels, dtype=np.uint16)[candidates] == channel_code
+        keep &= np.frombuffer(self._removed, dtype=np.uint8)[candidates] == 0
+        scenes = ["plot"] if scene_type == "plot" else ["daily", "plot"] if scene_type == "daily" else None
+        if scenes is not None:
+            scene_codes = np.frombuffer(self._scenes, dtype=np.uint16)[candidates]
+            in_scene = np.zeros(candidates.size, dtype=bool)
+            for code in (self._codes[s] for s in scenes if s in self._codes):
+                in_scene |= scene_codes == code
+            keep &= in_scene
+        candidates, scores = candidates[keep], scores[keep]
+        sources = np.frombuffer(self._source, dtype=np.uint8)[candidates]
+
+        results = []
+        for source_code, source_limit in ((0, limit), (1, summary_limit)):
+            picked = np.flatnonzero(sources == source_code)
+            if not picked.size or source_limit <= 0:
+                continue
+            if picked.size > source_limit:
+                picked = picked[np.argpartition(-scores[picked], source_limit - 1)[:source_limit]]
+            # 同分时新的在前（文档序号大的后加入）
+            for i in picked[np.lexsort((-candidates[picked], -scores[picked]))].tolist():
+                hit = {key: value for key, value in self._rows[candidates[i]].items() if key != "session_id"}
+                hit["_source"] = SOURCES[source_code]
+                hit["_score"] = round(float(scores[i]), 4)
+                results.append(hit)
+        return results
+
+    def get_rows(self, source: str, ids: Iterable[str]) -> Dict[str, Dict]:
+        """按 id 取已收录的行（向量镜像命中后补全正文用），未收录 / 已删除的不返回；索引正忙时返回空，调用方回库取"""
+        if not self.ready or not self._lock.acquire(timeout=SEARCH_LOCK_TIMEOUT):
+            return {}
+        code = SOURCES.index(source)
+        rows = {}
+        try:
+            for record_id in ids:
+                doc = self._positions.get(record_id)
+                if doc is not None and self._source[doc] == code:
+                    rows[record_id] = {key: value for key, value in self._rows[doc].items() if key != "session_id"}
+        finally:
+            self._lock.release()
+        return rows
+
+    # ---- 统计 ----
+
+    def memory_report(self) -> Dict:
+        """逐项统计内存占用（遍历全部倒排表，给基准测试 / 排查用）"""
+        with self._lock:
+            postings = sum(self._df)
+            postings_bytes = sum(sys.getsizeof(buf) for buf in self._postings)
+            dictionary_bytes = (
+                sys.getsizeof(self._terms) + sum(sys.getsizeof(t) for t in self._terms)
+                + sys.getsizeof(self._words) + sum(sys.getsizeof(w) for w in self._words)
+            )
+            doc_bytes = (
+                sys.getsizeof(self._rows) + sys.getsizeof(self._positions)
+                + sum(sys.getsizeof(v) for row in self._rows if row for v in row.values())
+                + sum(sys.getsizeof(row) for row in self._rows if row)
+            )
+            arrays_bytes = sum(sys.getsizeof(a) for a in (
+                self._source, self._lengths, self._channels, self._scenes, self._removed, self._last, self._df,
+            ))
+        mb = 1024 * 1024
+        return {
+            "documents": self._alive,
+            "terms": len(self._terms),
+            "postings": postings,
+            "postings_payload_mb": round(self._postings_bytes / mb, 2),
+            # 同样的 (文档序号, 词频) 用两个 uint32 存的大小，对比压缩效果
+            "postings_uncompressed_mb": round(postings * 8 / mb, 2),
+            "postings_mb": round(postings_bytes / mb, 2),
+            "dictionary_mb": round(dictionary_bytes / mb, 2),
+            "documents_mb": round(doc_bytes / mb, 2),
+            "arrays_mb": round(arrays_bytes / mb, 2),
+            "total_mb": round((postings_bytes + dictionary_bytes + doc_bytes + arrays_bytes) / mb, 2),
+        }
+
+    def get_stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "documents": self._alive,
+            "terms": len(self._terms),
+            "postings_mb": round(self._postings_bytes / 1024 / 1024, 2),
+            "searches": self._searches,
+            "busy": self._busy,
+            "builds": self._builds,
+            "invalidations": self._invalidations,
+        }
@@ -0,0 +1,799 @@
+"""
+本地嵌入式数据层（SQLite + FTS5 + NumPy）
+storage_driver=local 时替代 Supabase：整个记忆流程跑在一台机器上，不依赖网络，存储延迟在毫秒级，
+也可以离线做性能测试。
+
+- 表结构与 Supabase 上的 conversations / summaries / memories / sessions / synonym_map 对应
+  （只建网关用到的列），SQLite 文件开 WAL
+- 关键词检索：FTS5 trigram 分词（中文按三字滑窗，大小写不敏感），不足三个字的词退回 LIKE 扫描，
+  结果与 ILIKE '%词%' 一致
+- 向量：embedding 以 float32 BLOB 存在行里，启动时载入 services/vector_index.py 的内存索引，
+  写入时同步更新；检索语义与 search_*_v2 RPC 一致（channel 隔离、daily 含 plot）
+- 轮数：conversation_rounds 表在 BEGIN IMMEDIATE 事务里分配，与 migrations/002 的语义一致
+
+方法名、参数和返回格式与 PgRepository 一致（id / 时间戳为字符串），storage.py 等调用方无需区分。
+单个连接 + 锁，所有 SQL 在线程池里执行，不阻塞事件循环。
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+import sys
+sys.path.insert(0, '/home/dream/memory-system/gateway')
+from services.vector_index import VectorIndex, np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL DEFAULT 'dream',
+    user_msg TEXT NOT NULL DEFAULT '',
+    assistant_msg TEXT NOT NULL DEFAULT '',
+    synced_to_memu INTEGER NOT NULL DEFAULT 0,
+    scene_type TEXT DEFAULT 'daily',
+    model_channel TEXT DEFAULT 'deepseek',
+    round_number INTEGER,
+    created_at TEXT NOT NULL,
+    weight INTEGER DEFAULT 0,
+    topic TEXT,
+    entities TEXT,
+    emotion TEXT,
+    session_id TEXT,
+    embedding BLOB
+);
+CREATE INDEX IF NOT EXISTS idx_local_conv_channel_time ON conversations(user_id, model_channel, created_at);
+CREATE INDEX IF NOT EXISTS idx_local_conv_round ON conversations(user_id, model_channel, round_number);
+CREATE INDEX IF NOT EXISTS idx_local_conv_time ON conversations(created_at);
+CREATE INDEX IF NOT EXISTS idx_local_conv_session ON conversations(session_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(
+    user_msg, assistant_msg, content='conversations', content_rowid='seq', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN
+    INSERT INTO conversations_fts(rowid, user_msg, assistant_msg) VALUES (new.seq, new.user_msg, new.assistant_msg);
+END;
+CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN
+    INSERT INTO conversations_fts(conversations_fts, rowid, user_msg, assistant_msg)
+    VALUES ('delete', old.seq, old.user_msg, old.assistant_msg);
+END;
+CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE OF user_msg, assistant_msg ON conversations BEGIN
+    INSERT INTO conversations_fts(conversations_fts, rowid, user_msg, assistant_msg)
+    VALUES ('delete', old.seq, old.user_msg, old.assistant_msg);
+    INSERT INTO conversations_fts(rowid, user_msg, assistant_msg) VALUES (new.seq, new.user_msg, new.assistant_msg);
+END;
+
+CREATE TABLE IF NOT EXISTS conversation_rounds (
+    user_id TEXT NOT NULL,
+    model_channel TEXT NOT NULL,
+    last_round INTEGER NOT NULL,
+    PRIMARY KEY (user_id, model_channel)
+);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL DEFAULT 'dream',
+    summary TEXT NOT NULL,
+    start_round INTEGER,
+    end_round INTEGER,
+    scene_type TEXT DEFAULT 'daily',
+    model_channel TEXT DEFAULT 'deepseek',
+    topic TEXT,
+    created_at TEXT NOT NULL,
+    embedding BLOB
+);
+CREATE INDEX IF NOT EXISTS idx_local_sum_channel_time ON summaries(user_id, model_channel, created_at);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS summaries_fts USING fts5(
+    summary, content='summaries', content_rowid='seq', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS summaries_fts_insert AFTER INSERT ON summaries BEGIN
+    INSERT INTO summaries_fts(rowid, summary) VALUES (new.seq, new.summary);
+END;
+CREATE TRIGGER IF NOT EXISTS summaries_fts_delete AFTER DELETE ON summaries BEGIN
+    INSERT INTO summaries_fts(summaries_fts, rowid, summary) VALUES ('delete', old.seq, old.summary);
+END;
+
+CREATE TABLE IF NOT EXISTS memories (
+    id TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    layer TEXT,
+    scene_type TEXT,
+    base_importance REAL DEFAULT 0,
+    hits INTEGER DEFAULT 0,
+    last_accessed_at TEXT,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    scene_type TEXT DEFAULT 'daily',
+    model TEXT,
+    message_count INTEGER DEFAULT 0,
+    created_at TEXT,
+    updated_at TEXT
+);
+-- 和 migrations/006 一样由触发器增量维护消息数
+CREATE TRIGGER IF NOT EXISTS sessions_count_insert AFTER INSERT ON conversations
+WHEN new.session_id IS NOT NULL BEGIN
+    UPDATE sessions SET message_count = COALESCE(message_count, 0) + 1, updated_at = new.created_at
+    WHERE id = new.session_id;
+END;
+CREATE TRIGGER IF NOT EXISTS sessions_count_delete AFTER DELETE ON conversations
+WHEN old.session_id IS NOT NULL BEGIN
+    UPDATE sessions SET message_count = MAX(COALESCE(message_count, 0) - 1, 0) WHERE id = old.session_id;
+END;
+
+CREATE TABLE IF NOT EXISTS synonym_map (
+    term TEXT PRIMARY KEY,
+    synonyms TEXT NOT NULL,
+    category TEXT DEFAULT 'general'
+);
+"""
+
+# 返回给调用方的列（不含 seq / embedding）
+CONVERSATION_SELECT = (
+    "id, user_id, user_msg, assistant_msg, synced_to_memu, scene_type, model_channel, round_number, "
+    "created_at, weight, topic, entities, emotion, session_id"
+)
+
+# FTS5 trigram 只能匹配 >= 3 个字的词
+TRIGRAM_MIN_CHARS = 3
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _timestamp(value) -> Optional[str]:
+    """统一成 UTC ISO 字符串（固定格式，字符串比较即时间先后）"""
+    if not value:
+        return None
+    parsed = value if isinstance(value, datetime) else datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _row(row: sqlite3.Row) -> Dict:
+    data = dict(row)
+    if "synced_to_memu" in data:
+        data["synced_to_memu"] = bool(data["synced_to_memu"])
+    if data.get("entities"):
+        data["entities"] = json.loads(data["entities"])
+    return data
+
+
+def _rows(rows) -> List[Dict]:
+    return [_row(r) for r in rows]
+
+
+def _blob(embedding: List[float]) -> bytes:
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def _fts_phrase(term: str) -> str:
+    """FTS5 短语查询（双引号转义），整个词作为连续子串匹配"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _keyword_scene_clause(scene_type: str) -> str:
+    """关键词检索的场景过滤（与 hybrid_search 原来的 PostgREST 查询一致）"""
+    if scene_type == "plot":
+        return " AND scene_type = 'plot'"
+    if scene_type == "daily":
+        return " AND scene_type IN ('daily', 'plot')"
+    return ""
+
+
+class LocalRepository:
+    """SQLite 文件 + 内存向量索引，接口与 PgRepository 相同"""
+
+    def __init__(self, path: str):
+        if np is None:
+            raise RuntimeError("storage_driver=local requires numpy (pip install numpy)")
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._connect_lock = asyncio.Lock()
+        self._indexes: Dict[str, VectorIndex] = {}
+        self._queries = 0
+
+    # ---- 生命周期 ----
+
+    async def connect(self):
+        """打开数据库、建表并载入向量索引（幂等）"""
+        if self._conn is not None:
+            return
+        async with self._connect_lock:
+            if self._conn is not None:
+                return
+            await asyncio.to_thread(self._open)
+
+    def _open(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        indexes = {}
+        for table, select in (
+            ("conversations", "SELECT id, model_channel, scene_type, embedding FROM conversations WHERE embedding IS NOT NULL"),
+            ("summaries", "SELECT id, model_channel, scene_type, embedding FROM summaries WHERE embedding IS NOT NULL"),
+        ):
+            index = VectorIndex()
+            for row in conn.execute(select):
+                index.upsert(row["id"], np.frombuffer(row["embedding"], dtype=np.float32),
+                             row["model_channel"], row["scene_type"])
+            indexes[table] = index
+        self._indexes = indexes
+        self._conn = conn
+        print(f"[LocalRepo] Opened {self.path} "
+              f"({len(indexes['conversations'])} conversation / {len(indexes['summaries'])} summary vectors)")
+
+    async def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await asyncio.to_thread(conn.close)
+
+    def _call(self, fn, *args):
+        with self._lock:
+            self._queries += 1
+            return fn(self._conn, *args)
+
+    async def _run(self, fn, *args):
+        return await asyncio.to_thread(self._call, fn, *args)
+
+    async def _fetch(self, sql: str, *args) -> List[Dict]:
+        return await self._run(lambda conn: _rows(conn.execute(sql, args).fetchall()))
+
+    async def _fetchrow(self, sql: str, *args) -> Optional[Dict]:
+        def fetchrow(conn):
+            row = conn.execute(sql, args).fetchone()
+            return _row(row) if row else None
+        return await self._run(fetchrow)
+
+    async def _execute(self, sql: str, *args) -> int:
+        return await self._run(lambda conn: conn.execute(sql, args).rowcount)
+
+    async def _transaction(self, fn, *args):
+        """BEGIN IMMEDIATE 里执行 fn(conn, *args)，异常时回滚"""
+        def run(conn):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn, *args)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+        return await self._run(run)
+
+    def get_stats(self) -> dict:
+        if self._conn is None:
+            return {"driver": "local", "connected": False}
+        return {
+            "driver": "local",
+            "connected": True,
+            "path": self.path,
+            "queries": self._queries,
+            "vectors": {table: index.get_stats() for table, index in self._indexes.items()},
+        }
+
+    # ============ conversations ============
+
+    @staticmethod
+    def _insert_rows(conn, rows: List[Dict]) -> List[Dict]:
+        """插入若干行（同一事务内），按传入顺序返回插入后的行"""
+        inserted = []
+        now = _now()
+        for row in rows:
+            record = {
+                "id": str(row.get("id") or uuid4()),
+                "user_id": row.get("user_id", "dream"),
+                "user_msg": row["user_msg"],
+                "assistant_msg": row["assistant_msg"],
+                "synced_to_memu": int(bool(row.get("synced_to_memu", False))),
+                "scene_type": row.get("scene_type") or "daily",
+                "model_channel": row.get("model_channel") or "deepseek",
+                "round_number": row.get("round_number"),
+                "created_at": _timestamp(row.get("created_at")) or now,
+            }
+            conn.execute(
+                f"INSERT INTO conversations ({', '.join(record)}) VALUES ({', '.join('?' * len(record))})",
+                tuple(record.values()),
+            )
+            record["synced_to_memu"] = bool(record["synced_to_memu"])
+            record.update(weight=0, topic=None, entities=None, emotion=None, session_id=None)
+            inserted.append(record)
+        return inserted
+
+    @staticmethod
+    def _allocate_rounds(conn, user_id: str, channel: str, count: int) -> int:
+        """分配 count 个连续轮数，返回最后一个（调用方已在事务里）"""
+        row = conn.execute(
+            "SELECT last_round FROM conversation_rounds WHERE user_id = ? AND model_channel = ?",
+            (user_id, channel),
+        ).fetchone()
+        if row is None:
+            # 第一次分配：从现有对话的最大轮数接着排
+            last = conn.execute(
+                "SELECT COALESCE(MAX(round_number), 0) FROM conversations WHERE user_id = ? AND model_channel = ?",
+                (user_id, channel),
+            ).fetchone()[0]
+        else:
+            last = row["last_round"]
+        conn.execute(
+            "INSERT INTO conversation_rounds (user_id, model_channel, last_round) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id, model_channel) DO UPDATE SET last_round = excluded.last_round",
+            (user_id, channel, last + count),
+        )
+        return last + count
+
+    async def insert_conversation(self, user_id: str, user_msg: str, assistant_msg: str, round_number: int = None,
+                                  scene_type: str = "daily", channel: str = "deepseek") -> Optional[dict]:
+        rows = await self._transaction(self._insert_rows, [{
+            "user_id": user_id, "user_msg": user_msg, "assistant_msg": assistant_msg,
+            "scene_type": scene_type, "model_channel": channel, "round_number": round_number,
+        }])
+        return rows[0]
+
+    async def insert_conversation_with_round(self, user_id: str, user_msg: str, assistant_msg: str,
+                                             scene_type: str = "daily", channel: str = "deepseek") -> Optional[dict]:
+        rows = await self.insert_conversations_with_rounds(user_id, channel, [{
+            "user_msg": user_msg, "assistant_msg": assistant_msg, "scene_type": scene_type,
+        }])
+        return rows[0] if rows else None
+
+    async def insert_conversations_with_rounds(self, user_id: str, channel: str, rows: List[Dict]) -> List[Dict]:
+        if not rows:
+            return []
+
+        def insert(conn):
+            last = self._allocate_rounds(conn, user_id, channel, len(rows))
+            first = last - len(rows) + 1
+            return self._insert_rows(conn, [
+                dict(row, user_id=user_id, model_channel=channel, round_number=first + offset)
+                for offset, row in enumerate(rows)
+            ])
+        return await self._transaction(insert)
+
+    async def get_recent(self, user_id: str, limit: int, channel: str = "deepseek") -> List[Dict]:
+        return await self._fetch(
+            "SELECT user_msg, assistant_msg, created_at, scene_type FROM conversations "
+            "WHERE user_id = ? AND model_channel = ? ORDER BY created_at DESC, seq DESC LIMIT ?",
+            user_id, channel, limit,
+        )
+
+    async def get_global_recent(self, limit: int) -> List[Dict]:
+        return await self._fetch(
+            "SELECT user_msg, assistant_msg, scene_type, created_at FROM conversations "
+            "ORDER BY created_at DESC, seq DESC LIMIT ?",
+            limit,
+        )
+
+    async def get_unsynced(self, limit: int) -> List[Dict]:
+        return await self._fetch(
+            f"SELECT {CONVERSATION_SELECT} FROM conversations WHERE synced_to_memu = 0 ORDER BY created_at, seq LIMIT ?",
+            limit,
+        )
+
+    async def mark_synced(self, conversation_id: str) -> bool:
+        await self._execute("UPDATE conversations SET synced_to_memu = 1 WHERE id = ?", conversation_id)
+        return True
+
+    async def search(self, query: str, user_id: str, limit: int, channel: str = "deepseek") -> List[Dict]:
+        return await self._run(
+            self._match, "conversations", query, "user_id = ? AND model_channel = ?", [user_id, channel],
+            "user_msg, assistant_msg, created_at", limit,
+        )
+
+    async def update_weight(self, conversation_id: str, increment: int) -> bool:
+        updated = await self._execute(
+            "UPDATE conversations SET weight = COALESCE(weight, 0) + ? WHERE id = ?", increment, conversation_id,
+        )
+        return updated > 0
+
+    async def increment_weights(self, conversation_ids: List[str], increments: List[int]) -> int:
+        def increment(conn):
+            return sum(
+                conn.execute(
+                    "UPDATE conversations SET weight = COALESCE(weight, 0) + ? WHERE id = ?", (delta, conv_id)
+                ).rowcount
+                for conv_id, delta in zip(conversation_ids, increments)
+            )
+        return await self._transaction(increment)
+
+    async def get_by_id(self, conversation_id: str) -> Optional[Dict]:
+        return await self._fetchrow(f"SELECT {CONVERSATION_SELECT} FROM conversations WHERE id = ?", conversation_id)
+
+    async def get_current_round(self, user_id: str, channel: str = "deepseek") -> int:
+        row = await self._fetchrow(
+            "SELECT round_number FROM conversations WHERE user_id = ? AND model_channel = ? "
+            "ORDER BY created_at DESC, seq DESC LIMIT 1",
+            user_id, channel,
+        )
+        if row and row.get("round_number"):
+            return row["round_number"]
+        return 0
+
+    async def get_conversations_for_summary(self, user_id: str, start_round: int, end_round: int,
+                                            channel: str = "deepseek") -> List[Dict]:
+        return await self._fetch(
+            "SELECT user_msg, assistant_msg, round_number, created_at, scene_type FROM conversations "
+            "WHERE user_id = ? AND model_channel = ? AND round_number BETWEEN ? AND ? ORDER BY round_number",
+            user_id, channel, start_round, end_round,
+        )
+
+    async def insert_conversations_batch(self, rows: List[Dict]) -> List[Dict]:
+        if not rows:
+            return []
+        return await self._transaction(self._insert_rows, rows)
+
+    async def copy_conversations_with_rounds(self, user_id: str, channel: str, rows: List[Dict]) -> List[Optional[str]]:
+        """批量导入：一个事务里分配轮数并写入（SQLite 单事务批量插入已是最快路径）
+
+        行里带 id 时沿用，库里已有的、同一批里重复的跳过（不占轮数）；按传入顺序返回 id，跳过的位置为 None
+        """
+        if not rows:
+            return []
+
+        def insert(conn):
+            ids = [str(row["id"]) if row.get("id") else str(uuid4()) for row in rows]
+            seen = set()
+            for offset in range(0, len(ids), 500):
+                chunk = ids[offset:offset + 500]
+                seen.update(r[0] for r in conn.execute(
+                    f"SELECT id FROM conversations WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+            fresh = []
+            for i, conv_id in enumerate(ids):
+                if conv_id not in seen:
+                    seen.add(conv_id)
+                    fresh.append(i)
+            if not fresh:
+                return [None] * len(rows)
+            last = self._allocate_rounds(conn, user_id, channel, len(fresh))
+            first = last - len(fresh) + 1
+            self._insert_rows(conn, [
+                dict(rows[i], id=ids[i], user_id=user_id, model_channel=channel, round_number=first + offset)
+                for offset, i in enumerate(fresh)
+            ])
+            inserted = set(fresh)
+            return [conv_id if i in inserted else None for i, conv_id in enumerate(ids)]
+        return await self._transaction(insert)
+
+    async def move_channel(self, user_id: str, from_channel: str, to_channel: str) -> int:
+        """把一个 channel 的对话和摘要整体改到另一个 channel，轮数平移到目标 channel 已有轮数之后"""
+        if from_channel == to_channel:
+            return 0
+
+        def move(conn):
+            top = conn.execute(
+                "SELECT COALESCE(MAX(round_number), 0) FROM conversations WHERE user_id = ? AND model_channel = ?",
+                (user_id, from_channel),
+            ).fetchone()[0]
+            offset = self._allocate_rounds(conn, user_id, to_channel, top) - top
+            # 内存向量索引里的 channel 一起改（同一事务里，和 _store_embedding 一样）
+            for table in ("conversations", "summaries"):
+                ids = [row[0] for row in conn.execute(
+                    f"SELECT id FROM {table} WHERE user_id = ? AND model_channel = ? AND embedding IS NOT NULL",
+                    (user_id, from_channel),
+                )]
+                if table in self._indexes:
+                    self._indexes[table].set_channel(ids, to_channel)
+            moved = conn.execute(
+                "UPDATE conversations SET model_channel = ?, round_number = round_number + ? "
+                "WHERE user_id = ? AND model_channel = ?",
+                (to_channel, offset, user_id, from_channel),
+            ).rowcount
+            conn.execute(
+                "UPDATE summaries SET model_channel = ?, start_round = start_round + ?, end_round = end_round + ? "
+                "WHERE user_id = ? AND model_channel = ?",
+                (to_channel, offset, offset, user_id, from_channel),
+            )
+            return moved
+        return await self._transaction(move)
+
+    async def page_conversations(self, user_id: str, channel: Optional[str], after_created: Optional[str],
+                                 after_id: Optional[str], page_size: int) -> List[Dict]:
+        after = _timestamp(after_created)
+        return await self._fetch(
+            f"""
+            SELECT {CONVERSATION_SELECT}
+            FROM conversations
+            WHERE user_id = ?
+              AND (? IS NULL OR model_channel = ?)
+              AND (? IS NULL OR created_at > ? OR (created_at = ? AND id > ?))
+            ORDER BY created_at, id
+            LIMIT ?
+            """,
+            user_id, channel, channel, after, after, after, after_id, page_size,
+        )
+
+    async def page_summaries(self, user_id: str, after_created: Optional[str], after_id: Optional[str],
+                             page_size: int) -> List[Dict]:
+        after = _timestamp(after_created)
+        return await self._fetch(
+            """
+            SELECT id, summary, created_at, scene_type, topic, start_round, end_round, model_channel
+            FROM summaries
+            WHERE user_id = ?
+              AND (? IS NULL OR created_at > ? OR (created_at = ? AND id > ?))
+            ORDER BY created_at, id
+            LIMIT ?
+            """,
+            user_id, after, after, after, after_id, page_size,
+        )
+
+    async def get_missing_embeddings(self, channel: Optional[str], limit: int) -> List[Dict]:
+        return await self._fetch(
+            "SELECT id, user_msg, assistant_msg, model_channel, scene_type FROM conversations "
+            "WHERE embedding IS NULL AND (? IS NULL OR model_channel = ?) ORDER BY created_at, seq LIMIT ?",
+            channel, channel, limit,
+        )
+
+    async def store_embeddings(self, conversation_ids: List[str], embeddings: List[List[float]]) -> int:
+        def store(conn):
+            return sum(
+                self._store_embedding(conn, "conversations", conv_id, embedding)
+                for conv_id, embedding in zip(conversation_ids, embeddings)
+            )
+        return await self._transaction(store)
+
+    async def update_metadata(self, conversation_id: str, topic: str, entities: list, emotion: str) -> bool:
+        if not (topic or entities or emotion):
+            return False
+        await self._execute(
+            "UPDATE conversations SET topic = COALESCE(?, topic), entities = COALESCE(?, entities), "
+            "emotion = COALESCE(?, emotion) WHERE id = ?",
+            topic or None, json.dumps(entities, ensure_ascii=False) if entities else None, emotion or None,
+            conversation_id,
+        )
+        return True
+
+    async def get_recent_by_emotion(self, emotion: str, since: str, limit: int,
+                                    channel: str = "deepseek") -> List[Dict]:
+        return await self._fetch(
+            "SELECT id, user_msg, assistant_msg, created_at, scene_type, emotion FROM conversations "
+            "WHERE model_channel = ? AND emotion = ? AND created_at >= ? ORDER BY created_at DESC, seq DESC LIMIT ?",
+            channel, emotion, _timestamp(since), limit,
+        )
+
+    # ============ 关键词检索（FTS5） ============
+
+    @staticmethod
+    def _match(conn, table: str, term: str, where: str, params: list, columns: str, limit: int) -> List[Dict]:
+        """子串匹配（等价 ILIKE '%term%'）：>= 3 个字走 FTS5 trigram 索引，否则 LIKE 扫描"""
+        text_columns = ("user_msg", "assistant_msg") if table == "conversations" else ("summary",)
+        if len(term) >= TRIGRAM_MIN_CHARS:
+            sql = (
+                f"SELECT {columns} FROM {table} "
+                f"WHERE seq IN (SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH ?) AND {where} "
+                f"ORDER BY created_at DESC, seq DESC LIMIT ?"
+            )
+            args = [_fts_phrase(term), *params, limit]
+        else:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            like = " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in text_columns)
+            sql = (
+                f"SELECT {columns} FROM {table} WHERE ({like}) AND {where} "
+                f"ORDER BY created_at DESC, seq DESC LIMIT ?"
+            )
+            args = [pattern] * len(text_columns) + [*params, limit]
+        return _rows(conn.execute(sql, args).fetchall())
+
+    async def fulltext_search(self, query_terms: list, scene_type: str, limit: int,
+                              channel: str = "deepseek") -> List[Dict]:
+        scene = scene_type if scene_type and scene_type != "daily" else None
+        where = "model_channel = ?" + (" AND scene_type = ?" if scene else "")
+        params = [channel] + ([scene] if scene else [])
+        columns = "id, user_msg, assistant_msg, created_at, scene_type, topic, emotion, round_number"
+
+        def search(conn):
+            results, seen = [], set()
+            for term in query_terms[:3]:
+                if len(term) < 2:
+                    continue
+                for row in self._match(conn, "conversations", term, where, params, columns, limit):
+                    if row["id"] not in seen:
+                        seen.add(row["id"])
+                        results.append(row)
+            return results[:limit]
+        return await self._run(search)
+
+    async def keyword_search(self, terms: List[str], scene_type: str, limit: int = 15,
+                             channel: str = "deepseek") -> List[Dict]:
+        """混合检索的关键词一路：每个词各取 conversations（limit 条）和 summaries（5 条）候选，
+        和 keyword_search_multi（migrations/007）一样去重后按命中词数、时间排序"""
+        where = "model_channel = ?" + _keyword_scene_clause(scene_type)
+        sources = (
+            ("conversations", "id, user_msg, assistant_msg, created_at, scene_type, topic, emotion, round_number", limit),
+            ("summaries", "id, summary, created_at, scene_type, topic, start_round, end_round", 5),
+        )
+
+        def search(conn):
+            results = []
+            for table, columns, table_limit in sources:
+                hits: Dict[str, Dict] = {}
+                for term in dict.fromkeys(terms[:5]):
+                    if len(term) < 2:
+                        continue
+                    for row in self._match(conn, table, term, where, [channel], columns, table_limit):
+                        hit = hits.setdefault(row["id"], row)
+                        hit["_hits"] = hit.get("_hits", 0) + 1
+                ranked = sorted(hits.values(), key=lambda r: r["created_at"] or "", reverse=True)
+                ranked.sort(key=lambda r: r["_hits"], reverse=True)
+                for row in ranked[:table_limit]:
+                    row["_source"] = table
+                    results.append(row)
+            return results
+        return await self._run(search)
+
+    # ============ summaries ============
+
+    async def save_summary(self, user_id: str, summary: str, start_round: int, end_round: int,
+                           scene_type: str = "daily", channel: str = "deepseek") -> Optional[dict]:
+        record = {
+            "id": str(uuid4()), "user_id": user_id, "summary": summary, "start_round": start_round,
+            "end_round": end_round, "scene_type": scene_type, "model_channel": channel, "topic": None,
+            "created_at": _now(),
+        }
+        await self._execute(
+            f"INSERT INTO summaries ({', '.join(record)}) VALUES ({', '.join('?' * len(record))})",
+            *record.values(),
+        )
+        return record
+
+    async def get_recent_summaries(self, user_id: str, limit: int, channel: str = "deepseek") -> List[Dict]:
+        return await self._fetch(
+            "SELECT summary, start_round, end_round, created_at, scene_type FROM summaries "
+            "WHERE user_id = ? AND model_channel = ? ORDER BY created_at DESC, seq DESC LIMIT ?",
+            user_id, channel, limit,
+        )
+
+    async def get_last_summarized_round(self, user_id: str, channel: str = "deepseek") -> int:
+        row = await self._fetchrow(
+            "SELECT end_round FROM summaries WHERE user_id = ? AND model_channel = ? "
+            "ORDER BY created_at DESC, seq DESC LIMIT 1",
+            user_id, channel,
+        )
+        return row["end_round"] if row else 0
+
+    # ============ 向量 ============
+
+    def _store_embedding(self, conn, table: str, record_id: str, embedding: List[float]) -> int:
+        if table not in self._indexes:
+            raise ValueError(f"Unknown embedding table: {table}")
+        row = conn.execute(f"SELECT model_channel, scene_type FROM {table} WHERE id = ?", (record_id,)).fetchone()
+        if row is None:
+            return 0
+        conn.execute(f"UPDATE {table} SET embedding = ? WHERE id = ?", (_blob(embedding), record_id))
+        self._indexes[table].upsert(record_id, embedding, row["model_channel"], row["scene_type"])
+        return 1
+
+    async def store_embedding(self, table: str, record_id: str, embedding: List[float]):
+        await self._run(self._store_embedding, table, record_id, embedding)
+
+    async def vector_search(self, query_embedding: List[float], table: str, scene_type: Optional[str],
+                            limit: int, channel: str = "deepseek") -> List[Dict]:
+        """与 search_conversations_v2 / search_summaries_v2 返回相同的列（含 similarity）"""
+        index = self._indexes.get(table)
+        if index is None:
+            return []
+        if table == "conversations":
+            columns = "id, user_msg, assistant_msg, created_at, scene_type, topic, emotion, round_number"
+        else:
+            columns = "id, summary, created_at, scene_type, topic, start_round, end_round"
+
+        def search(conn):
+            hits = index.search(query_embedding, limit, channel, scene_type)
+            if not hits:
+                return []
+            ids = [record_id for record_id, _ in hits]
+            rows = {
+                row["id"]: row
+                for row in _rows(conn.execute(
+                    f"SELECT {columns} FROM {table} WHERE id IN ({', '.join('?' * len(ids))})", ids
+                ).fetchall())
+            }
+            results = []
+            for record_id, similarity in hits:
+                if record_id in rows:
+                    rows[record_id]["similarity"] = similarity
+                    results.append(rows[record_id])
+            return results
+        return await self._run(search)
+
+    async def page_embedded_ids(self, table: str, after_id: Optional[str], page_size: int) -> List[str]:
+        if table not in self._indexes:
+            raise ValueError(f"Unknown embedding table: {table}")
+        rows = await self._fetch(
+            f"SELECT id FROM {table} WHERE embedding IS NOT NULL AND (? IS NULL OR id > ?) ORDER BY id LIMIT ?",
+            after_id, after_id, page_size,
+        )
+        return [row["id"] for row in rows]
+
+    async def get_embeddings(self, table: str, ids: List[str]) -> List[Dict]:
+        if table not in self._indexes:
+            raise ValueError(f"Unknown embedding table: {table}")
+        rows = await self._fetch(
+            f"SELECT id, embedding, model_channel, scene_type FROM {table} "
+            f"WHERE embedding IS NOT NULL AND id IN ({', '.join('?' * len(ids))})",
+            *ids,
+        )
+        for row in rows:
+            row["embedding"] = np.frombuffer(row["embedding"], dtype=np.float32).tolist()
+        return rows
+
+    async def get_rows_by_ids(self, table: str, ids: List[str]) -> List[Dict]:
+        if table == "conversations":
+            columns = "id, user_msg, assistant_msg, created_at, scene_type, topic, emotion, round_number"
+        elif table == "summaries":
+            columns = "id, summary, created_at, scene_type, topic, start_round, end_round"
+        else:
+            raise ValueError(f"Unknown table: {table}")
+        return await self._fetch(f"SELECT {columns} FROM {table} WHERE id IN ({', '.join('?' * len(ids))})", *ids)
+
+    # ============ memories ============
+
+    async def touch_memories(self, memory_ids: List[str], hits: List[int]) -> int:
+        now = _now()
+
+        def touch(conn):
+            return sum(
+                conn.execute(
+                    "UPDATE memories SET hits = COALESCE(hits, 0) + ?, last_accessed_at = ? WHERE id = ?",
+                    (delta, now, memory_id),
+                ).rowcount
+                for memory_id, delta in zip(memory_ids, hits)
+            )
+        return await self._transaction(touch)
+
+    async def get_core_memories(self) -> tuple:
+        def fetch(conn):
+            core_base = conn.execute(
+                "SELECT * FROM memories WHERE layer = 'core_base' ORDER BY base_importance DESC"
+            ).fetchall()
+            core_living = conn.execute(
+                "SELECT * FROM memories WHERE layer = 'core_living' ORDER BY last_accessed_at DESC LIMIT 10"
+            ).fetchall()
+            return _rows(core_base), _rows(core_living)
+        return await self._run(fetch)
+
+    # ============ sessions ============
+
+    async def get_session_scene(self, session_id: str) -> Optional[str]:
+        row = await self._fetchrow("SELECT scene_type FROM sessions WHERE id = ?", session_id)
+        return row["scene_type"] if row else None
+
+    async def refresh_session_stats(self, session_id: str):
+        await self._execute(
+            "UPDATE sessions SET message_count = (SELECT COUNT(*) FROM conversations WHERE session_id = ?), "
+            "updated_at = ? WHERE id = ?",
+            session_id, _now(), session_id,
+        )
+
+    async def reconcile_session_counts(self) -> int:
+        return await self._execute(
+            "UPDATE sessions SET message_count = "
+            "(SELECT COUNT(*) FROM conversations c WHERE c.session_id = sessions.id) "
+            "WHERE COALESCE(message_count, -1) != "
+            "(SELECT COUNT(*) FROM conversations c WHERE c.session_id = sessions.id)"
+        )
+
+    # ============ synonym_map ============
+
+    async def load_synonyms(self) -> List[Dict]:
+        rows = await self._fetch("SELECT term, synonyms FROM synonym_map")
+        for row in rows:
+            row["synonyms"] = json.loads(row["synonyms"])
+        return rows
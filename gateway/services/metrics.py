@@ -0,0 +1,214 @@
+"""
+Prometheus 指标 - 轻量自带实现，不引入 prometheus_client
+请求路径上每次观测只做一次字典查找 + 二分定位桶 + 整数自增；
+文本格式（exposition format 0.0.4）只在 /metrics 被抓取时拼接。
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# 默认延迟桶（秒）：覆盖毫秒级的本地阶段到几分钟的长回复
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# 单个指标最多保留多少组标签，超出的归到 _overflow_（模型名由客户端传入，防止基数爆炸）
+MAX_SERIES = 500
+OVERFLOW = "_overflow_"
+
+REQUEST_LABELS = ("model", "backend", "channel")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labelvalues: Tuple, series: Dict) -> Tuple:
+        if labelvalues in series or len(series) < MAX_SERIES:
+            return labelvalues
+        return (OVERFLOW,) * len(self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """只增计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        key = self._key(labelvalues, self._values)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labelvalues, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """固定桶直方图（内部存非累积计数，渲染时再累加）"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [各桶计数..., +Inf 桶计数, sum]
+        self._series: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, *labelvalues):
+        key = self._key(labelvalues, self._series)
+        data = self._series.get(key)
+        if data is None:
+            data = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def time(self, *labelvalues) -> "_Timer":
+        """with metric.time(labels...): 观测代码块耗时"""
+        return _Timer(self, labelvalues)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labelvalues, data in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(data[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("_metric", "_labelvalues", "_started")
+
+    def __init__(self, metric: Histogram, labelvalues: Tuple):
+        self._metric = metric
+        self._labelvalues = labelvalues
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._metric.observe(time.perf_counter() - self._started, *self._labelvalues)
+        return False
+
+
+class GaugeCallback(_Metric):
+    """抓取时才取值的仪表（队列深度、缓存计数等已有统计直接复用，请求路径零开销）"""
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], float], kind: str = "gauge"):
+        super().__init__(name, documentation)
+        self.kind = kind
+        self._func = func
+
+    def render(self) -> List[str]:
+        try:
+            value = self._func()
+        except Exception as e:
+            print(f"[Metrics] Collect {self.name} failed: {e}")
+            return []
+        return self.header() + [f"{self.name} {_format_value(value)}"]
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name: str, documentation: str, func: Callable[[], float],
+                       kind: str = "gauge") -> GaugeCallback:
+        return self._register(GaugeCallback(name, documentation, func, kind))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# ---- 请求阶段耗时（标签：请求模型 / 实际后端 / 记忆通道） ----
+
+SCENE_DETECT_SECONDS = registry.histogram(
+    "gateway_scene_detect_seconds", "Scene detection latency", REQUEST_LABELS,
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+RETRIEVAL_SECONDS = registry.histogram(
+    "gateway_retrieval_seconds", "Auto-inject pre-flight (memory retrieval) latency", REQUEST_LABELS,
+)
+UPSTREAM_TTFB_SECONDS = registry.histogram(
+    "gateway_upstream_ttfb_seconds", "Time to first upstream byte (stream requests)", REQUEST_LABELS,
+)
+UPSTREAM_RESPONSE_SECONDS = registry.histogram(
+    "gateway_upstream_response_seconds", "Full upstream response time (non-stream requests)", REQUEST_LABELS,
+)
+STREAM_DURATION_SECONDS = registry.histogram(
+    "gateway_stream_duration_seconds", "Full upstream stream duration", REQUEST_LABELS,
+)
+STORAGE_SECONDS = registry.histogram(
+    "gateway_storage_seconds", "Time to hand a finished turn to storage", REQUEST_LABELS,
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0),
+)
+STORAGE_FLUSH_SECONDS = registry.histogram(
+    "gateway_storage_flush_seconds", "Batched database write latency for journaled turns",
+)
+
+# ---- 计数器 ----
+
+UPSTREAM_ERRORS = registry.counter(
+    "gateway_upstream_errors_total", "Upstream failures by kind (error / timeout / status)",
+    REQUEST_LABELS + ("kind",),
+)
+PROMPT_TOKENS = registry.counter(
+    "gateway_prompt_tokens_total", "Prompt tokens reported by upstream usage", REQUEST_LABELS,
+)
+PROMPT_CACHED_TOKENS = registry.counter(
+    "gateway_prompt_cached_tokens_total", "Prompt tokens served from the upstream prompt cache", REQUEST_LABELS,
+)
@@ -0,0 +1,725 @@
+"""
+原生异步 Postgres 数据层（asyncpg）
+直接连 Supabase 的 Postgres（settings.supabase_db_url），替代 supabase-py + asyncio.to_thread：
+- 不再占用线程池，也不经过 PostgREST 的 HTTPS 往返
+- 连接池复用连接；热点查询在建连时预先 prepare，之后每次只发 Bind/Execute
+
+方法名与 storage.py 里的 _db_* 同步函数一一对应（去掉 _db_ 前缀），返回值格式也一致：
+uuid / 时间戳转成字符串，和 PostgREST 返回的 JSON 一样，调用方无需改动。
+按 storage_driver 选择仓库见 services/repository.py。
+"""
+
+import asyncio
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from uuid import UUID, uuid4
+
+try:
+    import asyncpg
+except ImportError:  # 未安装时只能用 supabase 驱动
+    asyncpg = None
+
+# Supavisor 事务模式端口：连接在事务间会被换掉，不能用服务端 prepared statement
+TRANSACTION_POOLER_PORT = 6543
+
+# ============ 热点 SQL（建连时预先 prepare） ============
+
+SQL_GET_RECENT = """
+    SELECT user_msg, assistant_msg, created_at, scene_type
+    FROM conversations
+    WHERE user_id = $1 AND model_channel = $2
+    ORDER BY created_at DESC
+    LIMIT $3
+"""
+
+SQL_GET_CURRENT_ROUND = """
+    SELECT round_number
+    FROM conversations
+    WHERE user_id = $1 AND model_channel = $2
+    ORDER BY created_at DESC
+    LIMIT 1
+"""
+
+SQL_INSERT_CONVERSATION = """
+    INSERT INTO conversations
+        (user_id, user_msg, assistant_msg, synced_to_memu, scene_type, model_channel, round_number)
+    VALUES ($1, $2, $3, FALSE, $4, $5, $6)
+    RETURNING *
+"""
+
+SQL_INSERT_WITH_ROUND = "SELECT * FROM insert_conversation_with_round($1, $2, $3, $4, $5)"
+
+SQL_SEARCH_CONVERSATIONS_RPC = "SELECT * FROM search_conversations_v2($1::text::vector, $2, $3, $4)"
+SQL_SEARCH_SUMMARIES_RPC = "SELECT * FROM search_summaries_v2($1::text::vector, $2, $3, $4)"
+# migrations/008 之后多一个 ef_search 参数（HNSW 候选数）
+SQL_SEARCH_CONVERSATIONS_RPC_EF = "SELECT * FROM search_conversations_v2($1::text::vector, $2, $3, $4, $5)"
+SQL_SEARCH_SUMMARIES_RPC_EF = "SELECT * FROM search_summaries_v2($1::text::vector, $2, $3, $4, $5)"
+
+SQL_KEYWORD_SEARCH_MULTI = "SELECT * FROM keyword_search_multi($1, $2, $3, $4, $5)"
+
+HOT_STATEMENTS = (
+    SQL_GET_RECENT,
+    SQL_GET_CURRENT_ROUND,
+    SQL_INSERT_CONVERSATION,
+    SQL_INSERT_WITH_ROUND,
+    SQL_SEARCH_CONVERSATIONS_RPC,
+    SQL_SEARCH_SUMMARIES_RPC,
+    SQL_SEARCH_CONVERSATIONS_RPC_EF,
+    SQL_SEARCH_SUMMARIES_RPC_EF,
+    SQL_KEYWORD_SEARCH_MULTI,
+)
+
+RPC_BY_TABLE = {
+    "conversations": SQL_SEARCH_CONVERSATIONS_RPC,
+    "summaries": SQL_SEARCH_SUMMARIES_RPC,
+}
+RPC_EF_BY_TABLE = {
+    "conversations": SQL_SEARCH_CONVERSATIONS_RPC_EF,
+    "summaries": SQL_SEARCH_SUMMARIES_RPC_EF,
+}
+
+# 批量插入时允许调用方传入的列（防止拼进任意列名）
+CONVERSATION_COLUMNS = (
+    "user_id", "user_msg", "assistant_msg", "synced_to_memu",
+    "scene_type", "model_channel", "round_number", "created_at",
+)
+
+# 导出时的列（不含 embedding，向量单独回填）
+EXPORT_COLUMNS = (
+    "id, user_id, user_msg, assistant_msg, scene_type, model_channel, round_number, "
+    "created_at, topic, emotion, entities, weight, session_id"
+)
+# 建关键词索引时读取的摘要列
+SUMMARY_COLUMNS = "id, summary, created_at, scene_type, topic, start_round, end_round, model_channel"
+
+
+# keyword_search_multi（migrations/007）返回两张表合并的宽行，按来源只保留各自的列
+KEYWORD_HIT_COLUMNS = {
+    "conversations": ("id", "user_msg", "assistant_msg", "created_at", "scene_type", "topic", "emotion", "round_number"),
+    "summaries": ("id", "summary", "created_at", "scene_type", "topic", "start_round", "end_round"),
+}
+
+
+def keyword_scenes(scene_type: Optional[str]) -> Optional[List[str]]:
+    """关键词检索的场景过滤（plot 只查 plot，daily 查 daily + plot，其他不过滤）"""
+    if scene_type == "plot":
+        return ["plot"]
+    if scene_type == "daily":
+        return ["daily", "plot"]
+    return None
+
+
+def keyword_hit_rows(rows: List[Dict]) -> List[Dict]:
+    """keyword_search_multi 的结果 -> 和逐词查询一样的行（带 _source，另加命中词数 _hits）"""
+    results = []
+    for row in rows:
+        source = row["source"]
+        hit = {key: row[key] for key in KEYWORD_HIT_COLUMNS[source]}
+        hit["_source"] = source
+        hit["_hits"] = row["hits"]
+        results.append(hit)
+    return results
+
+
+def _jsonable(value):
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _row(record) -> Dict:
+    """asyncpg Record -> 与 PostgREST 一致的 dict"""
+    return {key: _jsonable(value) for key, value in record.items()}
+
+
+def _rows(records) -> List[Dict]:
+    return [_row(r) for r in records]
+
+
+def _vector_literal(embedding: List[float]) -> str:
+    return f"[{','.join(str(x) for x in embedding)}]"
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    """ISO 时间字符串 -> aware datetime（COPY 的二进制格式不接受字符串）"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class PgRepository:
+    """asyncpg 连接池 + conversations / summaries / memories / sessions / synonym_map 的查询"""
+
+    def __init__(self, dsn: str, min_size: int = 2, max_size: int = 10, ef_search: int = 0):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        # 向量检索的 HNSW 候选数（migrations/008），0 表示用函数默认值
+        self.ef_search = ef_search
+        self._pool = None
+        self._lock = asyncio.Lock()
+        # 走事务模式连接池时关闭语句缓存，也不预先 prepare
+        self.prepared = urlparse(dsn).port != TRANSACTION_POOLER_PORT
+        self._queries = 0
+        # 数据库里还没有 migrations/007 的 keyword_search_multi 时退回逐词查询，只提示一次
+        self._keyword_rpc_missing = False
+        # 同上：还没有 migrations/008 的 5 参数 search_*_v2 时不传 ef_search
+        self._vector_ef_missing = False
+
+    # ---- 生命周期 ----
+
+    async def connect(self):
+        """创建连接池（幂等，并发调用只建一次）"""
+        if self._pool is not None:
+            return
+        async with self._lock:
+            if self._pool is not None:
+                return
+            self._pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                statement_cache_size=100 if self.prepared else 0,
+                init=self._init_connection,
+            )
+            print(f"[PgRepo] Pool ready (size {self.min_size}-{self.max_size}, prepared={self.prepared})")
+
+    async def _init_connection(self, conn):
+        await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+        # pgvector 的 vector 按文本收发（'[0.1,0.2,...]'），和 PostgREST 返回的格式一致
+        # Supabase 把扩展装在 extensions schema 下，先查出实际所在 schema
+        vector_schema = await conn.fetchval(
+            "SELECT n.nspname FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace WHERE t.typname = 'vector'"
+        )
+        if vector_schema:
+            await conn.set_type_codec("vector", encoder=str, decoder=str, schema=vector_schema, format="text")
+        if not self.prepared:
+            return
+        # 预先 prepare 热点语句，进入 asyncpg 的语句缓存，后续同文本查询直接复用
+        for sql in HOT_STATEMENTS:
+            try:
+                await conn.prepare(sql)
+            except asyncpg.PostgresError as e:
+                # RPC 函数可能还没建，不影响其它语句
+                print(f"[PgRepo] Prepare skipped: {e}")
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _fetch(self, sql: str, *args) -> List[Dict]:
+        self._queries += 1
+        return _rows(await self._pool.fetch(sql, *args))
+
+    async def _fetchrow(self, sql: str, *args) -> Optional[Dict]:
+        self._queries += 1
+        record = await self._pool.fetchrow(sql, *args)
+        return _row(record) if record else None
+
+    async def _execute(self, sql: str, *args) -> str:
+        self._queries += 1
+        return await self._pool.execute(sql, *args)
+
+    def get_stats(self) -> dict:
+        """连接池占用"""
+        if self._pool is None:
+            return {"driver": "asyncpg", "connected": False}
+        return {
+            "driver": "asyncpg",
+            "connected": True,
+            "prepared": self.prepared,
+            "pool_size": self._pool.get_size(),
+            "pool_idle": self._pool.get_idle_size(),
+            "pool_max": self.max_size,
+            "queries": self._queries,
+        }
+
+    # ============ conversations ============
+
+    async def insert_conversation(self, user_id: str, user_msg: str, assistant_msg: str, round_number: int = None,
+                                  scene_type: str = "daily", channel: str = "deepseek") -> Optional[dict]:
+        return await self._fetchrow(SQL_INSERT_CONVERSATION, user_id, user_msg, assistant_msg,
+                                    scene_type, channel, round_number)
+
+    async def insert_conversation_with_round(self, user_id: str, user_msg: str, assistant_msg: str,
+                                             scene_type: str = "daily", channel: str = "deepseek") -> Optional[dict]:
+        """插入并原子分配轮数（migrations/002 的数据库函数）"""
+        return await self._fetchrow(SQL_INSERT_WITH_ROUND, user_id, user_msg, assistant_msg, scene_type, channel)
+
+    async def insert_conversations_with_rounds(self, user_id: str, channel: str, rows: List[Dict]) -> List[Dict]:
+        return await self._fetch(
+            "SELECT * FROM insert_conversations_with_rounds($1, $2, $3::jsonb)", user_id, channel, rows
+        )
+
+    async def get_recent(self, user_id: str, limit: int, channel: str = "deepseek") -> List[Dict]:
+        return await self._fetch(SQL_GET_RECENT, user_id, channel, limit)
+
+    async def get_global_recent(self, limit: int) -> List[Dict]:
+        return await self._fetch(
+            """
+            SELECT user_msg, assistant_msg, scene_type, created_at
+            FROM conversations
+            ORDER BY created_at DESC
+            LIMIT $1
+            """,
+            limit,
+        )
+
+    async def get_unsynced(self, limit: int) -> List[Dict]:
+        return await self._fetch(
+            "SELECT * FROM conversations WHERE synced_to_memu = FALSE ORDER BY created_at ASC LIMIT $1",
+            limit,
+        )
+
+    async def mark_synced(self, conversation_id: str) -> bool:
+        await self._execute("UPDATE conversations SET synced_to_memu = TRUE WHERE id = $1", conversation_id)
+        return True
+
+    async def search(self, query: str, user_id: str, limit: int, channel: str = "deepseek") -> List[Dict]:
+        return await self._fetch(
+            """
+            SELECT user_msg, assistant_msg, created_at
+            FROM conversations
+            WHERE user_id = $1 AND model_channel = $2
+              AND (user_msg ILIKE '%' || $3 || '%' OR assistant_msg ILIKE '%' || $3 || '%')
+            ORDER BY created_at DESC
+            LIMIT $4
+            """,
+            user_id, channel, query, limit,
+        )
+
+    async def update_weight(self, conversation_id: str, increment: int) -> bool:
+        # 单条原子自增，不再先读后写
+        status = await self._execute(
+            "UPDATE conversations SET weight = COALESCE(weight, 0) + $2 WHERE id = $1",
+            conversation_id, increment,
+        )
+        return status != "UPDATE 0"
+
+    async def increment_weights(self, conversation_ids: List[str], increments: List[int]) -> int:
+        """批量原子自增权重（一条 UPDATE ... FROM unnest），返回更新的行数"""
+        status = await self._execute(
+            """
+            UPDATE conversations c
+            SET weight = COALESCE(c.weight, 0) + d.delta
+            FROM unnest($1::uuid[], $2::int[]) AS d(id, delta)
+            WHERE c.id = d.id
+            """,
+            conversation_ids, increments,
+        )
+        return int(status.split()[-1])
+
+    async def get_by_id(self, conversation_id: str) -> Optional[Dict]:
+        return await self._fetchrow("SELECT * FROM conversations WHERE id = $1", conversation_id)
+
+    async def get_current_round(self, user_id: str, channel: str = "deepseek") -> int:
+        row = await self._fetchrow(SQL_GET_CURRENT_ROUND, user_id, channel)
+        if row and row.get("round_number"):
+            return row["round_number"]
+        return 0
+
+    async def get_conversations_for_summary(self, user_id: str, start_round: int, end_round: int,
+                                            channel: str = "deepseek") -> List[Dict]:
+        return await self._fetch(
+            """
+            SELECT user_msg, assistant_msg, round_number, created_at, scene_type
+            FROM conversations
+            WHERE user_id = $1 AND model_channel = $2 AND round_number BETWEEN $3 AND $4
+            ORDER BY round_number ASC
+            """,
+            user_id, channel, start_round, end_round,
+        )
+
+    async def insert_conversations_batch(self, rows: List[Dict]) -> List[Dict]:
+        """多行插入（一条 INSERT ... SELECT FROM unnest），按传入顺序返回插入后的行"""
+        if not rows:
+            return []
+        columns = [c for c in CONVERSATION_COLUMNS if c in rows[0]]
+        types = {"synced_to_memu": "bool", "round_number": "int"}
+        arrays = [[row.get(c) for row in rows] for c in columns]
+        unnest = ", ".join(f"${i + 1}::{types.get(c, 'text')}[]" for i, c in enumerate(columns))
+        names = ", ".join(columns)
+        # created_at 以 ISO 字符串传入，缺省取当前时间
+        values = ", ".join("COALESCE(created_at::timestamptz, NOW())" if c == "created_at" else c for c in columns)
+        sql = (
+            f"INSERT INTO conversations ({names}) "
+            f"SELECT {values} FROM unnest({unnest}) WITH ORDINALITY AS t({names}, ord) ORDER BY ord "
+            f"RETURNING *"
+        )
+        return await self._fetch(sql, *arrays)
+
+    async def copy_conversations_with_rounds(self, user_id: str, channel: str, rows: List[Dict]) -> List[Optional[str]]:
+        """批量导入：同一事务里先分配一段连续轮数（migrations/002），再用 COPY 写入
+
+        行里带 id 时沿用（重跑同一批按 id 去重：库里已有的、同一批里重复的都跳过，不占轮数），
+        不带的在客户端生成（COPY 不返回行）。按传入顺序返回 id，跳过的位置为 None。
+        """
+        if not rows:
+            return []
+        ids = [UUID(str(row["id"])) if row.get("id") else uuid4() for row in rows]
+        now = datetime.now(timezone.utc)
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                self._queries += 1
+                seen = {record["id"] for record in await conn.fetch(
+                    "SELECT id FROM conversations WHERE id = ANY($1::uuid[])", ids
+                )}
+                fresh = []
+                for i, conv_id in enumerate(ids):
+                    if conv_id not in seen:
+                        seen.add(conv_id)
+                        fresh.append(i)
+                if not fresh:
+                    return [None] * len(rows)
+                self._queries += 2
+                last = await conn.fetchval(
+                    "SELECT allocate_conversation_rounds($1, $2, $3)", user_id, channel, len(fresh)
+                )
+                first = last - len(fresh) + 1
+                records = [
+                    (
+                        ids[i], user_id, rows[i]["user_msg"], rows[i]["assistant_msg"], False,
+                        rows[i].get("scene_type") or "daily", channel, first + offset,
+                        _parse_timestamp(rows[i].get("created_at")) or now,
+                    )
+                    for offset, i in enumerate(fresh)
+                ]
+                await conn.copy_records_to_table(
+                    "conversations",
+                    records=records,
+                    columns=[
+                        "id", "user_id", "user_msg", "assistant_msg", "synced_to_memu",
+                        "scene_type", "model_channel", "round_number", "created_at",
+                    ],
+                )
+        inserted = set(fresh)
+        return [str(conv_id) if i in inserted else None for i, conv_id in enumerate(ids)]
+
+    async def move_channel(self, user_id: str, from_channel: str, to_channel: str) -> int:
+        """把一个 channel 的对话和摘要整体改到另一个 channel（migrations/009），返回迁移的对话条数"""
+        self._queries += 1
+        return await self._pool.fetchval(
+            "SELECT move_conversation_channel($1, $2, $3)", user_id, from_channel, to_channel
+        )
+
+    async def page_conversations(self, user_id: str, channel: Optional[str], after_created: Optional[str],
+                                 after_id: Optional[str], page_size: int) -> List[Dict]:
+        """按 (created_at, id) 键集分页顺序读取（导出用），after_* 为上一页最后一行"""
+        return await self._fetch(
+            f"""
+            SELECT {EXPORT_COLUMNS}
+            FROM conversations
+            WHERE user_id = $1
+              AND ($2::text IS NULL OR model_channel = $2)
+              AND ($3::timestamptz IS NULL OR (created_at, id) > ($3::timestamptz, $4::uuid))
+            ORDER BY created_at, id
+            LIMIT $5
+            """,
+            user_id, channel, _parse_timestamp(after_created), after_id, page_size,
+        )
+
+    async def page_summaries(self, user_id: str, after_created: Optional[str], after_id: Optional[str],
+                             page_size: int) -> List[Dict]:
+        """摘要按 (created_at, id) 键集分页顺序读取（建关键词索引用）"""
+        return await self._fetch(
+            f"""
+            SELECT {SUMMARY_COLUMNS}
+            FROM summaries
+            WHERE user_id = $1
+              AND ($2::timestamptz IS NULL OR (created_at, id) > ($2::timestamptz, $3::uuid))
+            ORDER BY created_at, id
+            LIMIT $4
+            """,
+            user_id, _parse_timestamp(after_created), after_id, page_size,
+        )
+
+    async def get_missing_embeddings(self, channel: Optional[str], limit: int) -> List[Dict]:
+        return await self._fetch(
+            """
+            SELECT id, user_msg, assistant_msg, model_channel, scene_type
+            FROM conversations
+            WHERE embedding IS NULL AND ($1::text IS NULL OR model_channel = $1)
+            ORDER BY created_at
+            LIMIT $2
+            """,
+            channel, limit,
+        )
+
+    async def store_embeddings(self, conversation_ids: List[str], embeddings: List[List[float]]) -> int:
+        """一条 UPDATE 写一批向量"""
+        status = await self._execute(
+            """
+            UPDATE conversations c
+            SET embedding = d.embedding::vector
+            FROM unnest($1::uuid[], $2::text[]) AS d(id, embedding)
+            WHERE c.id = d.id
+            """,
+            conversation_ids, [_vector_literal(e) for e in embeddings],
+        )
+        return int(status.split()[-1])
+
+    async def update_metadata(self, conversation_id: str, topic: str, entities: list, emotion: str) -> bool:
+        if not (topic or entities or emotion):
+            return False
+        # 传 NULL 的字段保持原值，和只 update 非空字段等价
+        await self._execute(
+            """
+            UPDATE conversations
+            SET topic = COALESCE($2, topic),
+                entities = COALESCE($3::text[], entities),
+                emotion = COALESCE($4, emotion)
+            WHERE id = $1
+            """,
+            conversation_id, topic or None, entities or None, emotion or None,
+        )
+        return True
+
+    async def fulltext_search(self, query_terms: list, scene_type: str, limit: int,
+                              channel: str = "deepseek") -> List[Dict]:
+        scene = scene_type if scene_type and scene_type != "daily" else None
+        if not self._keyword_rpc_missing:
+            try:
+                return keyword_hit_rows(await self._fetch(
+                    SQL_KEYWORD_SEARCH_MULTI, query_terms[:3], channel, [scene] if scene else None, limit, 0,
+                ))
+            except asyncpg.UndefinedFunctionError as e:
+                self._keyword_rpc_missing = True
+                print(f"[PgRepo] keyword_search_multi missing (run migrations/007), searching term by term: {e}")
+        results = []
+        async with self._pool.acquire() as conn:
+            for term in query_terms[:3]:
+                if len(term) < 2:
+                    continue
+                self._queries += 1
+                records = await conn.fetch(
+                    """
+                    SELECT id, user_msg, assistant_msg, created_at, scene_type, topic, emotion, round_number
+                    FROM conversations
+                    WHERE model_channel = $1
+                      AND (user_msg ILIKE '%' || $2 || '%' OR assistant_msg ILIKE '%' || $2 || '%')
+                      AND ($3::text IS NULL OR scene_type = $3)
+                    ORDER BY created_at DESC
+                    LIMIT $4
+                    """,
+                    channel, term, scene, limit,
+                )
+                results.extend(_rows(records))
+        seen = set()
+        deduped = []
+        for r in results:
+            if r["id"] not in seen:
+                seen.add(r["id"])
+                deduped.append(r)
+        return deduped[:limit]
+
+    async def keyword_search(self, terms: List[str], scene_type: str, limit: int = 15,
+                             channel: str = "deepseek") -> List[Dict]:
+        """混合检索的关键词一路：keyword_search_multi 一次查完全部词（去重、按命中词数排序），
+        conversations 取 limit 条、summaries 取 5 条；没有 migrations/007 时逐词查询"""
+        scenes = keyword_scenes(scene_type)
+        if not self._keyword_rpc_missing:
+            try:
+                return keyword_hit_rows(await self._fetch(SQL_KEYWORD_SEARCH_MULTI, terms, channel, scenes, limit, 5))
+            except asyncpg.UndefinedFunctionError as e:
+                self._keyword_rpc_missing = True
+                print(f"[PgRepo] keyword_search_multi missing (run migrations/007), searching term by term: {e}")
+        results = []
+        async with self._pool.acquire() as conn:
+            for term in terms[:5]:
+                if len(term) < 2:
+                    continue
+                self._queries += 2
+                conversations = await conn.fetch(
+                    """
+                    SELECT id, user_msg, assistant_msg, created_at, scene_type, topic, emotion, round_number
+                    FROM conversations
+                    WHERE model_channel = $1
+                      AND (user_msg ILIKE '%' || $2 || '%' OR assistant_msg ILIKE '%' || $2 || '%')
+                      AND ($3::text[] IS NULL OR scene_type = ANY($3))
+                    ORDER BY created_at DESC
+                    LIMIT $4
+                    """,
+                    channel, term, scenes, limit,
+                )
+                summaries = await conn.fetch(
+                    """
+                    SELECT id, summary, created_at, scene_type, topic, start_round, end_round
+                    FROM summaries
+                    WHERE model_channel = $1
+                      AND summary ILIKE '%' || $2 || '%'
+                      AND ($3::text[] IS NULL OR scene_type = ANY($3))
+                    ORDER BY created_at DESC
+                    LIMIT 5
+                    """,
+                    channel, term, scenes,
+                )
+                for row in _rows(conversations):
+                    row["_source"] = "conversations"
+                    results.append(row)
+                for row in _rows(summaries):
+                    row["_source"] = "summaries"
+                    results.append(row)
+        return results
+
+    async def get_recent_by_emotion(self, emotion: str, since: str, limit: int,
+                                    channel: str = "deepseek") -> List[Dict]:
+        return await self._fetch(
+            """
+            SELECT id, user_msg, assistant_msg, created_at, scene_type, emotion
+            FROM conversations
+            WHERE model_channel = $1 AND emotion = $2 AND created_at >= $3
+            ORDER BY created_at DESC
+            LIMIT $4
+            """,
+            channel, emotion, _parse_timestamp(since), limit,
+        )
+
+    # ============ summaries ============
+
+    async def save_summary(self, user_id: str, summary: str, start_round: int, end_round: int,
+                           scene_type: str = "daily", channel: str = "deepseek") -> Optional[dict]:
+        return await self._fetchrow(
+            """
+            INSERT INTO summaries (user_id, summary, start_round, end_round, scene_type, model_channel)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            RETURNING *
+            """,
+            user_id, summary, start_round, end_round, scene_type, channel,
+        )
+
+    async def get_recent_summaries(self, user_id: str, limit: int, channel: str = "deepseek") -> List[Dict]:
+        return await self._fetch(
+            """
+            SELECT summary, start_round, end_round, created_at, scene_type
+            FROM summaries
+            WHERE user_id = $1 AND model_channel = $2
+            ORDER BY created_at DESC
+            LIMIT $3
+            """,
+            user_id, channel, limit,
+        )
+
+    async def get_last_summarized_round(self, user_id: str, channel: str = "deepseek") -> int:
+        row = await self._fetchrow(
+            "SELECT end_round FROM summaries WHERE user_id = $1 AND model_channel = $2 ORDER BY created_at DESC LIMIT 1",
+            user_id, channel,
+        )
+        return row["end_round"] if row else 0
+
+    # ============ 向量（pgvector RPC） ============
+
+    async def store_embedding(self, table: str, record_id: str, embedding: List[float]):
+        if table not in RPC_BY_TABLE:
+            raise ValueError(f"Unknown embedding table: {table}")
+        await self._execute(
+            f"UPDATE {table} SET embedding = $2::text::vector WHERE id = $1",
+            record_id, _vector_literal(embedding),
+        )
+
+    async def vector_search(self, query_embedding: List[float], table: str, scene_type: Optional[str],
+                            limit: int, channel: str = "deepseek") -> List[Dict]:
+        sql = RPC_BY_TABLE.get(table)
+        if sql is None:
+            return []
+        embedding = _vector_literal(query_embedding)
+        if self.ef_search and not self._vector_ef_missing:
+            try:
+                return await self._fetch(RPC_EF_BY_TABLE[table], embedding, limit, scene_type, channel, self.ef_search)
+            except asyncpg.UndefinedFunctionError as e:
+                self._vector_ef_missing = True
+                print(f"[PgRepo] search_*_v2 has no ef_search parameter (run migrations/008), using defaults: {e}")
+        return await self._fetch(sql, embedding, limit, scene_type, channel)
+
+    async def page_embedded_ids(self, table: str, after_id: Optional[str], page_size: int) -> List[str]:
+        if table not in RPC_BY_TABLE:
+            raise ValueError(f"Unknown embedding table: {table}")
+        rows = await self._fetch(
+            f"""
+            SELECT id FROM {table}
+            WHERE embedding IS NOT NULL AND ($1::uuid IS NULL OR id > $1::uuid)
+            ORDER BY id
+            LIMIT $2
+            """,
+            after_id, page_size,
+        )
+        return [row["id"] for row in rows]
+
+    async def get_embeddings(self, table: str, ids: List[str]) -> List[Dict]:
+        if table not in RPC_BY_TABLE:
+            raise ValueError(f"Unknown embedding table: {table}")
+        return await self._fetch(
+            f"SELECT id, embedding::text AS embedding, model_channel, scene_type FROM {table} "
+            "WHERE id = ANY($1::uuid[]) AND embedding IS NOT NULL",
+            ids,
+        )
+
+    async def get_rows_by_ids(self, table: str, ids: List[str]) -> List[Dict]:
+        columns = KEYWORD_HIT_COLUMNS.get(table)
+        if columns is None:
+            raise ValueError(f"Unknown table: {table}")
+        return await self._fetch(f"SELECT {', '.join(columns)} FROM {table} WHERE id = ANY($1::uuid[])", ids)
+
+    # ============ memories ============
+
+    async def touch_memories(self, memory_ids: List[str], hits: List[int]) -> int:
+        """批量 hits + delta 并刷新访问时间，返回更新的行数"""
+        status = await self._execute(
+            """
+            UPDATE memories m
+            SET hits = COALESCE(m.hits, 0) + d.delta, last_accessed_at = NOW()
+            FROM unnest($1::uuid[], $2::int[]) AS d(id, delta)
+            WHERE m.id = d.id
+            """,
+            memory_ids, hits,
+        )
+        return int(status.split()[-1])
+
+    async def get_core_memories(self) -> tuple:
+        async with self._pool.acquire() as conn:
+            self._queries += 2
+            core_base = await conn.fetch(
+                "SELECT * FROM memories WHERE layer = 'core_base' ORDER BY base_importance DESC"
+            )
+            core_living = await conn.fetch(
+                "SELECT * FROM memories WHERE layer = 'core_living' ORDER BY last_accessed_at DESC LIMIT 10"
+            )
+        return _rows(core_base), _rows(core_living)
+
+    # ============ sessions ============
+
+    async def get_session_scene(self, session_id: str) -> Optional[str]:
+        row = await self._fetchrow("SELECT scene_type FROM sessions WHERE id = $1", session_id)
+        return row["scene_type"] if row else None
+
+    async def refresh_session_stats(self, session_id: str):
+        """一条语句重算消息数并更新时间戳"""
+        await self._execute(
+            """
+            UPDATE sessions
+            SET message_count = (SELECT COUNT(*) FROM conversations WHERE session_id = $1),
+                updated_at = NOW()
+            WHERE id = $1
+            """,
+            session_id,
+        )
+
+    async def reconcile_session_counts(self) -> int:
+        """校正触发器漂移的 message_count（migrations/006），返回校正的会话数"""
+        row = await self._fetchrow("SELECT reconcile_session_counts() AS fixed")
+        return row["fixed"] if row else 0
+
+    # ============ synonym_map ============
+
+    async def load_synonyms(self) -> List[Dict]:
+        return await self._fetch("SELECT term, synonyms FROM synonym_map")
@@ -1,23 +1,55 @@
 """
 pgvector 向量服务 - 替代 ChromaDB
 使用 Supabase 内置的 pgvector 扩展进行向量存储和搜索
+检索优先查本机向量镜像（services/vector_mirror.py），写入时同步更新
 """
 
 import httpx
 import asyncio
-from typing import List, Optional, Dict
+import fcntl
+import json
+import os
+from datetime import datetime
+from typing import List, Optional, Dict, Tuple
 import sys
 
 sys.path.insert(0, '/home/dream/memory-system/gateway')
 from config import get_settings
+from services.repository import get_repository
+from services.embedding_cache import EmbeddingCache, make_embedding_key, normalize_text
+from services.storage import get_embeddings, get_rows_by_ids, is_missing_function, keyword_index, page_embedded_ids
+from services.vector_mirror import TABLES, VectorMirror
 
 settings = get_settings()
 
+EMBEDDING_MODEL = "BAAI/bge-large-zh-v1.5"
+# BAAI/bge-large-zh-v1.5 的向量维度
+EMBEDDING_DIM = 1024
 
-async def generate_embedding(text: str) -> Optional[List[float]]:
-    """调用硅基流动 BAAI/bge-large-zh-v1.5 生成1024维向量"""
+# 按 (模型, 规范化文本) 缓存向量（见 services/embedding_cache.py）：检索查询进内存 LRU + 磁盘，
+# 入库文本（"用户: …\n助手: …" 这种不会和查询重合）只进磁盘，重跑回填 / 导入时复用
+embedding_cache = EmbeddingCache(
+    settings.embedding_cache_path or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "embedding_cache.db"),
+    settings.embedding_cache_size,
+    settings.embedding_cache_disk_entries,
+    settings.embedding_cache_enabled,
+)
+
+# 数据库里还没有 migrations/008 的 ef_search 参数时不再传，只提示一次
+_vector_ef_missing = False
+
+
+async def generate_embedding(text: str, remember: bool = True) -> Optional[List[float]]:
+    """调用硅基流动 BAAI/bge-large-zh-v1.5 生成1024维向量（先查向量缓存，相同文本不重复请求）
+    remember=False：入库文本，向量只写缓存的磁盘层"""
     if not text or not text.strip():
         return None
+    text = normalize_text(text)
+    key = make_embedding_key(EMBEDDING_MODEL, text)
+    cached = await embedding_cache.get(key, remember)
+    if cached is not None:
+        return cached
     try:
         async with httpx.AsyncClient(timeout=30.0) as client:
             response = await client.post(
@@ -27,13 +59,15 @@ async def generate_embedding(text: str) -> Optional[List[float]]:
                     "Authorization": f"Bearer {settings.siliconflow_api_key}"
                 },
                 json={
-                    "model": "BAAI/bge-large-zh-v1.5",
-                    "input": text[:2000]  # 截断过长文本
+                    "model": EMBEDDING_MODEL,
+                    "input": text  # normalize_text 已截断过长文本
                 }
             )
             if response.status_code == 200:
                 data = response.json()
-                return data["data"][0]["embedding"]
+                embedding = data["data"][0]["embedding"]
+                await embedding_cache.put(key, embedding, remember)
+                return embedding
             else:
                 print(f"[pgvector] Embedding API error: {response.status_code} - {response.text[:200]}")
                 return None
@@ -42,37 +76,85 @@ async def generate_embedding(text: str) -> Optional[List[float]]:
         return None
 
 
-async def store_embedding(table: str, record_id: str, embedding: List[float]):
-    """将embedding写入指定表的embedding列"""
+async def generate_embeddings(texts: List[str]) -> List[Optional[List[float]]]:
+    """一次请求生成一批向量（批量导入/回填用），按输入顺序返回；空文本对应 None，整批失败抛异常
+    缓存里已有的不再请求，批内重复的文本只请求一次；新向量只写缓存的磁盘层"""
+    results: List[Optional[List[float]]] = [None] * len(texts)
+    keys: Dict[int, str] = {}
+    pending: Dict[str, str] = {}
+    for i, text in enumerate(texts):
+        if text and text.strip():
+            normalized = normalize_text(text)
+            keys[i] = make_embedding_key(EMBEDDING_MODEL, normalized)
+            pending[keys[i]] = normalized
+    if not keys:
+        return results
+    vectors = await embedding_cache.get_many(list(pending), remember=False)
+    missing = [key for key in pending if key not in vectors]
+    if missing:
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            response = await client.post(
+                "https://api.siliconflow.cn/v1/embeddings",
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {settings.siliconflow_api_key}"
+                },
+                json={
+                    "model": EMBEDDING_MODEL,
+                    "input": [pending[key] for key in missing]
+                }
+            )
+        if response.status_code != 200:
+            raise RuntimeError(f"Embedding API error: {response.status_code} - {response.text[:200]}")
+        fetched = {missing[item["index"]]: item["embedding"] for item in response.json()["data"]}
+        await embedding_cache.put_many(fetched, remember=False)
+        vectors.update(fetched)
+    for i, key in keys.items():
+        results[i] = vectors.get(key)
+    return results
+
+
+async def store_embedding(table: str, record_id: str, embedding: List[float],
+                          channel: Optional[str] = None, scene_type: Optional[str] = None):
+    """将embedding写入指定表的embedding列；带上 channel / scene_type 时同步写进本机向量镜像"""
     try:
-        from supabase import create_client
-        supabase = create_client(settings.supabase_url, settings.supabase_key)
+        repo = await get_repository()
+        if repo is not None:
+            await repo.store_embedding(table, record_id, embedding)
+        else:
+            from supabase import create_client
+            supabase = create_client(settings.supabase_url, settings.supabase_key)
 
-        # pgvector 需要以字符串形式传入：'[0.1, 0.2, ...]'
-        embedding_str = f"[{','.join(str(x) for x in embedding)}]"
+            # pgvector 需要以字符串形式传入：'[0.1, 0.2, ...]'
+            embedding_str = f"[{','.join(str(x) for x in embedding)}]"
 
-        def _update():
-            supabase.table(table).update({
-                "embedding": embedding_str
-            }).eq("id", record_id).execute()
+            def _update():
+                supabase.table(table).update({
+                    "embedding": embedding_str
+                }).eq("id", record_id).execute()
 
-        await asyncio.to_thread(_update)
+            await asyncio.to_thread(_update)
         print(f"[pgvector] Stored embedding for {table}/{record_id[:8]}...")
     except Exception as e:
         print(f"[pgvector] Store error: {e}")
+        return
+
+    await mirror_embeddings(table, [(record_id, embedding, channel, scene_type)])
 
 
 async def store_conversation_embedding(
     conversation_id: str,
     user_msg: str,
     assistant_msg: str,
-    user_id: str = "dream"
+    user_id: str = "dream",
+    channel: Optional[str] = None,
+    scene_type: Optional[str] = None
 ):
     """将对话向量化并存入pgvector（替代ChromaDB版本）"""
     text = f"用户: {user_msg}\n助手: {assistant_msg}"
-    embedding = await generate_embedding(text)
+    embedding = await generate_embedding(text, remember=False)
     if embedding:
-        await store_embedding("conversations", conversation_id, embedding)
+        await store_embedding("conversations", conversation_id, embedding, channel, scene_type)
 
 
 async def store_summary_embedding(
@@ -80,74 +162,138 @@ async def store_summary_embedding(
     summary_text: str,
     start_round: int,
     end_round: int,
-    user_id: str = "dream"
+    user_id: str = "dream",
+    channel: Optional[str] = None,
+    scene_type: Optional[str] = None
 ) -> bool:
     """将摘要向量化并存入pgvector"""
-    embedding = await generate_embedding(summary_text)
+    embedding = await generate_embedding(summary_text, remember=False)
     if embedding:
-        await store_embedding("summaries", summary_id, embedding)
+        await store_embedding("summaries", summary_id, embedding, channel, scene_type)
         return True
     return False
 
 
-async def search_similar(
-    query_embedding: List[float],
-    table: str,
-    scene_type: Optional[str] = None,
-    limit: int = 10,
-    channel: str = "deepseek"
-) -> List[Dict]:
-    """
-    在指定表中执行向量搜索，支持scene_type和channel过滤
-    使用Supabase RPC调用pgvector的余弦距离搜索
+# ============ 本机向量镜像（见 services/vector_mirror.py） ============
+
+# local 驱动本身就在进程内检索向量，不需要镜像
+vector_mirror = VectorMirror(
+    settings.vector_mirror_dir or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "vector_mirror"),
+    EMBEDDING_DIM,
+    settings.vector_mirror_enabled and settings.storage_driver != "local",
+)
+
+
+async def mirror_embeddings(table: str, items: List[Tuple[str, List[float], Optional[str], Optional[str]]]):
+    """向量写库之后同步写进本机向量镜像 [(id, 向量, model_channel, scene_type)]
+
+    所有写向量的路径（实时对话、摘要、批量导入、回填）都走这里：镜像同步过一次之后只有这里和
+    每天的 sync_vector_mirror 会往里补，漏写的行要等到第二天才召回得到。
+    channel 未知的行按 id 回库取一次（带库里的向量和过滤列，和 sync_vector_mirror 补行一样）
     """
+    if not vector_mirror.enabled or not items:
+        return
     try:
-        from supabase import create_client
-        supabase = create_client(settings.supabase_url, settings.supabase_key)
+        known = [item for item in items if item[2]]
+        unknown = [str(item[0]) for item in items if not item[2]]
+        if unknown:
+            known.extend(
+                (row["id"], _parse_vector(row["embedding"]), row.get("model_channel"), row.get("scene_type"))
+                for row in await get_embeddings(table, unknown)
+            )
+        if known:
+            await asyncio.to_thread(_mirror_upsert, table, known)
+    except Exception as e:
+        print(f"[VectorMirror] Upsert error for {len(items)} {table} rows (left for the daily sync): {e}")
 
-        embedding_str = f"[{','.join(str(x) for x in query_embedding)}]"
 
-        if table == "conversations":
-            def _search():
-                query = supabase.table("conversations") \
-                    .select("id, user_msg, assistant_msg, created_at, scene_type, topic, emotion, round_number") \
-                    .eq("model_channel", channel)
-
-                if scene_type:
-                    if scene_type == "daily":
-                        query = query.in_("scene_type", ["daily", "plot"])
-                    else:
-                        query = query.eq("scene_type", scene_type)
-
-                query = query.not_.is_("embedding", "null")
-                result = query.order("created_at", desc=True).limit(limit * 3).execute()
-                return result.data if result.data else []
-
-        elif table == "summaries":
-            def _search():
-                query = supabase.table("summaries") \
-                    .select("id, summary, created_at, scene_type, topic, start_round, end_round") \
-                    .eq("model_channel", channel)
-
-                if scene_type:
-                    if scene_type == "daily":
-                        query = query.in_("scene_type", ["daily", "plot"])
-                    else:
-                        query = query.eq("scene_type", scene_type)
-
-                query = query.not_.is_("embedding", "null")
-                result = query.order("created_at", desc=True).limit(limit * 3).execute()
-                return result.data if result.data else []
-        else:
-            return []
+def _mirror_upsert(table: str, items: list) -> int:
+    # 命令行进程（导入 / 回填）第一次用到时打开，目录和 gateway 共享
+    vector_mirror.open()
+    return vector_mirror.upsert(table, items)
+
+
+def _parse_vector(value) -> List[float]:
+    """PostgREST / embedding::text 返回 '[0.1,...]' 字符串，local 驱动返回列表"""
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _sync_lock(path: str):
+    """多个 worker 同时启动时只让一个去同步（非阻塞文件锁，拿不到返回 None）"""
+    handle = open(path, "w")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
 
-        candidates = await asyncio.to_thread(_search)
 
-        return candidates[:limit]
+async def sync_vector_mirror(page_size: int = 1000, batch_size: int = 200):
+    """按库里有向量的 id 补齐镜像：缺的行取向量写入，库里已不存在的打墓碑（启动时后台执行 + 每天一次）
 
+    镜像文件跨重启保留，平时只有上次同步后别的进程写入的少量行需要补，不会把整表向量再拉一遍
+    """
+    if not vector_mirror.enabled:
+        return
+    started = datetime.now()
+    try:
+        await asyncio.to_thread(vector_mirror.open)
+        lock = _sync_lock(os.path.join(vector_mirror.directory, "sync.lock"))
+        if lock is None:
+            print("[VectorMirror] Another worker is syncing, skipped")
+            return
+        try:
+            added = removed = 0
+            for table in TABLES:
+                known = await asyncio.to_thread(vector_mirror.ids, table)
+                seen, missing = set(), []
+                after_id = None
+                while True:
+                    page = await page_embedded_ids(table, after_id, page_size)
+                    seen.update(page)
+                    missing.extend(record_id for record_id in page if record_id not in known)
+                    if len(page) < page_size:
+                        break
+                    after_id = page[-1]
+                for offset in range(0, len(missing), batch_size):
+                    rows = await get_embeddings(table, missing[offset:offset + batch_size])
+                    added += await asyncio.to_thread(vector_mirror.upsert, table, [
+                        (row["id"], _parse_vector(row["embedding"]), row.get("model_channel"), row.get("scene_type"))
+                        for row in rows
+                    ])
+                removed += await asyncio.to_thread(vector_mirror.remove, table, known - seen)
+            await asyncio.to_thread(vector_mirror.mark_synced)
+        finally:
+            lock.close()
     except Exception as e:
-        print(f"[pgvector] Search error in {table}: {e}")
+        print(f"[VectorMirror] Sync failed, vector search stays on the database: {e}")
+        return
+    stats = vector_mirror.get_stats()
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"[VectorMirror] Synced in {elapsed:.1f}s: +{added} / -{removed} "
+          f"({stats['conversations']['vectors']} conversation / {stats['summaries']['vectors']} summary vectors)")
+
+
+async def _mirror_search(
+    query_embedding: List[float],
+    table: str,
+    scene_type: Optional[str],
+    limit: int,
+    channel: str
+) -> List[Dict]:
+    """镜像里算出 top-k id，再补全正文：先查关键词索引里已有的行，没有的按主键回库取一次"""
+    hits = await asyncio.to_thread(vector_mirror.search, table, query_embedding, limit, channel, scene_type)
+    if not hits:
         return []
+    ids = [record_id for record_id, _ in hits]
+    rows = keyword_index.get_rows(table, ids)
+    missing = [record_id for record_id in ids if record_id not in rows]
+    if missing:
+        rows.update({row["id"]: row for row in await get_rows_by_ids(table, missing)})
+    # 库里已删除的行（镜像还没同步到）直接跳过
+    return [{**rows[record_id], "similarity": similarity} for record_id, similarity in hits if record_id in rows]
 
 
 async def vector_search_rpc(
@@ -160,20 +306,29 @@ async def vector_search_rpc(
     """
     使用Supabase PostgREST RPC调用pgvector搜索
     需要在Supabase中创建对应的函数
-    如果RPC不可用，降级为普通查询
+    storage_driver=asyncpg 时直接在 Postgres 里调用同名函数（prepared statement），
+    local 时查本机内存向量索引（语义相同）
+    本机向量镜像同步过之后优先查镜像（几毫秒，不走网络）；镜像出错时回到数据库，
+    数据库也失败时返回空列表（以前降级为"最新 N 条"，和查询毫无关系，反而会挤掉关键词命中）
     """
+    if table not in TABLES:
+        return []
+    if vector_mirror.ready:
+        try:
+            return await _mirror_search(query_embedding, table, scene_type, limit, channel)
+        except Exception as e:
+            print(f"[VectorMirror] Search failed in {table}, using the database: {e}")
+
     try:
+        repo = await get_repository()
+        if repo is not None:
+            return await repo.vector_search(query_embedding, table, scene_type, limit, channel)
+
         from supabase import create_client
         supabase = create_client(settings.supabase_url, settings.supabase_key)
 
         embedding_str = f"[{','.join(str(x) for x in query_embedding)}]"
-
-        if table == "conversations":
-            func_name = "search_conversations_v2"
-        elif table == "summaries":
-            func_name = "search_summaries_v2"
-        else:
-            return []
+        func_name = "search_conversations_v2" if table == "conversations" else "search_summaries_v2"
 
         params = {
             "query_embedding": embedding_str,
@@ -182,14 +337,23 @@ async def vector_search_rpc(
             "filter_channel": channel
         }
 
-        def _rpc():
+        def _rpc(params):
             result = supabase.rpc(func_name, params).execute()
             return result.data if result.data else []
 
-        results = await asyncio.to_thread(_rpc)
+        global _vector_ef_missing
+        if settings.vector_ef_search and not _vector_ef_missing:
+            try:
+                return await asyncio.to_thread(_rpc, {**params, "ef_search": settings.vector_ef_search})
+            except Exception as e:
+                if not is_missing_function(e):
+                    raise
+                _vector_ef_missing = True
+                print(f"[pgvector] {func_name} has no ef_search parameter (run migrations/008), using defaults: {e}")
+
+        results = await asyncio.to_thread(_rpc, params)
         return results
 
     except Exception as e:
-        # RPC不可用时降级
-        print(f"[pgvector] RPC search failed, falling back: {e}")
-        return await search_similar(query_embedding, table, scene_type, limit, channel)
+        print(f"[pgvector] Vector search failed in {table}, no vector hits this round: {e}")
+        return []
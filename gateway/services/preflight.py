@@ -0,0 +1,129 @@
+"""
+预检流水线 - 转发前的记忆检索限时执行
+检索与上游连接预热并行；检索超过该后端/别名的延迟预算时，不等它，直接转发（不带注入），
+迟到的结果缓存起来留给同一通道的下一轮使用。每个请求记录走了哪条路径。
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+# 迟到的检索结果保留多久（秒），过期不再注入
+LATE_RESULT_TTL = 300
+
+# 路径名
+PATH_SKIP = "skip"              # 未触发检索规则（或 meta 场景）
+PATH_INJECTED = "injected"      # 预算内拿到结果并注入
+PATH_EMPTY = "empty"            # 预算内完成但没有可注入内容
+PATH_DEADLINE = "deadline_miss" # 超出预算，未注入，结果迟到后缓存
+PATH_LATE_CACHE = "late_cache"  # 注入了上一轮迟到的缓存结果
+PATH_ERROR = "error"            # 检索异常
+PATHS = (PATH_SKIP, PATH_INJECTED, PATH_EMPTY, PATH_DEADLINE, PATH_LATE_CACHE, PATH_ERROR)
+
+
+class PreflightPipeline:
+    """转发前的限时记忆注入"""
+
+    def __init__(self, auto_inject, default_budget: float = 1.5, budgets: Optional[Dict[str, float]] = None):
+        self._auto_inject = auto_inject
+        self.default_budget = default_budget
+        # 别名或后端名（小写） -> 预算秒数
+        self._budgets = {k.lower(): v for k, v in (budgets or {}).items()}
+        # "{user_id}_{channel}" -> (记忆文本, 时间戳)
+        self._late_results: Dict[str, Tuple[str, float]] = {}
+        self._path_counts: Dict[str, int] = {p: 0 for p in PATHS}
+        self._retrieval_ms_total = 0.0
+        self._retrieval_count = 0
+
+    def get_budget(self, requested_model: str, backend_name: str = "") -> float:
+        """按 请求别名 > 后端名 > 默认值 查找预算"""
+        for key in (requested_model.lower(), backend_name.lower()):
+            if key and key in self._budgets:
+                return self._budgets[key]
+        return self.default_budget
+
+    async def run(
+        self,
+        user_msg: str,
+        scene_type: str,
+        messages: List[Dict],
+        budget: float,
+        user_id: str = "dream",
+        channel: str = "deepseek",
+    ) -> Tuple[List[Dict], str]:
+        """执行限时检索，返回 (可能注入过的 messages, 路径名)"""
+        late_key = f"{user_id}_{channel}"
+        started = time.perf_counter()
+        task = asyncio.create_task(
+            self._auto_inject.retrieve(user_msg, scene_type, user_id, channel)
+        )
+        done, _ = await asyncio.wait({task}, timeout=budget)
+
+        if not done:
+            # 超预算：不等了，迟到结果进缓存
+            task.add_done_callback(lambda t: self._on_late_result(t, late_key, started))
+            path = PATH_DEADLINE
+            memory_text = None
+        else:
+            self._record_retrieval(started)
+            try:
+                rule, memory_text = task.result()
+                if memory_text:
+                    path = PATH_INJECTED
+                elif rule in ("default", "meta"):
+                    path = PATH_SKIP
+                else:
+                    path = PATH_EMPTY
+            except Exception as e:
+                print(f"[Preflight] Retrieval error: {e}")
+                path = PATH_ERROR
+                memory_text = None
+
+        if not memory_text and scene_type != "meta":
+            cached = self._pop_late_result(late_key)
+            if cached:
+                memory_text = cached
+                path = PATH_LATE_CACHE
+
+        if memory_text:
+            messages = self._auto_inject.inject(messages, memory_text)
+
+        self._path_counts[path] += 1
+        return messages, path
+
+    def _on_late_result(self, task: asyncio.Task, late_key: str, started: float):
+        """迟到的检索完成回调：有结果就缓存给下一轮"""
+        if task.cancelled():
+            return
+        self._record_retrieval(started)
+        try:
+            _, memory_text = task.result()
+        except Exception as e:
+            print(f"[Preflight] Late retrieval error: {e}")
+            return
+        if memory_text:
+            self._late_results[late_key] = (memory_text, time.time())
+            print(f"[Preflight] Late result cached for {late_key} ({len(memory_text)} chars)")
+
+    def _pop_late_result(self, late_key: str) -> Optional[str]:
+        cached = self._late_results.pop(late_key, None)
+        if not cached:
+            return None
+        memory_text, ts = cached
+        if time.time() - ts > LATE_RESULT_TTL:
+            return None
+        return memory_text
+
+    def _record_retrieval(self, started: float):
+        self._retrieval_ms_total += (time.perf_counter() - started) * 1000
+        self._retrieval_count += 1
+
+    def get_stats(self) -> dict:
+        """各路径计数与平均检索耗时"""
+        avg = self._retrieval_ms_total / self._retrieval_count if self._retrieval_count else 0.0
+        return {
+            "default_budget": self.default_budget,
+            "paths": dict(self._path_counts),
+            "avg_retrieval_ms": round(avg, 1),
+            "late_results_pending": len(self._late_results),
+        }
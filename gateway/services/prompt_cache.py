@@ -0,0 +1,128 @@
+"""
+上游 prompt caching 适配
+- 记忆块以独立的尾部消息注入（见 AutoInject trailing 模式），system prompt 和历史消息逐字节不变
+- 支持 cache_control 的后端（Claude via OpenRouter / DZZI）在稳定前缀末尾打断点
+- 从上游 usage 里读取命中缓存的 token 数，统计节省比例
+"""
+
+from typing import Dict, List, Optional
+
+# 记忆尾部消息的开头标记（用于定位易变尾部的起点）
+MEMORY_MARKER = "[记忆参考"
+
+# Anthropic 每个请求最多 4 个断点；客户端自己打过断点时不再添加
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def _text_of(message: Dict) -> str:
+    content = message.get("content", "")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return ""
+
+
+def _has_cache_control(messages: List[Dict]) -> bool:
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, list) and any(isinstance(p, dict) and "cache_control" in p for p in content):
+            return True
+    return False
+
+
+def _with_breakpoint(message: Dict) -> Dict:
+    """返回在最后一个文本分片上带 cache_control 的消息副本"""
+    content = message.get("content", "")
+    if isinstance(content, str):
+        if not content:
+            return message
+        parts = [{"type": "text", "text": content, "cache_control": CACHE_CONTROL}]
+    elif isinstance(content, list) and content:
+        parts = [dict(p) if isinstance(p, dict) else p for p in content]
+        for part in reversed(parts):
+            if isinstance(part, dict) and part.get("type") == "text":
+                part["cache_control"] = CACHE_CONTROL
+                break
+        else:
+            return message
+    else:
+        return message
+    return dict(message, content=parts)
+
+
+def stable_prefix_end(messages: List[Dict]) -> int:
+    """稳定前缀的结束位置（不含）：最后一条 user 消息及其前面的记忆尾部消息属于易变部分"""
+    last_user = None
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get("role") == "user":
+            last_user = i
+            break
+    if last_user is None:
+        return len(messages)
+    end = last_user
+    if end > 0 and _text_of(messages[end - 1]).startswith(MEMORY_MARKER):
+        end -= 1
+    return end
+
+
+def add_cache_breakpoints(messages: List[Dict]) -> List[Dict]:
+    """在 system prompt 和稳定前缀末尾各打一个断点（不修改传入列表）"""
+    if not messages or _has_cache_control(messages):
+        return messages
+    end = stable_prefix_end(messages)
+    if end <= 0:
+        return messages
+
+    targets = set()
+    # 断点1：开头连续 system 消息的最后一条（人设 prompt 最长，也最稳定）
+    head = 0
+    while head < end and messages[head].get("role") == "system":
+        head += 1
+    if head:
+        targets.add(head - 1)
+    # 断点2：稳定前缀的最后一条消息（历史对话）
+    targets.add(end - 1)
+
+    return [_with_breakpoint(msg) if i in targets else msg for i, msg in enumerate(messages)]
+
+
+def extract_prompt_usage(usage: Optional[Dict]) -> Optional[Dict[str, int]]:
+    """兼容 OpenAI（prompt_tokens_details.cached_tokens）与 Anthropic（cache_read_input_tokens）两种 usage 格式"""
+    if not usage:
+        return None
+    details = usage.get("prompt_tokens_details") or {}
+    cached = details.get("cached_tokens") or usage.get("cache_read_input_tokens") or 0
+    written = usage.get("cache_creation_input_tokens") or details.get("cache_write_tokens") or 0
+    prompt = usage.get("prompt_tokens")
+    if prompt is None:
+        # Anthropic 的 input_tokens 不含缓存部分
+        prompt = (usage.get("input_tokens") or 0) + cached + written
+    return {"prompt_tokens": int(prompt), "cached_tokens": int(cached), "cache_write_tokens": int(written)}
+
+
+class PromptCacheStats:
+    """按后端累计 prompt token 与缓存命中 token"""
+
+    def __init__(self):
+        self._backends: Dict[str, Dict[str, int]] = {}
+
+    def record(self, backend: str, usage: Optional[Dict]) -> Optional[Dict[str, int]]:
+        parsed = extract_prompt_usage(usage)
+        if parsed is None:
+            return None
+        stats = self._backends.setdefault(
+            backend, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "cache_write_tokens": 0}
+        )
+        stats["requests"] += 1
+        for key, value in parsed.items():
+            stats[key] += value
+        return parsed
+
+    def get_stats(self) -> dict:
+        """各后端缓存命中比例"""
+        result = {}
+        for backend, stats in self._backends.items():
+            prompt = stats["prompt_tokens"]
+            result[backend] = dict(stats, cached_ratio=round(stats["cached_tokens"] / prompt, 3) if prompt else 0.0)
+        return result
@@ -0,0 +1,124 @@
+"""
+最近对话 / 摘要尾部缓存 - 按 (user_id, channel) 保存最新 N 条
+冷启动注入、init_context、全局时间线每次都要查同样几条最新记录。这里在进程内保留每个
+(user_id, channel) 最新 N 条对话和摘要，外加跨 channel 的全局时间线：启动时预热，写入时
+write-through 追加（最新的在前），删除时整体失效，读的时候命中就不再走网络。
+
+安全性：
+- 没加载过的 key 不追加（否则会把"只有新写的几条"当成完整尾部）；第一次读时从库里补
+- 补缓存前记下版本号，查询期间有写入或失效时放弃这次填充，避免把旧数据写回
+- 只在单 worker 下使用：其他 worker 的写入这里看不到
+"""
+
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+# 与 storage 里对应查询的返回字段一致
+CONVERSATION_FIELDS = ("user_msg", "assistant_msg", "created_at", "scene_type")
+SUMMARY_FIELDS = ("summary", "start_round", "end_round", "created_at", "scene_type")
+
+GLOBAL_KEY = ("global",)
+
+
+def conversations_key(user_id: str, channel: str) -> Tuple:
+    return ("conversations", user_id, channel)
+
+
+def summaries_key(user_id: str, channel: str) -> Tuple:
+    return ("summaries", user_id, channel)
+
+
+def _project(row: Dict, fields: Tuple[str, ...]) -> Dict:
+    return {field: row.get(field) for field in fields}
+
+
+class RecentTailCache:
+    """每个 key 一个定长 deque（最新的在前）"""
+
+    def __init__(self, size: int = 20):
+        """
+        Args:
+            size: 每个 key 保留多少条，0 表示关闭
+        """
+        self.size = max(0, size)
+        self._tails: Dict[Tuple, Deque[Dict]] = {}
+        # 每次写入 / 失效都加一，填充时校验
+        self.version = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._fills = 0
+        self._stale_fills = 0
+        self._appends = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    # ---- 读 ----
+
+    def get(self, key: Tuple, limit: int) -> Optional[List[Dict]]:
+        """命中返回最新 limit 条（副本），没加载过或 limit 超过缓存条数返回 None"""
+        tail = self._tails.get(key)
+        if tail is None or limit > self.size:
+            self._misses += 1
+            return None
+        self._hits += 1
+        # deque 没满说明库里一共就这么多，直接返回也是完整结果
+        return [dict(row) for row in list(tail)[:limit]]
+
+    def fill(self, key: Tuple, rows: Iterable[Dict], version: int) -> bool:
+        """用库里查到的最新记录（最新的在前）初始化一个 key；查询期间有写入则放弃"""
+        if not self.enabled:
+            return False
+        if version != self.version:
+            self._stale_fills += 1
+            return False
+        fields = SUMMARY_FIELDS if key[0] == "summaries" else CONVERSATION_FIELDS
+        self._tails[key] = deque((_project(row, fields) for row in rows), maxlen=self.size)
+        self._fills += 1
+        return True
+
+    # ---- 写 ----
+
+    def add_conversations(self, user_id: str, channel: str, rows: List[Dict]):
+        """刚插入的对话（按发生顺序）写入该 channel 和全局时间线"""
+        self.version += 1
+        for key in (conversations_key(user_id, channel), GLOBAL_KEY):
+            tail = self._tails.get(key)
+            if tail is None:
+                continue
+            for row in rows:
+                tail.appendleft(_project(row, CONVERSATION_FIELDS))
+                self._appends += 1
+
+    def add_summary(self, user_id: str, channel: str, row: Dict):
+        self.version += 1
+        tail = self._tails.get(summaries_key(user_id, channel))
+        if tail is not None:
+            tail.appendleft(_project(row, SUMMARY_FIELDS))
+            self._appends += 1
+
+    def invalidate(self, reason: str = ""):
+        """删除 / 导入历史数据之后整体失效，下次读时重新从库里补"""
+        self.version += 1
+        if self._tails:
+            self._tails.clear()
+            self._invalidations += 1
+            print(f"[RecentCache] Invalidated{f' ({reason})' if reason else ''}")
+
+    def get_stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "enabled": self.enabled,
+            "size": self.size,
+            "keys": len(self._tails),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            "fills": self._fills,
+            "stale_fills": self._stale_fills,
+            "appends": self._appends,
+            "invalidations": self._invalidations,
+        }
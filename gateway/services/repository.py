@@ -0,0 +1,63 @@
+"""
+存储后端选择（storage_driver）
+- supabase：supabase-py + asyncio.to_thread（storage.py 里的 _db_* 函数），get_repository() 返回 None
+- asyncpg：直连 Supabase Postgres（services/pg_repository.py）
+- local：本机 SQLite + FTS5 + NumPy 向量索引（services/local_repository.py），不需要 Supabase
+
+asyncpg / local 两个仓库的方法名、参数和返回格式相同，storage.py、pgvector_service.py、
+hybrid_search 的关键词检索等调用方只判断"有没有仓库"，不区分具体是哪一种。
+"""
+
+import os
+from typing import Optional, Union
+
+import sys
+sys.path.insert(0, '/home/dream/memory-system/gateway')
+from config import get_settings
+from services.local_repository import LocalRepository
+from services.pg_repository import PgRepository, asyncpg
+
+STORAGE_DRIVERS = ("supabase", "asyncpg", "local")
+
+Repository = Union[PgRepository, LocalRepository]
+
+_repository: Optional[Repository] = None
+
+
+def _create_repository(settings) -> Repository:
+    if settings.storage_driver == "asyncpg":
+        if asyncpg is None:
+            raise RuntimeError("storage_driver=asyncpg but asyncpg is not installed")
+        if not settings.supabase_db_url:
+            raise RuntimeError("storage_driver=asyncpg requires SUPABASE_DB_URL")
+        return PgRepository(settings.supabase_db_url, settings.pg_pool_min_size, settings.pg_pool_max_size,
+                            settings.vector_ef_search)
+    path = settings.local_db_path or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "memory.db"
+    )
+    return LocalRepository(path)
+
+
+async def get_repository() -> Optional[Repository]:
+    """storage_driver 为 asyncpg / local 时返回已连接的仓库单例，否则返回 None（调用方走 supabase-py）"""
+    global _repository
+    settings = get_settings()
+    if settings.storage_driver not in ("asyncpg", "local"):
+        return None
+    if _repository is None:
+        _repository = _create_repository(settings)
+    await _repository.connect()
+    return _repository
+
+
+async def close_repository():
+    global _repository
+    if _repository is not None:
+        await _repository.close()
+        _repository = None
+
+
+def get_repository_stats() -> dict:
+    if _repository is None:
+        return {"driver": get_settings().storage_driver}
+    return _repository.get_stats()
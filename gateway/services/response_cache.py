@@ -0,0 +1,73 @@
+"""
+响应缓存 - 确定性请求 / 客户端系统请求的回答复用
+标题生成、"summarize"、"Generate a concise" 之类的客户端内务请求经常原样重试，
+temperature=0 的请求结果也基本确定。这两类请求按 (模型, messages, temperature, tools)
+的规范化哈希缓存 assistant 消息，LRU + TTL 淘汰；命中时按请求模式（流式/非流式/假流式）重放。
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+def make_cache_key(model: str, messages: List[Dict], temperature, tools) -> str:
+    """规范化哈希：字段排序、紧凑分隔符，字典键顺序不同的同一请求得到同一个键"""
+    canonical = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "tools": tools},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL 的 assistant 消息缓存"""
+
+    def __init__(self, max_entries: int = 512, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (message, 写入时间)
+        self._entries: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        """命中返回 {"content", "reasoning_content", "tool_calls", "finish_reason", "usage"}"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            message, ts = entry
+            if time.time() - ts <= self.ttl:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return message
+            del self._entries[key]
+        self._misses += 1
+        return None
+
+    def put(self, key: str, message: Dict):
+        """只缓存有内容的完整回答"""
+        if not (message.get("content") or message.get("reasoning_content") or message.get("tool_calls")):
+            return
+        self._entries[key] = (message, time.time())
+        self._entries.move_to_end(key)
+        self._stores += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def get_stats(self) -> dict:
+        """命中率统计"""
+        lookups = self._hits + self._misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            "stores": self._stores,
+            "evictions": self._evictions,
+        }
@@ -0,0 +1,62 @@
+"""
+对话轮数分配
+db：数据库函数 insert_conversation_with_round / insert_conversations_with_rounds（migrations/002），
+    计数行 + INSERT 同一事务，一次往返，多进程并发也唯一且连续
+local：进程内热计数器，首次用到某个 (user_id, channel) 时从数据库读一次当前轮数，之后在内存递增，
+    写入直接带上轮数（普通 INSERT，不依赖迁移）。只适用于单进程写入（workers=1）
+legacy：以前的先查后插（未执行迁移时的兜底，有并发重复轮数的问题）
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Tuple, TypeVar
+
+ROUND_ALLOCATION_MODES = ("db", "local", "legacy")
+
+T = TypeVar("T")
+
+
+class LocalRoundCounter:
+    """按 (user_id, channel) 的进程内轮数计数器
+
+    同一个 key 的分配和写入在一把锁里串行完成：写入成功才推进计数，失败不留空号。
+    不同 channel 之间互不阻塞。
+    """
+
+    def __init__(self):
+        self._rounds: Dict[Tuple[str, str], int] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._allocated = 0
+        self._seeded = 0
+
+    async def allocate(self, user_id: str, channel: str, count: int,
+                       load_current: Callable[[], Awaitable[int]],
+                       write: Callable[[int], Awaitable[T]]) -> T:
+        """预留 count 个连续轮数并执行 write(第一个轮数)，返回 write 的结果"""
+        key = (user_id, channel)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if key not in self._rounds:
+                self._rounds[key] = await load_current()
+                self._seeded += 1
+            result = await write(self._rounds[key] + 1)
+            self._rounds[key] += count
+            self._allocated += count
+            return result
+
+    def current(self, user_id: str, channel: str):
+        """已预热时返回当前轮数，否则 None"""
+        return self._rounds.get((user_id, channel))
+
+    def reset(self, user_id: str = None, channel: str = None):
+        """丢弃计数（下次从数据库重新读），不传参数时全部丢弃"""
+        if user_id is None:
+            self._rounds.clear()
+        else:
+            self._rounds.pop((user_id, channel), None)
+
+    def get_stats(self) -> dict:
+        return {
+            "keys": len(self._rounds),
+            "seeded": self._seeded,
+            "allocated": self._allocated,
+        }
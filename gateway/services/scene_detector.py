@@ -1,8 +1,16 @@
 """
 场景检测器 - 纯规则引擎，零延迟
 根据用户消息内容判断场景类型：daily / plot / meta
+场景状态存放在状态后端（见 state_backend），多 worker 共享、重启后保留
 """
 
+from typing import Optional
+
+from services.state_backend import MemoryStateBackend, StateBackend
+
+# 状态后端里的 namespace：channel -> {"current": ..., "previous": ...}
+SCENE_NAMESPACE = "scene"
+
 
 class SceneDetector:
     """会话级场景状态管理器"""
@@ -25,27 +33,36 @@ class SceneDetector:
         "停一下", "别演了", "回到现实", "不演了"
     ]
 
-    def __init__(self):
+    def __init__(self, state: Optional[StateBackend] = None):
         # 按 channel 隔离场景状态
-        self._scenes = {}  # {channel: {"current": "daily", "previous": "daily"}}
+        self._state = state or MemoryStateBackend()
         self._scene_changed = False
 
     def _get_scene_state(self, channel: str) -> dict:
-        """获取指定 channel 的场景状态，不存在则初始化"""
-        if channel not in self._scenes:
-            self._scenes[channel] = {"current": "daily", "previous": "daily"}
-        return self._scenes[channel]
+        """获取指定 channel 的场景状态，不存在则返回初始状态"""
+        return self._state.get(SCENE_NAMESPACE, channel) or {"current": "daily", "previous": "daily"}
 
     def detect(self, user_msg: str, channel: str = "deepseek") -> str:
         """
         检测消息的场景类型
         返回 'daily' | 'plot' | 'meta'
         """
-        state = self._get_scene_state(channel)
-
         if not user_msg:
-            return state["current"]
+            return self._get_scene_state(channel)["current"]
+
+        # 读-改-写在状态后端里原子完成，多 worker 同时处理同一通道的消息不会互相覆盖
+        result = {}
+
+        def transition(state):
+            state = state or {"current": "daily", "previous": "daily"}
+            result["scene"] = self._transition(state, user_msg)
+            return state
+
+        self._state.update(SCENE_NAMESPACE, channel, transition)
+        return result["scene"]
 
+    def _transition(self, state: dict, user_msg: str) -> str:
+        """按触发词更新 state（原地修改）并返回本条消息的场景"""
         msg_lower = user_msg.lower()
         state["previous"] = state["current"]
         self._scene_changed = False
@@ -94,7 +111,7 @@ class SceneDetector:
     def reset(self, channel: str = None):
         """重置场景状态（用于测试或手动重置）"""
         if channel:
-            self._scenes[channel] = {"current": "daily", "previous": "daily"}
+            self._state.delete(SCENE_NAMESPACE, channel)
         else:
-            self._scenes = {}
+            self._state.clear(SCENE_NAMESPACE)
         self._scene_changed = False
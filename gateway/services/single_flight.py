@@ -0,0 +1,145 @@
+"""
+单飞合并（single-flight）- 相同的在途请求只打一次上游
+客户端弱网重试时会在一秒内发来两三个完全相同的请求体。按请求体指纹登记在途请求：
+后来者不再做检索/请求上游/存储，而是订阅领头请求的结果——
+流式订阅领头请求的 SSE 环形缓冲区（从第 0 个事件开始扇出），非流式等领头请求的响应体。
+领头请求结束后再保留 window 秒，稍晚到达的重试也能直接拿到结果。
+只有成功且完整的结果才会留给后来者：非 2xx 响应、出错或中途断掉的流结束时立即撤销登记，
+客户端重试会重新请求上游，而不是拿到同一个失败。
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+# 非流式结果：(状态码, 响应体字节)
+FlightResult = Tuple[int, bytes]
+
+
+class Flight:
+    """一个在途请求"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        # 流式：领头请求的 StreamBuffer
+        self.stream_buffer = None
+        # 非流式：领头请求的响应
+        self.result: Optional[FlightResult] = None
+        # 领头请求异常退出，订阅者需要自己重新发起
+        self.abandoned = False
+        self.subscribers = 0
+        self._settled = asyncio.Event()
+
+    @property
+    def settled(self) -> bool:
+        return self._settled.is_set()
+
+    async def wait(self):
+        """等领头请求开流 / 出结果 / 放弃"""
+        await self._settled.wait()
+
+
+class SingleFlight:
+    """在途请求登记表"""
+
+    def __init__(self, window: float = 5.0):
+        self.window = window
+        self._flights: Dict[str, Flight] = {}
+        self._leaders = 0
+        self._coalesced = 0
+        self._abandoned = 0
+        self._discarded = 0
+
+    @staticmethod
+    def fingerprint(body: dict) -> str:
+        """请求体规范化哈希（model / messages / stream 等字段全部参与）"""
+        canonical = json.dumps(body, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def join(self, key: str) -> Optional[Flight]:
+        """查找可订阅的在途（或刚结束）请求"""
+        self._expire()
+        flight = self._flights.get(key)
+        if flight is None:
+            return None
+        flight.subscribers += 1
+        self._coalesced += 1
+        return flight
+
+    def lead(self, key: str) -> Flight:
+        """登记为领头请求（调用方必须在同一个事件循环节拍内调用，保证不会出现两个领头）
+        同一个键已有仍在进行中的请求（订阅者读流太慢被挤出、自己重新发起时）不替换它，
+        返回的 Flight 不登记，只用于本请求自己的 resolve / abandon"""
+        flight = Flight(key)
+        current = self._flights.get(key)
+        if current is None or current.finished_at is not None:
+            self._flights[key] = flight
+        self._leaders += 1
+        return flight
+
+    def attach_stream(self, flight: Flight, buffer, producer: asyncio.Task,
+                      failed: Optional[Callable[[], bool]] = None):
+        """流式领头：订阅者从缓冲区读，producer 结束时请求结束；
+        流出错 / 没有正常收尾（或 failed() 为真）时撤销登记，不留给之后的重试"""
+        flight.stream_buffer = buffer
+        flight._settled.set()
+
+        def done(_):
+            self._finish(flight)
+            if buffer.error or not buffer.completed or (failed is not None and failed()):
+                self._discard(flight)
+
+        producer.add_done_callback(done)
+
+    def resolve(self, flight: Flight, status_code: int, body: bytes):
+        """非流式领头：发布响应体（只发布 2xx，失败的响应按 abandon 处理）"""
+        if not 200 <= status_code < 300:
+            self.abandon(flight)
+            return
+        flight.result = (status_code, body)
+        flight._settled.set()
+        self._finish(flight)
+
+    def abandon(self, flight: Flight):
+        """领头请求异常退出：撤销登记，订阅者各自重新发起"""
+        if flight.settled:
+            return
+        flight.abandoned = True
+        flight._settled.set()
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        self._abandoned += 1
+
+    def _finish(self, flight: Flight):
+        flight.finished_at = time.time()
+
+    def _discard(self, flight: Flight):
+        """已经开流的领头请求失败：正在读的订阅者读完为止，之后的重试不再复用"""
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        self._discarded += 1
+
+    def _expire(self):
+        now = time.time()
+        expired = [
+            key for key, flight in self._flights.items()
+            if flight.finished_at is not None and now - flight.finished_at > self.window
+        ]
+        for key in expired:
+            del self._flights[key]
+
+    def get_stats(self) -> dict:
+        """合并次数统计"""
+        self._expire()
+        return {
+            "inflight": sum(1 for f in self._flights.values() if f.finished_at is None),
+            "window": self.window,
+            "leaders": self._leaders,
+            "coalesced": self._coalesced,
+            "abandoned": self._abandoned,
+            "discarded": self._discarded,
+        }
@@ -0,0 +1,74 @@
+"""
+SSE 增量扫描器 - 透传模式下的旁路解析
+stream_chunks 把上游原始字节块直接转发给客户端，同时丢进队列；
+扫描器在另一个 task 里按行切分、解析 data: 行，把 content / reasoning_content 收进 collector
+"""
+
+import asyncio
+import json
+from typing import Optional
+
+
+class SSEDeltaScanner:
+    """按字节块增量切行并提取 delta 的扫描器（可跨块拼接半行）"""
+
+    def __init__(self, collector: dict):
+        self._collector = collector
+        # 未处理完的半行：bytearray 原地追加，一行被切成很多小块时不会每块都复制整段
+        self._buffer = bytearray()
+
+    def feed(self, block: bytes):
+        """喂入一个上游字节块，处理其中所有完整的行"""
+        end = block.rfind(b"\n")
+        if end < 0:
+            self._buffer += block
+            return
+        # 只有最后一个换行之前的部分要切行，剩下的半行留到下一块
+        self._buffer += block[:end]
+        lines = self._buffer.split(b"\n")
+        self._buffer = bytearray(block[end + 1:])
+        for line in lines:
+            self._handle_line(bytes(line))
+
+    def finish(self):
+        """流结束：处理缓冲区里最后一行（上游未以换行结尾时）"""
+        if self._buffer:
+            self._handle_line(bytes(self._buffer))
+            self._buffer = bytearray()
+
+    def _handle_line(self, line: bytes):
+        line = line.rstrip(b"\r")
+        if not line.startswith(b"data:"):
+            return
+        payload = line[5:].strip()
+        if not payload or payload == b"[DONE]":
+            return
+        try:
+            data = json.loads(payload)
+            if data.get("usage"):
+                self._collector["usage"] = data["usage"]
+            choices = data.get("choices") or [{}]
+            delta = choices[0].get("delta", {})
+            content = delta.get("content", "")
+            reasoning = delta.get("reasoning_content", "")
+            if content:
+                self._collector["assistant_chunks"].append(content)
+            if reasoning:
+                self._collector["reasoning_chunks"].append(reasoning)
+            if delta.get("tool_calls"):
+                self._collector["has_tool_calls"] = True
+            if choices[0].get("finish_reason"):
+                self._collector["finish_reason"] = choices[0]["finish_reason"]
+        except Exception:
+            pass
+
+
+async def scan_sse_queue(queue: asyncio.Queue, collector: dict):
+    """队列消费者：None 表示上游结束"""
+    scanner = SSEDeltaScanner(collector)
+    while True:
+        block: Optional[bytes] = await queue.get()
+        if block is None:
+            break
+        scanner.feed(block)
+    scanner.finish()
@@ -0,0 +1,241 @@
+"""
+共享状态后端 - 场景状态 / 会话轮数 / 地理编码缓存 / 同义词映射
+memory：进程内字典（单 worker，重启清空，和以前的行为一致）
+sqlite：本机 SQLite 文件（WAL 模式），多个 uvicorn worker 共享，重启后保留
+
+值按 JSON 存储；incr 是原子操作（多个 worker 同时自增不会丢计数）。
+"""
+
+import json
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+
+import sys
+sys.path.insert(0, '/home/dream/memory-system/gateway')
+from config import get_settings
+
+STATE_BACKENDS = ("memory", "sqlite")
+
+
+class StateBackend(ABC):
+    """状态后端接口：按 namespace 隔离的键值存储"""
+
+    name = "base"
+
+    @abstractmethod
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        ...
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    def update(self, namespace: str, key: str, func: Callable[[Any], Any], default: Any = None) -> Any:
+        """原子的读-改-写：value = func(当前值或 default)，写回并返回新值（多 worker 同时改不会互相覆盖）"""
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str):
+        ...
+
+    @abstractmethod
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        """原子自增，返回自增后的值（不存在时从 0 开始）"""
+
+    @abstractmethod
+    def items(self, namespace: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def clear(self, namespace: str):
+        ...
+
+    def close(self):
+        pass
+
+    def get_stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class MemoryStateBackend(StateBackend):
+    """进程内实现"""
+
+    name = "memory"
+
+    def __init__(self):
+        # namespace -> key -> (value, 过期时间戳或 None)
+        self._data: Dict[str, Dict[str, tuple]] = {}
+
+    def _live(self, namespace: str, key: str):
+        entry = self._data.get(namespace, {}).get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] < time.time():
+            del self._data[namespace][key]
+            return None
+        return entry
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        entry = self._live(namespace, key)
+        return default if entry is None else entry[0]
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        self._data.setdefault(namespace, {})[key] = (value, expires_at)
+
+    def update(self, namespace: str, key: str, func: Callable[[Any], Any], default: Any = None) -> Any:
+        value = func(self.get(namespace, key, default))
+        self.set(namespace, key, value)
+        return value
+
+    def delete(self, namespace: str, key: str):
+        self._data.get(namespace, {}).pop(key, None)
+
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        value = int(self.get(namespace, key, 0)) + amount
+        self.set(namespace, key, value)
+        return value
+
+    def items(self, namespace: str) -> Dict[str, Any]:
+        return {key: self.get(namespace, key) for key in list(self._data.get(namespace, {})) if self._live(namespace, key)}
+
+    def clear(self, namespace: str):
+        self._data.pop(namespace, None)
+
+    def get_stats(self) -> dict:
+        return {"backend": self.name, "namespaces": {ns: len(keys) for ns, keys in self._data.items()}}
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+)
+"""
+
+
+class SQLiteStateBackend(StateBackend):
+    """SQLite（WAL）实现：同一台机器上的多个 worker 共享一个文件
+
+    读写都是单条主键语句，本地文件上是几十微秒级，直接在事件循环里同步执行。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        # to_thread 里的调用（同义词加载等）和事件循环共用连接
+        self._lock = threading.Lock()
+        self._purge_expired()
+
+    def _purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (namespace, key, time.time()),
+            ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (namespace, key, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+
+    def update(self, namespace: str, key: str, func: Callable[[Any], Any], default: Any = None) -> Any:
+        # BEGIN IMMEDIATE 先拿写锁再读，其他 worker 的读-改-写排在后面，不会丢更新
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                    (namespace, key, time.time()),
+                ).fetchone()
+                value = func(default if row is None else json.loads(row[0]))
+                self._conn.execute(
+                    "INSERT INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, NULL) "
+                    "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires_at = NULL",
+                    (namespace, key, json.dumps(value, ensure_ascii=False)),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        # 单条 UPSERT ... RETURNING，SQLite 的写锁保证多进程下原子
+        with self._lock:
+            row = self._conn.execute(
+                "INSERT INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, NULL) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = CAST(value AS INTEGER) + ? "
+                "RETURNING value",
+                (namespace, key, str(amount), amount),
+            ).fetchone()
+        return int(row[0])
+
+    def items(self, namespace: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM kv WHERE namespace = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (namespace, time.time()),
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def clear(self, namespace: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE namespace = ?", (namespace,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT namespace, COUNT(*) FROM kv GROUP BY namespace").fetchall()
+        return {"backend": self.name, "path": self.path, "namespaces": dict(rows)}
+
+
+def create_state_backend(kind: str, path: str = "") -> StateBackend:
+    """按名字创建状态后端，未知名字回落到 memory"""
+    if kind == "sqlite":
+        return SQLiteStateBackend(path)
+    if kind != "memory":
+        print(f"[State] Unknown backend '{kind}', falling back to memory")
+    return MemoryStateBackend()
+
+
+@lru_cache()
+def get_state_backend() -> StateBackend:
+    """进程级单例（按 settings.state_backend 创建）"""
+    settings = get_settings()
+    path = settings.state_path or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "state.db"
+    )
+    backend = create_state_backend(settings.state_backend, path)
+    print(f"[State] Using {backend.name} state backend")
+    return backend
@@ -1,6 +1,7 @@
 """
 Supabase 存储服务
 修复：用 asyncio.to_thread() 包装同步调用，避免阻塞事件循环
+storage_driver=asyncpg / local 时改走 services/repository.py 选出的仓库（直连 Postgres 或本机 SQLite，不占线程池）
 """
 
 from supabase import create_client
@@ -8,12 +9,20 @@ from datetime import datetime
 from typing import Optional, List, Dict
 import asyncio
 import sys
+import uuid
 
 sys.path.insert(0, '/home/dream/memory-system/gateway')
 from config import get_settings
+from services.pg_repository import KEYWORD_HIT_COLUMNS, keyword_hit_rows, keyword_scenes
+from services.repository import get_repository
+from services.round_counter import LocalRoundCounter
+from services.counter_accumulator import CounterAccumulator
+from services.keyword_index import KeywordIndex
+from services.recent_cache import GLOBAL_KEY, RecentTailCache, conversations_key, summaries_key
 
 settings = get_settings()
-supabase = create_client(settings.supabase_url, settings.supabase_key)
+# local 驱动不需要 Supabase（也可能根本没配），不建客户端；_db_* 只在没有仓库时才会被调用
+supabase = create_client(settings.supabase_url, settings.supabase_key) if settings.storage_driver != "local" else None
 
 # 过滤关键词
 SKIP_KEYWORDS = [
@@ -56,6 +65,16 @@ def _db_get_recent(user_id: str, limit: int, channel: str = "deepseek") -> List[
     return result.data if result.data else []
 
 
+def _db_get_global_recent(limit: int) -> List[Dict]:
+    """【同步】跨 user / channel 的全局最新对话"""
+    result = supabase.table("conversations") \
+        .select("user_msg, assistant_msg, scene_type, created_at") \
+        .order("created_at", desc=True) \
+        .limit(limit) \
+        .execute()
+    return result.data if result.data else []
+
+
 def _db_get_unsynced(limit: int) -> List[Dict]:
     """【同步】获取未同步对话"""
     result = supabase.table("conversations") \
@@ -106,6 +125,15 @@ def _db_update_weight(conversation_id: str, increment: int) -> bool:
     return False
 
 
+def _db_increment_weights(conversation_ids: List[str], increments: List[int]) -> int:
+    """【同步】批量原子自增权重（数据库函数，见 migrations/003），返回更新的行数"""
+    result = supabase.rpc("increment_conversation_weights", {
+        "p_ids": conversation_ids,
+        "p_deltas": increments
+    }).execute()
+    return result.data or 0
+
+
 def _db_get_by_id(conversation_id: str) -> Optional[Dict]:
     """【同步】按ID查询"""
     result = supabase.table("conversations") \
@@ -129,6 +157,28 @@ def _db_get_current_round(user_id: str, channel: str = "deepseek") -> int:
     return 0
 
 
+def _db_insert_conversation_with_round(user_id: str, user_msg: str, assistant_msg: str, scene_type: str = "daily", channel: str = "deepseek") -> Optional[dict]:
+    """【同步】插入对话并原子分配轮数（数据库函数，见 migrations/002）"""
+    result = supabase.rpc("insert_conversation_with_round", {
+        "p_user_id": user_id,
+        "p_user_msg": user_msg,
+        "p_assistant_msg": assistant_msg,
+        "p_scene_type": scene_type,
+        "p_channel": channel
+    }).execute()
+    return result.data[0] if result.data else None
+
+
+def _db_insert_conversations_with_rounds(user_id: str, channel: str, rows: List[Dict]) -> List[Dict]:
+    """【同步】批量插入并分配连续轮数（数据库函数，见 migrations/002），按传入顺序返回"""
+    result = supabase.rpc("insert_conversations_with_rounds", {
+        "p_user_id": user_id,
+        "p_channel": channel,
+        "p_rows": rows
+    }).execute()
+    return result.data if result.data else []
+
+
 def _db_get_conversations_for_summary(user_id: str, start_round: int, end_round: int, channel: str = "deepseek") -> List[Dict]:
     """【同步】获取指定轮数范围的对话"""
     result = supabase.table("conversations") \
@@ -183,6 +233,86 @@ def _db_get_last_summarized_round(user_id: str, channel: str = "deepseek") -> in
 
 # ============ 对外暴露的 async 接口（保持原有函数签名不变） ============
 
+async def _run(name: str, *args):
+    """按 storage_driver 分发：asyncpg / local 仓库的同名方法，或丢进线程池的 _db_{name} 同步函数"""
+    repo = await get_repository()
+    if repo is not None:
+        return await getattr(repo, name)(*args)
+    return await asyncio.to_thread(globals()[f"_db_{name}"], *args)
+
+
+# ============ 最近对话 / 摘要尾部缓存（见 services/recent_cache.py） ============
+
+# 多 worker 时其他进程的写入这里看不到，直接关掉
+recent_cache = RecentTailCache(settings.recent_cache_size if settings.workers <= 1 else 0)
+
+
+async def _read_tail(key: tuple, limit: int, load) -> List[Dict]:
+    """先读缓存；未命中时按缓存容量从库里查一次并填充，load(n) 返回最新 n 条"""
+    cached = recent_cache.get(key, limit)
+    if cached is not None:
+        return cached
+    if not recent_cache.enabled or limit > recent_cache.size:
+        return await load(limit)
+    version = recent_cache.version
+    rows = await load(recent_cache.size)
+    recent_cache.fill(key, rows, version)
+    return rows[:limit]
+
+
+async def warm_recent_cache(user_id: str = "dream", channels: Optional[List[str]] = None):
+    """启动时预热各 channel 的最近对话、摘要和全局时间线"""
+    if not recent_cache.enabled:
+        return
+    for channel in channels or ["deepseek"]:
+        await get_recent_conversations(user_id, recent_cache.size, channel)
+        await get_recent_summaries(user_id, recent_cache.size, channel)
+    await get_global_recent(recent_cache.size)
+    print(f"[RecentCache] Warmed {recent_cache.get_stats()['keys']} tails ({recent_cache.size} rows each)")
+
+
+# ============ 进程内关键词索引（见 services/keyword_index.py） ============
+
+# 同样只在单 worker 下启用
+keyword_index = KeywordIndex(settings.keyword_index_enabled and settings.workers <= 1)
+
+
+def _index_rows(source: str, rows: List[Dict], channel: str):
+    """新写入的对话 / 摘要追加进关键词索引（插入返回的行可能不带 model_channel）"""
+    keyword_index.add(source, ({**row, "model_channel": row.get("model_channel") or channel} for row in rows if row))
+
+
+async def build_keyword_index(user_id: str = "dream", page_size: int = 200):
+    """从库里分页读全部对话和摘要建索引（启动时后台执行）；期间的写入照常追加，按 id 去重"""
+    if not keyword_index.enabled:
+        return
+    started = datetime.now()
+    version = keyword_index.reset()
+    try:
+        for source, pages in (
+            ("conversations", lambda after_created, after_id: _run(
+                "page_conversations", user_id, None, after_created, after_id, page_size)),
+            ("summaries", lambda after_created, after_id: _run(
+                "page_summaries", user_id, after_created, after_id, page_size)),
+        ):
+            after_created, after_id = None, None
+            while True:
+                page = await pages(after_created, after_id)
+                # 切分 / 编码在线程里做，不卡事件循环
+                await asyncio.to_thread(keyword_index.add, source, page)
+                if len(page) < page_size:
+                    break
+                after_created, after_id = page[-1]["created_at"], page[-1]["id"]
+    except Exception as e:
+        print(f"[KeywordIndex] Build failed, keyword search stays on the database: {e}")
+        return
+    if keyword_index.mark_ready(version):
+        stats = keyword_index.get_stats()
+        elapsed = (datetime.now() - started).total_seconds()
+        print(f"[KeywordIndex] Built {stats['documents']} documents / {stats['terms']} terms "
+              f"({stats['postings_mb']} MB postings) in {elapsed:.1f}s")
+
+
 async def save_conversation(user_msg: str, assistant_msg: str, user_id: str = "dream") -> Optional[str]:
     """保存对话到数据库"""
     for kw in SKIP_KEYWORDS:
@@ -192,8 +322,10 @@ async def save_conversation(user_msg: str, assistant_msg: str, user_id: str = "d
     if not user_msg.strip() or not assistant_msg.strip():
         return None
     try:
-        row = await asyncio.to_thread(_db_insert_conversation, user_id, user_msg, assistant_msg)
+        row = await _run("insert_conversation", user_id, user_msg, assistant_msg)
         if row:
+            recent_cache.add_conversations(user_id, "deepseek", [row])
+            _index_rows("conversations", [row], "deepseek")
             conv_id = row["id"]
             print(f"[Storage] Saved conversation {conv_id[:8]}...")
             return conv_id
@@ -204,18 +336,29 @@ async def save_conversation(user_msg: str, assistant_msg: str, user_id: str = "d
 
 
 async def get_recent_conversations(user_id: str = "dream", limit: int = 4, channel: str = "deepseek") -> List[Dict]:
-    """获取最近的对话"""
+    """获取最近的对话（优先读尾部缓存）"""
     try:
-        return await asyncio.to_thread(_db_get_recent, user_id, limit, channel)
+        return await _read_tail(
+            conversations_key(user_id, channel), limit, lambda n: _run("get_recent", user_id, n, channel)
+        )
     except Exception as e:
         print(f"[Storage] Get recent error: {e}")
         return []
 
 
+async def get_global_recent(limit: int = 6) -> List[Dict]:
+    """跨 channel 的全局最新对话（优先读尾部缓存）"""
+    try:
+        return await _read_tail(GLOBAL_KEY, limit, lambda n: _run("get_global_recent", n))
+    except Exception as e:
+        print(f"[Storage] Get global recent error: {e}")
+        return []
+
+
 async def get_unsynced_conversations(limit: int = 100) -> List[Dict]:
     """获取未同步到MemU的对话"""
     try:
-        return await asyncio.to_thread(_db_get_unsynced, limit)
+        return await _run("get_unsynced", limit)
     except Exception as e:
         print(f"[Storage] Get unsynced error: {e}")
         return []
@@ -224,7 +367,7 @@ async def get_unsynced_conversations(limit: int = 100) -> List[Dict]:
 async def mark_synced(conversation_id: str) -> bool:
     """标记对话已同步到MemU"""
     try:
-        return await asyncio.to_thread(_db_mark_synced, conversation_id)
+        return await _run("mark_synced", conversation_id)
     except Exception as e:
         print(f"[Storage] Mark synced error: {e}")
         return False
@@ -233,28 +376,59 @@ async def mark_synced(conversation_id: str) -> bool:
 async def search_conversations(query: str, user_id: str = "dream", limit: int = 5, channel: str = "deepseek") -> List[Dict]:
     """关键词搜索"""
     try:
-        return await asyncio.to_thread(_db_search, query, user_id, limit, channel)
+        return await _run("search", query, user_id, limit, channel)
     except Exception as e:
         print(f"[Storage] Search error: {e}")
         return []
 
 
-async def update_weight(conversation_id: str, increment: int = 1) -> bool:
-    """增加记忆权重"""
+async def _flush_weights(deltas: Dict[str, int]):
+    """权重累加器的落库函数：一条批量原子 UPDATE；没有 migrations/003 时逐条兜底"""
+    global _weight_rpc_missing
+    ids, increments = list(deltas), list(deltas.values())
+    if not _weight_rpc_missing:
+        try:
+            await _run("increment_weights", ids, increments)
+            print(f"[Storage] Weights flushed: {len(ids)} conversations (+{sum(increments)})")
+            return
+        except Exception as e:
+            if not is_missing_function(e):
+                raise
+            _weight_rpc_missing = True
+            print(f"[Storage] increment_conversation_weights missing (run migrations/003), updating one by one: {e}")
+    for conversation_id, increment in deltas.items():
+        await _run("update_weight", conversation_id, increment)
+
+
+_weight_rpc_missing = False
+weight_accumulator = CounterAccumulator(
+    "conversation_weight", _flush_weights,
+    interval=settings.counter_flush_interval, max_pending=settings.counter_flush_threshold,
+)
+
+
+def is_uuid(value: str) -> bool:
+    """累加器的 key 会进 uuid[] 参数，不是合法 UUID 的（截断的引用标记等）在入口挡掉"""
     try:
-        result = await asyncio.to_thread(_db_update_weight, conversation_id, increment)
-        if result:
-            print(f"[Storage] Weight updated: {conversation_id[:8]}...")
-        return result
-    except Exception as e:
-        print(f"[Storage] Update weight error: {e}")
+        uuid.UUID(str(value))
+        return True
+    except ValueError:
+        return False
+
+
+async def update_weight(conversation_id: str, increment: int = 1) -> bool:
+    """增加记忆权重（进累加器，按批原子落库，返回 True 表示已记下，ID 不是 UUID 返回 False）"""
+    if not is_uuid(conversation_id):
+        print(f"[Storage] Ignoring weight update for invalid id {conversation_id!r}")
         return False
+    weight_accumulator.add(conversation_id, increment)
+    return True
 
 
 async def get_by_id(conversation_id: str) -> Optional[Dict]:
     """根据ID获取对话"""
     try:
-        return await asyncio.to_thread(_db_get_by_id, conversation_id)
+        return await _run("get_by_id", conversation_id)
     except Exception as e:
         print(f"[Storage] Get by id error: {e}")
         return None
@@ -263,14 +437,100 @@ async def get_by_id(conversation_id: str) -> Optional[Dict]:
 async def get_current_round(user_id: str = "dream", channel: str = "deepseek") -> int:
     """获取当前对话轮数"""
     try:
-        return await asyncio.to_thread(_db_get_current_round, user_id, channel)
+        return await _run("get_current_round", user_id, channel)
     except Exception as e:
         print(f"[Storage] Get round error: {e}")
         return 0
 
 
+# ============ 轮数分配（round_allocation: db / local / legacy，见 services/round_counter.py） ============
+
+round_counter = LocalRoundCounter()
+# 数据库里还没有 migrations/002 的函数时自动退回 legacy，只提示一次
+_round_rpc_missing = False
+
+
+def is_missing_function(error: Exception) -> bool:
+    text = str(error)
+    return "PGRST202" in text or ("function" in text and "does not exist" in text)
+
+
+def _use_round_rpc() -> bool:
+    return settings.round_allocation == "db" and not _round_rpc_missing
+
+
+def _mark_round_rpc_missing(error: Exception):
+    global _round_rpc_missing
+    _round_rpc_missing = True
+    print(f"[Storage] Round allocation function missing (run migrations/002), using legacy allocation: {error}")
+
+
+async def _insert_with_round(user_id: str, user_msg: str, assistant_msg: str, scene_type: str, channel: str) -> Optional[dict]:
+    """分配轮数并插入单条对话，返回插入后的行"""
+    if _use_round_rpc():
+        try:
+            return await _run("insert_conversation_with_round", user_id, user_msg, assistant_msg, scene_type, channel)
+        except Exception as e:
+            if not is_missing_function(e):
+                raise
+            _mark_round_rpc_missing(e)
+
+    def write(round_number: int):
+        return _run("insert_conversation", user_id, user_msg, assistant_msg, round_number, scene_type, channel)
+
+    if settings.round_allocation == "local":
+        return await round_counter.allocate(
+            user_id, channel, 1, lambda: _run("get_current_round", user_id, channel), write
+        )
+    current_round = await _run("get_current_round", user_id, channel)
+    return await write(current_round + 1)
+
+
+async def _insert_batch_with_rounds(user_id: str, channel: str, turns: List[Dict]) -> List[Dict]:
+    """同一 channel 的多条对话按顺序分配连续轮数并一次插入，按传入顺序返回插入后的行"""
+    if _use_round_rpc():
+        rows = [
+            {"user_msg": t["user_msg"], "assistant_msg": t["assistant_msg"], "scene_type": t.get("scene_type", "daily"),
+             "created_at": t.get("created_at"), **({"id": t["id"]} if t.get("id") else {})}
+            for t in turns
+        ]
+        try:
+            return await _run("insert_conversations_with_rounds", user_id, channel, rows)
+        except Exception as e:
+            if not is_missing_function(e):
+                raise
+            _mark_round_rpc_missing(e)
+
+    def write(first_round: int):
+        rows = [{
+            "user_id": user_id,
+            "user_msg": turn["user_msg"],
+            "assistant_msg": turn["assistant_msg"],
+            "synced_to_memu": False,
+            "scene_type": turn.get("scene_type", "daily"),
+            "model_channel": channel,
+            "round_number": first_round + offset,
+        } for offset, turn in enumerate(turns)]
+        # 导入时沿用调用方给的 id（按 id 去重）
+        for row, turn in zip(rows, turns):
+            if turn.get("id"):
+                row["id"] = turn["id"]
+        # 导入历史对话时保留原始时间
+        if all(turn.get("created_at") for turn in turns):
+            for row, turn in zip(rows, turns):
+                row["created_at"] = turn["created_at"]
+        return _run("insert_conversations_batch", rows)
+
+    if settings.round_allocation == "local":
+        return await round_counter.allocate(
+            user_id, channel, len(turns), lambda: _run("get_current_round", user_id, channel), write
+        )
+    current_round = await _run("get_current_round", user_id, channel)
+    return await write(current_round + 1)
+
+
 async def save_conversation_with_round(user_msg: str, assistant_msg: str, user_id: str = "dream", scene_type: str = "daily", channel: str = "deepseek") -> Optional[str]:
-    """保存对话并记录轮数（v2: 支持scene_type, v3: 支持channel隔离）"""
+    """保存对话并记录轮数（v2: 支持scene_type, v3: 支持channel隔离, v4: 轮数原子分配）"""
     for kw in SKIP_KEYWORDS:
         if kw.lower() in user_msg.lower():
             print(f"[Storage] Skipped system message: {user_msg[:50]}...")
@@ -278,12 +538,12 @@ async def save_conversation_with_round(user_msg: str, assistant_msg: str, user_i
     if not user_msg.strip() or not assistant_msg.strip():
         return None
     try:
-        current_round = await asyncio.to_thread(_db_get_current_round, user_id, channel)
-        new_round = current_round + 1
-        row = await asyncio.to_thread(_db_insert_conversation, user_id, user_msg, assistant_msg, new_round, scene_type, channel)
+        row = await _insert_with_round(user_id, user_msg, assistant_msg, scene_type, channel)
         if row:
+            recent_cache.add_conversations(user_id, channel, [row])
+            _index_rows("conversations", [row], channel)
             conv_id = row["id"]
-            print(f"[Storage] Saved conversation {conv_id[:8]}... (round {new_round}, scene={scene_type}, channel={channel})")
+            print(f"[Storage] Saved conversation {conv_id[:8]}... (round {row.get('round_number')}, scene={scene_type}, channel={channel})")
             return conv_id
         return None
     except Exception as e:
@@ -291,10 +551,65 @@ async def save_conversation_with_round(user_msg: str, assistant_msg: str, user_i
         return None
 
 
+def _db_insert_conversations_batch(rows: List[Dict]) -> List[Dict]:
+    """【同步】多行插入对话记录（一次请求），按传入顺序返回插入后的行"""
+    result = supabase.table("conversations").insert(rows).execute()
+    return result.data if result.data else []
+
+
+class PartialBatchError(Exception):
+    """批量保存时前面的 channel 分组已经提交、后面的分组失败
+    committed：已经落库（或被过滤、不需要落库）的 turns 下标，重试时应跳过；ids 同 save_conversations_batch 的返回值
+    原始异常在 __cause__ 里"""
+
+    def __init__(self, ids: List[Optional[str]], committed: List[int], cause: Exception):
+        super().__init__(f"{len(committed)}/{len(ids)} turns committed before failure: {cause}")
+        self.ids = ids
+        self.committed = committed
+
+
+async def save_conversations_batch(turns: List[Dict], user_id: str = "dream") -> List[Optional[str]]:
+    """批量保存对话并分配轮数（供写后日志批量落库）
+
+    turns: [{"user_msg", "assistant_msg", "scene_type", "channel"}, ...]，按发生顺序
+    返回与 turns 一一对应的 conversation id（被过滤的系统消息为 None）
+    失败直接抛异常，由调用方决定重试，不吞错；每个 channel 分组是一条插入语句（各自原子），
+    前面的分组已提交、后面的失败时抛 PartialBatchError，告诉调用方哪些不要再写
+    """
+    ids: List[Optional[str]] = [None] * len(turns)
+    # 按 channel 分组，每组一次分配一段连续轮数，组内按顺序递增
+    groups: Dict[str, List[int]] = {}
+    for idx, turn in enumerate(turns):
+        user_msg = turn["user_msg"]
+        if any(kw.lower() in user_msg.lower() for kw in SKIP_KEYWORDS):
+            continue
+        if not user_msg.strip() or not turn["assistant_msg"].strip():
+            continue
+        groups.setdefault(turn.get("channel", "deepseek"), []).append(idx)
+
+    pending = set(idx for indexes in groups.values() for idx in indexes)
+    for channel, indexes in groups.items():
+        try:
+            inserted = await _insert_batch_with_rounds(user_id, channel, [turns[idx] for idx in indexes])
+        except Exception as e:
+            committed = [idx for idx in range(len(turns)) if idx not in pending]
+            if not any(ids):
+                raise
+            raise PartialBatchError(ids, committed, e) from e
+        pending.difference_update(indexes)
+        for idx, row in zip(indexes, inserted):
+            ids[idx] = row["id"]
+        recent_cache.add_conversations(user_id, channel, inserted)
+        _index_rows("conversations", inserted, channel)
+        if inserted:
+            print(f"[Storage] Batch saved {len(inserted)} conversations (rounds {inserted[0].get('round_number')}-{inserted[-1].get('round_number')}, channel={channel})")
+    return ids
+
+
 async def get_conversations_for_summary(user_id: str = "dream", start_round: int = 1, end_round: int = 5, channel: str = "deepseek") -> List[Dict]:
     """获取指定轮数范围的对话"""
     try:
-        return await asyncio.to_thread(_db_get_conversations_for_summary, user_id, start_round, end_round, channel)
+        return await _run("get_conversations_for_summary", user_id, start_round, end_round, channel)
     except Exception as e:
         print(f"[Storage] Get conversations for summary error: {e}")
         return []
@@ -303,8 +618,10 @@ async def get_conversations_for_summary(user_id: str = "dream", start_round: int
 async def save_summary(summary: str, start_round: int, end_round: int, user_id: str = "dream", scene_type: str = "daily", channel: str = "deepseek") -> Optional[str]:
     """保存摘要（v2: 支持scene_type, v3: 支持channel隔离）"""
     try:
-        row = await asyncio.to_thread(_db_save_summary, user_id, summary, start_round, end_round, scene_type, channel)
+        row = await _run("save_summary", user_id, summary, start_round, end_round, scene_type, channel)
         if row:
+            recent_cache.add_summary(user_id, channel, row)
+            _index_rows("summaries", [row], channel)
             summary_id = row["id"]
             print(f"[Storage] Saved summary {summary_id[:8]}... (rounds {start_round}-{end_round}, scene={scene_type}, channel={channel})")
             return summary_id
@@ -315,9 +632,11 @@ async def save_summary(summary: str, start_round: int, end_round: int, user_id:
 
 
 async def get_recent_summaries(user_id: str = "dream", limit: int = 3, channel: str = "deepseek") -> List[Dict]:
-    """获取最近的摘要"""
+    """获取最近的摘要（优先读尾部缓存）"""
     try:
-        return await asyncio.to_thread(_db_get_recent_summaries, user_id, limit, channel)
+        return await _read_tail(
+            summaries_key(user_id, channel), limit, lambda n: _run("get_recent_summaries", user_id, n, channel)
+        )
     except Exception as e:
         print(f"[Storage] Get summaries error: {e}")
         return []
@@ -326,7 +645,7 @@ async def get_recent_summaries(user_id: str = "dream", limit: int = 3, channel:
 async def get_last_summarized_round(user_id: str = "dream", channel: str = "deepseek") -> int:
     """获取最后一次摘要覆盖到的轮数"""
     try:
-        return await asyncio.to_thread(_db_get_last_summarized_round, user_id, channel)
+        return await _run("get_last_summarized_round", user_id, channel)
     except Exception as e:
         print(f"[Storage] Get last summarized round error: {e}")
         return 0
@@ -349,8 +668,38 @@ def _db_update_metadata(conversation_id: str, topic: str, entities: list, emotio
     return True
 
 
+# 数据库里还没有 migrations/007 的 keyword_search_multi 时退回逐词 ilike，只提示一次
+_keyword_rpc_missing = False
+
+
+def _db_keyword_search_multi(terms: List[str], channel: str, scenes: Optional[List[str]], conv_limit: int, sum_limit: int) -> Optional[List[Dict]]:
+    """【同步】keyword_search_multi 一次查完全部词；函数不存在时返回 None"""
+    global _keyword_rpc_missing
+    if _keyword_rpc_missing:
+        return None
+    try:
+        result = supabase.rpc("keyword_search_multi", {
+            "p_terms": terms,
+            "p_channel": channel,
+            "p_scenes": scenes,
+            "p_conv_limit": conv_limit,
+            "p_sum_limit": sum_limit,
+        }).execute()
+    except Exception as e:
+        if not is_missing_function(e):
+            raise
+        _keyword_rpc_missing = True
+        print(f"[Storage] keyword_search_multi missing (run migrations/007), searching term by term: {e}")
+        return None
+    return keyword_hit_rows(result.data or [])
+
+
 def _db_fulltext_search(query_terms: list, scene_type: str, limit: int, channel: str = "deepseek") -> List[Dict]:
-    """【同步】全文搜索（使用pg_trgm模糊匹配）"""
+    """【同步】全文搜索（二元组 GIN 索引，一次调用；没有 migrations/007 时逐词 ilike）"""
+    scenes = [scene_type] if scene_type and scene_type != "daily" else None
+    hits = _db_keyword_search_multi(query_terms[:3], channel, scenes, limit, 0)
+    if hits is not None:
+        return hits
     results = []
     for term in query_terms[:3]:
         if len(term) < 2:
@@ -359,8 +708,8 @@ def _db_fulltext_search(query_terms: list, scene_type: str, limit: int, channel:
             .select("id, user_msg, assistant_msg, created_at, scene_type, topic, emotion, round_number") \
             .eq("model_channel", channel) \
             .or_(f"user_msg.ilike.%{term}%,assistant_msg.ilike.%{term}%")
-        if scene_type and scene_type != "daily":
-            query = query.eq("scene_type", scene_type)
+        if scenes:
+            query = query.in_("scene_type", scenes)
         result = query.order("created_at", desc=True).limit(limit).execute()
         if result.data:
             results.extend(result.data)
@@ -374,19 +723,269 @@ def _db_fulltext_search(query_terms: list, scene_type: str, limit: int, channel:
     return deduped[:limit]
 
 
+def _db_keyword_search(terms: List[str], scene_type: str, limit: int = 15, channel: str = "deepseek") -> List[Dict]:
+    """【同步】混合检索的关键词一路：keyword_search_multi 一次查完全部词，两张表的命中去重、按命中词数排序；
+    没有 migrations/007 时退回逐词查 conversations（limit 条）和 summaries（5 条）的 ilike"""
+    scenes = keyword_scenes(scene_type)
+    hits = _db_keyword_search_multi(terms, channel, scenes, limit, 5)
+    if hits is not None:
+        return hits
+    results = []
+    for term in terms[:5]:
+        if len(term) < 2:  # 跳过太短的词
+            continue
+
+        # 搜索 conversations 表
+        try:
+            query = supabase.table("conversations") \
+                .select("id, user_msg, assistant_msg, created_at, scene_type, topic, emotion, round_number") \
+                .eq("model_channel", channel) \
+                .or_(f"user_msg.ilike.%{term}%,assistant_msg.ilike.%{term}%")
+            if scenes:
+                query = query.in_("scene_type", scenes)
+
+            result = query.order("created_at", desc=True).limit(limit).execute()
+            for row in result.data or []:
+                row["_source"] = "conversations"
+                results.append(row)
+        except Exception as e:
+            print(f"[HybridSearch] Keyword conv search error: {e}")
+
+        # 搜索 summaries 表
+        try:
+            query = supabase.table("summaries") \
+                .select("id, summary, created_at, scene_type, topic, start_round, end_round") \
+                .eq("model_channel", channel) \
+                .ilike("summary", f"%{term}%")
+            if scenes:
+                query = query.in_("scene_type", scenes)
+
+            result = query.order("created_at", desc=True).limit(5).execute()
+            for row in result.data or []:
+                row["_source"] = "summaries"
+                results.append(row)
+        except Exception as e:
+            print(f"[HybridSearch] Keyword sum search error: {e}")
+    return results
+
+
+def _db_get_recent_by_emotion(emotion: str, since: str, limit: int, channel: str = "deepseek") -> List[Dict]:
+    """【同步】某个时间之后相同情感的对话"""
+    result = supabase.table("conversations") \
+        .select("id, user_msg, assistant_msg, created_at, scene_type, emotion") \
+        .eq("model_channel", channel) \
+        .eq("emotion", emotion) \
+        .gte("created_at", since) \
+        .order("created_at", desc=True) \
+        .limit(limit) \
+        .execute()
+    return result.data if result.data else []
+
+
 async def update_conversation_metadata(conv_id: str, topic: str = None, entities: list = None, emotion: str = None) -> bool:
     """后台异步更新对话元数据"""
     try:
-        return await asyncio.to_thread(_db_update_metadata, conv_id, topic, entities, emotion)
+        updated = await _run("update_metadata", conv_id, topic, entities, emotion)
     except Exception as e:
         print(f"[Storage] Update metadata error: {e}")
         return False
+    if updated:
+        keyword_index.update_fields(conv_id, {"topic": topic, "emotion": emotion})
+    return updated
 
 
 async def fulltext_search(query_terms: list, scene_type: str = None, limit: int = 10, channel: str = "deepseek") -> List[Dict]:
-    """全文搜索（使用pg_trgm模糊匹配）"""
+    """全文搜索（二元组 GIN 索引，见 migrations/007）"""
     try:
-        return await asyncio.to_thread(_db_fulltext_search, query_terms, scene_type, limit, channel)
+        return await _run("fulltext_search", query_terms, scene_type, limit, channel)
     except Exception as e:
         print(f"[Storage] Fulltext search error: {e}")
         return []
+
+
+async def keyword_search(terms: List[str], scene_type: str, limit: int = 15, channel: str = "deepseek") -> List[Dict]:
+    """混合检索的关键词一路（每行带 _source）：进程内索引建好后直接查内存（索引正忙时除外），
+    否则按 storage_driver 走 keyword_search_multi RPC / asyncpg / 本地 FTS5"""
+    if keyword_index.ready:
+        hits = keyword_index.search(terms, scene_type, limit, channel)
+        # None：索引正忙（大批写入中），这一次走数据库
+        if hits is not None:
+            return hits
+    return await _run("keyword_search", terms, scene_type, limit, channel)
+
+
+async def get_recent_by_emotion(emotion: str, since: str, limit: int = 5, channel: str = "deepseek") -> List[Dict]:
+    """since（ISO 时间）之后相同情感的对话，最新的在前"""
+    return await _run("get_recent_by_emotion", emotion, since, limit, channel)
+
+
+# ============ 批量导入 / 导出（services/bulk_import.py 使用） ============
+
+EXPORT_SELECT = (
+    "id, user_id, user_msg, assistant_msg, scene_type, model_channel, round_number, "
+    "created_at, topic, emotion, entities, weight, session_id"
+)
+
+
+def _db_page_conversations(user_id: str, channel: Optional[str], after_created: Optional[str], after_id: Optional[str], page_size: int) -> List[Dict]:
+    """【同步】按 (created_at, id) 键集分页顺序读取"""
+    query = supabase.table("conversations") \
+        .select(EXPORT_SELECT) \
+        .eq("user_id", user_id)
+    if channel:
+        query = query.eq("model_channel", channel)
+    if after_created:
+        # 时间戳里有 : 和 .，在 or 过滤里要加引号
+        query = query.or_(f'created_at.gt."{after_created}",and(created_at.eq."{after_created}",id.gt.{after_id})')
+    result = query.order("created_at").order("id").limit(page_size).execute()
+    return result.data if result.data else []
+
+
+def _db_page_summaries(user_id: str, after_created: Optional[str], after_id: Optional[str], page_size: int) -> List[Dict]:
+    """【同步】摘要按 (created_at, id) 键集分页顺序读取"""
+    query = supabase.table("summaries") \
+        .select("id, summary, created_at, scene_type, topic, start_round, end_round, model_channel") \
+        .eq("user_id", user_id)
+    if after_created:
+        query = query.or_(f'created_at.gt."{after_created}",and(created_at.eq."{after_created}",id.gt.{after_id})')
+    result = query.order("created_at").order("id").limit(page_size).execute()
+    return result.data if result.data else []
+
+
+def _db_get_missing_embeddings(channel: Optional[str], limit: int) -> List[Dict]:
+    """【同步】还没有向量的对话（按时间顺序）"""
+    query = supabase.table("conversations") \
+        .select("id, user_msg, assistant_msg, model_channel, scene_type") \
+        .is_("embedding", "null")
+    if channel:
+        query = query.eq("model_channel", channel)
+    result = query.order("created_at").limit(limit).execute()
+    return result.data if result.data else []
+
+
+def _db_store_embeddings(conversation_ids: List[str], embeddings: List[List[float]]) -> int:
+    """【同步】一次写一批向量（数据库函数，见 migrations/004）"""
+    result = supabase.rpc("store_conversation_embeddings", {
+        "p_ids": conversation_ids,
+        "p_embeddings": [f"[{','.join(str(x) for x in e)}]" for e in embeddings]
+    }).execute()
+    return result.data or 0
+
+
+def _db_page_embedded_ids(table: str, after_id: Optional[str], page_size: int) -> List[str]:
+    """【同步】有向量的行的 id，按 id 分页（向量镜像同步用）"""
+    query = supabase.table(table).select("id").not_.is_("embedding", "null")
+    if after_id:
+        query = query.gt("id", after_id)
+    result = query.order("id").limit(page_size).execute()
+    return [row["id"] for row in result.data or []]
+
+
+def _db_get_embeddings(table: str, ids: List[str]) -> List[Dict]:
+    """【同步】按 id 取向量和过滤列（embedding 为 '[0.1,...]' 字符串）"""
+    result = supabase.table(table) \
+        .select("id, embedding, model_channel, scene_type") \
+        .in_("id", ids) \
+        .not_.is_("embedding", "null") \
+        .execute()
+    return result.data if result.data else []
+
+
+def _db_get_rows_by_ids(table: str, ids: List[str]) -> List[Dict]:
+    """【同步】按 id 取检索结果行（和 search_*_v2 返回的列一致，不含 similarity）"""
+    result = supabase.table(table) \
+        .select(", ".join(KEYWORD_HIT_COLUMNS[table])) \
+        .in_("id", ids) \
+        .execute()
+    return result.data if result.data else []
+
+
+async def import_conversations_batch(rows: List[Dict], user_id: str = "dream", channel: str = "deepseek") -> List[Optional[str]]:
+    """导入同一 channel 的一批历史对话（按时间顺序），分配连续轮数，返回对应的 id
+
+    行里带 id 时按 id 去重：库里已有的跳过，返回值对应位置为 None（重跑同一批不会重复插入）。
+    asyncpg：同一事务里分配轮数 + COPY；local：同一事务批量插入；supabase：insert_conversations_with_rounds 多行插入
+    （migrations/009 起在库里按 id 去重，这里先筛一遍，没有 RPC 的回退路径也不会撞主键）
+    失败直接抛异常，由调用方按检查点重试
+    """
+    repo = await get_repository()
+    if repo is not None:
+        ids = await repo.copy_conversations_with_rounds(user_id, channel, rows)
+    else:
+        existing = await asyncio.to_thread(_db_existing_conversation_ids, [row["id"] for row in rows if row.get("id")])
+        fresh = [row for row in rows if row.get("id") not in existing]
+        inserted = await _insert_batch_with_rounds(user_id, channel, fresh) if fresh else []
+        if all(row.get("id") for row in rows):
+            returned = {row["id"] for row in inserted}
+            ids = [row["id"] if row["id"] in returned else None for row in rows]
+        else:
+            ids = [row["id"] for row in inserted]
+    # 历史对话的时间可能早于缓存里的记录，不能直接追加
+    recent_cache.invalidate("import")
+    # 关键词索引和时间顺序无关，直接追加
+    _index_rows("conversations", [{**row, "id": conv_id} for row, conv_id in zip(rows, ids) if conv_id], channel)
+    return ids
+
+
+def _db_existing_conversation_ids(ids: List[str]) -> set:
+    """【同步】库里已有的 id（导入去重用）"""
+    existing = set()
+    for offset in range(0, len(ids), 200):
+        result = supabase.table("conversations").select("id").in_("id", ids[offset:offset + 200]).execute()
+        existing.update(row["id"] for row in result.data or [])
+    return existing
+
+
+def _db_move_channel(user_id: str, from_channel: str, to_channel: str) -> int:
+    """【同步】channel 迁移（数据库函数，见 migrations/009）"""
+    result = supabase.rpc("move_conversation_channel", {
+        "p_user_id": user_id,
+        "p_from": from_channel,
+        "p_to": to_channel
+    }).execute()
+    return result.data or 0
+
+
+async def move_conversation_channel(user_id: str, from_channel: str, to_channel: str) -> int:
+    """把一个 channel 的对话和摘要整体改到另一个 channel（原地更新，不复制），返回迁移的对话条数"""
+    moved = await _run("move_channel", user_id, from_channel, to_channel)
+    if moved:
+        recent_cache.invalidate("channel moved")
+    return moved
+
+
+async def iter_conversations(user_id: str = "dream", channel: Optional[str] = None, page_size: int = 1000):
+    """按时间顺序逐页产出对话（键集分页，内存占用只有一页）"""
+    after_created, after_id = None, None
+    while True:
+        page = await _run("page_conversations", user_id, channel, after_created, after_id, page_size)
+        for row in page:
+            yield row
+        if len(page) < page_size:
+            return
+        after_created, after_id = page[-1]["created_at"], page[-1]["id"]
+
+
+async def get_conversations_missing_embedding(channel: Optional[str] = None, limit: int = 500) -> List[Dict]:
+    """还没有向量的对话"""
+    return await _run("get_missing_embeddings", channel, limit)
+
+
+async def store_conversation_embeddings(conversation_ids: List[str], embeddings: List[List[float]]) -> int:
+    """批量写入对话向量（本机向量镜像由调用方写，见 pgvector_service.mirror_embeddings）"""
+    return await _run("store_embeddings", conversation_ids, embeddings)
+
+
+async def page_embedded_ids(table: str, after_id: Optional[str] = None, page_size: int = 1000) -> List[str]:
+    """有向量的行的 id（按 id 顺序分页）"""
+    return await _run("page_embedded_ids", table, after_id, page_size)
+
+
+async def get_embeddings(table: str, ids: List[str]) -> List[Dict]:
+    """按 id 取向量 + model_channel / scene_type"""
+    return await _run("get_embeddings", table, ids)
+
+
+async def get_rows_by_ids(table: str, ids: List[str]) -> List[Dict]:
+    """按 id 取向量检索结果行（不保证顺序）"""
+    return await _run("get_rows_by_ids", table, ids)
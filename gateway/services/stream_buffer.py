@@ -0,0 +1,229 @@
+"""
+可续传的流式响应 - 每个流一个有界环形缓冲区
+上游流由独立的后台 task 拉取并写入缓冲区，客户端只是缓冲区的一个读者：
+客户端断开不会中断上游生成，重连后 GET /v1/streams/{id}?from=N 继续读。两种模式：
+- 事件模式：按空行切成事件，每个事件加一行 id: N，from=N 是事件序号，标准 EventSource 客户端也可以用
+  Last-Event-ID 续传；代价是字节会被改写（行尾统一成 LF、多出 id 行）
+- 原样模式（raw，配合 stream_passthrough）：上游字节块原样存、原样发，不切事件不加 id，
+  from=N 是已收到的字节数（响应头 X-Stream-Resume: bytes）
+"""
+
+import asyncio
+import secrets
+import time
+from collections import OrderedDict, deque
+from typing import AsyncGenerator, AsyncIterator, Deque, Dict, Optional
+
+
+# [DONE] 标记可能被块边界切开，原样模式下带上前一块末尾这么多字节一起找
+DONE_MARKER = b"data: [DONE]"
+
+
+class StreamBuffer:
+    """单个流的环形缓冲区（只保留最近 max_frames 个事件；原样模式下是字节块）"""
+
+    def __init__(self, stream_id: str, max_frames: int, raw: bool = False):
+        self.stream_id = stream_id
+        self.raw = raw
+        self._frames: Deque[bytes] = deque(maxlen=max_frames)
+        # 缓冲区里第一个事件的序号（更早的已被挤出）
+        self.first_index = 0
+        # 下一个事件的序号（= 已产生的事件总数）
+        self.next_index = 0
+        # 原样模式：缓冲区里第一个字节块的字节偏移 / 已产生的总字节数
+        self.first_offset = 0
+        self.next_offset = 0
+        self._tail = b""
+        self.done = False
+        # 上游正常收尾（出现过 data: [DONE]）且 producer 没出错，才算完整的流（单飞合并据此决定能否给后来者复用）
+        self.completed = False
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.readers = 0
+        self._pending = b""
+        # 上一块以 CR 结尾：可能是被块边界切开的 CRLF，先扣着等下一块
+        self._pending_cr = False
+        self._changed = asyncio.Event()
+
+    # ---- 写入（后台 producer） ----
+
+    def feed(self, chunk: bytes):
+        """喂入上游字节块（透传模式下块边界不对齐事件），按空行切成完整事件
+        SSE 的行尾可以是 CRLF、LF 或单独的 CR，这里统一换成 LF 再切，缓冲区里存的都是 LF 行尾"""
+        if self.raw:
+            self._feed_raw(chunk)
+            return
+        if self._pending_cr:
+            chunk = b"\r" + chunk
+            self._pending_cr = False
+        if chunk.endswith(b"\r"):
+            chunk = chunk[:-1]
+            self._pending_cr = True
+        if b"\r" in chunk:
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        self._pending += chunk
+        if b"\n\n" not in self._pending:
+            return
+        events = self._pending.split(b"\n\n")
+        self._pending = events.pop()
+        for event in events:
+            if event:
+                self._append(event)
+        self._notify()
+
+    def _feed_raw(self, chunk: bytes):
+        """原样模式：字节块原封不动进缓冲区"""
+        if not chunk:
+            return
+        if DONE_MARKER in self._tail + chunk:
+            self.completed = True
+        self._tail = chunk[-(len(DONE_MARKER) - 1):]
+        if len(self._frames) == self._frames.maxlen:
+            self.first_index += 1
+            self.first_offset += len(self._frames[0])
+        self._frames.append(chunk)
+        self.next_index += 1
+        self.next_offset += len(chunk)
+        self._notify()
+
+    @property
+    def first_position(self) -> int:
+        """还能续传的最早位置（事件模式是事件序号，原样模式是字节偏移）"""
+        return self.first_offset if self.raw else self.first_index
+
+    @property
+    def next_position(self) -> int:
+        return self.next_offset if self.raw else self.next_index
+
+    def finish(self):
+        """上游结束：剩余的半个事件也补上"""
+        self._pending_cr = False
+        if self._pending.strip():
+            self._append(self._pending.rstrip(b"\n"))
+        self._pending = b""
+        self.done = True
+        self.finished_at = time.time()
+        self._notify()
+
+    def _append(self, event: bytes):
+        if len(self._frames) == self._frames.maxlen:
+            self.first_index += 1
+        if event.rstrip().endswith(b"data: [DONE]"):
+            self.completed = True
+        self._frames.append(b"id: %d\n" % self.next_index + event + b"\n\n")
+        self.next_index += 1
+
+    def _notify(self):
+        # 唤醒所有等待中的读者，换一个新的 Event 给下一轮
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    # ---- 读取 ----
+
+    async def follow(self, start: int = 0) -> AsyncGenerator[bytes, None]:
+        """从 start 开始读（事件序号；原样模式下是字节偏移），追到上游结束为止"""
+        index, skip = start, 0
+        if self.raw:
+            # 从缓冲区第一块开始数，跳过 start 之前的字节（start 可能还没产生，等到了再跳）
+            index, skip = self.first_index, start - self.first_offset
+            if skip < 0:
+                index, skip = self.first_index - 1, 0
+        self.readers += 1
+        try:
+            while True:
+                while index < self.next_index:
+                    if index < self.first_index:
+                        # 读得太慢，需要的事件已被挤出缓冲区
+                        print(f"[StreamBuffer] Reader of {self.stream_id} fell behind (frame {index} evicted)")
+                        yield b'data: {"error": "stream buffer overrun"}\n\n'
+                        return
+                    frame = self._frames[index - self.first_index]
+                    index += 1
+                    if skip:
+                        if skip >= len(frame):
+                            skip -= len(frame)
+                            continue
+                        frame, skip = frame[skip:], 0
+                    yield frame
+                if self.done:
+                    return
+                changed = self._changed
+                await changed.wait()
+        finally:
+            self.readers -= 1
+
+
+async def pump_stream(buffer: StreamBuffer, source: AsyncIterator[bytes]):
+    """后台 producer：把上游生成器写进缓冲区（不受客户端断连影响）"""
+    try:
+        async for chunk in source:
+            buffer.feed(chunk)
+    except Exception as e:
+        buffer.error = str(e)[:200]
+        print(f"[StreamBuffer] Producer error for {buffer.stream_id}: {e}")
+    finally:
+        buffer.finish()
+
+
+class StreamRegistry:
+    """活跃/刚结束的流缓冲区表，按数量上限和 TTL 淘汰"""
+
+    def __init__(self, max_streams: int = 32, max_frames: int = 10000, ttl: float = 300.0):
+        self.max_streams = max_streams
+        self.max_frames = max_frames
+        self.ttl = ttl
+        self._buffers: "OrderedDict[str, StreamBuffer]" = OrderedDict()
+        self._created = 0
+        self._resumed = 0
+        self._evicted = 0
+
+    def create(self, raw: bool = False) -> StreamBuffer:
+        self._expire()
+        while len(self._buffers) >= self.max_streams:
+            self._evict_one()
+        stream_id = secrets.token_urlsafe(16)
+        buffer = StreamBuffer(stream_id, self.max_frames, raw)
+        self._buffers[stream_id] = buffer
+        self._created += 1
+        return buffer
+
+    def get(self, stream_id: str) -> Optional[StreamBuffer]:
+        self._expire()
+        return self._buffers.get(stream_id)
+
+    def mark_resumed(self):
+        self._resumed += 1
+
+    def _expire(self):
+        now = time.time()
+        expired = [
+            sid for sid, buf in self._buffers.items()
+            if buf.done and buf.finished_at and now - buf.finished_at > self.ttl
+        ]
+        for sid in expired:
+            del self._buffers[sid]
+
+    def _evict_one(self):
+        # 优先淘汰最早结束的流；全都在跑时淘汰最早创建的（它的读者会继续持有引用直到读完）
+        for sid, buf in self._buffers.items():
+            if buf.done:
+                del self._buffers[sid]
+                self._evicted += 1
+                return
+        self._buffers.popitem(last=False)
+        self._evicted += 1
+
+    def get_stats(self) -> dict:
+        """缓冲区占用与续传次数"""
+        active = sum(1 for buf in self._buffers.values() if not buf.done)
+        return {
+            "streams": len(self._buffers),
+            "active": active,
+            "max_streams": self.max_streams,
+            "max_frames": self.max_frames,
+            "ttl": self.ttl,
+            "created": self._created,
+            "resumed": self._resumed,
+            "evicted": self._evicted,
+        }
@@ -138,7 +138,9 @@ async def check_and_generate_summary(user_id: str = "dream", channel: str = "dee
                         summary_text=summary_text,
                         start_round=start_round,
                         end_round=end_round,
-                        user_id=user_id
+                        user_id=user_id,
+                        channel=channel,
+                        scene_type=scene_type
                     ))
 
                 return True
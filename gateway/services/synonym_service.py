@@ -1,59 +1,105 @@
 """
 同义词映射服务
 启动时从 synonym_map 表加载映射，对搜索关键词进行同义词扩展
+加载结果同时发布到状态后端：多 worker 时任一 worker refresh 后其他 worker 会跟进，
+数据库不可用时用共享副本兜底
 """
 
 import re
 import asyncio
-from typing import List, Dict
+import time
+from typing import List, Dict, Optional
 import sys
 
 sys.path.insert(0, '/home/dream/memory-system/gateway')
 from config import get_settings
+from services.repository import get_repository
+from services.state_backend import MemoryStateBackend, StateBackend
 
 settings = get_settings()
 
+# 状态后端里的 namespace：mapping -> {term: [synonyms]}，version -> 发布次数
+SYNONYM_NAMESPACE = "synonyms"
+# 多久检查一次共享副本是否被其他 worker 更新过（秒）
+SYNC_INTERVAL = 30
+
 
 class SynonymService:
     """同义词映射与查询扩展"""
 
-    def __init__(self):
+    def __init__(self, state: Optional[StateBackend] = None):
         # term -> [synonyms] 映射
         self._mapping: Dict[str, List[str]] = {}
         # 反向映射：任意同义词 -> 主词的同义词列表
         self._reverse: Dict[str, List[str]] = {}
         self._loaded = False
+        self._state = state or MemoryStateBackend()
+        self._version = 0
+        self._last_sync = 0.0
 
     async def load(self):
         """从数据库加载映射表"""
         try:
-            from supabase import create_client
-            supabase = create_client(settings.supabase_url, settings.supabase_key)
-
-            def _fetch():
-                result = supabase.table("synonym_map").select("term, synonyms").execute()
-                return result.data if result.data else []
-
-            rows = await asyncio.to_thread(_fetch)
+            repo = await get_repository()
+            if repo is not None:
+                rows = await repo.load_synonyms()
+            else:
+                from supabase import create_client
+                supabase = create_client(settings.supabase_url, settings.supabase_key)
 
-            self._mapping.clear()
-            self._reverse.clear()
+                def _fetch():
+                    result = supabase.table("synonym_map").select("term, synonyms").execute()
+                    return result.data if result.data else []
 
-            for row in rows:
-                term = row["term"]
-                synonyms = row["synonyms"]
-                self._mapping[term] = synonyms
-                # 建立反向索引
-                for syn in synonyms:
-                    self._reverse[syn.lower()] = synonyms
+                rows = await asyncio.to_thread(_fetch)
 
+            self._apply({row["term"]: row["synonyms"] for row in rows})
+            self._publish()
             self._loaded = True
             print(f"[Synonym] Loaded {len(self._mapping)} synonym groups")
         except Exception as e:
             print(f"[Synonym] Load error: {e}")
-            # 加载失败不影响系统运行，用空映射
+            # 加载失败不影响系统运行：有共享副本用共享副本，否则用空映射
+            if self._sync_from_state(force=True):
+                print(f"[Synonym] Using shared copy ({len(self._mapping)} synonym groups)")
             self._loaded = True
 
+    def _apply(self, mapping: Dict[str, List[str]]):
+        """替换映射并重建反向索引"""
+        self._mapping = dict(mapping)
+        self._reverse = {}
+        for synonyms in self._mapping.values():
+            for syn in synonyms:
+                self._reverse[syn.lower()] = synonyms
+
+    def _publish(self):
+        try:
+            self._state.set(SYNONYM_NAMESPACE, "mapping", self._mapping)
+            self._version = self._state.incr(SYNONYM_NAMESPACE, "version")
+            self._last_sync = time.time()
+        except Exception as e:
+            print(f"[Synonym] Publish error: {e}")
+
+    def _sync_from_state(self, force: bool = False) -> bool:
+        """共享副本版本比本地新时切换过去（按 SYNC_INTERVAL 节流）"""
+        now = time.time()
+        if not force and now - self._last_sync < SYNC_INTERVAL:
+            return False
+        self._last_sync = now
+        try:
+            version = int(self._state.get(SYNONYM_NAMESPACE, "version", 0))
+            if version == self._version and not force:
+                return False
+            mapping = self._state.get(SYNONYM_NAMESPACE, "mapping")
+        except Exception as e:
+            print(f"[Synonym] Sync error: {e}")
+            return False
+        if mapping is None:
+            return False
+        self._apply(mapping)
+        self._version = version
+        return True
+
     def expand(self, query: str) -> List[str]:
         """
         对查询进行同义词扩展
@@ -61,6 +107,7 @@ class SynonymService:
         """
         if not query:
             return []
+        self._sync_from_state()
 
         # 简单分词：按空格、标点、中英文边界分割
         tokens = self._tokenize(query)
@@ -0,0 +1,152 @@
+"""
+进程内向量索引（NumPy）
+每行一个归一化后的 float32 向量，附带 channel / scene_type，检索时先按过滤条件做掩码，
+再用一次矩阵乘法算余弦相似度、argpartition 取 top-k。和 search_*_v2 RPC 的语义一致：
+- channel 精确匹配
+- filter_scene 为空不过滤；daily 同时匹配 daily / plot；其他场景精确匹配
+几万到几十万条 1024 维向量时单次检索在毫秒级，不需要近似索引。
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 只有本地存储驱动需要
+    np = None
+
+
+def scene_filter_values(filter_scene: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """RPC 的场景过滤规则，返回允许的 scene_type（None 表示不过滤）"""
+    if not filter_scene:
+        return None
+    if filter_scene == "daily":
+        return ("daily", "plot")
+    return (filter_scene,)
+
+
+class VectorIndex:
+    """可增量更新的暴力余弦检索"""
+
+    def __init__(self, dim: Optional[int] = None, capacity: int = 1024):
+        if np is None:
+            raise RuntimeError("VectorIndex requires numpy (pip install numpy)")
+        self.dim = dim
+        self._capacity = capacity
+        self._vectors = None
+        self._channels = np.zeros(capacity, dtype=np.int32)
+        self._scenes = np.zeros(capacity, dtype=np.int32)
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        # channel / scene 字符串 -> 整数编码（掩码比较用整数数组）
+        self._codes: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _code(self, value: Optional[str]) -> int:
+        key = value or ""
+        if key not in self._codes:
+            self._codes[key] = len(self._codes)
+        return self._codes[key]
+
+    def _grow(self, needed: int):
+        if self._vectors is not None and needed <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        channels = np.zeros(capacity, dtype=np.int32)
+        scenes = np.zeros(capacity, dtype=np.int32)
+        count = len(self._ids)
+        if self._vectors is not None:
+            vectors[:count] = self._vectors[:count]
+            channels[:count] = self._channels[:count]
+            scenes[:count] = self._scenes[:count]
+        self._vectors, self._channels, self._scenes = vectors, channels, scenes
+        self._capacity = capacity
+
+    def upsert(self, record_id: str, vector, channel: Optional[str], scene_type: Optional[str]):
+        """写入或替换一行（向量在这里归一化）"""
+        vec = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if self.dim is None:
+            self.dim = vec.shape[0]
+        if vec.shape[0] != self.dim:
+            raise ValueError(f"Embedding dimension {vec.shape[0]} != index dimension {self.dim}")
+        norm = float(np.linalg.norm(vec))
+        if norm > 0:
+            vec = vec / norm
+        pos = self._positions.get(record_id)
+        if pos is None:
+            pos = len(self._ids)
+            self._grow(pos + 1)
+            self._ids.append(record_id)
+            self._positions[record_id] = pos
+        self._vectors[pos] = vec
+        self._channels[pos] = self._code(channel)
+        self._scenes[pos] = self._code(scene_type)
+
+    def set_channel(self, record_ids, channel: Optional[str]) -> int:
+        """改已有行的 channel（channel 迁移用），返回改动条数"""
+        positions = [self._positions[i] for i in record_ids if i in self._positions]
+        if positions:
+            self._channels[positions] = self._code(channel)
+        return len(positions)
+
+    def remove(self, record_id: str) -> bool:
+        """删除一行（用最后一行填补空位）"""
+        pos = self._positions.pop(record_id, None)
+        if pos is None:
+            return False
+        last = len(self._ids) - 1
+        if pos != last:
+            moved = self._ids[last]
+            self._ids[pos] = moved
+            self._positions[moved] = pos
+            self._vectors[pos] = self._vectors[last]
+            self._channels[pos] = self._channels[last]
+            self._scenes[pos] = self._scenes[last]
+        self._ids.pop()
+        return True
+
+    def search(self, query, limit: int, channel: Optional[str] = None,
+               filter_scene: Optional[str] = None) -> List[Tuple[str, float]]:
+        """返回 [(id, 余弦相似度)]，相似度从高到低"""
+        count = len(self._ids)
+        if not count or limit <= 0:
+            return []
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        if q.shape[0] != self.dim:
+            raise ValueError(f"Query dimension {q.shape[0]} != index dimension {self.dim}")
+        norm = float(np.linalg.norm(q))
+        if norm > 0:
+            q = q / norm
+
+        mask = np.ones(count, dtype=bool)
+        if channel is not None:
+            code = self._codes.get(channel)
+            if code is None:
+                return []
+            mask &= self._channels[:count] == code
+        scenes = scene_filter_values(filter_scene)
+        if scenes is not None:
+            codes = [self._codes[s] for s in scenes if s in self._codes]
+            if not codes:
+                return []
+            mask &= np.isin(self._scenes[:count], codes)
+        candidates = np.flatnonzero(mask)
+        if not candidates.size:
+            return []
+
+        scores = self._vectors[candidates] @ q
+        k = min(limit, candidates.size)
+        top = np.argpartition(-scores, k - 1)[:k] if k < candidates.size else np.arange(candidates.size)
+        top = top[np.argsort(-scores[top])]
+        return [(self._ids[candidates[i]], float(scores[i])) for i in top]
+
+    def get_stats(self) -> dict:
+        return {
+            "vectors": len(self._ids),
+            "dim": self.dim,
+            "memory_mb": round(self._vectors.nbytes / 1024 / 1024, 1) if self._vectors is not None else 0.0,
+        }
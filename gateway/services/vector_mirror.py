@@ -0,0 +1,395 @@
+"""
+向量镜像（本机内存映射文件 + NumPy 暴力检索）- 混合检索向量一路的本地版
+conversations / summaries 的 embedding 在本机各存一份：
+- {dir}/{table}.f32：归一化后的 float32 矩阵，按行号直接写（os.pwrite），检索时 np.memmap 只读映射，
+  重启、其他 worker 打开即用，不用把整表 embedding 从库里再拉一遍
+- {dir}/mirror.db：SQLite（WAL）记录每行的 id / model_channel / scene_type / 版本号；
+  写入在 BEGIN IMMEDIATE 事务里分配行号，多个进程同时写也不会抢到同一行
+其他进程写入后 PRAGMA data_version 会变，检索前据此增量读取新版本的行；矩阵文件按容量翻倍预分配，
+很少需要重新映射。
+
+过滤语义和 search_*_v2 RPC 一致（见 services/vector_index.scene_filter_values）。
+单用户几万条 1024 维向量，一次矩阵乘法在毫秒级，没有引入 HNSW 之类的近似索引。
+删除只打墓碑（行号不回收），同步时按库里现有的 id 清理。
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from services.vector_index import np, scene_filter_values
+
+TABLES = ("conversations", "summaries")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vectors (
+    tbl TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    model_channel TEXT,
+    scene_type TEXT,
+    version INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tbl, pos),
+    UNIQUE (tbl, id)
+);
+CREATE INDEX IF NOT EXISTS idx_vectors_version ON vectors(version);
+CREATE TABLE IF NOT EXISTS mirror_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+INITIAL_CAPACITY = 1024
+
+
+class _TableMirror:
+    """一张表的内存视图：行号 -> id / 过滤编码 / 是否有效，加上矩阵文件的只读映射"""
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.ids: List[Optional[str]] = []
+        self.positions: Dict[str, int] = {}
+        self.channels = np.zeros(0, dtype=np.int32)
+        self.scenes = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+        # 已分配的行数（含墓碑），检索只扫前 rows 行
+        self.rows = 0
+        self.matrix = None
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def _grow(self, size: int):
+        if size <= self.alive.size:
+            return
+        capacity = max(INITIAL_CAPACITY, self.alive.size)
+        while capacity < size:
+            capacity *= 2
+        for name in ("channels", "scenes", "alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:old.size] = old
+            setattr(self, name, new)
+        self.ids.extend([None] * (capacity - len(self.ids)))
+
+    def apply(self, rows: List[tuple], codes):
+        """应用一批变更 [(pos, id, channel, scene_type, deleted)]（同一批里行号不重复）"""
+        top = max(row[0] for row in rows) + 1
+        self._grow(top)
+        self.rows = max(self.rows, top)
+        positions, ids = self.positions, self.ids
+        for pos, record_id, _, _, deleted in rows:
+            previous = ids[pos]
+            if previous is not None and previous != record_id:
+                positions.pop(previous, None)
+            ids[pos] = record_id
+            if deleted:
+                positions.pop(record_id, None)
+            else:
+                positions[record_id] = pos
+        index = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        self.channels[index] = [codes(row[2]) for row in rows]
+        self.scenes[index] = [codes(row[3]) for row in rows]
+        self.alive[index] = [not row[4] for row in rows]
+
+    def remap(self, rows: int):
+        """矩阵文件变大后重新映射（只读、共享，其他进程写进文件的向量直接可见）"""
+        if self.matrix is not None and self.matrix.shape[0] >= rows:
+            return
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        count = size // self.row_bytes
+        self.matrix = np.memmap(self.path, dtype=np.float32, mode="r", shape=(count, self.dim)) if count else None
+
+
+class VectorMirror:
+    """conversations / summaries 两张表的向量镜像（多进程共享同一目录）"""
+
+    def __init__(self, directory: str, dim: int = 1024, enabled: bool = True):
+        self.directory = directory
+        self.dim = dim
+        self.enabled = enabled and np is not None
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._tables: Dict[str, _TableMirror] = {}
+        self._fds: Dict[str, int] = {}
+        self._codes: Dict[str, int] = {}
+        self._version = 0
+        self._data_version = None
+        self.synced = False
+
+        self._searches = 0
+        self._refreshes = 0
+        self._writes = 0
+
+    # ---- 打开 / 同步状态 ----
+
+    def open(self):
+        """建目录和元数据库，载入已有的镜像（毫秒级：只读元数据，矩阵按需映射）；多个线程同时调用只打开一次"""
+        if not self.enabled or self._conn is not None:
+            return
+        with self._lock:
+            if self._conn is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.directory, "mirror.db"), timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            for table in TABLES:
+                path = os.path.join(self.directory, f"{table}.f32")
+                self._fds[table] = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._tables[table] = _TableMirror(path, self.dim)
+            self._conn = conn
+            self._refresh()
+
+    def close(self):
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @property
+    def ready(self) -> bool:
+        """至少完整同步过一次（任何一个进程）才拿来检索，否则半截镜像会漏召回"""
+        if not self.enabled or self._conn is None:
+            return False
+        if not self.synced:
+            with self._lock:
+                self._maybe_refresh()
+        return self.synced
+
+    def mark_synced(self):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO mirror_state (key, value) VALUES ('synced_at', datetime('now')) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+            )
+            self.synced = True
+
+    def _code(self, value: Optional[str]) -> int:
+        key = value or ""
+        if key not in self._codes:
+            self._codes[key] = len(self._codes)
+        return self._codes[key]
+
+    def _refresh(self):
+        """读取本进程还没见过的版本（调用方持有 _lock）"""
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        # (tbl, pos) 是主键，每行只出现一次，不需要按版本排序；第一次载入整表顺序扫描，不走版本索引
+        if self._version:
+            rows = self._conn.execute(
+                "SELECT tbl, pos, id, model_channel, scene_type, deleted, version FROM vectors WHERE version > ?",
+                (self._version,),
+            ).fetchall()
+        else:
+            rows = self._conn.execute(
+                "SELECT tbl, pos, id, model_channel, scene_type, deleted, version FROM vectors"
+            ).fetchall()
+        if rows:
+            by_table: Dict[str, List[tuple]] = {}
+            for tbl, pos, record_id, channel, scene, deleted, _ in rows:
+                by_table.setdefault(tbl, []).append((pos, record_id, channel, scene, deleted))
+            for tbl, changes in by_table.items():
+                if tbl in self._tables:
+                    self._tables[tbl].apply(changes, self._code)
+            self._version = max(self._version, max(row[6] for row in rows))
+            self._refreshes += 1
+        for mirror in self._tables.values():
+            if mirror.rows:
+                mirror.remap(mirror.rows)
+        if not self.synced:
+            self.synced = self._conn.execute(
+                "SELECT 1 FROM mirror_state WHERE key = 'synced_at'"
+            ).fetchone() is not None
+        self._data_version = data_version
+
+    def _maybe_refresh(self):
+        if self._conn.execute("PRAGMA data_version").fetchone()[0] != self._data_version:
+            self._refresh()
+
+    # ---- 写 ----
+
+    def upsert(self, table: str, items: Iterable[Tuple[str, object, Optional[str], Optional[str]]]) -> int:
+        """写入 [(id, 向量, model_channel, scene_type)]，已有 id 原位覆盖，返回写入条数"""
+        if not self.enabled or self._conn is None:
+            return 0
+        mirror = self._tables[table]
+        fd = self._fds[table]
+        items = list(items)
+        if not items:
+            return 0
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM vectors").fetchone()[0]
+                next_pos = conn.execute(
+                    "SELECT COALESCE(MAX(pos), -1) + 1 FROM vectors WHERE tbl = ?", (table,)
+                ).fetchone()[0]
+                existing = dict(conn.execute(
+                    f"SELECT id, pos FROM vectors WHERE tbl = ? AND id IN ({','.join('?' * len(items))})",
+                    (table, *[str(item[0]) for item in items]),
+                ).fetchall())
+                capacity = os.fstat(fd).st_size // mirror.row_bytes
+                needed = next_pos + len(items)
+                if needed > capacity:
+                    capacity = max(capacity, INITIAL_CAPACITY)
+                    while capacity < needed:
+                        capacity *= 2
+                    os.ftruncate(fd, capacity * mirror.row_bytes)
+                records = []
+                for record_id, vector, channel, scene_type in items:
+                    record_id = str(record_id)
+                    vec = np.asarray(vector, dtype=np.float32).reshape(-1)
+                    if vec.shape[0] != self.dim:
+                        raise ValueError(f"Embedding dimension {vec.shape[0]} != mirror dimension {self.dim}")
+                    norm = float(np.linalg.norm(vec))
+                    if norm > 0:
+                        vec = vec / norm
+                    pos = existing.get(record_id)
+                    if pos is None:
+                        pos = existing[record_id] = next_pos
+                        next_pos += 1
+                    # 先写向量再提交元数据：其他进程看到新版本时向量一定已经在文件里
+                    os.pwrite(fd, vec.tobytes(), pos * mirror.row_bytes)
+                    records.append((table, pos, record_id, channel, scene_type, version))
+                conn.executemany(
+                    "INSERT INTO vectors (tbl, pos, id, model_channel, scene_type, version, deleted) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 0) "
+                    "ON CONFLICT(tbl, id) DO UPDATE SET model_channel = excluded.model_channel, "
+                    "scene_type = excluded.scene_type, version = excluded.version, deleted = 0",
+                    records,
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._writes += len(records)
+            self._refresh()
+        return len(records)
+
+    def remove(self, table: str, ids: Iterable[str]) -> int:
+        """打墓碑，返回删除条数"""
+        if not self.enabled or self._conn is None:
+            return 0
+        ids = [str(i) for i in ids]
+        if not ids:
+            return 0
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM vectors").fetchone()[0]
+                removed = 0
+                for offset in range(0, len(ids), 500):
+                    chunk = ids[offset:offset + 500]
+                    removed += conn.execute(
+                        f"UPDATE vectors SET deleted = 1, version = ? "
+                        f"WHERE tbl = ? AND deleted = 0 AND id IN ({','.join('?' * len(chunk))})",
+                        (version, table, *chunk),
+                    ).rowcount
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._refresh()
+        return removed
+
+    def rename_channel(self, old: str, new: str) -> int:
+        """把 channel 为 old 的行改成 new（channel 迁移用，向量不动），返回改动条数"""
+        if not self.enabled or self._conn is None or old == new:
+            return 0
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM vectors").fetchone()[0]
+                renamed = conn.execute(
+                    "UPDATE vectors SET model_channel = ?, version = ? WHERE model_channel = ? AND deleted = 0",
+                    (new, version, old),
+                ).rowcount
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._refresh()
+        return renamed
+
+    # ---- 读 ----
+
+    def ids(self, table: str) -> set:
+        with self._lock:
+            self._maybe_refresh()
+            return set(self._tables[table].positions)
+
+    def search(self, table: str, query, limit: int, channel: Optional[str] = None,
+               filter_scene: Optional[str] = None) -> List[Tuple[str, float]]:
+        """返回 [(id, 余弦相似度)]，相似度从高到低"""
+        mirror = self._tables.get(table)
+        if mirror is None or limit <= 0:
+            return []
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        if q.shape[0] != self.dim:
+            raise ValueError(f"Query dimension {q.shape[0]} != mirror dimension {self.dim}")
+        norm = float(np.linalg.norm(q))
+        if norm > 0:
+            q = q / norm
+
+        with self._lock:
+            self._maybe_refresh()
+            self._searches += 1
+            matrix = mirror.matrix
+            if matrix is None or not mirror.positions:
+                return []
+            count = min(matrix.shape[0], mirror.rows)
+            mask = mirror.alive[:count].copy()
+            if channel is not None:
+                code = self._codes.get(channel)
+                if code is None:
+                    return []
+                mask &= mirror.channels[:count] == code
+            scenes = scene_filter_values(filter_scene)
+            if scenes is not None:
+                scene_mask = np.zeros(count, dtype=bool)
+                for scene in scenes:
+                    if scene in self._codes:
+                        scene_mask |= mirror.scenes[:count] == self._codes[scene]
+                mask &= scene_mask
+            ids = mirror.ids
+
+        candidates = np.flatnonzero(mask)
+        if not candidates.size:
+            return []
+        # 取候选行要先拷贝再计算，候选超过三分之一时不如整块顺序扫描映射页
+        if candidates.size * 3 >= count:
+            scores = matrix[:count] @ q
+            scores = scores[candidates]
+        else:
+            scores = matrix[candidates] @ q
+        k = min(limit, candidates.size)
+        top = np.argpartition(-scores, k - 1)[:k] if k < candidates.size else np.arange(candidates.size)
+        top = top[np.argsort(-scores[top])]
+        return [(ids[candidates[i]], float(scores[i])) for i in top]
+
+    def get_stats(self) -> Dict:
+        stats = {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "searches": self._searches,
+            "refreshes": self._refreshes,
+            "writes": self._writes,
+        }
+        for table, mirror in self._tables.items():
+            stats[table] = {
+                "vectors": len(mirror),
+                "file_mb": round(os.path.getsize(mirror.path) / 1024 / 1024, 1) if os.path.exists(mirror.path) else 0.0,
+            }
+        return stats
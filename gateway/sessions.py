@@ -2,16 +2,22 @@
 会话管理 — CRUD + 场景继承
 """
 
+import asyncio
+import base64
+import binascii
 import json
 from datetime import datetime, timezone
 from uuid import uuid4
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 
 from auth import auth_required
 from config import get_settings
+from services.repository import get_repository
+from services.storage import is_missing_function, keyword_index, recent_cache
 
 # ---- Supabase 客户端 ----
 
@@ -27,6 +33,105 @@ def get_supabase():
     return _supabase
 
 
+# ---- 列投影 ----
+
+# 列表视图只取展示需要的列
+SESSION_LIST_COLUMNS = "id, title, model, scene_type, message_count, created_at, updated_at"
+MESSAGE_LIST_COLUMNS = "id, user_msg, assistant_msg, thinking_summary, model, token_count, scene_type, created_at"
+# 导出：不含 embedding（每行上万字符的向量文本）
+MESSAGE_EXPORT_COLUMNS = (
+    "id, session_id, user_msg, assistant_msg, thinking_summary, model, token_count, scene_type, "
+    "model_channel, round_number, topic, emotion, entities, weight, created_at"
+)
+EXPORT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 200
+
+
+# ---- 键集分页游标 ----
+# 游标是上一页最后一行的 (排序时间戳, id)，base64 编码后对客户端不透明；
+# 下一页用 (ts, id) < 游标 取，深翻页也只走索引，不再 range(offset) 扫描丢弃前面的行
+
+def encode_cursor(row: dict, ts_field: str) -> str:
+    raw = json.dumps([row[ts_field], row["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """返回 (ts, id)；排序列为空的行（没执行 migrations/010 时的 updated_at）ts 是 None"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, row_id = json.loads(raw)
+        if ts is not None:
+            datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+            ts = str(ts)
+        return ts, str(row_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+
+def _after(query, ts_field: str, cursor: Optional[str], desc: bool):
+    """在 (ts_field, id) 排序上接着游标往后取
+
+    ts_field 可能为空时按 Postgres 的默认顺序处理：倒序时空值排在最前，正序时排在最后
+    """
+    if cursor:
+        ts, row_id = decode_cursor(cursor)
+        op = "lt" if desc else "gt"
+        if ts is None:
+            # 游标停在空值段里：倒序时空值段剩下的行之后是全部非空行，正序时只剩空值段
+            if desc:
+                query = query.or_(f"and({ts_field}.is.null,id.{op}.{row_id}),{ts_field}.not.is.null")
+            else:
+                query = query.is_(ts_field, "null").filter("id", op, row_id)
+        else:
+            # 时间戳里有 : 和 .，在 or 过滤里要加引号
+            condition = f'{ts_field}.{op}."{ts}",and({ts_field}.eq."{ts}",id.{op}.{row_id})'
+            if not desc:
+                condition += f",{ts_field}.is.null"
+            query = query.or_(condition)
+    return query.order(ts_field, desc=desc).order("id", desc=desc)
+
+
+def _page(rows: list, page_size: int, ts_field: str) -> tuple:
+    """多取一行判断是否还有下一页，返回 (本页行, next_cursor)"""
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, encode_cursor(rows[-1], ts_field)
+    return rows, None
+
+
+def _fetch_page(query, ts_field: str, cursor: Optional[str], page: Optional[int], page_size: int,
+                response: Response) -> tuple:
+    """取一页，返回 (本页行, next_cursor)
+
+    page 是改成游标分页前的参数，已废弃：只在没传 cursor 时生效，按 offset 取（深翻页会扫描丢弃前面的行），
+    响应头带 Deprecation，返回的 next_cursor 可以直接换成游标接着翻
+    """
+    if page is not None and not cursor:
+        response.headers["Deprecation"] = "true"
+        print(f"[sessions] Deprecated page={page} parameter used, switch to cursor")
+        offset = (max(page, 1) - 1) * page_size
+        query = _after(query, ts_field, None, desc=True).range(offset, offset + page_size)
+    else:
+        query = _after(query, ts_field, cursor, desc=True).limit(page_size + 1)
+    return _page(query.execute().data or [], page_size, ts_field)
+
+
+# 没执行 migrations/010 时 sessions 上没有 sort_at：第一次查询报错后退回按 updated_at 分页（只提示一次）
+_sort_at_missing = False
+
+
+def _is_missing_column(error: Exception) -> bool:
+    text = str(error)
+    return "42703" in text or ("column" in text and "does not exist" in text)
+
+
+def _mark_sort_at_missing(error: Exception):
+    global _sort_at_missing
+    _sort_at_missing = True
+    print(f"[sessions] sessions.sort_at missing (run migrations/010), paging on updated_at: {error}")
+
+
 # ---- 请求/响应模型 ----
 
 class CreateSessionRequest(BaseModel):
@@ -81,26 +186,44 @@ async def create_session(req: CreateSessionRequest, _=Depends(auth_required)):
 
 @router.get("")
 async def list_sessions(
+    response: Response,
     scene: Optional[str] = None,
-    page: int = 1,
+    cursor: Optional[str] = None,
     page_size: int = 20,
+    page: Optional[int] = None,
     _=Depends(auth_required),
 ):
-    """列出会话（支持场景筛选、分页）"""
-    sb = get_supabase()
-    query = sb.table("sessions") \
-        .select("*") \
-        .eq("user_id", "dream") \
-        .order("updated_at", desc=True)
+    """列出会话（支持场景筛选；按 updated_at 倒序键集分页，传上一页返回的 next_cursor 取下一页）
 
-    if scene:
-        query = query.eq("scene_type", scene)
+    updated_at 为空的会话按 created_at 排（sort_at 列，见 migrations/010）；page 已废弃，见 _fetch_page
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    sb = get_supabase()
 
-    offset = (page - 1) * page_size
-    query = query.range(offset, offset + page_size - 1)
+    def fetch(sort_at: bool) -> tuple:
+        query = sb.table("sessions") \
+            .select(SESSION_LIST_COLUMNS + (", sort_at" if sort_at else "")) \
+            .eq("user_id", "dream")
+        if scene:
+            query = query.eq("scene_type", scene)
+        return _fetch_page(query, "sort_at" if sort_at else "updated_at", cursor, page, page_size, response)
 
-    result = query.execute()
-    return {"sessions": result.data, "page": page, "page_size": page_size}
+    sort_at = get_settings().session_sort_at and not _sort_at_missing
+    try:
+        sessions, next_cursor = fetch(sort_at)
+    except Exception as e:
+        if not sort_at or not _is_missing_column(e):
+            raise
+        _mark_sort_at_missing(e)
+        sort_at = False
+        sessions, next_cursor = fetch(False)
+    if sort_at:
+        for row in sessions:
+            row.pop("sort_at", None)
+    result = {"sessions": sessions, "page_size": page_size, "next_cursor": next_cursor}
+    if page is not None and not cursor:
+        result["page"] = page
+    return result
 
 
 @router.get("/{session_id}")
@@ -146,6 +269,9 @@ async def delete_session(session_id: str, _=Depends(auth_required)):
 
     # 再删 session
     result = sb.table("sessions").delete().eq("id", session_id).execute()
+    # 删掉的对话可能还在最近对话缓存里（不知道属于哪个 channel，整体失效）
+    recent_cache.invalidate("session deleted")
+    keyword_index.remove_session(session_id)
     if not result.data:
         raise HTTPException(status_code=404, detail="会话不存在")
     return {"ok": True}
@@ -154,54 +280,120 @@ async def delete_session(session_id: str, _=Depends(auth_required)):
 @router.get("/{session_id}/messages")
 async def get_messages(
     session_id: str,
-    page: int = 1,
+    response: Response,
+    cursor: Optional[str] = None,
     page_size: int = 50,
+    page: Optional[int] = None,
     _=Depends(auth_required),
 ):
-    """拉取会话的历史消息（分页，最新的在前）"""
+    """拉取会话的历史消息（最新的在前；按 created_at 键集分页，传上一页返回的 next_cursor 取更早的消息；
+    page 已废弃，见 _fetch_page）"""
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
     sb = get_supabase()
-    offset = (page - 1) * page_size
+    query = sb.table("conversations") \
+        .select(MESSAGE_LIST_COLUMNS) \
+        .eq("session_id", session_id)
+
+    messages, next_cursor = _fetch_page(query, "created_at", cursor, page, page_size, response)
+    result = {"messages": messages, "page_size": page_size, "next_cursor": next_cursor}
+    if page is not None and not cursor:
+        result["page"] = page
+    return result
+
 
-    result = sb.table("conversations") \
-        .select("id, user_msg, assistant_msg, thinking_summary, model, token_count, scene_type, created_at") \
-        .eq("session_id", session_id) \
-        .order("created_at", desc=True) \
-        .range(offset, offset + page_size - 1) \
-        .execute()
+def _fetch_export_page(session_id: str, cursor: Optional[str]) -> list:
+    """【同步】按时间正序取一页导出用的消息"""
+    query = get_supabase().table("conversations") \
+        .select(MESSAGE_EXPORT_COLUMNS) \
+        .eq("session_id", session_id)
+    return _after(query, "created_at", cursor, desc=False).limit(EXPORT_PAGE_SIZE).execute().data or []
 
-    return {"messages": result.data, "page": page, "page_size": page_size}
+
+async def _iter_session_messages(session_id: str):
+    """逐页产出会话消息（内存里只有一页）"""
+    cursor = None
+    while True:
+        rows = await asyncio.to_thread(_fetch_export_page, session_id, cursor)
+        for row in rows:
+            yield row
+        if len(rows) < EXPORT_PAGE_SIZE:
+            return
+        cursor = encode_cursor(rows[-1], "created_at")
 
 
 @router.post("/{session_id}/export")
-async def export_session(session_id: str, _=Depends(auth_required)):
-    """导出单个会话为 JSON"""
+async def export_session(session_id: str, format: str = "json", _=Depends(auth_required)):
+    """导出单个会话（流式输出，边分页读边写，长会话也只占一页的内存）
+
+    format=json：{"session", "messages": [...], "exported_at"}，结构与以前一致
+    format=ndjson：第一行 {"session": ...}，之后每行一条消息，最后一行 {"exported_at": ...}
+    """
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format 只支持 json / ndjson")
     sb = get_supabase()
 
     session = sb.table("sessions").select("*").eq("id", session_id).execute()
     if not session.data:
         raise HTTPException(status_code=404, detail="会话不存在")
 
-    messages = sb.table("conversations") \
-        .select("*") \
-        .eq("session_id", session_id) \
-        .order("created_at", desc=False) \
-        .execute()
+    def dumps(value) -> str:
+        return json.dumps(value, ensure_ascii=False)
 
-    return {
-        "session": session.data[0],
-        "messages": messages.data,
-        "exported_at": datetime.now(timezone.utc).isoformat(),
-    }
+    async def ndjson():
+        yield dumps({"session": session.data[0]}) + "\n"
+        async for row in _iter_session_messages(session_id):
+            yield dumps(row) + "\n"
+        yield dumps({"exported_at": datetime.now(timezone.utc).isoformat()}) + "\n"
+
+    async def json_document():
+        yield '{"session": ' + dumps(session.data[0]) + ', "messages": ['
+        first = True
+        async for row in _iter_session_messages(session_id):
+            yield ("" if first else ", ") + dumps(row)
+            first = False
+        yield '], "exported_at": ' + dumps(datetime.now(timezone.utc).isoformat()) + "}"
+
+    filename = f"session-{session_id}.{format}"
+    return StreamingResponse(
+        ndjson() if format == "ndjson" else json_document(),
+        media_type="application/x-ndjson" if format == "ndjson" else "application/json",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 # ---- 辅助函数（供其他模块调用）----
 
+# migrations/006 的触发器和 reconcile_session_counts() 在同一个迁移里：第一次用到时调一次
+# reconcile_session_counts() 探测，函数不存在说明触发器也没有，退回每条消息后 count 重算（只提示一次）
+_count_trigger_checked = False
+_count_trigger_missing = False
+
+
+def _mark_count_trigger_missing(error: Exception):
+    global _count_trigger_missing
+    _count_trigger_missing = True
+    print(f"[sessions] reconcile_session_counts missing (run migrations/006), recounting messages per turn: {error}")
+
+
 async def update_session_stats(session_id: str):
-    """更新会话的消息计数和时间戳（在存消息后异步调用）"""
+    """更新会话的消息计数和时间戳（在存消息后异步调用）
+
+    执行过 migrations/006 后由 conversations 上的触发器在插入时增量维护，这里什么都不用做；
+    session_count_trigger 关闭、或探测到没执行迁移时退回 count 重算。
+    """
     if not session_id:
         return
-    sb = get_supabase()
     try:
+        if get_settings().session_count_trigger and not _count_trigger_missing:
+            if not _count_trigger_checked:
+                await reconcile_session_counts()
+            if not _count_trigger_missing:
+                return
+        repo = await get_repository()
+        if repo is not None:
+            await repo.refresh_session_stats(session_id)
+            return
+        sb = get_supabase()
         count_result = sb.table("conversations") \
             .select("id", count="exact") \
             .eq("session_id", session_id) \
@@ -213,4 +405,31 @@ async def update_session_stats(session_id: str):
             "updated_at": datetime.now(timezone.utc).isoformat(),
         }).eq("id", session_id).execute()
     except Exception as e:
-        print(f"[sessions] update_session_stats error: {e}")
\ No newline at end of file
+        print(f"[sessions] update_session_stats error: {e}")
+
+
+async def reconcile_session_counts() -> int:
+    """按 conversations 实际行数校正 message_count，返回校正的会话数（memory_cycle 定时调用）
+
+    没执行 migrations/006 时返回 0，并让 update_session_stats 退回 count 重算
+    """
+    global _count_trigger_checked
+    if _count_trigger_missing:
+        return 0
+    try:
+        repo = await get_repository()
+        if repo is not None:
+            fixed = await repo.reconcile_session_counts()
+        else:
+            result = await asyncio.to_thread(lambda: get_supabase().rpc("reconcile_session_counts", {}).execute())
+            fixed = result.data or 0
+    except Exception as e:
+        if not is_missing_function(e):
+            raise
+        _count_trigger_checked = True
+        _mark_count_trigger_missing(e)
+        return 0
+    _count_trigger_checked = True
+    if fixed:
+        print(f"[sessions] Reconciled message_count for {fixed} sessions")
+    return fixed
@@ -0,0 +1,71 @@
+"""
+计数累加器：一个落不了库的坏 key 不能把整批卡住
+用法（在 gateway 目录下）：python -m pytest -q tests
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.counter_accumulator import CounterAccumulator
+
+BAD = "abc"
+
+
+def make_accumulator(max_attempts: int = 3):
+    written = {}
+    calls = []
+
+    async def flusher(deltas):
+        calls.append(dict(deltas))
+        # 和 unnest($1::uuid[]) 一样：批里只要有一个坏 key，整条语句失败
+        if BAD in deltas:
+            raise ValueError(f'invalid input syntax for type uuid: "{BAD}"')
+        for key, delta in deltas.items():
+            written[key] = written.get(key, 0) + delta
+
+    accumulator = CounterAccumulator("test", flusher, interval=60, max_pending=1000, max_attempts=max_attempts)
+    return accumulator, written, calls
+
+
+def test_bad_key_does_not_block_others():
+    async def run():
+        accumulator, written, _ = make_accumulator()
+        for key in ("a1", "a2", BAD, "a1"):
+            accumulator.add(key)
+        assert await accumulator.flush() is False
+        assert written == {"a1": 2, "a2": 1}
+        assert accumulator.pending(BAD) == 1
+
+        # 坏 key 留着重试，不影响后来的 key
+        accumulator.add("a3")
+        await accumulator.flush()
+        assert written == {"a1": 2, "a2": 1, "a3": 1}
+        await accumulator.stop()
+
+    asyncio.run(run())
+
+
+def test_bad_key_dropped_after_max_attempts():
+    async def run():
+        accumulator, written, calls = make_accumulator(max_attempts=2)
+        accumulator.add(BAD)
+        accumulator.add("a1")
+        assert await accumulator.flush() is False
+        assert accumulator.pending(BAD) == 1
+        assert await accumulator.flush() is False
+        # 第二次单独重试仍失败：丢掉，之后的 flush 不再带它
+        assert accumulator.pending(BAD) == 0
+        stats = accumulator.get_stats()
+        assert stats["dropped_keys"] == 1 and stats["pending_keys"] == 0
+
+        calls.clear()
+        accumulator.add("a2")
+        assert await accumulator.flush() is True
+        assert calls == [{"a2": 1}]
+        assert written == {"a1": 1, "a2": 1}
+        await accumulator.stop()
+
+    asyncio.run(run())
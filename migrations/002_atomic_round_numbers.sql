@@ -0,0 +1,129 @@
+-- ============================================================
+-- Migration 002: 原子分配对话轮数
+-- 以前先查 channel 最新一条的 round_number 再 +1 插入（两次往返），
+-- 同一 channel 并发写入（多 worker 同时落库）会拿到相同的轮数。
+-- 改为每个 (user_id, model_channel) 一行计数器：UPDATE 计数行 + INSERT 在同一个事务里，
+-- 计数行的行锁让同一 channel 的写入排队，事务回滚时计数也一起回滚 —— 轮数唯一且连续。
+-- 执行方式：在 Supabase SQL Editor 中逐段执行
+-- 日期：2026-10-18
+-- ============================================================
+
+-- ============ 第一段：轮数计数表 ============
+CREATE TABLE IF NOT EXISTS conversation_rounds (
+    user_id TEXT NOT NULL,
+    model_channel TEXT NOT NULL,
+    last_round INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, model_channel)
+);
+
+-- 补种子时按 channel 取最大轮数
+CREATE INDEX IF NOT EXISTS idx_conv_user_channel_round
+    ON conversations(user_id, model_channel, round_number DESC);
+
+-- 用现有数据初始化计数（可重复执行，只会往大了调）
+INSERT INTO conversation_rounds (user_id, model_channel, last_round)
+SELECT user_id, COALESCE(model_channel, 'deepseek'), COALESCE(MAX(round_number), 0)
+FROM conversations
+GROUP BY user_id, COALESCE(model_channel, 'deepseek')
+ON CONFLICT (user_id, model_channel)
+DO UPDATE SET last_round = GREATEST(conversation_rounds.last_round, EXCLUDED.last_round);
+
+-- ============ 第二段：分配 N 个连续轮数（内部使用） ============
+-- 返回分配到的最后一个轮数；必须和 INSERT 在同一事务里调用，单独调用会留下空号
+CREATE OR REPLACE FUNCTION allocate_conversation_rounds(
+    p_user_id text,
+    p_channel text,
+    p_count int DEFAULT 1
+)
+RETURNS int
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_last int;
+BEGIN
+    UPDATE conversation_rounds
+    SET last_round = last_round + p_count
+    WHERE user_id = p_user_id AND model_channel = p_channel
+    RETURNING last_round INTO v_last;
+
+    IF NOT FOUND THEN
+        -- 新 channel：从已有数据的最大轮数起步；并发首写由 ON CONFLICT 兜住
+        INSERT INTO conversation_rounds (user_id, model_channel, last_round)
+        SELECT p_user_id, p_channel, COALESCE(MAX(c.round_number), 0) + p_count
+        FROM conversations c
+        WHERE c.user_id = p_user_id AND c.model_channel = p_channel
+        ON CONFLICT (user_id, model_channel)
+        DO UPDATE SET last_round = conversation_rounds.last_round + p_count
+        RETURNING last_round INTO v_last;
+    END IF;
+
+    RETURN v_last;
+END;
+$$;
+
+-- ============ 第三段：插入单条对话并分配轮数（一次往返） ============
+CREATE OR REPLACE FUNCTION insert_conversation_with_round(
+    p_user_id text,
+    p_user_msg text,
+    p_assistant_msg text,
+    p_scene_type text DEFAULT 'daily',
+    p_channel text DEFAULT 'deepseek'
+)
+RETURNS SETOF conversations
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_round int;
+BEGIN
+    v_round := allocate_conversation_rounds(p_user_id, p_channel, 1);
+    RETURN QUERY
+    INSERT INTO conversations
+        (user_id, user_msg, assistant_msg, synced_to_memu, scene_type, model_channel, round_number)
+    VALUES
+        (p_user_id, p_user_msg, p_assistant_msg, FALSE, p_scene_type, p_channel, v_round)
+    RETURNING *;
+END;
+$$;
+
+-- ============ 第四段：批量插入并分配连续轮数（写后日志批量落库用） ============
+-- p_rows: [{"user_msg": ..., "assistant_msg": ..., "scene_type": ...}, ...]，按发生顺序
+CREATE OR REPLACE FUNCTION insert_conversations_with_rounds(
+    p_user_id text,
+    p_channel text,
+    p_rows jsonb
+)
+RETURNS SETOF conversations
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_count int := jsonb_array_length(p_rows);
+    v_last int;
+BEGIN
+    IF v_count = 0 THEN
+        RETURN;
+    END IF;
+    v_last := allocate_conversation_rounds(p_user_id, p_channel, v_count);
+    RETURN QUERY
+    INSERT INTO conversations
+        (user_id, user_msg, assistant_msg, synced_to_memu, scene_type, model_channel, round_number)
+    SELECT
+        p_user_id,
+        r.value->>'user_msg',
+        r.value->>'assistant_msg',
+        FALSE,
+        COALESCE(r.value->>'scene_type', 'daily'),
+        p_channel,
+        v_last - v_count + r.ord::int
+    FROM jsonb_array_elements(p_rows) WITH ORDINALITY AS r(value, ord)
+    ORDER BY r.ord
+    RETURNING *;
+END;
+$$;
+
+-- ============ 验证 ============
+-- 同一 channel 的轮数应无重复：
+-- SELECT user_id, model_channel, round_number, COUNT(*)
+-- FROM conversations
+-- WHERE round_number IS NOT NULL
+-- GROUP BY 1, 2, 3 HAVING COUNT(*) > 1;
+-- 计数应等于最大轮数：
+-- SELECT r.*, (SELECT MAX(round_number) FROM conversations c
+--              WHERE c.user_id = r.user_id AND c.model_channel = r.model_channel) AS max_round
+-- FROM conversation_rounds r;
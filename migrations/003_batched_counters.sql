@@ -0,0 +1,51 @@
+-- ============================================================
+-- Migration 003: 批量原子自增（引用权重 / 记忆 hits）
+-- 网关在内存里按 ID 累加增量，定时把整批 {id: delta} 用一条 UPDATE 写入，
+-- 取代以前每次先 SELECT 再 UPDATE 的两次往返（并发时还会丢增量）。
+-- 执行方式：在 Supabase SQL Editor 中逐段执行
+-- 日期：2026-10-18
+-- ============================================================
+
+-- ============ 第一段：conversations.weight 批量自增 ============
+-- p_ids 与 p_deltas 一一对应，返回实际更新的行数
+CREATE OR REPLACE FUNCTION increment_conversation_weights(
+    p_ids uuid[],
+    p_deltas int[]
+)
+RETURNS int
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_updated int;
+BEGIN
+    UPDATE conversations c
+    SET weight = COALESCE(c.weight, 0) + d.delta
+    FROM unnest(p_ids, p_deltas) AS d(id, delta)
+    WHERE c.id = d.id;
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$;
+
+-- ============ 第二段：memories.hits 批量自增 + 刷新访问时间 ============
+CREATE OR REPLACE FUNCTION touch_memories(
+    p_ids uuid[],
+    p_hits int[]
+)
+RETURNS int
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_updated int;
+BEGIN
+    UPDATE memories m
+    SET hits = COALESCE(m.hits, 0) + d.delta,
+        last_accessed_at = NOW()
+    FROM unnest(p_ids, p_hits) AS d(id, delta)
+    WHERE m.id = d.id;
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$;
+
+-- ============ 验证 ============
+-- SELECT increment_conversation_weights(ARRAY[]::uuid[], ARRAY[]::int[]);  -- 应返回 0
+-- SELECT touch_memories(ARRAY[]::uuid[], ARRAY[]::int[]);                  -- 应返回 0
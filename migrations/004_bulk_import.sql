@@ -0,0 +1,73 @@
+-- ============================================================
+-- Migration 004: 批量导入支持
+-- 1) insert_conversations_with_rounds 接受可选的 created_at（导入历史对话时保留原始时间）
+-- 2) 批量写入向量：一条 UPDATE 写一批 embedding
+-- 依赖 Migration 002
+-- 执行方式：在 Supabase SQL Editor 中逐段执行
+-- 日期：2026-10-18
+-- ============================================================
+
+-- ============ 第一段：批量插入保留原始时间 ============
+-- p_rows 每项可带 created_at（ISO 时间字符串），不带时取当前时间
+CREATE OR REPLACE FUNCTION insert_conversations_with_rounds(
+    p_user_id text,
+    p_channel text,
+    p_rows jsonb
+)
+RETURNS SETOF conversations
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_count int := jsonb_array_length(p_rows);
+    v_last int;
+BEGIN
+    IF v_count = 0 THEN
+        RETURN;
+    END IF;
+    v_last := allocate_conversation_rounds(p_user_id, p_channel, v_count);
+    RETURN QUERY
+    INSERT INTO conversations
+        (user_id, user_msg, assistant_msg, synced_to_memu, scene_type, model_channel, round_number, created_at)
+    SELECT
+        p_user_id,
+        r.value->>'user_msg',
+        r.value->>'assistant_msg',
+        FALSE,
+        COALESCE(r.value->>'scene_type', 'daily'),
+        p_channel,
+        v_last - v_count + r.ord::int,
+        COALESCE((r.value->>'created_at')::timestamptz, NOW())
+    FROM jsonb_array_elements(p_rows) WITH ORDINALITY AS r(value, ord)
+    ORDER BY r.ord
+    RETURNING *;
+END;
+$$;
+
+-- ============ 第二段：批量写入向量 ============
+-- p_embeddings 为 '[0.1,0.2,...]' 形式的文本，与 p_ids 一一对应
+CREATE OR REPLACE FUNCTION store_conversation_embeddings(
+    p_ids uuid[],
+    p_embeddings text[]
+)
+RETURNS int
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_updated int;
+BEGIN
+    UPDATE conversations c
+    SET embedding = d.embedding::vector
+    FROM unnest(p_ids, p_embeddings) AS d(id, embedding)
+    WHERE c.id = d.id;
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$;
+
+-- ============ 第三段：待补向量的对话索引 ============
+-- 向量回填按 created_at 取 embedding 为空的行，部分索引只覆盖这些行，补完后几乎不占空间
+CREATE INDEX IF NOT EXISTS idx_conv_missing_embedding
+    ON conversations(created_at)
+    WHERE embedding IS NULL;
+
+-- ============ 验证 ============
+-- SELECT store_conversation_embeddings(ARRAY[]::uuid[], ARRAY[]::text[]);  -- 应返回 0
+-- SELECT count(*) FROM conversations WHERE embedding IS NULL;
@@ -0,0 +1,21 @@
+-- ============================================================
+-- Migration 005: 会话接口键集分页索引
+-- /api/sessions 和 /api/sessions/{id}/messages 改为按 (时间戳, id) 游标翻页，
+-- 下面两个复合索引让每一页都是一次索引范围扫描，翻到多深都不变慢。
+-- 执行方式：在 Supabase SQL Editor 中逐段执行
+-- 日期：2026-10-18
+-- ============================================================
+
+-- ============ 第一段：会话列表（按 updated_at 倒序） ============
+CREATE INDEX IF NOT EXISTS idx_sessions_user_updated_id
+    ON sessions(user_id, updated_at DESC, id DESC);
+
+-- ============ 第二段：会话消息（按 created_at 翻页 / 导出） ============
+CREATE INDEX IF NOT EXISTS idx_conv_session_created_id
+    ON conversations(session_id, created_at, id);
+
+-- ============ 验证 ============
+-- EXPLAIN SELECT id FROM conversations
+-- WHERE session_id = '00000000-0000-0000-0000-000000000000'
+--   AND (created_at, id) > (NOW() - interval '1 day', '00000000-0000-0000-0000-000000000000')
+-- ORDER BY created_at, id LIMIT 50;  -- 应使用 idx_conv_session_created_id
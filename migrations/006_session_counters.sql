@@ -0,0 +1,92 @@
+-- ============================================================
+-- Migration 006: 会话消息数增量维护
+-- 以前每存一条消息都要 count="exact" 扫一遍该会话的 conversations 再 UPDATE sessions，
+-- 会话越长越慢。改为 conversations 上的语句级触发器：插入 / 删除时按 session_id 汇总后
+-- 对 sessions.message_count 原子加减（一条语句插入多行也只更新一次），插入时顺带刷新 updated_at。
+-- reconcile_session_counts() 用于定时校正漂移（触发器建立之前的数据、手工改库、
+-- 把消息改挂到别的会话等），由 memory_cycle 的定时任务调用。
+-- 执行方式：在 Supabase SQL Editor 中逐段执行
+-- 日期：2026-10-18
+-- ============================================================
+
+-- ============ 第一段：插入时递增 ============
+CREATE OR REPLACE FUNCTION sessions_count_inserted()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE sessions s
+    SET message_count = COALESCE(s.message_count, 0) + d.n,
+        updated_at = NOW()
+    FROM (
+        SELECT session_id, COUNT(*) AS n
+        FROM inserted_rows
+        WHERE session_id IS NOT NULL
+        GROUP BY session_id
+    ) d
+    WHERE s.id = d.session_id;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_conversations_session_count_insert ON conversations;
+CREATE TRIGGER trg_conversations_session_count_insert
+    AFTER INSERT ON conversations
+    REFERENCING NEW TABLE AS inserted_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION sessions_count_inserted();
+
+-- ============ 第二段：删除时递减 ============
+CREATE OR REPLACE FUNCTION sessions_count_deleted()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE sessions s
+    SET message_count = GREATEST(COALESCE(s.message_count, 0) - d.n, 0)
+    FROM (
+        SELECT session_id, COUNT(*) AS n
+        FROM deleted_rows
+        WHERE session_id IS NOT NULL
+        GROUP BY session_id
+    ) d
+    WHERE s.id = d.session_id;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_conversations_session_count_delete ON conversations;
+CREATE TRIGGER trg_conversations_session_count_delete
+    AFTER DELETE ON conversations
+    REFERENCING OLD TABLE AS deleted_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION sessions_count_deleted();
+
+-- ============ 第三段：校正 ============
+-- 只改计数不一致的会话，返回校正的行数；不动 updated_at（避免打乱会话列表排序）
+CREATE OR REPLACE FUNCTION reconcile_session_counts()
+RETURNS int
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_fixed int;
+BEGIN
+    UPDATE sessions s
+    SET message_count = COALESCE(c.n, 0)
+    FROM sessions s2
+    LEFT JOIN (
+        SELECT session_id, COUNT(*) AS n
+        FROM conversations
+        WHERE session_id IS NOT NULL
+        GROUP BY session_id
+    ) c ON c.session_id = s2.id
+    WHERE s.id = s2.id
+      AND s.message_count IS DISTINCT FROM COALESCE(c.n, 0);
+    GET DIAGNOSTICS v_fixed = ROW_COUNT;
+    RETURN v_fixed;
+END;
+$$;
+
+-- 建触发器前已有的数据先校正一次
+SELECT reconcile_session_counts();
+
+-- ============ 验证 ============
+-- SELECT tgname FROM pg_trigger WHERE tgname LIKE 'trg_conversations_session_count_%';  -- 应返回2行
+-- SELECT reconcile_session_counts();  -- 再执行应返回 0
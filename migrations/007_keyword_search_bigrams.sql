@@ -0,0 +1,119 @@
+-- ============================================================
+-- Migration 007: 多词关键词检索（二元组 GIN 索引 + 单次调用 RPC）
+-- 混合检索的关键词一路以前每个词各发两次 ilike '%词%'（conversations + summaries），
+-- 最多 10 次串行往返，而且都用不上索引：pg_trgm 要 3 个字符才能抽出三元组，
+-- 中文检索词大多是 2 个字，'%咖啡%' 只能全表扫描。
+-- 这里改成按字符二元组建 GIN 表达式索引（中文、英文都适用，不依赖分词器），
+-- keyword_search_multi 一次接收全部检索词，两张表的命中去重后按命中词数 + 时间排序返回。
+-- 执行方式：在 Supabase SQL Editor 中逐段执行
+-- 日期：2026-10-18
+-- ============================================================
+
+-- ============ 第一段：二元组函数 ============
+-- 'Hi咖啡' -> {hi, i咖, 咖啡}；小写后去重，索引和查询两边用同一个函数
+CREATE OR REPLACE FUNCTION text_bigrams(p_text text)
+RETURNS text[]
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT COALESCE(array_agg(DISTINCT substr(lower(p_text), i, 2)), '{}')
+    FROM generate_series(1, char_length(p_text) - 1) AS i
+$$;
+
+-- ============ 第二段：GIN 表达式索引 ============
+-- 数据量大时建索引需要一些时间，可在低峰期执行
+CREATE INDEX IF NOT EXISTS idx_conv_bigrams ON conversations
+    USING GIN (text_bigrams(COALESCE(user_msg, '') || E'\n' || COALESCE(assistant_msg, '')));
+
+CREATE INDEX IF NOT EXISTS idx_summaries_bigrams ON summaries
+    USING GIN (text_bigrams(COALESCE(summary, '')));
+
+-- ============ 第三段：多词检索 RPC ============
+-- 每个词：二元组包含（走 GIN 索引）+ ILIKE 复核，取最新 p_conv_limit / p_sum_limit 条候选（和以前逐词查询的候选范围一样）；
+-- 候选按 id 去重，hits = 命中的词数，按 hits、created_at 倒序各取前 N 条。
+-- p_scenes 为 NULL 不过滤场景；词里的 % _ \ 按字面匹配。
+CREATE OR REPLACE FUNCTION keyword_search_multi(
+    p_terms text[],
+    p_channel text,
+    p_scenes text[] DEFAULT NULL,
+    p_conv_limit int DEFAULT 15,
+    p_sum_limit int DEFAULT 5
+)
+RETURNS TABLE(
+    source text,
+    id uuid,
+    user_msg text,
+    assistant_msg text,
+    summary text,
+    created_at timestamptz,
+    scene_type text,
+    topic text,
+    emotion text,
+    round_number int,
+    start_round int,
+    end_round int,
+    hits int
+)
+LANGUAGE sql STABLE AS $$
+    WITH terms AS (
+        SELECT DISTINCT
+            text_bigrams(t) AS grams,
+            '%' || replace(replace(replace(t, '\', '\\'), '%', '\%'), '_', '\_') || '%' AS pattern
+        FROM unnest(p_terms[1:5]) AS t
+        WHERE char_length(t) >= 2
+    ),
+    conv_hits AS (
+        SELECT m.id, COUNT(*)::int AS hits
+        FROM terms
+        CROSS JOIN LATERAL (
+            SELECT c.id
+            FROM conversations c
+            WHERE text_bigrams(COALESCE(c.user_msg, '') || E'\n' || COALESCE(c.assistant_msg, '')) @> terms.grams
+              AND (c.user_msg ILIKE terms.pattern OR c.assistant_msg ILIKE terms.pattern)
+              AND c.model_channel = p_channel
+              AND (p_scenes IS NULL OR c.scene_type = ANY(p_scenes))
+            ORDER BY c.created_at DESC
+            LIMIT p_conv_limit
+        ) m
+        GROUP BY m.id
+    ),
+    sum_hits AS (
+        SELECT m.id, COUNT(*)::int AS hits
+        FROM terms
+        CROSS JOIN LATERAL (
+            SELECT s.id
+            FROM summaries s
+            WHERE text_bigrams(COALESCE(s.summary, '')) @> terms.grams
+              AND s.summary ILIKE terms.pattern
+              AND s.model_channel = p_channel
+              AND (p_scenes IS NULL OR s.scene_type = ANY(p_scenes))
+            ORDER BY s.created_at DESC
+            LIMIT p_sum_limit
+        ) m
+        GROUP BY m.id
+    ),
+    conv AS (
+        SELECT 'conversations'::text, c.id, c.user_msg, c.assistant_msg, NULL::text, c.created_at,
+               c.scene_type, c.topic, c.emotion, c.round_number, NULL::int, NULL::int, h.hits
+        FROM conv_hits h
+        JOIN conversations c ON c.id = h.id
+        ORDER BY h.hits DESC, c.created_at DESC
+        LIMIT p_conv_limit
+    ),
+    summ AS (
+        SELECT 'summaries'::text, s.id, NULL::text, NULL::text, s.summary, s.created_at,
+               s.scene_type, s.topic, NULL::text, NULL::int, s.start_round, s.end_round, h.hits
+        FROM sum_hits h
+        JOIN summaries s ON s.id = h.id
+        ORDER BY h.hits DESC, s.created_at DESC
+        LIMIT p_sum_limit
+    )
+    SELECT * FROM conv
+    UNION ALL
+    SELECT * FROM summ
+$$;
+
+-- ============ 验证 ============
+-- SELECT text_bigrams('Hi咖啡');  -- 应返回 {hi,i咖,咖啡}（顺序不定）
+-- SELECT source, id, hits FROM keyword_search_multi(ARRAY['咖啡', '下雨'], 'deepseek', ARRAY['daily', 'plot']);
+-- EXPLAIN SELECT id FROM conversations
+-- WHERE text_bigrams(COALESCE(user_msg, '') || E'\n' || COALESCE(assistant_msg, '')) @> text_bigrams('咖啡');
+--   -- 应使用 idx_conv_bigrams（Bitmap Index Scan）
@@ -0,0 +1,232 @@
+-- ============================================================
+-- Migration 008: 向量检索 HNSW 索引 + 可调 ef_search 的 search_*_v2
+-- 001 里的 search_conversations_v2 / search_summaries_v2 是 ORDER BY embedding <=> q LIMIT n，
+-- 没有任何向量索引，每次检索都要把该通道全部 1024 维向量算一遍距离，耗时随历史线性增长。
+-- 这里：
+-- - 按 model_channel 建部分 HNSW 索引（检索总是带 channel 条件，每个索引只含本通道的行，
+--   候选不会被别的通道占掉）；新增通道时照第二段再建一个即可，没建索引的通道退回精确扫描，结果不受影响
+-- - RPC 增加 ef_search 参数：HNSW 每次取 ef_search 个候选（同时是 hnsw.ef_search），越大召回越高、越慢
+-- - 场景过滤在候选上做（pgvector 0.6 的 HNSW 扫描最多返回 ef_search 行，过滤放进索引扫描会直接少结果）；
+--   过滤后不足 match_count 条时把候选放大 4 倍重取（最多 1000，hnsw.ef_search 的上限），
+--   仍不够（场景很稀疏或通道总共没几条）再精确扫描兜底，保证不会因为 ANN 少返回
+-- 需要 pgvector >= 0.5.0（HNSW）。pgvector >= 0.8 可以改用 hnsw.iterative_scan，这里不依赖。
+-- 执行方式：在 Supabase SQL Editor 中逐段执行
+-- 日期：2026-10-18
+-- ============================================================
+
+-- ============ 第一段：确认 pgvector 版本 ============
+-- SELECT extversion FROM pg_extension WHERE extname = 'vector';  -- 需 >= 0.5.0
+
+-- ============ 第二段：按通道建部分 HNSW 索引 ============
+-- 数据量大时建索引需要一些时间，可在低峰期执行；图放不进 maintenance_work_mem 时会明显变慢
+SET maintenance_work_mem = '1GB';
+
+CREATE INDEX IF NOT EXISTS idx_conv_embedding_hnsw_deepseek ON conversations
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+    WHERE model_channel = 'deepseek';
+CREATE INDEX IF NOT EXISTS idx_conv_embedding_hnsw_claude ON conversations
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+    WHERE model_channel = 'claude';
+
+CREATE INDEX IF NOT EXISTS idx_summaries_embedding_hnsw_deepseek ON summaries
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+    WHERE model_channel = 'deepseek';
+CREATE INDEX IF NOT EXISTS idx_summaries_embedding_hnsw_claude ON summaries
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+    WHERE model_channel = 'claude';
+
+RESET maintenance_work_mem;
+
+-- ============ 第三段：替换 search_conversations_v2 ============
+-- 旧的 3 参数（gateway/migrations/v2_rpc_functions.sql）和 4 参数（001）版本先删掉，
+-- 否则按位置传 4 个参数时和新的 5 参数版本有歧义
+DROP FUNCTION IF EXISTS search_conversations_v2(vector, int, text);
+DROP FUNCTION IF EXISTS search_conversations_v2(vector, int, text, text);
+
+-- channel 用 format(%L) 拼成字面量，规划器才能匹配上对应通道的部分索引（参数化的通用计划用不上）
+CREATE OR REPLACE FUNCTION search_conversations_v2(
+    query_embedding vector(1024),
+    match_count int DEFAULT 5,
+    filter_scene text DEFAULT 'daily',
+    filter_channel text DEFAULT 'deepseek',
+    ef_search int DEFAULT 200
+)
+RETURNS TABLE(
+    id uuid,
+    user_msg text,
+    assistant_msg text,
+    created_at timestamptz,
+    scene_type text,
+    topic text,
+    emotion text,
+    round_number int,
+    similarity float
+)
+LANGUAGE plpgsql AS $$
+DECLARE
+    candidate_count int := LEAST(GREATEST(ef_search, match_count), 1000);
+    hit_ids uuid[];
+    hit_distances float8[];
+BEGIN
+    LOOP
+        PERFORM set_config('hnsw.ef_search', candidate_count::text, true);
+
+        EXECUTE format($q$
+            SELECT array_agg(k.id ORDER BY k.distance), array_agg(k.distance ORDER BY k.distance)
+            FROM (
+                SELECT a.id, a.distance
+                FROM (
+                    SELECT c.id, c.scene_type, c.embedding <=> $1 AS distance
+                    FROM conversations c
+                    WHERE c.embedding IS NOT NULL AND c.model_channel = %L
+                    ORDER BY c.embedding <=> $1
+                    LIMIT $2
+                ) a
+                WHERE $3 IS NULL
+                   OR $3 = 'all'
+                   OR a.scene_type = $3
+                   OR ($3 = 'daily' AND a.scene_type IN ('daily', 'plot'))
+                ORDER BY a.distance
+                LIMIT $4
+            ) k
+        $q$, filter_channel)
+        INTO hit_ids, hit_distances
+        USING query_embedding, candidate_count, filter_scene, match_count;
+        EXIT WHEN COALESCE(cardinality(hit_ids), 0) >= match_count OR candidate_count >= 1000;
+        -- 场景过滤后不够：放大候选再取一次（相当于 pgvector 0.8 的 iterative scan），到 1000 仍不够再精确扫描
+        candidate_count := LEAST(candidate_count * 4, 1000);
+    END LOOP;
+
+    IF COALESCE(cardinality(hit_ids), 0) < match_count THEN
+        -- 候选被场景过滤掉太多（或本通道总共没几条）：精确扫描兜底
+        -- 排序表达式加 0 是为了不走 HNSW（索引扫描最多只返回 ef_search 行）
+        RETURN QUERY
+        SELECT
+            c.id, c.user_msg, c.assistant_msg, c.created_at,
+            c.scene_type, c.topic, c.emotion, c.round_number,
+            1 - (c.embedding <=> query_embedding) AS similarity
+        FROM conversations c
+        WHERE c.embedding IS NOT NULL
+            AND c.model_channel = filter_channel
+            AND (
+                filter_scene IS NULL
+                OR filter_scene = 'all'
+                OR c.scene_type = filter_scene
+                OR (filter_scene = 'daily' AND c.scene_type IN ('daily', 'plot'))
+            )
+        ORDER BY (c.embedding <=> query_embedding) + 0
+        LIMIT match_count;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT
+        c.id, c.user_msg, c.assistant_msg, c.created_at,
+        c.scene_type, c.topic, c.emotion, c.round_number,
+        1 - h.distance AS similarity
+    FROM unnest(hit_ids, hit_distances) WITH ORDINALITY AS h(id, distance, rank)
+    JOIN conversations c ON c.id = h.id
+    ORDER BY h.rank;
+END;
+$$;
+
+-- ============ 第四段：替换 search_summaries_v2 ============
+DROP FUNCTION IF EXISTS search_summaries_v2(vector, int, text);
+DROP FUNCTION IF EXISTS search_summaries_v2(vector, int, text, text);
+
+CREATE OR REPLACE FUNCTION search_summaries_v2(
+    query_embedding vector(1024),
+    match_count int DEFAULT 3,
+    filter_scene text DEFAULT 'daily',
+    filter_channel text DEFAULT 'deepseek',
+    ef_search int DEFAULT 200
+)
+RETURNS TABLE(
+    id uuid,
+    summary text,
+    created_at timestamptz,
+    scene_type text,
+    topic text,
+    start_round int,
+    end_round int,
+    similarity float
+)
+LANGUAGE plpgsql AS $$
+DECLARE
+    candidate_count int := LEAST(GREATEST(ef_search, match_count), 1000);
+    hit_ids uuid[];
+    hit_distances float8[];
+BEGIN
+    LOOP
+        PERFORM set_config('hnsw.ef_search', candidate_count::text, true);
+
+        EXECUTE format($q$
+            SELECT array_agg(k.id ORDER BY k.distance), array_agg(k.distance ORDER BY k.distance)
+            FROM (
+                SELECT a.id, a.distance
+                FROM (
+                    SELECT s.id, s.scene_type, s.embedding <=> $1 AS distance
+                    FROM summaries s
+                    WHERE s.embedding IS NOT NULL AND s.model_channel = %L
+                    ORDER BY s.embedding <=> $1
+                    LIMIT $2
+                ) a
+                WHERE $3 IS NULL
+                   OR $3 = 'all'
+                   OR a.scene_type = $3
+                   OR ($3 = 'daily' AND a.scene_type IN ('daily', 'plot'))
+                ORDER BY a.distance
+                LIMIT $4
+            ) k
+        $q$, filter_channel)
+        INTO hit_ids, hit_distances
+        USING query_embedding, candidate_count, filter_scene, match_count;
+        EXIT WHEN COALESCE(cardinality(hit_ids), 0) >= match_count OR candidate_count >= 1000;
+        -- 场景过滤后不够：放大候选再取一次（相当于 pgvector 0.8 的 iterative scan），到 1000 仍不够再精确扫描
+        candidate_count := LEAST(candidate_count * 4, 1000);
+    END LOOP;
+
+    IF COALESCE(cardinality(hit_ids), 0) < match_count THEN
+        RETURN QUERY
+        SELECT
+            s.id, s.summary, s.created_at,
+            s.scene_type, s.topic, s.start_round, s.end_round,
+            1 - (s.embedding <=> query_embedding) AS similarity
+        FROM summaries s
+        WHERE s.embedding IS NOT NULL
+            AND s.model_channel = filter_channel
+            AND (
+                filter_scene IS NULL
+                OR filter_scene = 'all'
+                OR s.scene_type = filter_scene
+                OR (filter_scene = 'daily' AND s.scene_type IN ('daily', 'plot'))
+            )
+        ORDER BY (s.embedding <=> query_embedding) + 0
+        LIMIT match_count;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT
+        s.id, s.summary, s.created_at,
+        s.scene_type, s.topic, s.start_round, s.end_round,
+        1 - h.distance AS similarity
+    FROM unnest(hit_ids, hit_distances) WITH ORDINALITY AS h(id, distance, rank)
+    JOIN summaries s ON s.id = h.id
+    ORDER BY h.rank;
+END;
+$$;
+
+-- ============ 验证 ============
+-- SELECT indexname FROM pg_indexes WHERE indexname LIKE '%embedding_hnsw%';  -- 应有 4 个
+-- 计划回归检查（应看到 Index Scan using idx_conv_embedding_hnsw_deepseek）：
+-- BEGIN;
+-- SET LOCAL hnsw.ef_search = 200;
+-- EXPLAIN SELECT id FROM conversations
+-- WHERE embedding IS NOT NULL AND model_channel = 'deepseek'
+-- ORDER BY embedding <=> (SELECT embedding FROM conversations WHERE embedding IS NOT NULL LIMIT 1)
+-- LIMIT 100;
+-- ROLLBACK;
+-- 或在 gateway 目录下：python bench/bench_vector_search.py --check-plan（计划退化时退出码非 0）
+-- SELECT id, similarity FROM search_conversations_v2(
+--     (SELECT embedding FROM conversations WHERE embedding IS NOT NULL LIMIT 1), 5, 'daily', 'deepseek', 200);
@@ -0,0 +1,113 @@
+-- ============================================================
+-- Migration 009: 批量导入幂等 + channel 迁移
+-- 1) insert_conversations_with_rounds 接受可选的 id：已存在的 id 跳过，只给新行分配轮数，
+--    导入中途崩溃（已提交、检查点没写上）后重跑同一批不会重复插入
+-- 2) move_conversation_channel：把一个 channel 的对话和摘要整体改到另一个 channel（原地 UPDATE，
+--    轮数整体平移到目标 channel 已有轮数之后），代替"导出 + 换 channel 再导入"
+-- 依赖 Migration 002、004
+-- 执行方式：在 Supabase SQL Editor 中逐段执行
+-- 日期：2026-10-18
+-- ============================================================
+
+-- ============ 第一段：批量插入，按 id 去重 ============
+-- p_rows 每项可带 id（uuid）和 created_at；带 id 且库里已有的行（以及同一批里重复的 id）跳过，
+-- 返回实际插入的行（按传入顺序）
+CREATE OR REPLACE FUNCTION insert_conversations_with_rounds(
+    p_user_id text,
+    p_channel text,
+    p_rows jsonb
+)
+RETURNS SETOF conversations
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_rows jsonb;
+    v_count int;
+    v_last int;
+BEGIN
+    -- 先去掉库里已有的 id 和同一批里重复的 id，只给剩下的行分配轮数
+    SELECT COALESCE(jsonb_agg(r.value ORDER BY r.ord), '[]'::jsonb) INTO v_rows
+    FROM (
+        SELECT DISTINCT ON (COALESCE(e.value->>'id', e.ord::text)) e.value, e.ord
+        FROM jsonb_array_elements(p_rows) WITH ORDINALITY AS e(value, ord)
+        WHERE e.value->>'id' IS NULL
+           OR NOT EXISTS (SELECT 1 FROM conversations c WHERE c.id = (e.value->>'id')::uuid)
+        ORDER BY COALESCE(e.value->>'id', e.ord::text), e.ord
+    ) r;
+
+    v_count := jsonb_array_length(v_rows);
+    IF v_count = 0 THEN
+        RETURN;
+    END IF;
+    v_last := allocate_conversation_rounds(p_user_id, p_channel, v_count);
+    RETURN QUERY
+    INSERT INTO conversations
+        (id, user_id, user_msg, assistant_msg, synced_to_memu, scene_type, model_channel, round_number, created_at)
+    SELECT
+        COALESCE((r.value->>'id')::uuid, gen_random_uuid()),
+        p_user_id,
+        r.value->>'user_msg',
+        r.value->>'assistant_msg',
+        FALSE,
+        COALESCE(r.value->>'scene_type', 'daily'),
+        p_channel,
+        v_last - v_count + r.ord::int,
+        COALESCE((r.value->>'created_at')::timestamptz, NOW())
+    FROM jsonb_array_elements(v_rows) WITH ORDINALITY AS r(value, ord)
+    ORDER BY r.ord
+    -- 并发导入同一批时兜底
+    ON CONFLICT (id) DO NOTHING
+    RETURNING *;
+END;
+$$;
+
+-- ============ 第二段：channel 迁移 ============
+-- 轮数整体加上目标 channel 当前的最大轮数（摘要的 start_round / end_round 同样平移，和对话仍一一对应），
+-- 返回迁移的对话条数
+CREATE OR REPLACE FUNCTION move_conversation_channel(
+    p_user_id text,
+    p_from text,
+    p_to text
+)
+RETURNS int
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_max int;
+    v_offset int;
+    v_moved int;
+BEGIN
+    IF p_from = p_to THEN
+        RETURN 0;
+    END IF;
+    -- 锁住源 channel 的计数行，迁移期间同一 channel 的新写入排队
+    PERFORM 1 FROM conversation_rounds
+    WHERE user_id = p_user_id AND model_channel = p_from
+    FOR UPDATE;
+
+    SELECT COALESCE(MAX(round_number), 0) INTO v_max
+    FROM conversations
+    WHERE user_id = p_user_id AND model_channel = p_from;
+    -- 一次占用 v_max 个轮数，返回值减去 v_max 就是目标 channel 原来的最大轮数
+    v_offset := allocate_conversation_rounds(p_user_id, p_to, v_max) - v_max;
+
+    UPDATE conversations
+    SET model_channel = p_to,
+        round_number = round_number + v_offset
+    WHERE user_id = p_user_id AND model_channel = p_from;
+    GET DIAGNOSTICS v_moved = ROW_COUNT;
+
+    UPDATE summaries
+    SET model_channel = p_to,
+        start_round = start_round + v_offset,
+        end_round = end_round + v_offset
+    WHERE user_id = p_user_id AND model_channel = p_from;
+
+    RETURN v_moved;
+END;
+$$;
+
+-- ============ 验证 ============
+-- 同一个 id 插两次，第二次应返回 0 行：
+-- SELECT count(*) FROM insert_conversations_with_rounds('dream', 'test',
+--     '[{"id": "00000000-0000-0000-0000-000000000009", "user_msg": "a", "assistant_msg": "b"}]');
+-- DELETE FROM conversations WHERE id = '00000000-0000-0000-0000-000000000009';
+-- SELECT move_conversation_channel('dream', 'nonexistent', 'deepseek');  -- 应返回 0
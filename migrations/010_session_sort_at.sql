@@ -0,0 +1,25 @@
+-- ============================================================
+-- Migration 010: 会话列表排序键 sort_at
+-- 老数据里有 updated_at 为空的会话：按 updated_at 键集分页时游标里是 null，没法接着往下翻。
+-- 加一列生成列 sort_at = COALESCE(updated_at, created_at)，会话列表按 (sort_at, id) 分页，
+-- 从没更新过的会话按创建时间排进去
+-- 依赖 Migration 005（替换其中的会话列表索引）
+-- 执行方式：在 Supabase SQL Editor 中逐段执行
+-- 日期：2026-10-18
+-- ============================================================
+
+-- ============ 第一段：生成列 ============
+-- created_at 也为空的极老数据排到最后（'epoch' 在解析时就是常量，生成列允许）
+ALTER TABLE sessions
+    ADD COLUMN IF NOT EXISTS sort_at timestamptz
+    GENERATED ALWAYS AS (COALESCE(updated_at, created_at, 'epoch'::timestamptz)) STORED;
+
+-- ============ 第二段：索引 ============
+CREATE INDEX IF NOT EXISTS idx_sessions_user_sort_id
+    ON sessions(user_id, sort_at DESC, id DESC);
+DROP INDEX IF EXISTS idx_sessions_user_updated_id;
+
+-- ============ 验证 ============
+-- SELECT count(*) FROM sessions WHERE sort_at IS NULL;  -- 应为 0
+-- EXPLAIN SELECT id FROM sessions WHERE user_id = 'dream'
+-- ORDER BY sort_at DESC, id DESC LIMIT 20;  -- 应使用 idx_sessions_user_sort_id